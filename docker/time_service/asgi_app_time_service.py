@@ -0,0 +1,41 @@
+import redis
+
+from time_service import OnearthTimeService
+
+# Redis host configuration
+REDIS_HOST = "{REDIS_HOST}"
+
+def detect_cluster_mode(host, port=6379, timeout=10):
+    """
+    Detect if Redis host is a cluster or single instance from INFO CLUSTER.
+
+    This runs once at module import time, before the event loop starts.
+    See wsgi_app_time_service.py for the more thorough detection used by the WSGI app.
+    """
+    try:
+        client = redis.Redis(host=host, port=port, decode_responses=True,
+                             socket_connect_timeout=timeout, socket_timeout=timeout)
+        cluster_enabled = client.info('cluster').get('cluster_enabled') == 1
+        client.close()
+        print(f"Auto-detected {'REDIS CLUSTER' if cluster_enabled else 'SINGLE INSTANCE'}")
+        return cluster_enabled
+    except Exception as e:
+        print(f"ERROR: Redis mode detection failed ({e}), defaulting to single instance mode")
+        return False
+
+
+REDIS_CLUSTER_MODE = detect_cluster_mode(REDIS_HOST)
+
+# ASGI application for OnEarth Time Service, e.g.
+#   uvicorn asgi_app_time_service:application --workers 4
+# Each worker process serves many concurrent requests on a single event loop,
+# with a shared redis.asyncio connection pool
+time_service = OnearthTimeService()
+application = time_service.asgi_app(
+    {
+        "handler_type": "redis",
+        "host": REDIS_HOST,
+        "cluster_mode": REDIS_CLUSTER_MODE
+    },
+    {"filename_format": "basic"}
+)
@@ -8,18 +8,307 @@ for OnEarth tile services with Redis backend support.
 Licensed under the Apache License, Version 2.0
 """
 
+import calendar
 import hashlib
 import json
 import math
 import re
 import socket
+import threading
 import time
+import traceback
+from bisect import bisect_right
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional, Tuple, Union
 from urllib.parse import parse_qs, unquote
 import redis
 
 
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch_seconds(date_obj: datetime) -> int:
+    """Convert a naive UTC datetime to integer seconds since the epoch."""
+    return (date_obj - EPOCH) // timedelta(seconds=1)
+
+
+def from_epoch_seconds(seconds: int) -> datetime:
+    """Convert integer seconds since the epoch to a naive UTC datetime."""
+    return EPOCH + timedelta(seconds=seconds)
+
+
+def parse_epoch_seconds(date_string: str) -> int:
+    """Parse an ISO8601 date or datetime string to integer seconds since the epoch."""
+    return to_epoch_seconds(datetime.fromisoformat(date_string.replace('Z', '+00:00')).replace(tzinfo=None))
+
+
+class PeriodIndex:
+    """
+    Parallel arrays describing a sorted list of period strings: start and end times
+    in epoch seconds, the decoded duration of each period, and the length of fixed
+    durations in seconds (None for durations with years or months).
+
+    Entries that aren't full periods (i.e. a single date) have no end, duration or interval.
+    """
+
+    __slots__ = ('starts', 'ends', 'durations', 'intervals')
+
+    def __init__(self, periods: List[str]):
+        self.starts = []
+        self.ends = []
+        self.durations = []
+        self.intervals = []
+        for period in periods:
+            start, end, duration, interval = self.decode(period)
+            self.starts.append(start)
+            self.ends.append(end)
+            self.durations.append(duration)
+            self.intervals.append(interval)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def entry(self, idx: int) -> Tuple[int, Optional[int], Optional[Dict[str, int]], Optional[int]]:
+        return self.starts[idx], self.ends[idx], self.durations[idx], self.intervals[idx]
+
+    @staticmethod
+    def decode(period: str) -> Tuple[int, Optional[int], Optional[Dict[str, int]], Optional[int]]:
+        """Decode a single period string into its start, end, duration and fixed interval."""
+        parsed_period = period.split("/")
+        start = parse_epoch_seconds(parsed_period[0])
+        if len(parsed_period) < 3:
+            return start, None, None, None
+        duration = OnearthTimeService.parse_iso8601_duration(parsed_period[2])
+        if not duration:
+            return start, None, None, None
+        interval = None
+        if OnearthTimeService.duration_is_fixed(duration):
+            interval = OnearthTimeService.duration_fixed_total_seconds(duration)
+        return start, parse_epoch_seconds(parsed_period[1]), duration, interval
+
+
+class PeriodStarts:
+    """Read-only sequence of the start times of unindexed period strings, parsed on access for bisect."""
+
+    __slots__ = ('periods',)
+
+    def __init__(self, periods: List[str]):
+        self.periods = periods
+
+    def __len__(self) -> int:
+        return len(self.periods)
+
+    def __getitem__(self, idx: int) -> int:
+        return parse_epoch_seconds(self.periods[idx].split("/", 1)[0])
+
+
+class CachedPeriods(list):
+    """
+    List of period strings as stored in Redis, along with a PeriodIndex that's
+    built once per layer version, the first time the list is snapped against.
+    """
+
+    def __init__(self, periods):
+        super().__init__(periods)
+        self._index = None
+
+    @property
+    def index(self) -> PeriodIndex:
+        if self._index is None:
+            self._index = PeriodIndex(self)
+        return self._index
+
+
+class LayerPeriodCache:
+    """
+    Per-process cache of layer period data read from Redis.
+
+    Entries are served without touching Redis until `ttl` seconds have passed.
+    After that, the layer's `:generation` counter is read, and the entry is only
+    reloaded if the counter has been bumped (see periods.py and oe_best_redis.py)
+    or if the layer has no counter at all.
+    """
+
+    def __init__(self, ttl: float, max_layers: int = 4096, max_best_dates: int = 256):
+        self.ttl = ttl
+        self.max_layers = max_layers
+        self.max_best_dates = max_best_dates
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        entry["checked"] = time.monotonic()
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_layers:
+                self._entries.popitem(last=False)
+
+    def is_fresh(self, entry: Dict[str, Any]) -> bool:
+        return time.monotonic() - entry["checked"] < self.ttl
+
+    def touch(self, entry: Dict[str, Any]) -> None:
+        entry["checked"] = time.monotonic()
+
+
+class BestLayerCache:
+    """
+    Bounded cache of a layer's best layer names by snap date, evicting the least
+    recently used dates first. Dates without a best layer are cached as None.
+    """
+
+    def __init__(self, max_dates: int):
+        self.max_dates = max_dates
+        self._names = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, snap_date_string: str) -> Tuple[bool, Optional[str]]:
+        with self._lock:
+            if snap_date_string not in self._names:
+                return False, None
+            self._names.move_to_end(snap_date_string)
+            return True, self._names[snap_date_string]
+
+    def put(self, snap_date_string: str, best_layer_name: Optional[str]) -> None:
+        with self._lock:
+            self._names[snap_date_string] = best_layer_name
+            self._names.move_to_end(snap_date_string)
+            while len(self._names) > self.max_dates:
+                self._names.popitem(last=False)
+
+
+# Lua script used by `redis_snap_handler` to snap a date on the Redis server.
+# Periods in a :periods zset all have the same score, so they're ordered lexicographically,
+# which matches chronological order for ISO8601 start dates. The last period starting on or
+# before the requested date is found with ZREVRANGEBYLEX, snapped to the previous interval,
+# and then looked up in the layer's :best hash.
+#   KEYS[1] -- layer :periods key
+#   KEYS[2] -- layer :best key
+#   ARGV[1] -- requested date, formatted as YYYY-MM-DDThh:mm:ssZ
+# Returns {'ok', snap date, best layer name or ''}, {'out_of_range'}, {'invalid_layer'},
+# or {'fallback'} if the request needs to be handled by the Python snapping code.
+SNAP_SCRIPT = """
+local function days_from_civil(y, m, d)
+    if m <= 2 then y = y - 1 end
+    local era = math.floor(y / 400)
+    local yoe = y - era * 400
+    local doy = math.floor((153 * ((m + 9) % 12) + 2) / 5) + d - 1
+    local doe = yoe * 365 + math.floor(yoe / 4) - math.floor(yoe / 100) + doy
+    return era * 146097 + doe - 719468
+end
+
+local function civil_from_days(z)
+    z = z + 719468
+    local era = math.floor(z / 146097)
+    local doe = z - era * 146097
+    local yoe = math.floor((doe - math.floor(doe / 1460) + math.floor(doe / 36524) - math.floor(doe / 146096)) / 365)
+    local doy = doe - (365 * yoe + math.floor(yoe / 4) - math.floor(yoe / 100))
+    local mp = math.floor((5 * doy + 2) / 153)
+    local d = doy - math.floor((153 * mp + 2) / 5) + 1
+    local m = mp < 10 and mp + 3 or mp - 9
+    local y = yoe + era * 400
+    if m <= 2 then y = y + 1 end
+    return y, m, d
+end
+
+local function parse_date(date_string)
+    local y, m, d = string.match(date_string, '^(%d%d%d%d)%-(%d%d)%-(%d%d)')
+    if not y then return nil end
+    local hh, mm, ss = string.match(date_string, '^%d%d%d%d%-%d%d%-%d%dT(%d%d):(%d%d):(%d%d)')
+    return days_from_civil(tonumber(y), tonumber(m), tonumber(d)) * 86400
+        + (tonumber(hh) or 0) * 3600 + (tonumber(mm) or 0) * 60 + (tonumber(ss) or 0)
+end
+
+local function format_date(t)
+    local days = math.floor(t / 86400)
+    local secs = t - days * 86400
+    local y, m, d = civil_from_days(days)
+    return string.format('%04d-%02d-%02dT%02d:%02d:%02dZ', y, m, d,
+        math.floor(secs / 3600), math.floor((secs % 3600) / 60), secs % 60)
+end
+
+local function days_in_month(y, m)
+    if m == 12 then return 31 end
+    return days_from_civil(y, m + 1, 1) - days_from_civil(y, m, 1)
+end
+
+-- Keeps the day of the month, or uses the last day of shorter months
+local function add_months(t, months)
+    local days = math.floor(t / 86400)
+    local y, m, d = civil_from_days(days)
+    local month_idx = y * 12 + m - 1 + months
+    local new_y = math.floor(month_idx / 12)
+    local new_m = month_idx % 12 + 1
+    d = math.min(d, days_in_month(new_y, new_m))
+    return days_from_civil(new_y, new_m, d) * 86400 + (t - days * 86400)
+end
+
+local function duration_unit(part, unit)
+    return tonumber(string.match(part, '(%d+)' .. unit)) or 0
+end
+
+local key_type = redis.call('TYPE', KEYS[1])
+if type(key_type) == 'table' then key_type = key_type['ok'] end
+if key_type == 'none' then return {'invalid_layer'} end
+if key_type ~= 'zset' then return {'fallback'} end
+
+local req = parse_date(ARGV[1])
+local candidates = redis.call('ZREVRANGEBYLEX', KEYS[1], '[' .. ARGV[1] .. '/\\255', '-', 'LIMIT', 0, 1)
+if #candidates == 0 then return {'out_of_range'} end
+
+local period = candidates[1]
+local start_string, end_string, duration_string = string.match(period, '^([^/]*)/([^/]*)/([^/]*)$')
+if not start_string then start_string = string.match(period, '^([^/]*)') end
+local start = parse_date(start_string)
+if not start then return {'fallback'} end
+
+local snap
+if start == req then
+    snap = req
+else
+    if not duration_string then return {'out_of_range'} end
+    local date_part, time_part = string.match(duration_string, '^P([^T]*)T?(.*)$')
+    if not date_part then return {'out_of_range'} end
+    local period_end = parse_date(end_string)
+    if not period_end then return {'fallback'} end
+    local months = duration_unit(date_part, 'Y') * 12 + duration_unit(date_part, 'M')
+    local interval = (duration_unit(date_part, 'W') * 7 + duration_unit(date_part, 'D')) * 86400
+        + duration_unit(time_part, 'H') * 3600 + duration_unit(time_part, 'M') * 60 + duration_unit(time_part, 'S')
+
+    if months == 0 and interval > 0 then
+        snap = start + math.floor((req - start) / interval) * interval
+        if snap > period_end then return {'out_of_range'} end
+    elseif months > 0 and interval == 0 then
+        local y, m = civil_from_days(math.floor(start / 86400))
+        local req_y, req_m = civil_from_days(math.floor(req / 86400))
+        local end_y, end_m = civil_from_days(math.floor(period_end / 86400))
+        local interval_idx = math.min(math.floor(((req_y - y) * 12 + req_m - m) / months),
+                                      math.floor(((end_y - y) * 12 + end_m - m) / months) + 1)
+        snap = add_months(start, interval_idx * months)
+        if snap > req then
+            interval_idx = interval_idx - 1
+            snap = add_months(start, interval_idx * months)
+        end
+        if interval_idx > 0 and snap > period_end then return {'out_of_range'} end
+    else
+        return {'fallback'}
+    end
+end
+
+local snap_string = format_date(snap)
+local best = redis.call('HGET', KEYS[2], snap_string)
+return {'ok', snap_string, best or ''}
+"""
+
+
 class OnearthTimeService:
     """OnEarth Time Service for handling temporal data queries."""
     
@@ -29,6 +318,12 @@ class OnearthTimeService:
     DATETIME_FILENAME_FORMAT = '%Y%j%H%M%S'
     DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
     DATE_FORMAT = '%Y-%m-%d'
+
+    # Maximum number of layers read per pipelined Redis request
+    PIPELINE_BATCH_SIZE = 500
+
+    # Seconds after which the lock on rebuilding a `layers:all` aggregate expires, in case its holder died
+    ALL_LAYERS_LOCK_TIMEOUT = 60
     
     def __init__(self):
         self.close_func = None
@@ -121,6 +416,13 @@ class OnearthTimeService:
         total_seconds += duration.get('seconds', 0)
         return total_seconds
 
+    @staticmethod
+    def add_months(date_obj: datetime, months: int) -> datetime:
+        """Add a number of months to a date, keeping the time and the day, or the last day of shorter months."""
+        month_idx = date_obj.year * 12 + date_obj.month - 1 + months
+        year, month = month_idx // 12, month_idx % 12 + 1
+        return date_obj.replace(year=year, month=month, day=min(date_obj.day, calendar.monthrange(year, month)[1]))
+
     @staticmethod
     def add_interval(date_obj: datetime, duration: Dict[str, int]) -> datetime:
         """Add time interval to date based on duration object."""
@@ -175,6 +477,28 @@ class OnearthTimeService:
         snap_to_previous: bool
     ) -> Optional[datetime]:
         """Find snap date for non-fixed time intervals (Y, M)."""
+        interval_in_months = duration.get('years', 0) * 12 + duration.get('months', 0)
+        if self.duration_fixed_total_seconds(duration) == 0:
+            # Whole month/year intervals land on the same day and time of the month, so the
+            # number of intervals can be found directly from the difference in months
+            month_diff = (req_date.year - start_date.year) * 12 + req_date.month - start_date.month
+            end_month_diff = (end_date.year - start_date.year) * 12 + end_date.month - start_date.month
+            # Intervals after the first one past the end of the period are never needed
+            interval_idx = min(month_diff // interval_in_months, end_month_diff // interval_in_months + 1)
+            previous_interval_date = self.add_months(start_date, interval_idx * interval_in_months)
+            # The requested date may be earlier in the month than the interval date
+            if previous_interval_date > req_date:
+                interval_idx -= 1
+                previous_interval_date = self.add_months(start_date, interval_idx * interval_in_months)
+
+            if interval_idx > 0 and previous_interval_date > end_date:  # Snap date isn't in this period
+                return None
+            if snap_to_previous:
+                return previous_interval_date
+            check_date = self.add_months(start_date, (interval_idx + 1) * interval_in_months)
+            return check_date if check_date <= end_date else None
+
+        # Mixed intervals (e.g. P1M1D) can shift the day of the month, so step through each interval
         previous_interval_date = start_date
 
         while True:
@@ -214,34 +538,38 @@ class OnearthTimeService:
     
     def time_snap(self, req_date: datetime, periods: List[str], snap_to_previous: bool) -> Tuple[Optional[datetime], int]:
         """Binary search for snap date in periods."""
-        snap_date = None
-        snap_period_idx = 1
-        left, right = 0, len(periods) - 1
-
-        while left <= right:
-            mid = left + (right - left) // 2
-            parsed_period = periods[mid].split("/")
-            period_date = datetime.fromisoformat(parsed_period[0].replace('Z', '+00:00')).replace(tzinfo=None)
-
-            if req_date == period_date:
-                snap_date = req_date
-                snap_period_idx = mid
-                break
+        req_time = to_epoch_seconds(req_date)
 
-            if len(parsed_period) > 1 and req_date > period_date:  # This is a period, so look at both dates
-                duration = self.parse_iso8601_duration(parsed_period[2])
-                if duration:
-                    end_date = datetime.fromisoformat(parsed_period[1].replace('Z', '+00:00')).replace(tzinfo=None)
-                    snap_date = self.get_snap_date(
-                        period_date, req_date, end_date, duration, snap_to_previous
-                    )
-                    snap_period_idx = mid
-
-            if req_date < period_date:
-                right = mid - 1
-            else:
-                left = mid + 1
+        # Periods served from the layer cache are already indexed, so only decode the matching period otherwise
+        index = periods.index if isinstance(periods, CachedPeriods) else None
+        starts = index.starts if index is not None else PeriodStarts(periods)
+
+        # The snap date can only be in the last period that starts on or before the requested date
+        snap_period_idx = bisect_right(starts, req_time) - 1
+        if snap_period_idx < 0:
+            return None, 1
 
+        if index is not None:
+            start, end, duration, interval = index.entry(snap_period_idx)
+        else:
+            start, end, duration, interval = PeriodIndex.decode(periods[snap_period_idx])
+
+        if req_time == start:
+            return req_date, snap_period_idx
+        if end is None:  # This isn't a period, so there's nothing to snap to
+            return None, 1
+
+        if interval is not None:
+            date_diff = req_time - start
+            if snap_to_previous:
+                snap_time = start + (date_diff // interval) * interval
+            else:
+                snap_time = start + -(-date_diff // interval) * interval
+            snap_date = from_epoch_seconds(snap_time) if snap_time <= end else None
+        else:
+            snap_date = self.find_snap_date_for_non_fixed_time_interval(
+                from_epoch_seconds(start), req_date, from_epoch_seconds(end), duration, snap_to_previous
+            )
         return snap_date, snap_period_idx
     
     # Trim to the specified number of periods and skip periods as needed
@@ -254,18 +582,13 @@ class OnearthTimeService:
             if skip >= len(periods):
                 layer_datetime_info[key]["periods"] = []
             elif len(periods) > abs(limit) or (skip > 0 and len(periods) >= skip):
-                truncated = []
                 if limit < 0:
-                    start_idx = len(periods) + limit - skip
-                    end_idx = len(periods) - skip
-                    for i in range(max(0, start_idx), max(0, end_idx)):
-                        if i < len(periods):
-                            truncated.append(periods[i])
+                    start_idx = max(0, len(periods) + limit - skip)
+                    end_idx = max(0, len(periods) - skip)
                 else:
                     start_idx = skip
                     end_idx = min(limit + skip, len(periods))
-                    truncated = periods[start_idx:end_idx]
-                layer_datetime_info[key]["periods"] = truncated
+                layer_datetime_info[key]["periods"] = periods[start_idx:end_idx]
                 
         return layer_datetime_info
     
@@ -304,8 +627,13 @@ class OnearthTimeService:
         last_period_end_date = None
 
         try:
-            first_period_start_date = len(all_periods) > 0 and datetime.fromisoformat(all_periods[0].split("/")[0].replace('Z', '+00:00')).replace(tzinfo=None) or None
-            last_period_end_date = len(all_periods) > 0 and datetime.fromisoformat(all_periods[-1].split("/")[1].replace('Z', '+00:00')).replace(tzinfo=None) or None
+            if isinstance(all_periods, CachedPeriods):
+                index = all_periods.index
+                first_period_start_date = from_epoch_seconds(index.starts[0])
+                last_period_end_date = from_epoch_seconds(index.ends[-1]) if index.ends[-1] is not None else None
+            else:
+                first_period_start_date = len(all_periods) > 0 and datetime.fromisoformat(all_periods[0].split("/")[0].replace('Z', '+00:00')).replace(tzinfo=None) or None
+                last_period_end_date = len(all_periods) > 0 and datetime.fromisoformat(all_periods[-1].split("/")[1].replace('Z', '+00:00')).replace(tzinfo=None) or None
         except (ValueError, IndexError):
             pass
         
@@ -380,8 +708,8 @@ class OnearthTimeService:
             
         return default or "", filtered_periods
     
-    def redis_handler(self, options: Dict[str, Any]) -> callable:
-        """Create Redis handler function."""
+    def redis_client(self, options: Dict[str, Any]):
+        """Create a Redis client for the handler options."""
         # Detect cluster mode from options
         cluster_mode = options.get("cluster_mode", False)
 
@@ -408,55 +736,133 @@ class OnearthTimeService:
                 health_check_interval=30  # Check connection health every 30s
             )
             print(f"INFO: Redis single instance mode for host {options['host']}")
-        
+        return client
+
+    def redis_snap_handler(self, options: Dict[str, Any], client=None) -> Optional[callable]:
+        """
+        Create a handler that snaps dates with a single EVALSHA of SNAP_SCRIPT.
+        Returns None in cluster mode, since a layer's :periods and :best keys can be in different slots.
+        """
+        if options.get("cluster_mode", False):
+            print("INFO: Server-side snap script isn't supported in Redis Cluster mode")
+            return None
+        if client is None:
+            client = self.redis_client(options)
+        snap_script = client.register_script(SNAP_SCRIPT)
+
+        def handler(uuid: str, layer_name: str, lookup_keys: Optional[List[str]], req_date: datetime) -> Optional[Dict]:
+            """Returns the snap date and best layer name, an error message, or None to use the Python snapping code."""
+            start_db_request = time.time() * 1000 * 1000
+            prefix_string = ":".join(lookup_keys) + ":" if lookup_keys else ""
+            layer_key = f"{prefix_string}layer:{layer_name}"
+
+            try:
+                result = snap_script(keys=[f"{layer_key}:periods", f"{layer_key}:best"],
+                                     args=[req_date.strftime(self.DATETIME_FORMAT)])
+            except Exception as e:
+                print(f"ERROR running snap script: {e}")
+                return None
+            finally:
+                duration = int(time.time() * 1000 * 1000 - start_db_request)
+                print(f"step=time_database_request duration={duration} uuid={uuid}")
+
+            return self._snap_script_result(result, layer_name)
+
+        return handler
+
+    @staticmethod
+    def _snap_script_result(result: List[str], layer_name: str) -> Optional[Dict]:
+        """Convert the reply of SNAP_SCRIPT to a snap result, an error message, or None if it fell back."""
+        if result[0] == "ok":
+            return {"prefix": result[2] or layer_name, "date": result[1]}
+        elif result[0] == "out_of_range":
+            return {"err_msg": "Date out of range"}
+        elif result[0] == "invalid_layer":
+            return {"err_msg": "Invalid Layer"}
+        return None
+
+    @staticmethod
+    def layer_cache(options: Dict[str, Any]) -> Optional[LayerPeriodCache]:
+        """Create the optional per-process cache of layer periods, default dates and best layers."""
+        if not options.get("cache_ttl"):
+            return None
+        cache = LayerPeriodCache(float(options["cache_ttl"]), int(options.get("cache_max_layers", 4096)),
+                                 int(options.get("cache_max_best_dates", 256)))
+        print(f"INFO: Layer period cache enabled with a TTL of {cache.ttl}s")
+        return cache
+
+    def route_layer_request(self, client, cache: Optional[LayerPeriodCache], reads: Dict[str, callable],
+                            layer_name: Optional[str], lookup_keys: Optional[List[str]],
+                            snap_date_string: Optional[str], periods_start: Optional[str],
+                            periods_end: Optional[str], all_layers_ttl: Optional[float]):
+        """
+        Route a layer handler request. This is a generator for run_steps or async_run_steps that
+        yields the Redis reads it needs, taken from `reads` (the client's get and hget, and the
+        cached layer, cached best layer, layer periods and all layers readers), and returns the response.
+        """
+        prefix_string = ":".join(lookup_keys) + ":" if lookup_keys else ""
+
+        if not layer_name:
+            # Get all layers
+            return (yield reads["all_layers"], client, prefix_string, periods_start, periods_end, all_layers_ttl)
+
+        layer_key = f"{prefix_string}layer:{layer_name}"
+        if snap_date_string:
+            # Get best layer name
+            if cache:
+                best_layer_name = yield reads["cached_best"], client, cache, layer_key, snap_date_string
+            else:
+                best_layer_name = yield reads["hget"], f"{layer_key}:best", snap_date_string
+            return best_layer_name if best_layer_name else layer_name
+
+        # Get default and periods
+        if cache:
+            entry = yield reads["cached_layer"], client, cache, layer_key
+            default = entry["default"]
+            periods = entry["periods"]
+        else:
+            default = yield reads["get"], f"{layer_key}:default"
+            periods = yield reads["periods"], client, layer_key
+
+        # Handle Case of Data is legitimately missing
+        if not periods:
+            return {"err_msg": "Invalid Layer"}
+
+        # Process periods
+        if periods_start or periods_end:
+            default, periods = self.range_handler(periods, default, periods_start, periods_end)
+
+        return {
+            layer_name: {
+                "default": default,
+                "periods": periods,
+                "periods_in_range": len(periods)
+            }
+        }
+
+    def redis_handler(self, options: Dict[str, Any], client=None) -> callable:
+        """Create Redis handler function."""
+        if client is None:
+            client = self.redis_client(options)
+        cache = self.layer_cache(options)
+        reads = {
+            "get": client.get,
+            "hget": client.hget,
+            "cached_layer": self._get_cached_layer,
+            "cached_best": self._get_cached_best,
+            "periods": self._read_layer_periods,
+            "all_layers": self.redis_get_all_layers
+        }
+
         def handler(uuid: str, layer_name: Optional[str] = None, lookup_keys: Optional[List[str]] = None,
                    snap_date_string: Optional[str] = None, periods_start: Optional[str] = None,
                    periods_end: Optional[str] = None) -> Union[str, Dict]:
 
             start_db_request = time.time() * 1000 * 1000
-            prefix_string = ""
-
-            if lookup_keys:
-                prefix_string = ":".join(lookup_keys) + ":"
-                
             try:
-                if layer_name:
-                    if snap_date_string:
-                        # Get best layer name
-                        best_layer_name = client.hget(f"{prefix_string}layer:{layer_name}:best", snap_date_string)
-                        return best_layer_name if best_layer_name else layer_name
-                    else:
-                        # Get default and periods
-                        default = client.get(f"{prefix_string}layer:{layer_name}:default")
-                        
-                        key_type = client.type(f"{prefix_string}layer:{layer_name}:periods")
-                        periods = None
-                        
-                        if key_type == "zset":
-                            periods = client.zrange(f"{prefix_string}layer:{layer_name}:periods", 0, -1)
-                        elif key_type == "set":
-                            periods = list(client.smembers(f"{prefix_string}layer:{layer_name}:periods"))
-                            periods.sort() 
-                        
-                        # Handle Case of Data is legitimately missing 
-                        if not periods or len(periods) == 0:
-                            return {"err_msg": "Invalid Layer"}
-                            
-                        # Process periods
-                        if periods_start or periods_end:
-                            default, periods = self.range_handler(periods, default, periods_start, periods_end)
-                            
-                        return {
-                            layer_name: {
-                                "default": default,
-                                "periods": periods,
-                                "periods_in_range": len(periods)
-                            }
-                        }
-                else:
-                    # Get all layers
-                    return self.redis_get_all_layers(client, prefix_string, periods_start, periods_end)
-                    
+                return self.run_steps(self.route_layer_request(client, cache, reads, layer_name, lookup_keys,
+                                                               snap_date_string, periods_start, periods_end,
+                                                               options.get("all_layers_ttl")))
             except Exception as e:
                 print(f"ERROR querying Redis: {e}")
                 return self.send_response(503, json.dumps({"err_msg": "Time database error"}))
@@ -465,11 +871,204 @@ class OnearthTimeService:
                 print(f"step=time_database_request duration={duration} uuid={uuid}")
                 
         return handler
+
+    def redis_batch_handler(self, options: Dict[str, Any], client=None) -> callable:
+        """
+        Create a handler for batch requests, which reads the default dates and periods
+        of many layers, or the best layers for many snap dates, with pipelined requests.
+        """
+        if client is None:
+            client = self.redis_client(options)
+
+        def handler(uuid: str, layer_names: List[str], lookup_keys: Optional[List[str]] = None,
+                    snap_dates: Optional[List[Tuple[str, str]]] = None) -> Optional[Union[Dict, List[str]]]:
+            """
+            Returns the (default, periods) of each layer, or the best layer name for each
+            (layer_name, snap_date_string) pair in snap_dates. Returns None if Redis fails.
+            """
+            start_db_request = time.time() * 1000 * 1000
+            prefix_string = ":".join(lookup_keys) + ":" if lookup_keys else ""
+
+            try:
+                if snap_dates is not None:
+                    pipe = self._queue_best_layers(client.pipeline(transaction=False), prefix_string, snap_dates)
+                    return self._best_layer_names(snap_dates, pipe.execute())
+                return self._read_layers(client, prefix_string, layer_names)
+            except Exception as e:
+                print(f"ERROR querying Redis: {e}")
+                return None
+            finally:
+                duration = int(time.time() * 1000 * 1000 - start_db_request)
+                print(f"step=time_database_request duration={duration} uuid={uuid}")
+
+        return handler
+
+    @staticmethod
+    def _queue_best_layers(pipe, prefix_string: str, snap_dates: List[Tuple[str, str]]):
+        """Queue the best layer requests for a list of (layer_name, snap_date_string) pairs."""
+        for layer_name, snap_date_string in snap_dates:
+            pipe.hget(f"{prefix_string}layer:{layer_name}:best", snap_date_string)
+        return pipe
+
+    @staticmethod
+    def _best_layer_names(snap_dates: List[Tuple[str, str]], results: List[Optional[str]]) -> List[str]:
+        """Use the layer itself for snap dates without a best layer."""
+        return [best_layer_name or layer_name for (layer_name, _), best_layer_name in zip(snap_dates, results)]
+
+    @staticmethod
+    def _read_layer_periods(client, layer_key: str) -> Optional[List[str]]:
+        """Read the sorted periods of a layer, whether stored as a zset or an unsorted set."""
+        key_type = client.type(f"{layer_key}:periods")
+        periods = None
+        
+        if key_type == "zset":
+            periods = client.zrange(f"{layer_key}:periods", 0, -1)
+        elif key_type == "set":
+            periods = list(client.smembers(f"{layer_key}:periods"))
+            periods.sort() 
+        return periods
+
+    @staticmethod
+    def _validate_cached(client, cache: LayerPeriodCache, layer_key: str, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Get a cache entry, or None if it's expired and the layer has changed."""
+        entry = cache.get(cache_key)
+        if entry is not None and not cache.is_fresh(entry):
+            # Layers without a generation counter can't be validated, so always reload them
+            generation = client.get(f"{layer_key}:generation")
+            if generation is not None and generation == entry["generation"]:
+                cache.touch(entry)
+            else:
+                entry = None
+        return entry
+
+    def _get_cached_layer(self, client, cache: LayerPeriodCache, layer_key: str) -> Dict[str, Any]:
+        """Get a layer's cache entry, reloading it from Redis if it's expired and the layer has changed."""
+        entry = self._validate_cached(client, cache, layer_key, layer_key)
+        if entry is None:
+            # Read the generation first so that a concurrent update is picked up on the next check
+            generation = client.get(f"{layer_key}:generation")
+            periods = self._read_layer_periods(client, layer_key)
+            entry = {
+                "generation": generation,
+                "default": client.get(f"{layer_key}:default"),
+                "periods": CachedPeriods(periods) if periods else None
+            }
+            cache.put(layer_key, entry)
+        return entry
+
+    def _get_cached_best(self, client, cache: LayerPeriodCache, layer_key: str, snap_date_string: str) -> Optional[str]:
+        """
+        Get the best layer name for a snap date through the cache. Best layers are cached apart from
+        the layer's periods, so looking one up doesn't read the periods.
+        """
+        entry = self._validate_cached(client, cache, layer_key, f"{layer_key}:best")
+        if entry is None:
+            entry = {
+                "generation": client.get(f"{layer_key}:generation"),
+                "best": BestLayerCache(cache.max_best_dates)
+            }
+            cache.put(f"{layer_key}:best", entry)
+        else:
+            found, best_layer_name = entry["best"].get(snap_date_string)
+            if found:
+                return best_layer_name
+        best_layer_name = client.hget(f"{layer_key}:best", snap_date_string)
+        entry["best"].put(snap_date_string, best_layer_name)
+        return best_layer_name
     
     def redis_get_all_layers(self, client, prefix_string: str, periods_start: Optional[str],
-                           periods_end: Optional[str]) -> Dict:
+                           periods_end: Optional[str], all_layers_ttl: Optional[float] = None) -> Dict:
         """Get all layers from Redis (supports both single instance and cluster mode)."""
+        if all_layers_ttl:
+            all_layers = self._get_all_layers_aggregate(client, prefix_string, all_layers_ttl)
+        else:
+            all_layers = self._read_layers(client, prefix_string, self._scan_layer_names(client, prefix_string))
+
+        return self._filter_layers(all_layers, periods_start, periods_end)
+
+    def _filter_layers(self, all_layers: Dict[str, Tuple[Optional[str], List[str]]],
+                       periods_start: Optional[str], periods_end: Optional[str]) -> Dict:
+        """Build the all-layers response, limiting each layer's periods to the requested range."""
         layers = {}
+        for layer_name, (default, periods) in all_layers.items():
+            # Always include the layer, even if periods is empty
+            if periods_start or periods_end:
+                default, periods = self.range_handler(periods, default, periods_start, periods_end)
+
+            layer_info = {
+                "periods": periods,
+                "periods_in_range": len(periods)
+            }
+            if default is not None:
+                layer_info["default"] = default
+
+            layers[layer_name] = layer_info
+        return layers
+
+    def _get_all_layers_aggregate(self, client, prefix_string: str, all_layers_ttl: float) -> Dict:
+        """
+        Get all layers from the precomputed `layers:all` key. The key is rebuilt from the individual
+        layer keys when the `layers:all:generation` counter, which calculate_layer_periods increments
+        whenever it updates a layer, has changed since it was built, or when it's older than
+        all_layers_ttl. The key is shared by all time service processes, and only the request holding
+        `layers:all:lock` rebuilds it; the others keep serving the current aggregate meanwhile.
+        """
+        aggregate_key = f"{prefix_string}layers:all"
+        pipe = client.pipeline(transaction=False)
+        pipe.get(aggregate_key)
+        pipe.get(f"{aggregate_key}:generation")
+        aggregate, generation = pipe.execute()
+        aggregate = self._load_all_layers_aggregate(aggregate)
+        if self._all_layers_aggregate_is_current(aggregate, generation, all_layers_ttl):
+            return aggregate["layers"]
+
+        lock = client.lock(f"{aggregate_key}:lock", timeout=self.ALL_LAYERS_LOCK_TIMEOUT)
+        if not lock.acquire(blocking=False):
+            if aggregate is not None:
+                return aggregate["layers"]
+            # Nothing to serve until the first build is done
+            return self._read_layers(client, prefix_string, self._scan_layer_names(client, prefix_string))
+        try:
+            print(f"INFO: Rebuilding {aggregate_key}")
+            # Read the counter first so that layers updated during the rebuild trigger another one
+            generation = client.get(f"{aggregate_key}:generation")
+            all_layers = self._read_layers(client, prefix_string, self._scan_layer_names(client, prefix_string))
+            client.set(aggregate_key, self._dump_all_layers_aggregate(all_layers, generation))
+        finally:
+            self._release_lock(lock)
+        return all_layers
+
+    @staticmethod
+    def _load_all_layers_aggregate(aggregate: Optional[str]) -> Optional[Dict]:
+        """Parse a `layers:all` value, or return None if it's missing or in an older format."""
+        aggregate = json.loads(aggregate) if aggregate else None
+        if not isinstance(aggregate, dict) or "layers" not in aggregate or "built" not in aggregate:
+            return None
+        return aggregate
+
+    @staticmethod
+    def _dump_all_layers_aggregate(all_layers: Dict, generation: Optional[str]) -> str:
+        """Serialize all layers as a `layers:all` value, with the generation and time it was built from."""
+        return json.dumps({"generation": generation, "built": time.time(), "layers": all_layers})
+
+    @staticmethod
+    def _all_layers_aggregate_is_current(aggregate: Optional[Dict], generation: Optional[str],
+                                         all_layers_ttl: float) -> bool:
+        """Check whether a `layers:all` aggregate can be served without rebuilding it."""
+        return (aggregate is not None and aggregate["generation"] == generation and
+                time.time() - aggregate["built"] < all_layers_ttl)
+
+    @staticmethod
+    def _release_lock(lock) -> None:
+        """Release a lock, which may have already expired if the work took longer than its timeout."""
+        try:
+            lock.release()
+        except redis.exceptions.LockError:
+            pass
+
+    def _scan_layer_names(self, client, prefix_string: str) -> set:
+        """Scan Redis for the distinct names of all layers with keys under the prefix."""
+        layer_names = set()
 
         # Check if client is a cluster by looking for cluster-specific methods
         is_cluster = hasattr(client, 'get_nodes')
@@ -492,71 +1091,319 @@ class OnearthTimeService:
                                 match=f"{prefix_string}layer:*",
                                 count=1000  # Batch size for efficiency
                             )
-
-                            self._process_layer_keys(client, keys, prefix_string, periods_start,
-                                                    periods_end, layers)
+                            layer_names.update(self._layer_names_from_keys(keys))
 
                             if cursor == 0:
                                 break
+                return layer_names
             except Exception as e:
                 print(f"ERROR scanning Redis cluster: {e}")
                 # Fall back to regular scan if cluster scan fails
                 print("INFO: Falling back to regular SCAN (may miss keys in multi-node cluster)")
-                cursor = 0
-                while True:
-                    cursor, keys = client.scan(cursor, match=f"{prefix_string}layer:*")
-                    self._process_layer_keys(client, keys, prefix_string, periods_start,
-                                            periods_end, layers)
-                    if cursor == 0:
-                        break
         else:
             # Single instance mode: use regular scan
             print("INFO: Scanning single Redis instance for layers")
-            cursor = 0
-            while True:
-                cursor, keys = client.scan(cursor, match=f"{prefix_string}layer:*")
-                self._process_layer_keys(client, keys, prefix_string, periods_start,
-                                        periods_end, layers)
-                if cursor == 0:
-                    break
 
-        return layers
+        cursor = 0
+        while True:
+            cursor, keys = client.scan(cursor, match=f"{prefix_string}layer:*", count=1000)
+            layer_names.update(self._layer_names_from_keys(keys))
+            if cursor == 0:
+                break
+        return layer_names
+
+    @staticmethod
+    def _layer_names_from_keys(keys: List[str]) -> List[str]:
+        """Extract layer names from layer keys, i.e. `layer_name` from `prefix:layer:layer_name:default`."""
+        return [key.split(":")[-2] for key in keys if len(key.split(":")) >= 2]
+
+    def _read_layers(self, client, prefix_string: str, layer_names) -> Dict[str, Tuple[Optional[str], List[str]]]:
+        """
+        Read the default date and sorted periods of each layer using pipelined requests:
+        one batch for the default dates and :periods key types, then one for the periods.
+        In cluster mode, layers are grouped by the hash slot of their :periods key so
+        that each pipeline batch is sent to as few nodes as possible.
+        """
+        all_layers = {}
+        for batch in self._layer_batches(client, prefix_string, layer_names):
+            pipe = self._queue_layer_defaults(client.pipeline(transaction=False), prefix_string, batch)
+            results = pipe.execute()
+            defaults = results[0::2]
+            key_types = results[1::2]
+
+            pipe = self._queue_layer_periods(client.pipeline(transaction=False), prefix_string, batch, key_types)
+            self._collect_layers(all_layers, batch, defaults, key_types, pipe.execute())
+        return all_layers
+
+    def _layer_batches(self, client, prefix_string: str, layer_names) -> List[List[str]]:
+        """Split layer names into pipeline batches, sorted by hash slot in cluster mode."""
+        layer_names = sorted(layer_names)
+        if hasattr(client, 'get_nodes'):
+            layer_names.sort(key=lambda layer_name: client.keyslot(f"{prefix_string}layer:{layer_name}:periods"))
+        return [layer_names[batch_start:batch_start + self.PIPELINE_BATCH_SIZE]
+                for batch_start in range(0, len(layer_names), self.PIPELINE_BATCH_SIZE)]
+
+    @staticmethod
+    def _queue_layer_defaults(pipe, prefix_string: str, batch: List[str]):
+        """Queue the default date and :periods key type requests for a batch of layers."""
+        for layer_name in batch:
+            pipe.get(f"{prefix_string}layer:{layer_name}:default")
+            pipe.type(f"{prefix_string}layer:{layer_name}:periods")
+        return pipe
+
+    @staticmethod
+    def _queue_layer_periods(pipe, prefix_string: str, batch: List[str], key_types: List[str]):
+        """Queue the periods requests for a batch of layers, skipping layers without periods."""
+        for layer_name, key_type in zip(batch, key_types):
+            if key_type == "zset":
+                pipe.zrange(f"{prefix_string}layer:{layer_name}:periods", 0, -1)
+            elif key_type == "set":
+                pipe.smembers(f"{prefix_string}layer:{layer_name}:periods")
+        return pipe
 
-    def _process_layer_keys(self, client, keys: List[str], prefix_string: str,
-                           periods_start: Optional[str], periods_end: Optional[str],
-                           layers: Dict) -> None:
-        """Process Redis keys and extract layer information."""
-        for key in keys:
-            key_parts = key.split(":")
-            if len(key_parts) >= 2:
-                layer_name = key_parts[-2]
-                if layer_name not in layers:
-                    layers[layer_name] = {}
-
-                default = client.get(f"{prefix_string}layer:{layer_name}:default")
-                key_type = client.type(f"{prefix_string}layer:{layer_name}:periods")
-
-                periods = []
-                if key_type == "zset":
-                    periods = client.zrange(f"{prefix_string}layer:{layer_name}:periods", 0, -1)
-                elif key_type == "set":
-                    periods = list(client.smembers(f"{prefix_string}layer:{layer_name}:periods"))
-                    if periods:
-                        periods.sort()
-
-                # Always include the layer, even if periods is empty
-                if periods_start or periods_end:
-                    default, periods = self.range_handler(periods, default, periods_start, periods_end)
-
-                layer_info = {
-                    "periods": periods,
-                    "periods_in_range": len(periods)
-                }
-                if default is not None:
-                    layer_info["default"] = default
-
-                layers[layer_name] = layer_info
+    @staticmethod
+    def _collect_layers(all_layers: Dict, batch: List[str], defaults: List[Optional[str]],
+                        key_types: List[str], periods_results: List) -> None:
+        """Add the default date and sorted periods of each layer in a batch to all_layers."""
+        periods_results = iter(periods_results)
+        for layer_name, default, key_type in zip(batch, defaults, key_types):
+            periods = []
+            if key_type == "zset":
+                periods = next(periods_results)
+            elif key_type == "set":
+                periods = sorted(next(periods_results))
+            all_layers[layer_name] = (default, periods)
     
+    def async_redis_client(self, options: Dict[str, Any]):
+        """Create a redis.asyncio client for the handler options."""
+        import redis.asyncio
+
+        if options.get("cluster_mode", False):
+            client = redis.asyncio.RedisCluster(
+                host=options["host"],
+                port=options.get("port", 6379),
+                decode_responses=True,
+                read_from_replicas=True,
+                reinitialize_steps=10,
+            )
+            print(f"INFO: Async Redis Cluster mode enabled for host {options['host']}")
+        else:
+            client = redis.asyncio.Redis(
+                host=options["host"],
+                port=options.get("port", 6379),
+                decode_responses=True,
+                socket_keepalive=True,
+                socket_connect_timeout=10,
+                health_check_interval=30
+            )
+            print(f"INFO: Async Redis single instance mode for host {options['host']}")
+        return client
+
+    def async_redis_snap_handler(self, options: Dict[str, Any], client=None) -> Optional[callable]:
+        """Asyncio variant of redis_snap_handler."""
+        if options.get("cluster_mode", False):
+            print("INFO: Server-side snap script isn't supported in Redis Cluster mode")
+            return None
+        if client is None:
+            client = self.async_redis_client(options)
+        snap_script = client.register_script(SNAP_SCRIPT)
+
+        async def handler(uuid: str, layer_name: str, lookup_keys: Optional[List[str]], req_date: datetime) -> Optional[Dict]:
+            start_db_request = time.time() * 1000 * 1000
+            prefix_string = ":".join(lookup_keys) + ":" if lookup_keys else ""
+            layer_key = f"{prefix_string}layer:{layer_name}"
+
+            try:
+                result = await snap_script(keys=[f"{layer_key}:periods", f"{layer_key}:best"],
+                                           args=[req_date.strftime(self.DATETIME_FORMAT)])
+            except Exception as e:
+                print(f"ERROR running snap script: {e}")
+                return None
+            finally:
+                duration = int(time.time() * 1000 * 1000 - start_db_request)
+                print(f"step=time_database_request duration={duration} uuid={uuid}")
+
+            return self._snap_script_result(result, layer_name)
+
+        return handler
+
+    def async_redis_handler(self, options: Dict[str, Any], client=None) -> callable:
+        """Asyncio variant of redis_handler, using a redis.asyncio client."""
+        if client is None:
+            client = self.async_redis_client(options)
+        cache = self.layer_cache(options)
+        reads = {
+            "get": client.get,
+            "hget": client.hget,
+            "cached_layer": self._async_get_cached_layer,
+            "cached_best": self._async_get_cached_best,
+            "periods": self._async_read_layer_periods,
+            "all_layers": self.async_redis_get_all_layers
+        }
+
+        async def handler(uuid: str, layer_name: Optional[str] = None, lookup_keys: Optional[List[str]] = None,
+                          snap_date_string: Optional[str] = None, periods_start: Optional[str] = None,
+                          periods_end: Optional[str] = None) -> Union[str, Dict]:
+
+            start_db_request = time.time() * 1000 * 1000
+            try:
+                return await self.async_run_steps(self.route_layer_request(client, cache, reads, layer_name,
+                                                                           lookup_keys, snap_date_string,
+                                                                           periods_start, periods_end,
+                                                                           options.get("all_layers_ttl")))
+            except Exception as e:
+                print(f"ERROR querying Redis: {e}")
+                return self.send_response(503, json.dumps({"err_msg": "Time database error"}))
+            finally:
+                duration = int(time.time() * 1000 * 1000 - start_db_request)
+                print(f"step=time_database_request duration={duration} uuid={uuid}")
+
+        return handler
+
+    def async_redis_batch_handler(self, options: Dict[str, Any], client=None) -> callable:
+        """Asyncio variant of redis_batch_handler."""
+        if client is None:
+            client = self.async_redis_client(options)
+
+        async def handler(uuid: str, layer_names: List[str], lookup_keys: Optional[List[str]] = None,
+                          snap_dates: Optional[List[Tuple[str, str]]] = None) -> Optional[Union[Dict, List[str]]]:
+            start_db_request = time.time() * 1000 * 1000
+            prefix_string = ":".join(lookup_keys) + ":" if lookup_keys else ""
+
+            try:
+                if snap_dates is not None:
+                    pipe = self._queue_best_layers(client.pipeline(transaction=False), prefix_string, snap_dates)
+                    return self._best_layer_names(snap_dates, await pipe.execute())
+                return await self._async_read_layers(client, prefix_string, layer_names)
+            except Exception as e:
+                print(f"ERROR querying Redis: {e}")
+                return None
+            finally:
+                duration = int(time.time() * 1000 * 1000 - start_db_request)
+                print(f"step=time_database_request duration={duration} uuid={uuid}")
+
+        return handler
+
+    @staticmethod
+    async def _async_read_layer_periods(client, layer_key: str) -> Optional[List[str]]:
+        """Asyncio variant of _read_layer_periods."""
+        key_type = await client.type(f"{layer_key}:periods")
+        periods = None
+
+        if key_type == "zset":
+            periods = await client.zrange(f"{layer_key}:periods", 0, -1)
+        elif key_type == "set":
+            periods = sorted(await client.smembers(f"{layer_key}:periods"))
+        return periods
+
+    @staticmethod
+    async def _async_validate_cached(client, cache: LayerPeriodCache, layer_key: str,
+                                     cache_key: str) -> Optional[Dict[str, Any]]:
+        """Asyncio variant of _validate_cached."""
+        entry = cache.get(cache_key)
+        if entry is not None and not cache.is_fresh(entry):
+            generation = await client.get(f"{layer_key}:generation")
+            if generation is not None and generation == entry["generation"]:
+                cache.touch(entry)
+            else:
+                entry = None
+        return entry
+
+    async def _async_get_cached_layer(self, client, cache: LayerPeriodCache, layer_key: str) -> Dict[str, Any]:
+        """Asyncio variant of _get_cached_layer."""
+        entry = await self._async_validate_cached(client, cache, layer_key, layer_key)
+        if entry is None:
+            generation = await client.get(f"{layer_key}:generation")
+            periods = await self._async_read_layer_periods(client, layer_key)
+            entry = {
+                "generation": generation,
+                "default": await client.get(f"{layer_key}:default"),
+                "periods": CachedPeriods(periods) if periods else None
+            }
+            cache.put(layer_key, entry)
+        return entry
+
+    async def _async_get_cached_best(self, client, cache: LayerPeriodCache, layer_key: str,
+                                     snap_date_string: str) -> Optional[str]:
+        """Asyncio variant of _get_cached_best."""
+        entry = await self._async_validate_cached(client, cache, layer_key, f"{layer_key}:best")
+        if entry is None:
+            entry = {
+                "generation": await client.get(f"{layer_key}:generation"),
+                "best": BestLayerCache(cache.max_best_dates)
+            }
+            cache.put(f"{layer_key}:best", entry)
+        else:
+            found, best_layer_name = entry["best"].get(snap_date_string)
+            if found:
+                return best_layer_name
+        best_layer_name = await client.hget(f"{layer_key}:best", snap_date_string)
+        entry["best"].put(snap_date_string, best_layer_name)
+        return best_layer_name
+
+    async def async_redis_get_all_layers(self, client, prefix_string: str, periods_start: Optional[str],
+                                         periods_end: Optional[str], all_layers_ttl: Optional[float] = None) -> Dict:
+        """Asyncio variant of redis_get_all_layers."""
+        if all_layers_ttl:
+            all_layers = await self._async_get_all_layers_aggregate(client, prefix_string, all_layers_ttl)
+        else:
+            all_layers = await self._async_read_layers(
+                client, prefix_string, await self._async_scan_layer_names(client, prefix_string))
+
+        return self._filter_layers(all_layers, periods_start, periods_end)
+
+    async def _async_get_all_layers_aggregate(self, client, prefix_string: str, all_layers_ttl: float) -> Dict:
+        """Asyncio variant of _get_all_layers_aggregate."""
+        aggregate_key = f"{prefix_string}layers:all"
+        pipe = client.pipeline(transaction=False)
+        pipe.get(aggregate_key)
+        pipe.get(f"{aggregate_key}:generation")
+        aggregate, generation = await pipe.execute()
+        aggregate = self._load_all_layers_aggregate(aggregate)
+        if self._all_layers_aggregate_is_current(aggregate, generation, all_layers_ttl):
+            return aggregate["layers"]
+
+        lock = client.lock(f"{aggregate_key}:lock", timeout=self.ALL_LAYERS_LOCK_TIMEOUT)
+        if not await lock.acquire(blocking=False):
+            if aggregate is not None:
+                return aggregate["layers"]
+            return await self._async_read_layers(
+                client, prefix_string, await self._async_scan_layer_names(client, prefix_string))
+        try:
+            print(f"INFO: Rebuilding {aggregate_key}")
+            generation = await client.get(f"{aggregate_key}:generation")
+            all_layers = await self._async_read_layers(
+                client, prefix_string, await self._async_scan_layer_names(client, prefix_string))
+            await client.set(aggregate_key, self._dump_all_layers_aggregate(all_layers, generation))
+        finally:
+            try:
+                await lock.release()
+            except redis.exceptions.LockError:
+                pass
+        return all_layers
+
+    async def _async_scan_layer_names(self, client, prefix_string: str) -> set:
+        """Asyncio variant of _scan_layer_names."""
+        # redis.asyncio's RedisCluster.scan_iter already iterates over every primary node
+        layer_names = set()
+        async for key in client.scan_iter(match=f"{prefix_string}layer:*", count=1000):
+            layer_names.update(self._layer_names_from_keys([key]))
+        return layer_names
+
+    async def _async_read_layers(self, client, prefix_string: str,
+                                 layer_names) -> Dict[str, Tuple[Optional[str], List[str]]]:
+        """Asyncio variant of _read_layers."""
+        all_layers = {}
+        for batch in self._layer_batches(client, prefix_string, layer_names):
+            pipe = self._queue_layer_defaults(client.pipeline(transaction=False), prefix_string, batch)
+            results = await pipe.execute()
+            defaults = results[0::2]
+            key_types = results[1::2]
+
+            pipe = self._queue_layer_periods(client.pipeline(transaction=False), prefix_string, batch, key_types)
+            self._collect_layers(all_layers, batch, defaults, key_types, await pipe.execute())
+        return all_layers
+
     def basic_date_formatter(self, options: Optional[Dict] = None) -> callable:
         """Basic date formatter."""
         def formatter(layer_name: str, date_obj: datetime) -> str:
@@ -585,141 +1432,358 @@ class OnearthTimeService:
             return f"{layer_name}{date_obj.strftime(format_str)}"
         return formatter
     
+    def filename_handler(self, filename_options: Optional[Dict] = None) -> callable:
+        """Create the filename formatter for the filename options."""
+        if not filename_options:
+            return self.basic_date_formatter()
+        elif filename_options.get("filename_format") == "hash":
+            return self.hash_formatter(filename_options)
+        elif filename_options.get("filename_format") == "strftime":
+            return self.strftime_formatter(filename_options)
+        else:
+            return self.basic_date_formatter(filename_options)
+
+    def parse_request_date(self, date_string: str) -> Optional[datetime]:
+        """Parse a date or datetime query parameter, returning None if it's invalid."""
+        if not re.match(self.DATE_TEMPLATE, date_string) and not re.match(self.DATETIME_TEMPLATE, date_string):
+            return None
+        try:
+            return datetime.fromisoformat(date_string.replace('Z', '+00:00')).replace(tzinfo=None)
+        except ValueError:
+            return None
+
+    def parse_request(self, query_string: str) -> Tuple[Dict[str, Any], Optional[Tuple[str, Dict[str, str], int]]]:
+        """
+        Parse and validate the query parameters of a time service request.
+        Returns the parameters and an error response if any of them are invalid.
+        """
+        params = {
+            "layer_name": self.get_query_param("layer", query_string),
+            "batch": self.get_query_param("layers", query_string),
+            "request_date_string": self.get_query_param("datetime", query_string),
+            "periods_start": self.get_query_param("periods_start", query_string),
+            "periods_end": self.get_query_param("periods_end", query_string),
+            "limit": self.get_query_param("limit", query_string),
+            "skip": int(self.get_query_param("skip", query_string) or "0"),
+            "lookup_keys": self.get_query_keys(query_string)
+        }
+
+        # Validate inputs 
+        if params["limit"]:
+            try:
+                params["limit"] = int(params["limit"])
+            except ValueError:
+                return params, self.send_response(200, json.dumps({"err_msg": "Limit must be an integer"}))
+
+        if params["periods_start"] and not self.parse_request_date(params["periods_start"]):
+            return params, self.send_response(200, json.dumps({"err_msg": "Invalid periods start date"}))
+
+        if params["periods_end"] and not self.parse_request_date(params["periods_end"]):
+            return params, self.send_response(200, json.dumps({"err_msg": "Invalid periods end date"}))
+
+        return params, None
+
+    def use_snap_handler(self, params: Dict[str, Any]) -> Optional[datetime]:
+        """
+        Returns the requested date if the request can be snapped on the Redis server,
+        i.e. it has a valid datetime and doesn't need the full list of periods.
+        """
+        request_date_string = params["request_date_string"]
+        if not request_date_string or params["periods_start"] or params["periods_end"]:
+            return None
+        return self.parse_request_date(request_date_string)
+
+    @staticmethod
+    def parse_batch_request(batch_string: str) -> List[Tuple[str, Optional[str]]]:
+        """Parse a comma-separated list of `layer[:datetime]` pairs from the `layers` query parameter."""
+        batch_requests = []
+        for batch_request in batch_string.split(","):
+            # Only split on the first colon, since datetimes contain colons
+            layer_name, _, request_date_string = batch_request.strip().partition(":")
+            if layer_name:
+                batch_requests.append((layer_name, request_date_string or None))
+        return batch_requests
+
+    def batch_snap(self, batch_requests: List[Tuple[str, Optional[str]]],
+                   all_layers: Dict[str, Tuple[Optional[str], List[str]]]) -> List[Dict[str, Any]]:
+        """
+        Snap each (layer_name, request_date_string) pair against the layer's periods.
+        Pairs without a date (or with `default`) snap to the layer's default date.
+        Returns a message for each pair, with the snapped datetime under "date" or an error message.
+        """
+        out_msgs = []
+        for layer_name, request_date_string in batch_requests:
+            default, periods = all_layers.get(layer_name, (None, []))
+            if not periods:
+                out_msgs.append({"layer": layer_name, "err_msg": "Invalid Layer"})
+                continue
+
+            if not request_date_string or request_date_string.lower() == "default":
+                try:
+                    snap_date = datetime.fromisoformat(default.replace('Z', '+00:00')).replace(tzinfo=None)
+                except (AttributeError, ValueError):
+                    out_msgs.append({"layer": layer_name, "err_msg": "Invalid Date"})
+                    continue
+            else:
+                req_date = self.parse_request_date(request_date_string)
+                if not req_date:
+                    out_msgs.append({"layer": layer_name, "err_msg": "Invalid Date"})
+                    continue
+                snap_date, _ = self.time_snap(req_date, periods, True)
+                if not snap_date:
+                    out_msgs.append({"layer": layer_name, "err_msg": "Date out of range"})
+                    continue
+            out_msgs.append({"layer": layer_name, "date": snap_date})
+        return out_msgs
+
+    @staticmethod
+    def batch_snap_dates(out_msgs: List[Dict[str, Any]]) -> List[Tuple[str, str]]:
+        """List the (layer_name, snap_date_string) pairs that need a best layer lookup."""
+        return [(out_msg["layer"], out_msg["date"].strftime(OnearthTimeService.DATETIME_FORMAT))
+                for out_msg in out_msgs if "date" in out_msg]
+
+    def batch_response(self, out_msgs: List[Dict[str, Any]], best_layer_names: List[str],
+                       filename_handler: callable) -> List[Dict[str, Any]]:
+        """Add the best layer name (prefix) and filename to each successful snap."""
+        best_layer_names = iter(best_layer_names)
+        for out_msg in out_msgs:
+            if "date" in out_msg:
+                snap_date = out_msg["date"]
+                out_msg["prefix"] = next(best_layer_names)
+                out_msg["date"] = snap_date.strftime(self.DATETIME_FORMAT)
+                out_msg["filename"] = filename_handler(out_msg["prefix"], snap_date)
+        return out_msgs
+
+    @staticmethod
+    def log_request_duration(start_timestamp: float, uuid: str) -> None:
+        """Log the duration of a time service request."""
+        # use int to round to the nearest integer to prevent "number has no integer representation" error
+        duration = int(time.time() * 1000 * 1000 - start_timestamp)
+        print(f"step=timesnap_request duration={duration} uuid={uuid}")
+
+    @staticmethod
+    def run_steps(steps):
+        """
+        Run a request routing generator (see route_request) synchronously. The generator yields
+        (io_function, *args) tuples for the reads it needs, is sent their results, and returns the
+        response, so the synchronous and asyncio handlers share the same routing code.
+        """
+        try:
+            step = next(steps)
+            while True:
+                step = steps.send(step[0](*step[1:]))
+        except StopIteration as stop:
+            return stop.value
+
+    @staticmethod
+    async def async_run_steps(steps):
+        """Asyncio variant of run_steps, for generators that yield coroutine functions."""
+        try:
+            step = next(steps)
+            while True:
+                step = steps.send(await step[0](*step[1:]))
+        except StopIteration as stop:
+            return stop.value
+
+    def route_request(self, query_string: str, headers: Dict[str, str], layer_handler: callable,
+                      batch_handler: callable, snap_handler: Optional[callable], filename_handler: callable):
+        """
+        Route a time service request. This is a generator for run_steps or async_run_steps that
+        yields the layer, batch and snap handler calls it needs, and returns the response.
+        """
+        uuid = headers.get("UUID", "none")
+        start_timestamp = time.time() * 1000 * 1000
+
+        params, error_response = self.parse_request(query_string)
+        if error_response:
+            return error_response
+        layer_name = params["layer_name"]
+        request_date_string = params["request_date_string"]
+        periods_start = params["periods_start"]
+        periods_end = params["periods_end"]
+        limit = params["limit"]
+        skip = params["skip"]
+        lookup_keys = params["lookup_keys"]
+
+        # A list of layer[:datetime] pairs returns the snap results of every pair
+        if params["batch"]:
+            batch_requests = self.parse_batch_request(params["batch"])
+            all_layers = yield batch_handler, uuid, sorted({layer for layer, _ in batch_requests}), lookup_keys
+            if all_layers is None:
+                return self.send_response(503, json.dumps({"err_msg": "Time database error"}))
+            out_msgs = self.batch_snap(batch_requests, all_layers)
+            snap_dates = self.batch_snap_dates(out_msgs)
+            best_layer_names = (yield batch_handler, uuid, None, lookup_keys, snap_dates) if snap_dates else []
+            if best_layer_names is None:
+                return self.send_response(503, json.dumps({"err_msg": "Time database error"}))
+            out_msgs = self.batch_response(out_msgs, best_layer_names, filename_handler)
+            self.log_request_duration(start_timestamp, uuid)
+            return self.send_response(200, json.dumps(out_msgs))
+
+        # A blank query returns the entire list of layers and periods
+        if not query_string or not layer_name:
+            self.log_request_duration(start_timestamp, uuid)
+
+            layer_datetime_info = yield layer_handler, uuid, None, lookup_keys, None, periods_start, periods_end
+            if limit or skip > 0:
+                layer_datetime_info = self.apply_skip_limit(layer_datetime_info, skip, limit)
+            return self.send_response(200, json.dumps(layer_datetime_info))
+
+        # Snap on the Redis server if enabled, unless the request needs the full list of periods
+        req_date = self.use_snap_handler(params) if snap_handler else None
+        if req_date:
+            out_msg = yield snap_handler, uuid, layer_name, lookup_keys, req_date
+            if out_msg is not None:
+                if not out_msg.get("err_msg"):
+                    snap_date = datetime.strptime(out_msg["date"], self.DATETIME_FORMAT)
+                    out_msg["filename"] = filename_handler(out_msg["prefix"], snap_date)
+                self.log_request_duration(start_timestamp, uuid)
+                return self.send_response(200, json.dumps(out_msg))
+
+        layer_datetime_info = yield layer_handler, uuid, layer_name, lookup_keys, None, periods_start, periods_end
+        if isinstance(layer_datetime_info, dict) and layer_datetime_info.get("err_msg"):
+            return self.send_response(200, json.dumps(layer_datetime_info))
+
+        # A layer but no date returns the default date and available periods for that layer
+        if not request_date_string:
+            self.log_request_duration(start_timestamp, uuid)
+
+            if limit or skip > 0:
+                layer_datetime_info = self.apply_skip_limit(layer_datetime_info, skip, limit)
+            return self.send_response(200, json.dumps(layer_datetime_info))
+
+        # If it's a default request, return the default date, best layer name, and filename
+        if request_date_string.lower() == "default":
+            default_date_str = layer_datetime_info[layer_name]["default"]
+            default_date = datetime.fromisoformat(default_date_str.replace('Z', '+00:00')).replace(tzinfo=None)
+            best_layer_name = yield layer_handler, uuid, layer_name, lookup_keys, default_date.strftime(self.DATETIME_FORMAT)
+
+            out_msg = {
+                "prefix": best_layer_name,
+                "date": default_date.strftime(self.DATETIME_FORMAT),
+                "filename": filename_handler(best_layer_name, default_date)
+            }
+
+            self.log_request_duration(start_timestamp, uuid)
+            return self.send_response(200, json.dumps(out_msg))
+
+        # Send error message if the date is in a bad format or can't be parsed for any other reason
+        req_date = self.parse_request_date(request_date_string)
+        if not req_date:
+            self.log_request_duration(start_timestamp, uuid)
+            return self.send_response(200, json.dumps({"err_msg": "Invalid Date"}))
+
+        # Find snap date if date request is valid
+        if layer_name not in layer_datetime_info:
+            return self.send_response(200, json.dumps({"err_msg": "Invalid Layer"}))
+
+        periods = layer_datetime_info[layer_name]["periods"]
+        snap_date, _ = self.time_snap(req_date, periods, True)
+
+        # Return snap date and error if none is found
+        if snap_date:
+            snap_date_string = snap_date.strftime(self.DATETIME_FORMAT)
+            best_layer_name = yield layer_handler, uuid, layer_name, lookup_keys, snap_date_string
+
+            out_msg = {
+                "prefix": best_layer_name,
+                "date": snap_date_string,
+                "filename": filename_handler(best_layer_name, snap_date)
+            }
+        else:
+            out_msg = {"err_msg": "Date out of range"}
+
+        self.log_request_duration(start_timestamp, uuid)
+        return self.send_response(200, json.dumps(out_msg))
+
     def time_service(self, layer_handler_options: Dict, filename_options: Optional[Dict] = None) -> callable:
         """Main time service handler factory."""
         # Create layer handler
+        snap_handler = None
         if layer_handler_options["handler_type"] == "redis":
-            layer_handler = self.redis_handler(layer_handler_options)
+            client = self.redis_client(layer_handler_options)
+            layer_handler = self.redis_handler(layer_handler_options, client)
+            batch_handler = self.redis_batch_handler(layer_handler_options, client)
+            if layer_handler_options.get("snap_script"):
+                snap_handler = self.redis_snap_handler(layer_handler_options, client)
         else:
             raise ValueError(f"Unsupported handler type: {layer_handler_options['handler_type']}")
         
         # Create filename handler
-        if not filename_options:
-            filename_handler = self.basic_date_formatter()
-        elif filename_options.get("filename_format") == "hash":
-            filename_handler = self.hash_formatter(filename_options)
-        elif filename_options.get("filename_format") == "strftime":
-            filename_handler = self.strftime_formatter(filename_options)
-        else:
-            filename_handler = self.basic_date_formatter(filename_options)
+        filename_handler = self.filename_handler(filename_options)
         
         def handler(query_string: str, headers: Dict[str, str], notes: Dict[str, str]) -> Tuple[str, Dict[str, str], int]:
             """Main request handler."""
-            uuid = headers.get("UUID", "none")
-            start_timestamp = time.time() * 1000 * 1000
-            
-            layer_name = self.get_query_param("layer", query_string)
-            periods_start = self.get_query_param("periods_start", query_string)
-            periods_end = self.get_query_param("periods_end", query_string)
-            limit = self.get_query_param("limit", query_string)
-            skip = int(self.get_query_param("skip", query_string) or "0")
-            lookup_keys = self.get_query_keys(query_string)
-            
-            # Validate inputs 
-            if limit:
-                try:
-                    limit = int(limit)
-                except ValueError:
-                    return self.send_response(200, json.dumps({"err_msg": "Limit must be an integer"}))
-            
-            if periods_start:
-                try:
-                    if not re.match(self.DATE_TEMPLATE, periods_start) and not re.match(self.DATETIME_TEMPLATE, periods_start):
-                        return self.send_response(200, json.dumps({"err_msg": "Invalid periods start date"}))
-                    datetime.fromisoformat(periods_start.replace('Z', '+00:00')).replace(tzinfo=None)
-                except ValueError:
-                    return self.send_response(200, json.dumps({"err_msg": "Invalid periods start date"}))
-                
-            if periods_end:
-                try:
-                    if not re.match(self.DATE_TEMPLATE, periods_end) and not re.match(self.DATETIME_TEMPLATE, periods_end):
-                        return self.send_response(200, json.dumps({"err_msg": "Invalid periods end date"}))
-                    datetime.fromisoformat(periods_end.replace('Z', '+00:00')).replace(tzinfo=None)
-                except ValueError:
-                    return self.send_response(200, json.dumps({"err_msg": "Invalid periods end date"}))
-            
-            # A blank query returns the entire list of layers and periods
-            if not query_string or not layer_name:
-                # use int to round to the nearest integer to prevent "number has no integer representation" error
-                duration = int(time.time() * 1000 * 1000 - start_timestamp)
-                print(f"step=timesnap_request duration={duration} uuid={uuid}")
-                
-                layer_datetime_info = layer_handler(uuid, None, lookup_keys, None, periods_start, periods_end)
-                if limit or skip > 0:
-                    layer_datetime_info = self.apply_skip_limit(layer_datetime_info, skip, limit)
-                return self.send_response(200, json.dumps(layer_datetime_info))
-            
-            request_date_string = self.get_query_param("datetime", query_string)
-            layer_datetime_info = layer_handler(uuid, layer_name, lookup_keys, None, periods_start, periods_end)
-            if isinstance(layer_datetime_info, dict) and layer_datetime_info.get("err_msg"):
-                return self.send_response(200, json.dumps(layer_datetime_info))
-            
-            # A layer but no date returns the default date and available periods for that layer
-            if not request_date_string:
-                # use int to round to the nearest integer to prevent "number has no integer representation" error
-                duration = int(time.time() * 1000 * 1000 - start_timestamp)
-                print(f"step=timesnap_request duration={duration} uuid={uuid}")
-                
-                if limit or skip > 0:
-                    layer_datetime_info = self.apply_skip_limit(layer_datetime_info, skip, limit)
-                return self.send_response(200, json.dumps(layer_datetime_info))
-            
-            # If it's a default request, return the default date, best layer name, and filename
-            if request_date_string.lower() == "default":
-                default_date_str = layer_datetime_info[layer_name]["default"]
-                default_date = datetime.fromisoformat(default_date_str.replace('Z', '+00:00')).replace(tzinfo=None)
-                best_layer_name = layer_handler(uuid, layer_name, lookup_keys, default_date.strftime(self.DATETIME_FORMAT))
-                
-                out_msg = {
-                    "prefix": best_layer_name,
-                    "date": default_date.strftime(self.DATETIME_FORMAT),
-                    "filename": filename_handler(best_layer_name, default_date)
-                }
-                
-                duration = int(time.time() * 1000 * 1000 - start_timestamp)
-                print(f"step=timesnap_request duration={duration} uuid={uuid}")
-                return self.send_response(200, json.dumps(out_msg))
-            
-            # Send error message if date is in a bad format
-            if not re.match(self.DATE_TEMPLATE, request_date_string) and not re.match(self.DATETIME_TEMPLATE, request_date_string):
-                duration = int(time.time() * 1000 * 1000 - start_timestamp)
-                print(f"step=timesnap_request duration={duration} uuid={uuid}")
-                return self.send_response(200, json.dumps({"err_msg": "Invalid Date"}))
-            
-            # Send error message if we can't parse the date for any other reason
-            try:
-                req_date = datetime.fromisoformat(request_date_string.replace('Z', '+00:00')).replace(tzinfo=None)
-            except ValueError:
-                duration = int(time.time() * 1000 * 1000 - start_timestamp)
-                print(f"step=timesnap_request duration={duration} uuid={uuid}")
-                return self.send_response(200, json.dumps({"err_msg": "Invalid Date"}))
-            
-            # Find snap date if date request is valid
-            if layer_name not in layer_datetime_info:
-                return self.send_response(200, json.dumps({"err_msg": "Invalid Layer"}))
-                
-            periods = layer_datetime_info[layer_name]["periods"]
-            snap_date, _ = self.time_snap(req_date, periods, True)
-            
-            # Return snap date and error if none is found
-            if snap_date:
-                snap_date_string = snap_date.strftime(self.DATETIME_FORMAT)
-                best_layer_name = layer_handler(uuid, layer_name, lookup_keys, snap_date_string)
-                
-                out_msg = {
-                    "prefix": best_layer_name,
-                    "date": snap_date_string,
-                    "filename": filename_handler(best_layer_name, snap_date)
-                }
-            else:
-                out_msg = {"err_msg": "Date out of range"}
-            
-            duration = int(time.time() * 1000 * 1000 - start_timestamp)
-            print(f"step=timesnap_request duration={duration} uuid={uuid}")
-            return self.send_response(200, json.dumps(out_msg))
+            return self.run_steps(self.route_request(query_string, headers, layer_handler, batch_handler,
+                                                     snap_handler, filename_handler))
         
         return handler
 
+    def async_time_service(self, layer_handler_options: Dict, filename_options: Optional[Dict] = None) -> callable:
+        """
+        Asyncio variant of time_service, built on redis.asyncio. The returned coroutine
+        function takes the same arguments and returns the same responses as the
+        synchronous handler, so a single event loop can serve many concurrent requests.
+        """
+        snap_handler = None
+        if layer_handler_options["handler_type"] == "redis":
+            client = self.async_redis_client(layer_handler_options)
+            layer_handler = self.async_redis_handler(layer_handler_options, client)
+            batch_handler = self.async_redis_batch_handler(layer_handler_options, client)
+            if layer_handler_options.get("snap_script"):
+                snap_handler = self.async_redis_snap_handler(layer_handler_options, client)
+        else:
+            raise ValueError(f"Unsupported handler type: {layer_handler_options['handler_type']}")
+
+        filename_handler = self.filename_handler(filename_options)
+
+        async def handler(query_string: str, headers: Dict[str, str], notes: Dict[str, str]) -> Tuple[str, Dict[str, str], int]:
+            """Main request handler."""
+            return await self.async_run_steps(self.route_request(query_string, headers, layer_handler, batch_handler,
+                                                                 snap_handler, filename_handler))
+
+        return handler
+
+    def asgi_app(self, layer_handler_options: Dict, filename_options: Optional[Dict] = None) -> callable:
+        """Create an ASGI application that serves time service requests with async_time_service."""
+        time_service_handler = self.async_time_service(layer_handler_options, filename_options)
+
+        async def application(scope: Dict[str, Any], receive: callable, send: callable) -> None:
+            if scope["type"] == "lifespan":
+                while True:
+                    message = await receive()
+                    if message["type"] == "lifespan.startup":
+                        await send({"type": "lifespan.startup.complete"})
+                    elif message["type"] == "lifespan.shutdown":
+                        await send({"type": "lifespan.shutdown.complete"})
+                        return
+            if scope["type"] != "http":
+                return
+
+            query_string = scope.get("query_string", b"").decode("latin-1")
+            headers = {name.decode("latin-1").title(): value.decode("latin-1")
+                       for name, value in scope.get("headers", [])}
+            headers.setdefault("UUID", headers.get("Uuid", "asgi-request"))
+
+            try:
+                response_body, response_headers, status_code = await time_service_handler(query_string, headers, {})
+            except Exception as e:
+                # Details of the error are only logged, since they can include Redis connection details
+                print(f"ERROR in ASGI application: {e}")
+                traceback.print_exc()
+                response_body, response_headers, status_code = self.send_response(
+                    500, json.dumps({"err_msg": "Server error"}))
+
+            await send({
+                "type": "http.response.start",
+                "status": status_code,
+                "headers": [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                            for name, value in response_headers.items()]
+            })
+            await send({"type": "http.response.body", "body": response_body.encode("utf-8")})
+
+        return application
+
 
 # For backwards compatibility
 onearthTimeService = OnearthTimeService()
\ No newline at end of file
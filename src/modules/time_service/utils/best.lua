@@ -32,6 +32,8 @@ if redis.call("EXISTS", KEYS[1] .. ":best_layer") == 1 and ARGV[1] ~= nil then
     redis.call("ZREM", best_key .. ":dates", ARGV[1])
     redis.call("ECHO","*** Warn: Deleted or not configured, removing Best LAYER: " .. best_key .. " DATE: " .. ARGV[1])
   end
+  -- Let time service caches know that the best layers have changed
+  redis.call("INCR", best_key .. ":generation")
 elseif not ARGV[1] then -- recalculate :best and :dates keys for best layer based on the :dates keys of the layers listed in :best_config
   local source_layers = redis.call("ZRANGE", KEYS[1] .. ":best_config", 0, -1)
   if source_layers then
@@ -45,5 +47,6 @@ elseif not ARGV[1] then -- recalculate :best and :dates keys for best layer base
         redis.call("ZADD", KEYS[1] .. ":dates", 0, date)
       end
     end
+    redis.call("INCR", KEYS[1] .. ":generation")
   end
 end
\ No newline at end of file
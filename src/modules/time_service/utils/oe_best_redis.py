@@ -73,6 +73,97 @@ def calculate_layer_best(redis_cli, layer_key, new_datetime, debug=False):
             logger.warning('Deleted or not configured, removing Best LAYER: %s DATE: %s',
                            best_key, new_datetime)
 
+        # Let time service caches know that the best layer's :best key has changed
+        redis_cli.incr(f'{best_key}:generation')
+
+
+def calculate_layers_best(redis_cli, layer_dates, debug=False):
+    """
+    Bulk version of calculate_layer_best for many dates of many layers. The best layer of each
+    date is determined in memory, and each key is read and written with pipelined requests.
+    Args:
+        redis_cli (redis.Redis or redis.RedisCluster): Redis client instance.
+        layer_dates (dict): Maps each layer key ('layer_prefix:layer_name') to the list of new
+            datetimes that have already been added to its :dates key.
+        debug (bool): If True, set logging level to DEBUG, otherwise INFO.
+    Returns:
+        list: The keys of the best layers that were updated.
+    Raises:
+        redis.exceptions.RedisError: If there is an error with the Redis operations.
+    """
+    logger.setLevel(logging.DEBUG if debug else logging.INFO)
+    layer_keys = list(layer_dates.keys())
+
+    pipe = redis_cli.pipeline(transaction=False)
+    for layer_key in layer_keys:
+        pipe.get(f'{layer_key}:best_layer')
+    best_layers = pipe.execute()
+
+    # Group the new dates by best layer
+    best_dates = {}
+    best_layer_keys = {}
+    for layer_key, best_layer in zip(layer_keys, best_layers):
+        if best_layer is None:
+            continue
+        layer_prefix = re.match(r'(.*):', layer_key).group(1)
+        best_key = f'{layer_prefix}:{best_layer.decode("utf-8")}'
+        logger.info('Creating besting linking for %s', layer_key)
+        best_dates.setdefault(best_key, set()).update(layer_dates[layer_key])
+        best_layer_keys.setdefault(best_key, layer_key)
+    best_keys = list(best_dates.keys())
+    if not best_keys:
+        return []
+
+    pipe = redis_cli.pipeline(transaction=False)
+    for best_key in best_keys:
+        pipe.zrevrange(f'{best_key}:best_config', 0, -1)
+    best_configs = pipe.execute()
+
+    # If no best_config exists, then add the first layer's config as the only best_config
+    pipe = redis_cli.pipeline(transaction=False)
+    for i, best_key in enumerate(best_keys):
+        if not best_configs[i]:
+            layer_name = best_layer_keys[best_key].split(':')[-1]
+            pipe.zadd(f'{best_key}:best_config', {layer_name: 0})
+            best_configs[i] = [layer_name.encode('utf-8')]
+    pipe.execute()
+
+    # Get the dates of all the layers in each best_config, with higher scores first
+    pipe = redis_cli.pipeline(transaction=False)
+    for best_key, layers in zip(best_keys, best_configs):
+        layer_prefix = re.match(r'(.*):', best_key).group(1)
+        logger.info('Checking layers for %s:best_config is %s', best_key, layers)
+        for layer in layers:
+            pipe.zrange(f'{layer_prefix}:{layer.decode("utf-8")}:dates', 0, -1)
+    config_dates = iter(pipe.execute())
+
+    pipe = redis_cli.pipeline(transaction=False)
+    for best_key, layers in zip(best_keys, best_configs):
+        layers_dates = [(layer.decode('utf-8'), set(next(config_dates))) for layer in layers]
+        best = {}
+        not_found = []
+        for new_datetime in sorted(best_dates[best_key]):
+            for layer, dates in layers_dates:
+                if new_datetime.encode('utf-8') in dates:
+                    best[f'{new_datetime}Z'] = layer
+                    break
+            else:
+                not_found.append(new_datetime)
+
+        if best:
+            pipe.hset(f'{best_key}:best', mapping=best)
+            pipe.zadd(f'{best_key}:dates', {date[:-1]: 0 for date in best})
+        if not_found:
+            pipe.hdel(f'{best_key}:best', *[f'{date}Z' for date in not_found])
+            pipe.zrem(f'{best_key}:dates', *not_found)
+            logger.warning('Deleted or not configured, removing Best LAYER: %s DATES: %s',
+                           best_key, not_found)
+
+        # Let time service caches know that the best layer's :best key has changed
+        pipe.incr(f'{best_key}:generation')
+    pipe.execute()
+    return best_keys
+
 
 def recalculate_best(redis_cli, best_key, debug=False):
     """
@@ -103,6 +194,7 @@ def recalculate_best(redis_cli, best_key, debug=False):
             for date in dates:
                 redis_cli.hset(f'{best_key}:best', date.decode("utf-8") + 'Z', source_layer.decode('utf-8'))
                 redis_cli.zadd(f'{best_key}:dates', {date.decode("utf-8"): 0})
+        redis_cli.incr(f'{best_key}:generation')
 
 
 # Main routine to be run in CLI mode
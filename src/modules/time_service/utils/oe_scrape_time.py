@@ -32,7 +32,10 @@ import json
 import re
 from oe_redis_utl import create_redis_client
 from periods import calculate_layer_periods
-from oe_best_redis import calculate_layer_best
+from oe_best_redis import calculate_layer_best, calculate_layers_best
+
+# Maximum number of dates added to a :dates key by a single ZADD in bulk mode
+BULK_ZADD_SIZE = 10000
 
 TEST_RESPONSE = {
     'IsTruncated': False,
@@ -359,6 +362,64 @@ def getAllFiles(root_path):
             keys.append(new_key)
     return keys
 
+def bulkUpdateRedis(r, objects, layer_name=None, reproject=False):
+    """
+    Bulk version of the per-layer updates done by updateDateService. The dates of every layer,
+    including copy_dates targets and reprojected epsg3857 layers, are written with pipelined
+    ZADDs, then the best layers are calculated for all the dates at once, and then the periods
+    of each layer are calculated once.
+
+    Args:
+        r: Redis client
+        objects: Dates of each layer in each projection, as returned by keyMapper
+        layer_name: Layer name to filter on
+        reproject: If True, also add the dates of epsg4326 layers to epsg3857
+    """
+    scraped_layers = []
+    for proj, layers in objects.items():
+        for layer, data in layers.items():
+            if layer_name and layer != layer_name:
+                continue
+            dates = [datetime.strptime(date, '%Y%j%H%M%S').isoformat() for date in sorted(data['dates'])]
+            scraped_layers.append((proj, layer, dates))
+
+    pipe = r.pipeline(transaction=False)
+    for proj, layer, _ in scraped_layers:
+        pipe.get(f'{proj}:layer:{layer}:copy_dates')
+    copy_layers = pipe.execute()
+
+    # Source layers go first, so that their periods are calculated before their copy_dates targets'
+    layer_dates = {}
+    copy_layer_dates = {}
+    for (proj, layer, dates), copy_layer in zip(scraped_layers, copy_layers):
+        print(f'Configuring layer: {proj}:{layer}')
+        layers_to_update = [(layer_dates, layer)]
+        if copy_layer is not None:
+            copy_layer = copy_layer.decode("utf-8")
+            print(f'Copying dates from {layer} to {copy_layer}')
+            layers_to_update.append((copy_layer_dates, copy_layer))
+        for target, layer_to_update in layers_to_update:
+            target.setdefault(f'{proj}:layer:{layer_to_update}', set()).update(dates)
+            if reproject and str(proj) == 'epsg4326':
+                target.setdefault(f'epsg3857:layer:{layer_to_update}', set()).update(dates)
+    for layer_key, dates in copy_layer_dates.items():
+        layer_dates.setdefault(layer_key, set()).update(dates)
+    layer_dates = {layer_key: sorted(dates) for layer_key, dates in layer_dates.items()}
+
+    pipe = r.pipeline(transaction=False)
+    for layer_key, dates in layer_dates.items():
+        for i in range(0, len(dates), BULK_ZADD_SIZE):
+            pipe.zadd(f'{layer_key}:dates', {date: 0 for date in dates[i:i + BULK_ZADD_SIZE]})
+    pipe.execute()
+    print(f'Added dates for {len(layer_dates)} layers')
+
+    best_keys = calculate_layers_best(redis_cli=r, layer_dates=layer_dates)
+    print("Best Layers: ", best_keys)
+
+    for layer_key in list(layer_dates.keys()) + [key for key in best_keys if key not in layer_dates]:
+        calculate_layer_periods(redis_cli=r, layer_key=layer_key)
+
+
 def updateDateService(redis_uri,
                       redis_port,
                       bucket,
@@ -366,7 +427,8 @@ def updateDateService(redis_uri,
                       layer_name=None,
                       reproject=False,
                       check_exists=False,
-                      s3_inventory=False):
+                      s3_inventory=False,
+                      bulk=False):
     r = create_redis_client(host=redis_uri, port=redis_port)
     created = r.mget('created')[0]
     if created is None:
@@ -413,6 +475,9 @@ def updateDateService(redis_uri,
     else:
         objects = reduce(keyMapper, getAllKeys(s3, bucket), {})
 
+    if bulk:
+        bulkUpdateRedis(r, objects, layer_name, reproject)
+        return
 
     scrape_threads    = []
     scrape_semaphore  = threading.BoundedSemaphore(10)
@@ -538,6 +603,13 @@ parser.add_argument(
     dest='s3_inventory',
     help='Check if s3 inventory exist; if it does use keys from inventory',
     action='store_true')
+parser.add_argument(
+    '-u',
+    '--bulk',
+    default=False,
+    dest='bulk',
+    help='Write all dates and best layers with pipelined requests, then calculate the periods of each layer once',
+    action='store_true')
 
 args = parser.parse_args()
 
@@ -549,4 +621,5 @@ updateDateService(
     layer_name=args.layer,
     reproject=args.reproject,
     check_exists=args.check_exists,
-    s3_inventory=args.s3_inventory)
+    s3_inventory=args.s3_inventory,
+    bulk=args.bulk)
@@ -817,3 +817,13 @@ else
     end
   end
 end
+
+-- Let time service caches know that the layer's periods have changed, including the
+-- layers:all aggregate of the layer's key prefix
+local aggregatePrefix = layerPrefix:match("^(.*)layer:$")
+for _, key in ipairs(layer_keys) do
+  redis.call("INCR", key .. ":generation")
+  if aggregatePrefix ~= nil then
+    redis.call("INCR", aggregatePrefix .. "layers:all:generation")
+  end
+end
@@ -17,11 +17,18 @@ This script calculates periods and calls periods.lua to update redis
 """
 
 import argparse
-from datetime import datetime
+from datetime import datetime, timedelta
 import dateutil.relativedelta as rd
 from oe_redis_utl import create_redis_client
 import sys
 import re
+import warnings
+
+# NumPy is optional, and is used to detect periods in large lists of dates
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 DEBUG = False
 
@@ -77,9 +84,59 @@ def get_duration_from_rd(rel_delta):
         duration += str(rel_delta.seconds) + 'S'
     return duration
 
-def find_periods_and_breaks(dates, interval):
+# Parses a list of dates into a NumPy datetime64 array, or returns None if NumPy isn't available
+# or the dates aren't all in the YYYY-MM-DD or YYYY-MM-DDThh:mm:ss formats
+def parse_dates(dates):
+    if np is None or len(dates) == 0:
+        return None
+    # Anything else (e.g. fractional seconds or time zones) can't be parsed exactly by NumPy
+    if not set(map(len, dates)) <= {10, 19}:
+        return None
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            return np.array(dates, dtype='datetime64[s]')
+    except (ValueError, TypeError, Warning):
+        return None
+
+# Adds a dateutil.relativedelta to an array of datetime64 dates, clipping the day of the month
+# the same way as relativedelta when adding months or years. Returns None if the interval
+# uses anything other than relative years, months, days, hours, minutes and seconds.
+def add_interval(parsed_dates, interval):
+    if interval.microseconds or interval.leapdays or interval.weekday or any(
+            value is not None for value in (interval.year, interval.month, interval.day,
+                                            interval.hour, interval.minute, interval.second, interval.microsecond)):
+        return None
+    months = interval.years * 12 + interval.months
+    if months:
+        month_starts = parsed_dates.astype('datetime64[M]')
+        offsets = parsed_dates - month_starts.astype('datetime64[s]')
+        day_offsets = offsets // np.timedelta64(1, 'D')
+        target_months = month_starts + months
+        month_lengths = (target_months + 1).astype('datetime64[D]') - target_months.astype('datetime64[D]')
+        clipped_days = np.minimum(day_offsets, month_lengths.astype(np.int64) - 1)
+        parsed_dates = (target_months.astype('datetime64[s]') + clipped_days.astype('timedelta64[D]')
+                        + (offsets - day_offsets.astype('timedelta64[D]')))
+    fixed_seconds = int(timedelta(days=interval.days, hours=interval.hours, minutes=interval.minutes,
+                                  seconds=interval.seconds).total_seconds())
+    return parsed_dates + np.timedelta64(fixed_seconds, 's')
+
+def find_periods_and_breaks(dates, interval, parsed_dates=None):
     new_periods = []
     duration = get_duration_from_rd(interval)
+
+    # Find all breaks at once if the dates can be parsed with NumPy
+    if parsed_dates is None:
+        parsed_dates = parse_dates(dates)
+    next_dates = add_interval(parsed_dates[:-1], interval) if parsed_dates is not None else None
+    if next_dates is not None:
+        break_idxs = (np.flatnonzero(next_dates != parsed_dates[1:]) + 1).tolist()
+        for start_idx, end_idx in zip([0] + break_idxs, break_idxs + [len(dates)]):
+            new_periods.append({'start': dates[start_idx],
+                                'end': dates[end_idx - 1],
+                                'duration': duration})
+        return new_periods
+
     start_date = dates[0]
     prev_date = start_date
     for date in dates[1:]:
@@ -162,28 +219,44 @@ def calculate_periods_from_config(dates, config, start_date, end_date, find_smal
         # or fall outside of start_date and end_date
         start_idx = 0
         end_idx = len(dates) - 1
+        parsed_dates = parse_dates(dates)
         if force_start != 'DETECT' or start_date:
             if force_start == 'DETECT':
                 start_datetime = datetime.fromisoformat(start_date)
             else:
                 start_datetime = datetime.fromisoformat(force_start)
-            while start_datetime > datetime.fromisoformat(dates[start_idx]):
-                start_idx = start_idx + 1
+            if parsed_dates is not None:
+                start_idxs = np.flatnonzero(parsed_dates >= np.datetime64(start_datetime, 'us'))
+                start_idx = int(start_idxs[0]) if len(start_idxs) > 0 else len(dates)
                 if start_idx >= len(dates):
                     print(f'No dates available to detect for a forced start date of {start_datetime.isoformat()}')
                     return []
+            else:
+                while start_datetime > datetime.fromisoformat(dates[start_idx]):
+                    start_idx = start_idx + 1
+                    if start_idx >= len(dates):
+                        print(f'No dates available to detect for a forced start date of {start_datetime.isoformat()}')
+                        return []
         if force_end != 'DETECT' or end_date:
             if force_end == 'DETECT':
                 end_datetime = datetime.fromisoformat(end_date)
             else:
                 end_datetime = datetime.fromisoformat(force_end)
-            while end_datetime < datetime.fromisoformat(dates[end_idx]):
-                end_idx = end_idx - 1
+            if parsed_dates is not None:
+                end_idxs = np.flatnonzero(parsed_dates <= np.datetime64(end_datetime, 'us'))
+                end_idx = int(end_idxs[-1]) if len(end_idxs) > 0 else -1
                 if end_idx < 0:
                     print(f'No dates available to detect for a forced end date of {end_datetime.isoformat()}')
                     return []
+            else:
+                while end_datetime < datetime.fromisoformat(dates[end_idx]):
+                    end_idx = end_idx - 1
+                    if end_idx < 0:
+                        print(f'No dates available to detect for a forced end date of {end_datetime.isoformat()}')
+                        return []
     
         trimmed_dates = dates[start_idx:end_idx + 1]
+        trimmed_parsed_dates = parsed_dates[start_idx:end_idx + 1] if parsed_dates is not None else None
         
         # Calculate periods based on dates list
         
@@ -200,6 +273,11 @@ def calculate_periods_from_config(dates, config, start_date, end_date, find_smal
                     interval = first_relative_interval
                     
                 # Otherwise figure out the size and interval of the period based on the smallest interval between two dates
+                elif trimmed_parsed_dates is not None:
+                    min_idx = int(np.argmin(np.diff(trimmed_parsed_dates)))
+                    min_interval_start_date = trimmed_dates[min_idx]
+                    min_interval_end_date = trimmed_dates[min_idx + 1]
+                    interval = rd.relativedelta(datetime.fromisoformat(min_interval_end_date), datetime.fromisoformat(min_interval_start_date))
                 else:
                     min_interval = datetime.fromisoformat(trimmed_dates[1]) - datetime.fromisoformat(trimmed_dates[0])
                     min_interval_start_date = trimmed_dates[0]
@@ -212,7 +290,7 @@ def calculate_periods_from_config(dates, config, start_date, end_date, find_smal
                             min_interval_end_date = trimmed_dates[i + 1]
                 
                     interval = rd.relativedelta(datetime.fromisoformat(min_interval_end_date), datetime.fromisoformat(min_interval_start_date))
-            new_periods = find_periods_and_breaks(trimmed_dates, interval)
+            new_periods = find_periods_and_breaks(trimmed_dates, interval, trimmed_parsed_dates)
             periods.extend(new_periods)
         
         # Single date in this period
@@ -245,18 +323,7 @@ def calculate_periods_from_config(dates, config, start_date, end_date, find_smal
     # Create formatted list
     period_strings = []
     for period_dict in periods:
-        period_str = ''
-        if force_period != 'DETECT':
-            period_dict['duration'] = force_period
-        period_str = f'{period_dict["start"]}Z/{period_dict["end"]}Z/{period_dict["duration"]}'
-        # Whole date intervals
-        if 'T' not in period_dict['duration']:
-            period_str = period_str.replace('T00:00:00', '')
-            # 'PT' is only used when the interval is subdaily
-            period_str = period_str.replace('PT', 'P')
-            # Remove 'Z' if we don't have times associated with the dates
-            if 'T' not in period_str:
-                period_str = period_str.replace('Z', '')
+        period_str = format_period(period_dict, force_period)
         period_strings.append(period_str)
 
         if DEBUG:
@@ -264,8 +331,121 @@ def calculate_periods_from_config(dates, config, start_date, end_date, find_smal
 
     return period_strings                
     
-
-def calculate_layer_periods(redis_cli, layer_key, new_datetime=None, expiration=False, start_date=None, end_date=None, keep_existing_periods=False, find_smallest_interval=False, debug=False):
+# Returns the period string for a period dictionary with a start, end, and duration
+def format_period(period_dict, force_period='DETECT'):
+    if force_period != 'DETECT':
+        period_dict['duration'] = force_period
+    period_str = f'{period_dict["start"]}Z/{period_dict["end"]}Z/{period_dict["duration"]}'
+    # Whole date intervals
+    if 'T' not in period_dict['duration']:
+        period_str = period_str.replace('T00:00:00', '')
+        # 'PT' is only used when the interval is subdaily
+        period_str = period_str.replace('PT', 'P')
+        # Remove 'Z' if we don't have times associated with the dates
+        if 'T' not in period_str:
+            period_str = period_str.replace('Z', '')
+    return period_str
+
+# Returns the sort key of a period string, i.e. its start datetime
+def period_start(period_str):
+    return datetime.fromisoformat(period_str.split('/')[0].rstrip('Z'))
+
+# Incrementally recalculates the periods of a layer after new_datetime has been added to its :dates.
+# Only the periods next to the new date are extended, split, or merged.
+# Returns the layer's periods and the periods to add and remove from :periods, or None if the
+# periods need to be fully recalculated instead. This is the case when the time config isn't
+# a plain DETECT, when the new date could change the detected interval, or when the existing
+# periods don't match the dates.
+def calculate_incremental_periods(redis_cli, layer_key, new_datetime, config):
+    # Only DETECT configs with an optional forced period are supported, e.g. DETECT or DETECT/P1D
+    config_parts = config.split('/')
+    if config_parts[0] != 'DETECT' or len(config_parts) > 3:
+        return None
+    force_period = 'DETECT'
+    if len(config_parts) == 2 and config_parts[1].startswith('P'):
+        force_period = config_parts[1]
+    elif len(config_parts) == 3 and config_parts[1] == 'DETECT':
+        force_period = config_parts[2]
+    elif len(config_parts) != 1:
+        return None
+    if redis_cli.type(f'{layer_key}:periods') != b'zset':
+        return None
+
+    # The interval is detected from the first three dates, so these can't include the new date
+    new_idx = redis_cli.zrank(f'{layer_key}:dates', new_datetime)
+    if new_idx is None or new_idx < 3:
+        return None
+    if force_period != 'DETECT':
+        interval = get_rd_from_interval(force_period)
+        duration = force_period
+    else:
+        first_dates = [datetime.fromisoformat(date.decode('utf-8')) for date in redis_cli.zrange(f'{layer_key}:dates', 0, 2)]
+        interval = rd.relativedelta(first_dates[1], first_dates[0])
+        if interval != rd.relativedelta(first_dates[2], first_dates[1]):
+            return None
+        duration = get_duration_from_rd(interval)
+
+    neighbors = [date.decode('utf-8') for date in redis_cli.zrange(f'{layer_key}:dates', new_idx - 1, new_idx + 1)]
+    prev_date = neighbors[0]
+    next_date = neighbors[2] if len(neighbors) > 2 else None
+
+    # Find the existing periods containing the dates before and after the new date
+    existing_periods = [period.decode('utf-8') for period in redis_cli.zrange(f'{layer_key}:periods', 0, -1)]
+    prev_period = None
+    next_period = None
+    for period in existing_periods:
+        start, end, period_duration = period.split('/')
+        if period_duration != duration:
+            return None
+        start_datetime = datetime.fromisoformat(start.rstrip('Z'))
+        end_datetime = datetime.fromisoformat(end.rstrip('Z'))
+        if start_datetime <= datetime.fromisoformat(prev_date) <= end_datetime:
+            prev_period = (start.rstrip('Z'), end.rstrip('Z'), period)
+        if next_date and start_datetime <= datetime.fromisoformat(next_date) <= end_datetime:
+            next_period = (start.rstrip('Z'), end.rstrip('Z'), period)
+    if prev_period is None or (next_date and next_period is None):
+        return None
+
+    # Split the neighboring periods at the new date
+    if prev_period == next_period:
+        left = (prev_period[0], prev_date)
+        right = (next_date, next_period[1])
+    else:
+        if datetime.fromisoformat(prev_period[1]) != datetime.fromisoformat(prev_date):
+            return None
+        if next_period and datetime.fromisoformat(next_period[0]) != datetime.fromisoformat(next_date):
+            return None
+        left = prev_period[:2]
+        right = next_period[:2] if next_period else None
+
+    # Then join the new date to the neighboring periods if it's one interval apart from them
+    new_runs = []
+    if datetime.fromisoformat(prev_date) + interval == datetime.fromisoformat(new_datetime):
+        current = (left[0], new_datetime)
+    else:
+        new_runs.append(left)
+        current = (new_datetime, new_datetime)
+    if right and datetime.fromisoformat(new_datetime) + interval == datetime.fromisoformat(next_date):
+        current = (current[0], right[1])
+        right = None
+    new_runs.append(current)
+    if right:
+        new_runs.append(right)
+
+    new_periods = [format_period({'start': start, 'end': end, 'duration': duration}, force_period) for start, end in new_runs]
+    old_periods = {prev_period[2]}
+    if next_period:
+        old_periods.add(next_period[2])
+    periods_to_add = [period for period in new_periods if period not in old_periods]
+    periods_to_remove = [period for period in old_periods if period not in new_periods]
+
+    periods_to_remove_set = set(periods_to_remove)
+    calculated_periods = [period for period in existing_periods if period not in periods_to_remove_set] + periods_to_add
+    calculated_periods.sort(key=period_start)
+    return calculated_periods, periods_to_add, periods_to_remove
+
+
+def calculate_layer_periods(redis_cli, layer_key, new_datetime=None, expiration=False, start_date=None, end_date=None, keep_existing_periods=False, find_smallest_interval=False, debug=False, incremental=True):
     print(f'Calculating time periods for {layer_key}')
     DEBUG = debug
 
@@ -295,11 +475,6 @@ def calculate_layer_periods(redis_cli, layer_key, new_datetime=None, expiration=
                     print(f'{key}:dates already has {new_datetime}, no changes will be made')
                 return
     
-    # Get all dates for the layer
-    dates_bytes = redis_cli.zrange(f'{layer_key}:dates', 0, -1)
-    # convert to strings
-    dates = [date_byte.decode('utf-8') for date_byte in dates_bytes]
-
     # Get all time configurations for the layer
     configs_bytes = sorted(redis_cli.smembers(f'{layer_key}:config'))
     configs = [config_byte.decode('utf-8') for config_byte in configs_bytes]
@@ -308,13 +483,35 @@ def calculate_layer_periods(redis_cli, layer_key, new_datetime=None, expiration=
     if len(configs) == 0:
         configs = ['DETECT']
 
-    # Calculate the periods for each time config
-    calculated_periods = []
-    for config in configs:
-        new_periods = calculate_periods_from_config(dates, config, start_date, end_date, find_smallest_interval)
-        calculated_periods = calculated_periods + new_periods
+    # When adding a single date, try to only update the periods next to it
+    incremental_periods = None
+    if (incremental and new_datetime and len(layer_keys) == 1 and len(configs) == 1 and not start_date
+            and not end_date and not keep_existing_periods and not find_smallest_interval):
+        incremental_periods = calculate_incremental_periods(redis_cli, layer_key, new_datetime, configs[0])
 
-    for key in layer_keys:
+    if incremental_periods is not None:
+        calculated_periods, periods_to_add, periods_to_remove = incremental_periods
+        if DEBUG:
+            print(f'Incrementally updating periods, adding {periods_to_add} and removing {periods_to_remove}')
+        if len(periods_to_add) > 0:
+            redis_cli.zadd(f'{layer_key}:periods', get_zadd_dict(periods_to_add))
+        if len(periods_to_remove) > 0:
+            redis_cli.zrem(f'{layer_key}:periods', *periods_to_remove)
+        layer_keys_to_recalculate = []
+    else:
+        # Get all dates for the layer
+        dates_bytes = redis_cli.zrange(f'{layer_key}:dates', 0, -1)
+        # convert to strings
+        dates = [date_byte.decode('utf-8') for date_byte in dates_bytes]
+
+        # Calculate the periods for each time config
+        calculated_periods = []
+        for config in configs:
+            new_periods = calculate_periods_from_config(dates, config, start_date, end_date, find_smallest_interval)
+            calculated_periods = calculated_periods + new_periods
+        layer_keys_to_recalculate = layer_keys
+
+    for key in layer_keys_to_recalculate:
         is_set = redis_cli.type(f'{key}:periods') == b'set'
         
         # Situations where we'll need to add all calculated periods to the periods key
@@ -368,17 +565,19 @@ def calculate_layer_periods(redis_cli, layer_key, new_datetime=None, expiration=
         else:
             existing_periods_bytes = redis_cli.zrange(f'{key}:periods', 0, -1)
             existing_periods = [period_bytes.decode('utf-8') for period_bytes in existing_periods_bytes]
+            existing_periods_set = set(existing_periods)
+            calculated_periods_set = set(calculated_periods)
             
             # Determine which calculated periods aren't already in redis
             periods_to_add = []
             for new_period in calculated_periods:
-                if new_period not in existing_periods:
+                if new_period not in existing_periods_set:
                     periods_to_add.append(new_period)
 
             # Determine which periods in redis did not reappear after recalculation
             periods_to_remove = []
             for old_period in existing_periods:
-                if old_period not in calculated_periods:
+                if old_period not in calculated_periods_set:
                     periods_to_remove.append(old_period)
 
             # Update redis
@@ -414,6 +613,14 @@ def calculate_layer_periods(redis_cli, layer_key, new_datetime=None, expiration=
             redis_cli.set(f'{key}:default', default_date)
     else:
         print('Warning: no default date could be determined.')
+
+    # Let time service caches know that the layer's periods have changed, including the
+    # layers:all aggregate of the layer's key prefix
+    for key in layer_keys:
+        redis_cli.incr(f'{key}:generation')
+        prefix_match = re.match(r'(.*)layer:[^:]*$', key)
+        if prefix_match:
+            redis_cli.incr(f'{prefix_match.group(1)}layers:all:generation')
     
     print('Periods added to', layer_key)
 
@@ -469,6 +676,11 @@ if __name__ == '__main__':
                         action='store_true',
                         default=False,
                         help='Print additional log messages')
+    parser.add_argument('-a', '--full_recalculation',
+                        dest='full_recalculation',
+                        action='store_true',
+                        default=False,
+                        help='Always recalculate all periods from all dates. Otherwise, when a new datetime is added to a layer with a DETECT time config, only the periods next to it are updated.')
     args = parser.parse_args()
 
     redis_cli = create_redis_client(host=args.redis_uri, port=args.port, debug=args.debug)
@@ -481,5 +693,6 @@ if __name__ == '__main__':
                             args.end_date,
                             args.keep_existing_periods,
                             args.find_smallest_interval,
-                            args.debug
+                            args.debug,
+                            not args.full_recalculation
                         )
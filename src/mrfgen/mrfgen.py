@@ -71,8 +71,11 @@
 
 from optparse import OptionParser
 import glob
+import hashlib
+import json
 import logging
 import os
+import resource
 import subprocess
 import sys
 import time
@@ -83,6 +86,7 @@ import filetype
 import sqlite3
 import math
 import oe_utils
+import oe_mrf
 import re
 from overtiffpacker import pack
 from decimal import *
@@ -107,10 +111,12 @@ from oe_utils import (
 )
 
 import multiprocessing
+import concurrent.futures
+from multiprocessing.pool import ThreadPool
+import threading
 import datetime
 from contextlib import contextmanager  # used to build context pool
 import functools
-import random
 import numpy as np
 import rasterio
 from PIL import Image
@@ -121,6 +127,21 @@ oe_utils.basename = None
 errors = 0
 
 
+@functools.lru_cache()
+def read_empty_config(empty_config_filename):
+    """
+    Reads the predefined empty tiles config file. The result is kept for later runs in the same process.
+    Argument:
+        empty_config_filename -- Path of the empty_config file
+    """
+    tiles = {}
+    with open(empty_config_filename, "r") as empty_config_file:
+        for line in empty_config_file:
+            (key, val) = line.split()
+            tiles[key] = val
+    return tiles
+
+
 def lookupEmptyTile(empty_tile):
     """
     Lookup predefined empty tiles form config file
@@ -129,16 +150,11 @@ def lookupEmptyTile(empty_tile):
     if script_dir == "/usr/bin":
         script_dir = "/usr/share/onearth/mrfgen"  # use default directory if in bin
     try:
-        empty_config_file = open(script_dir + "/empty_config", "r")
+        tiles = read_empty_config(script_dir + "/empty_config")
     except IOError:
         log_sig_exit(
             "ERROR", script_dir + "/empty_config could not be found", sigevent_url
         )
-    tiles = {}
-    for line in empty_config_file:
-        (key, val) = line.split()
-        tiles[key] = val
-    empty_config_file.close()
     try:
         if tiles[empty_tile][0] == "/":
             return os.path.abspath(tiles[empty_tile])
@@ -179,6 +195,237 @@ def get_mrf_names(mrf_data, mrf_name, parameter_name, date_of_data, time_of_data
     return (mrf, index, data, aux, vrt)
 
 
+# In-process cache of gdalinfo metadata, keyed by (path, mtime, size). Cleared at the start of each
+# run_mrfgen call, so long-running batch processes don't keep the metadata of earlier runs.
+_image_info_cache = {}
+_image_info_lock = threading.Lock()
+
+
+def _image_info_key(tile):
+    """
+    Returns the cache key for an image, or None for paths that can't be
+    stat'ed locally (e.g. remote /vsi paths), which aren't cached since
+    there's no way to tell whether they have been replaced.
+    Argument:
+        tile -- Image path
+    """
+    try:
+        stats = os.stat(tile)
+    except OSError:
+        return None
+    return (os.path.abspath(tile), stats.st_mtime_ns, stats.st_size)
+
+
+def get_image_info(tile):
+    """
+    Returns gdalinfo metadata (the same dict as `gdalinfo -json`) for an image.
+    The image is opened once in-process through the GDAL bindings and the result
+    is cached until the file's modification time or size changes. Images that
+    can't be stat'ed locally are read every time.
+    Argument:
+        tile -- Image path
+    Returns:
+        Metadata dict, or None if the image could not be read
+    """
+    key = _image_info_key(tile)
+    if key is not None:
+        with _image_info_lock:
+            if key in _image_info_cache:
+                return _image_info_cache[key]
+
+    try:
+        tile_info = gdal.Info(tile, format="json")
+    except RuntimeError as e:
+        log_sig_err(f"gdalinfo errors: {e}", sigevent_url)
+        tile_info = None
+    if tile_info is None:
+        log_sig_err(f"gdalinfo failed for {tile}: {gdal.GetLastErrorMsg()}", sigevent_url)
+        # Don't cache failures so that later calls can retry
+        return None
+
+    if key is not None:
+        with _image_info_lock:
+            _image_info_cache[key] = tile_info
+    return tile_info
+
+
+def prefetch_image_info(tiles, threads=4):
+    """
+    Loads gdalinfo metadata for a list of images into the cache using a pool of threads.
+    Images that can't be cached are skipped.
+    Arguments:
+        tiles -- List of image paths
+        threads -- Number of threads to use
+    """
+    keys = ((tile, _image_info_key(tile)) for tile in set(tiles))
+    tiles = [tile for tile, key in keys if key is not None and key not in _image_info_cache]
+    if len(tiles) <= 1 or threads <= 1:
+        for tile in tiles:
+            get_image_info(tile)
+        return
+    log_info_mssg(f"Prefetching image metadata for {len(tiles)} tiles")
+    with ThreadPool(min(threads, len(tiles))) as pool:
+        pool.map(get_image_info, tiles)
+
+
+# Persistent cache of intermediate files (VRTs, crops, antimeridian cuts), keyed by the
+# content of their sources and the parameters used to build them. Source digests are
+# cached alongside the entries. Disabled unless intermediate_cache_dir is configured.
+intermediate_cache_dir = None
+intermediate_cache_maxsize = None
+_file_digest_cache = {}
+
+
+def file_digest(path):
+    """
+    Returns the SHA-256 hex digest of a file's contents. Digests are keyed on the file's path,
+    size, modification time and inode, and are kept in-process and in intermediate_cache_dir
+    so that later runs don't read unchanged files again.
+    Argument:
+        path -- File path
+    """
+    stats = os.stat(path)
+    key = (os.path.abspath(path), stats.st_size, stats.st_mtime_ns, stats.st_ino)
+    if key in _file_digest_cache:
+        return _file_digest_cache[key]
+    digest_filename = None
+    if intermediate_cache_dir:
+        digest_filename = os.path.join(
+            intermediate_cache_dir, hashlib.sha256(repr(key).encode()).hexdigest() + ".sha256"
+        )
+        try:
+            with open(digest_filename) as f:
+                hexdigest = f.read()
+            # Mark the digest as recently used for eviction
+            os.utime(digest_filename)
+            if len(hexdigest) == 64:
+                _file_digest_cache[key] = hexdigest
+                return hexdigest
+        except OSError:
+            pass
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    _file_digest_cache[key] = digest.hexdigest()
+    if digest_filename is not None:
+        temp_filename = "{0}.{1}.tmp".format(digest_filename, os.getpid())
+        try:
+            with open(temp_filename, "w") as f:
+                f.write(_file_digest_cache[key])
+            os.replace(temp_filename, digest_filename)
+        except OSError:
+            remove_file(temp_filename)
+    return _file_digest_cache[key]
+
+
+def intermediate_key(sources, params):
+    """
+    Returns the cache key for a set of intermediate files, or None if caching is
+    disabled or a source can't be read locally.
+    Arguments:
+        sources -- Files the intermediates are derived from
+        params -- Parameters used to build the intermediates, including their output paths
+            since VRTs refer to their sources by path
+    """
+    if not intermediate_cache_dir:
+        return None
+    key = hashlib.sha256()
+    try:
+        for source in sources:
+            key.update(os.path.abspath(source).encode())
+            key.update(file_digest(source).encode())
+    except OSError:
+        return None
+    for param in params:
+        key.update(b"\0" + str(param).encode())
+    return key.hexdigest()
+
+
+def restore_intermediates(key, outputs):
+    """
+    Copies cached intermediate files to their output paths.
+    Arguments:
+        key -- Cache key from intermediate_key
+        outputs -- Output paths; ones that weren't created when the entry was stored are removed
+    Returns:
+        True if the entry was found and restored
+    """
+    if key is None:
+        return False
+    entry = os.path.join(intermediate_cache_dir, key)
+    try:
+        cached = set(os.listdir(entry))
+        for output in outputs:
+            if os.path.basename(output) in cached:
+                shutil.copyfile(os.path.join(entry, os.path.basename(output)), output)
+            else:
+                remove_file(output)
+        # Mark the entry as recently used for eviction
+        os.utime(entry)
+    except OSError:
+        return False
+    log_info_mssg("Restored cached intermediates for " + ", ".join(outputs))
+    return True
+
+
+def store_intermediates(key, outputs):
+    """
+    Adds intermediate files to the cache. Outputs that don't exist are skipped.
+    Arguments:
+        key -- Cache key from intermediate_key
+        outputs -- Output paths
+    """
+    if key is None:
+        return
+    entry = os.path.join(intermediate_cache_dir, key)
+    temp_entry = "{0}.{1}.tmp".format(entry, os.getpid())
+    try:
+        os.makedirs(temp_entry, exist_ok=True)
+        for output in outputs:
+            if os.path.isfile(output):
+                shutil.copyfile(output, os.path.join(temp_entry, os.path.basename(output)))
+        # Another process may have stored the same entry in the meantime
+        os.rename(temp_entry, entry)
+    except OSError:
+        shutil.rmtree(temp_entry, ignore_errors=True)
+
+
+def evict_intermediate_cache():
+    """
+    Removes the least recently used cache entries until the cache is no larger
+    than intermediate_cache_maxsize bytes.
+    """
+    if not intermediate_cache_dir or intermediate_cache_maxsize is None:
+        return
+    entries = []
+    total_size = 0
+    for name in os.listdir(intermediate_cache_dir):
+        entry = os.path.join(intermediate_cache_dir, name)
+        if name.endswith(".tmp"):
+            continue
+        try:
+            if name.endswith(".sha256"):
+                size = os.stat(entry).st_size
+            elif os.path.isdir(entry):
+                size = sum(f.stat().st_size for f in os.scandir(entry))
+            else:
+                continue
+            entries.append((os.stat(entry).st_mtime, size, entry))
+        except OSError:
+            continue
+        total_size += size
+    for mtime, size, entry in sorted(entries):
+        if total_size <= intermediate_cache_maxsize:
+            break
+        if os.path.isdir(entry):
+            shutil.rmtree(entry, ignore_errors=True)
+        else:
+            remove_file(entry)
+        total_size -= size
+    log_info_mssg("Intermediate cache size is {0} bytes".format(total_size))
+
+
 def diff_resolution(tiles):
     """
     Compares images within a list for different image resolutions
@@ -193,9 +440,9 @@ def diff_resolution(tiles):
     log_info_mssg("Checking for different resolutions in tiles")
     res = None
     for tile in tiles:
-        tile_info = oe_utils.run_gdalinfo(tile, sigevent_url)
+        tile_info = get_image_info(tile)
         if tile_info is None:
-            # error is logged inside the run_gdalinfo function, no need to log here
+            # error is logged inside the get_image_info function, no need to log here
             continue
 
         # Writing this section more defensively since the original code does not handle errors
@@ -272,7 +519,7 @@ def get_image_epsg(tile):
     log_info_mssg("Getting image epsg")
     epsg = None
 
-    tile_info = oe_utils.run_gdalinfo(tile, sigevent_url)
+    tile_info = get_image_info(tile)
 
     wkt = ""
     try:
@@ -305,7 +552,7 @@ def get_image_extents(tile):
     """
     log_info_mssg("Getting image extents")
 
-    tile_info = oe_utils.run_gdalinfo(tile, sigevent_url)
+    tile_info = get_image_info(tile)
     if tile_info is None:
         # Will sys.exit the script
         log_sig_exit(
@@ -338,7 +585,7 @@ def has_color_table(tile):
     log_info_mssg("Checking for color table in " + tile)
     _has_color_table = False
 
-    tile_info = oe_utils.run_gdalinfo(tile, sigevent_url)
+    tile_info = get_image_info(tile)
     if tile_info is None:
         log_info_mssg("No color table found")
         return False
@@ -367,7 +614,7 @@ def has_palette(tile):
     log_info_mssg("Checking for palettes in " + tile)
     _has_palette = False
 
-    tile_info = oe_utils.run_gdalinfo(tile, sigevent_url)
+    tile_info = get_image_info(tile)
     if tile_info is None:
         return False
 
@@ -665,6 +912,18 @@ def split_across_antimeridian(
         working_dir -- Directory to use for temporary files
     """
     temp_tile = working_dir + os.path.basename(tile) + ".temp.vrt"
+    tile_left = temp_tile + ".left_cut.vrt"
+    tile_right = temp_tile + ".right_cut.vrt"
+    key = intermediate_key(
+        [tile],
+        ["antimeridian", source_extents, antimeridian, xres, yres, target_x, target_y, temp_tile],
+    )
+    if restore_intermediates(key, [temp_tile, tile_left, tile_right]):
+        return (
+            tile_left if os.path.isfile(tile_left) else None,
+            tile_right if os.path.isfile(tile_right) else None,
+        )
+    start_errors = errors
     log_info_mssg("Splitting across antimeridian with " + temp_tile)
     ulx, uly, lrx, lry = source_extents
     if Decimal(lrx) <= Decimal(antimeridian):
@@ -711,8 +970,6 @@ def split_across_antimeridian(
     if returncode != 0 or err:
         return (None, None)
     tile = temp_tile
-    tile_left = tile + ".left_cut.vrt"
-    tile_right = tile + ".right_cut.vrt"
 
     if Decimal(source_extents[2]) <= Decimal(antimeridian):
         # modify input into >180 space if not already
@@ -840,6 +1097,9 @@ def split_across_antimeridian(
             + ",".join(get_image_extents(tile_right))
         )
 
+    # Only cache splits that completed without errors
+    if errors == start_errors:
+        store_intermediates(key, [temp_tile] + [cut for cut in (tile_left, tile_right) if cut])
     return (tile_left, tile_right)
 
 
@@ -863,6 +1123,9 @@ def crop_to_extents(tile, tile_extents, projection_extents, working_dir):
     if float(lry) < float(ymin):
         lry = ymin
     cut_tile = working_dir + os.path.basename(tile) + "._cut.vrt"
+    key = intermediate_key([tile], ["crop", ulx, lry, lrx, uly, cut_tile])
+    if restore_intermediates(key, [cut_tile]):
+        return cut_tile
     gdalwarp_command_list = [
         "gdalwarp",
         "-overwrite",
@@ -877,9 +1140,11 @@ def crop_to_extents(tile, tile_extents, projection_extents, working_dir):
         cut_tile,
     ]
     log_the_command(gdalwarp_command_list)
-    subprocess.call(
+    returncode = subprocess.call(
         gdalwarp_command_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE
     )
+    if returncode == 0:
+        store_intermediates(key, [cut_tile])
     return cut_tile
 
 
@@ -890,40 +1155,101 @@ def poolcontext(*args, **kwargs):
     pool.terminate()
 
 
-class rw_lock:
-    def __init__(self):
-        self.counter = multiprocessing.Value("i", 0)
-        self.cond = multiprocessing.Condition(lock=self.counter.get_lock())
-
-    def down_read(self):
-        self.cond.acquire()
-        self.counter.value += 1
-
-        self.cond.release()
-
-    def up_read(self):
-        self.cond.acquire()
-        self.counter.value -= 1
+def get_tile_block_ranges(tiles, target_x, target_y, mrf_blocksize, target_extents):
+    """
+    Returns the range of MRF base-level blocks that inserting each tile may write to.
+    Tile extents are aligned with mrf_block_align, the same way they are for merges.
+    Arguments:
+        tiles -- List of tiles to insert
+        target_x -- The target resolution for x
+        target_y -- The target resolution for y
+        mrf_blocksize -- The block size of MRF tiles
+        target_extents -- Full extents of the target imagery
+    Returns:
+        List of (col_start, col_end, row_start, row_end) block ranges, end exclusive
+    """
+    t_xmin, t_ymin, t_xmax, t_ymax = target_extents
+    if target_y == "":
+        target_y = float(int(target_x) / 2)
+    xmin, ymin, xmax, ymax = [Decimal(x) for x in target_extents]
+    x_res = Decimal(target_x) / abs(xmax - xmin)
+    y_res = Decimal(target_y) / abs(ymax - ymin)
+    block_size = Decimal(mrf_blocksize)
 
-        if self.counter.value == 0:
-            self.cond.notify()
+    block_ranges = []
+    for tile in tiles:
+        s_xmin, s_ymax, s_xmax, s_ymin = [Decimal(x) for x in get_image_extents(tile)]
+        if s_xmin > s_xmax or s_xmin < xmin or s_xmax > xmax:
+            # Tiles that cross the antimeridian or fall outside of the extents are split or
+            # cropped before they are inserted, so reserve the full width of the grid for them
+            s_xmin, s_xmax = xmin, xmax
+        s_ymax = min(s_ymax, ymax)
+        s_ymin = max(s_ymin, ymin)
+        ulx, uly, lrx, lry = [
+            Decimal(x)
+            for x in mrf_block_align(
+                [s_xmin, s_ymax, s_xmax, s_ymin],
+                t_xmin,
+                t_ymin,
+                t_xmax,
+                t_ymax,
+                target_x,
+                target_y,
+                mrf_blocksize,
+            )
+        ]
+        col_start = int(((ulx - xmin) * x_res) // block_size)
+        col_end = max(int(math.ceil(((lrx - xmin) * x_res) / block_size)), col_start + 1)
+        row_start = int(((ymax - uly) * y_res) // block_size)
+        row_end = max(int(math.ceil(((ymax - lry) * y_res) / block_size)), row_start + 1)
+        block_ranges.append((col_start, col_end, row_start, row_end))
+    return block_ranges
 
-        self.cond.release()
 
-    def down_write(self):
-        self.cond.acquire()
+def partition_tiles_by_block(
+    tiles, target_x, target_y, mrf_blocksize, target_extents
+):
+    """
+    Groups tiles into partitions that cover disjoint ranges of the MRF block grid, so that
+    each partition can be inserted by a separate worker without touching the blocks of another.
+    Tiles whose blocks (see get_tile_block_ranges) overlap end up in the same partition.
+    Partitions are returned largest first (by input file size) and keep the input order of their tiles.
+    Arguments:
+        tiles -- List of tiles to insert
+        target_x -- The target resolution for x
+        target_y -- The target resolution for y
+        mrf_blocksize -- The block size of MRF tiles
+        target_extents -- Full extents of the target imagery
+    """
+    parents = list(range(len(tiles)))
 
-        while self.counter.value != 0:
-            self.cond.wait()
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
 
-    def up_write(self):
-        self.cond.notify()
-        self.cond.release()
+    block_owners = {}
+    block_ranges = get_tile_block_ranges(
+        tiles, target_x, target_y, mrf_blocksize, target_extents
+    )
+    for i, (col_start, col_end, row_start, row_end) in enumerate(block_ranges):
+        for col in range(col_start, col_end):
+            for row in range(row_start, row_end):
+                owner = block_owners.setdefault((col, row), i)
+                if owner != i:
+                    parents[find(i)] = find(owner)
+
+    partitions = {}
+    for i, tile in enumerate(tiles):
+        partitions.setdefault(find(i), []).append(tile)
 
+    def partition_size(partition):
+        return sum(
+            [os.path.getsize(tile) for tile in partition if os.path.exists(tile)]
+        )
 
-lock = (
-    rw_lock()
-)  # used to ensure that gdal_merge doesn't happen at the same time as a parallel insert
+    return sorted(partitions.values(), key=partition_size, reverse=True)
 
 
 def parallel_mrf_insert(
@@ -940,29 +1266,44 @@ def parallel_mrf_insert(
     merge,
     working_dir,
     no_cpus,
+    regenerate_overviews=True,
 ):
     """
-    Launches multiple workers each handling a fraction of the tiles to be merged into the final mrf file.
-    Also sets the mrf to be mp_safe to allow for simultaneous access. Generally 2-4 workers is ideal.
-    There can be some degredation in performance for large numbers of workers. We use the rw_lock to
-    synchronize access between the processes, since gdal_merge must be performed while no other process is running
-    mrf_insert. If mrf_maxsize is None, will run mrf_insert with max_size max(2 * total size of input tiles, 50GB).
-    Otherwise uses mrf_maxsize.
+    Launches multiple workers to insert tiles into the final mrf file. Tiles are partitioned by the MRF
+    block grid (see partition_tiles_by_block) so each worker owns a disjoint range of base-level blocks,
+    and partitions are handed out largest first to whichever worker is free. Since workers never touch the
+    same base-level blocks, merges don't need to be synchronized. Overview blocks can still be shared by
+    partitions, so the ones above the inserted blocks are regenerated once all workers are done.
+    The mrf is set to be mp_safe so that workers can append to the data file at the same time. The data
+    file is only cleaned after the inserts, if it is larger than mrf_maxsize or, if mrf_maxsize is None,
+    max(2 * total size of input tiles, 50GB).
 
     Arguments:
         tiles ... working_dir: Same as mrf_insert
         no_cpus (int) -- Number of CPUs to run mrf_insert in parallel
+        regenerate_overviews -- Regenerate the overview blocks written by mrf_insert. Can be turned off
+            if the overviews are rebuilt afterwards anyway.
     """
 
     log_info_mssg("parallel_mrf_insert with mrf {}".format(mrf))
 
     no_pools = min(multiprocessing.cpu_count() - 1, len(tiles), no_cpus)
+    if len(tiles) > 1 and no_pools > 1:
+        partitions = partition_tiles_by_block(
+            tiles, target_x, target_y, mrf_blocksize, target_extents
+        )
+        log_info_mssg(
+            "Partitioned {} tiles into {} disjoint block ranges for mrf {}".format(
+                len(tiles), len(partitions), mrf
+            )
+        )
+        no_pools = min(no_pools, len(partitions))
     log_info_mssg(
         "no_pools for parallel mrf_insert is {} for mrf {}".format(no_pools, mrf)
     )
 
-    if len(tiles) == 1 or no_pools == 1:
-        log_info_mssg("making serial call since not enough tiles or cores")
+    if len(tiles) == 1 or no_pools <= 1:
+        log_info_mssg("making serial call since not enough tiles, partitions or cores")
         errors = run_mrf_insert(
             tiles,
             mrf,
@@ -991,6 +1332,7 @@ def parallel_mrf_insert(
             )
         )
 
+        # The data file can't be cleaned while other workers are inserting, so that's done after the pool finishes
         func = functools.partial(
             run_mrf_insert,
             mrf=mrf,
@@ -1004,8 +1346,6 @@ def parallel_mrf_insert(
             nodata=nodata,
             merge=merge,
             working_dir=working_dir,
-            mp_safe=True,
-            max_size=max_size,
         )
 
         with open(mrf) as f:  # make mp_safe
@@ -1015,21 +1355,8 @@ def parallel_mrf_insert(
         with open(mrf, "w") as f:  # overwrite mrf
             f.write(data)
 
-        log_info_mssg(
-            "Splitting list of length {} into chunks of size {}".format(
-                len(tiles), len(tiles) // no_pools
-            )
-        )
-
-        def chunks(l, n):
-            for i in range(0, len(l), n):
-                yield l[i : i + n]
-
-        random.shuffle(tiles)  # shuffle tiles to avoid overlaps as much as possible
-        partition = chunks(tiles, len(tiles) // no_pools)
-
         with poolcontext(processes=no_pools) as pool:
-            results = pool.map(func, partition, 1)
+            results = list(pool.imap_unordered(func, partitions))
 
         log_info_mssg(
             "mrf {} map finished, results are type {}, {}".format(
@@ -1039,35 +1366,102 @@ def parallel_mrf_insert(
 
         errors = sum(results)
 
+        if regenerate_overviews and insert_method != "":
+            regenerate_inserted_overviews(
+                tiles,
+                mrf,
+                insert_method,
+                target_x,
+                target_y,
+                mrf_blocksize,
+                target_extents,
+            )
+
+        if os.stat(data_name(mrf)).st_size > max_size:
+            log_info_mssg_with_timestamp(
+                "cleaning data file {} with size {}".format(
+                    data_name(mrf), os.stat(data_name(mrf)).st_size
+                )
+            )
+            clean_mrf(data_name(mrf))
+            log_info_mssg_with_timestamp(
+                "done cleaning data file {}. now has size {}".format(
+                    data_name(mrf), os.stat(data_name(mrf)).st_size
+                )
+            )
+
     log_info_mssg("Errors {}, mrf {}".format(errors, mrf))
 
     return errors
 
 
-def clean_mrf(data_filename):  # cleans mrf files in place.
-    def index_name(mrf_name):
-        bname, ext = os.path.splitext(mrf_name)
-        return bname + os.extsep + "idx"
+def regenerate_inserted_overviews(
+    tiles, mrf, insert_method, target_x, target_y, mrf_blocksize, target_extents
+):
+    """
+    Regenerates the overview blocks above the base-level blocks covered by a list of inserted tiles.
+    Partitions inserted in parallel can share overview blocks, and mrf_insert in each worker computes
+    them from whatever the other workers had written at the time.
+    Arguments:
+        tiles -- List of inserted tiles
+        mrf -- The MRF the tiles were inserted into
+        insert_method -- The resampling method mrf_insert used {Avg, NNb}
+        target_x -- The target resolution for x
+        target_y -- The target resolution for y
+        mrf_blocksize -- The block size of MRF tiles
+        target_extents -- Full extents of the target imagery
+    """
+    dirty_blocks = set()
+    for col_start, col_end, row_start, row_end in get_tile_block_ranges(
+        tiles, target_x, target_y, mrf_blocksize, target_extents
+    ):
+        dirty_blocks.update(
+            (col, row)
+            for col in range(col_start, col_end)
+            for row in range(row_start, row_end)
+        )
+    overview_resampling = "nearest" if insert_method.lower() == "nnb" else "average"
+    dataset = gdal.Open(mrf, gdal.GA_Update)
+    if dataset is None or dataset.GetRasterBand(1).GetOverviewCount() == 0:
+        return
+    log_info_mssg(
+        "Regenerating overviews above {0} blocks of {1} after parallel insert".format(
+            len(dirty_blocks), mrf
+        )
+    )
+    regenerated = regenerate_overview_blocks(dataset, overview_resampling, dirty_blocks)
+    dataset.FlushCache()
+    dataset = None
+    if not regenerated:
+        log_sig_err(
+            "Regenerating overview blocks of {0} failed: {1}".format(
+                mrf, gdal.GetLastErrorMsg()
+            ),
+            sigevent_url,
+        )
 
-    bname, ext = os.path.splitext(data_filename)
-    target_path = bname + os.extsep + "tmp" + ext
 
-    mrf_status = subprocess.Popen(
-        ["mrf_clean.py", data_filename, target_path],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    out, err = mrf_status.communicate()
+def clean_mrf(data_filename):  # cleans mrf files in place.
+    """
+    Compacts an MRF data file so it only contains the tiles referenced by its index.
+    Argument:
+        data_filename -- The MRF data file
+    """
+    bname, ext = os.path.splitext(data_filename)
+    index_filename = bname + os.extsep + "idx"
 
-    log_info_mssg(out)
+    try:
+        with timed_stage("mrf_clean"):
+            old_size, new_size = oe_mrf.compact_mrf(data_filename, index_filename)
+    except (IOError, OSError, ValueError) as e:
+        log_sig_err("Error compacting {0}: {1}".format(data_filename, e), sigevent_url)
+        return
 
-    if mrf_status.returncode != 0:
-        log_info_mssg(
-            "mrf_clean returned with status code {}".format(mrf_status.returncode)
+    log_info_mssg(
+        "Compacted {} from {} to {} bytes, reclaimed {} bytes".format(
+            data_filename, old_size, new_size, old_size - new_size
         )
-
-    os.rename(target_path, data_filename)
-    os.rename(index_name(target_path), index_name(data_filename))
+    )
 
 
 def run_mrf_insert(
@@ -1083,7 +1477,6 @@ def run_mrf_insert(
     nodata,
     merge,
     working_dir,
-    mp_safe=False,
     max_size=None,
 ):
     """
@@ -1101,7 +1494,6 @@ def run_mrf_insert(
         nodata -- nodata value
         merge -- Merge over transparent regions of imagery
         working_dir -- Directory to use for temporary files
-        mp_safe -- mrf_insert should be mp_safe (default False)
         max_size -- run clean_mrf on target mrf when this size is reached (in bytes)
     """
     errors = 0
@@ -1116,15 +1508,7 @@ def run_mrf_insert(
         mrf_insert_command_list.append("-r")
         mrf_insert_command_list.append(insert_method)
 
-    should_lock = mp_safe
-
-    if should_lock:
-        global lock
-
     for i, tile in enumerate(tiles):
-        if should_lock:
-            lock.down_read()
-
         s_xmin, s_ymax, s_xmax, s_ymin = get_image_extents(tile)
         print("Source extents: " + ",".join([s_xmin, s_ymax, s_xmax, s_ymin]))
 
@@ -1134,8 +1518,6 @@ def run_mrf_insert(
         if os.path.splitext(tile)[1] == '.vrt' and not ('_cut.' in tile or '_reproject.' in tile):
             # ignore temp VRTs unless it's an antimeridian cut or reprojected source image
             log_info_mssg('Skipping insert of ' + tile)
-            if should_lock:
-                lock.up_read()
             continue
         """
 
@@ -1150,8 +1532,6 @@ def run_mrf_insert(
             cut_tile = crop_to_extents(
                 tile, [s_xmin, s_ymax, s_xmax, s_ymin], target_extents, working_dir
             )
-            if should_lock:
-                lock.up_read()
 
             errors += run_mrf_insert(
                 [cut_tile],
@@ -1183,8 +1563,6 @@ def run_mrf_insert(
                 str((Decimal(t_ymin) - Decimal(t_ymax)) / Decimal(target_y)),
                 working_dir,
             )
-            if should_lock:
-                lock.up_read()
 
             insert_tiles = []
 
@@ -1221,35 +1599,28 @@ def run_mrf_insert(
             continue
 
         if merge:  # merge tile with existing imagery if true
-            if should_lock:
-                lock.up_read()
-                lock.down_write()
-
-            tile = gdalmerge(
-                mrf,
-                tile,
-                [s_xmin, s_ymax, s_xmax, s_ymin],
-                target_x,
-                target_y,
-                mrf_blocksize,
-                t_xmin,
-                t_ymin,
-                t_xmax,
-                t_ymax,
-                nodata,
-                resize_resampling,
-                working_dir,
-                target_epsg,
-            )
+            with timed_stage("merge", tile=tile):
+                tile = gdalmerge(
+                    mrf,
+                    tile,
+                    [s_xmin, s_ymax, s_xmax, s_ymin],
+                    target_x,
+                    target_y,
+                    mrf_blocksize,
+                    t_xmin,
+                    t_ymin,
+                    t_xmax,
+                    t_ymax,
+                    nodata,
+                    resize_resampling,
+                    working_dir,
+                    target_epsg,
+                )
 
             if tile is None:
                 errors += 1
                 return errors
 
-            if should_lock:
-                lock.up_write()
-                lock.down_read()
-
         vrt_tile = working_dir + os.path.basename(tile) + ".vrt"
 
         diff_res, ps = diff_resolution([tile, mrf])
@@ -1285,51 +1656,50 @@ def run_mrf_insert(
 
             tile_vrt_command_list.append(tile)
             tile_vrt_command_list.append(vrt_tile)
-            log_the_command(tile_vrt_command_list)
-            tile_vrt = subprocess.Popen(
-                tile_vrt_command_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-            )
-            returncode = tile_vrt.wait()
-            if returncode != 0:
-                log_sig_err(
-                    "build tile VRT (gdalwarp) return code {0}".format(returncode),
-                    sigevent_url,
+            key = intermediate_key([tile], tile_vrt_command_list)
+            if not restore_intermediates(key, [vrt_tile]):
+                log_the_command(tile_vrt_command_list)
+                stage = start_stage("gdalwarp", tile=tile)
+                tile_vrt = subprocess.Popen(
+                    tile_vrt_command_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE
                 )
+                returncode = tile_vrt.wait()
+                end_stage(stage)
+                if returncode != 0:
+                    log_sig_err(
+                        "build tile VRT (gdalwarp) return code {0}".format(returncode),
+                        sigevent_url,
+                    )
+                else:
+                    store_intermediates(key, [vrt_tile])
 
             if merge:  # merge tile with existing imagery
-                if should_lock:
-                    lock.up_read()
-                    lock.down_write()
-
                 s_xmin, s_ymax, s_xmax, s_ymin = get_image_extents(
                     vrt_tile
                 )  # get new extents
                 log_info_mssg("Image extents " + str(extents))
-                tile = gdalmerge(
-                    mrf,
-                    vrt_tile,
-                    [s_xmin, s_ymax, s_xmax, s_ymin],
-                    target_x,
-                    target_y,
-                    mrf_blocksize,
-                    t_xmin,
-                    t_ymin,
-                    t_xmax,
-                    t_ymax,
-                    nodata,
-                    resize_resampling,
-                    working_dir,
-                    target_epsg,
-                )
+                with timed_stage("merge", tile=vrt_tile):
+                    tile = gdalmerge(
+                        mrf,
+                        vrt_tile,
+                        [s_xmin, s_ymax, s_xmax, s_ymin],
+                        target_x,
+                        target_y,
+                        mrf_blocksize,
+                        t_xmin,
+                        t_ymin,
+                        t_xmax,
+                        t_ymax,
+                        nodata,
+                        resize_resampling,
+                        working_dir,
+                        target_epsg,
+                    )
                 if tile is None:
                     errors += 1
                     return errors
                 mrf_insert_command_list.append(tile)
 
-                if should_lock:
-                    lock.up_write()
-                    lock.down_read()
-
             else:
                 mrf_insert_command_list.append(vrt_tile)
         else:
@@ -1337,6 +1707,7 @@ def run_mrf_insert(
 
         mrf_insert_command_list.append(mrf)
         log_the_command(mrf_insert_command_list)
+        stage = start_stage("mrf_insert", tile=tile)
 
         try:
             mrf_insert = subprocess.Popen(
@@ -1357,6 +1728,7 @@ def run_mrf_insert(
             else:
                 log_info_mssg(str(message).strip())
         returncode = mrf_insert.wait()
+        end_stage(stage)
         if returncode != 0:
             log_sig_err("mrf_insert return code {0}".format(returncode), sigevent_url)
 
@@ -1375,27 +1747,19 @@ def run_mrf_insert(
             remove_file(vrt)
         """
 
-        if should_lock:
-            lock.up_read()
-
         if max_size is not None:
             if os.stat(data_name(mrf)).st_size > max_size:
-                if should_lock:
-                    lock.down_write()
-                if os.stat(data_name(mrf)).st_size > max_size:
-                    log_info_mssg_with_timestamp(
-                        "cleaning data file {} with size {}".format(
-                            data_name(mrf), os.stat(data_name(mrf)).st_size
-                        )
+                log_info_mssg_with_timestamp(
+                    "cleaning data file {} with size {}".format(
+                        data_name(mrf), os.stat(data_name(mrf)).st_size
                     )
-                    clean_mrf(data_name(mrf))
-                    log_info_mssg_with_timestamp(
-                        "done cleaning data file {}. now has size {}".format(
-                            data_name(mrf), os.stat(data_name(mrf)).st_size
-                        )
+                )
+                clean_mrf(data_name(mrf))
+                log_info_mssg_with_timestamp(
+                    "done cleaning data file {}. now has size {}".format(
+                        data_name(mrf), os.stat(data_name(mrf)).st_size
                     )
-                if should_lock:
-                    lock.up_write()
+                )
 
     return errors
 
@@ -1618,7 +1982,8 @@ def create_vrt(basename, empty_tile, epsg, xmin, ymin, xmax, ymax):
         [basename, "_gdalbuildvrt_empty_stderr.txt"]
     )
     gdalbuildvrt_stderr_file = open(gdalbuildvrt_stderr_filename, "w")
-    subprocess.call(gdalbuildvrt_command_list, stderr=gdalbuildvrt_stderr_file)
+    with timed_stage("gdalbuildvrt"):
+        subprocess.call(gdalbuildvrt_command_list, stderr=gdalbuildvrt_stderr_file)
 
     # remove empty tile from vrt
     try:
@@ -1758,1303 +2123,891 @@ def run_gdaladdo(overview_resampling, mrf_filename, overview_levels, zlevels):
         log_sig_exit("ERROR", mssg, sigevent_url)
 
 
-# call oe_utils' log_sig_err and keep track of errors if count_err is True
-def log_sig_err(mssg, sigevent_url, count_err=True):
-    global errors
-    oe_utils.log_sig_err(mssg, sigevent_url)
-    if count_err:
-        errors += 1
-
+def get_parent_blocks(blocks, src_size, dst_size, mrf_blocksize):
+    """
+    Returns the blocks of an overview level that are derived from a set of blocks in the level below it.
+    Arguments:
+        blocks -- Set of (col, row) blocks in the source level
+        src_size -- (x, y) size of the source level in pixels
+        dst_size -- (x, y) size of the overview level in pixels
+        mrf_blocksize -- The block size of MRF tiles
+    """
+    block_size = int(mrf_blocksize)
+    parents = set()
+    for col, row in blocks:
+        ranges = []
+        for start, src, dst in ((col, src_size[0], dst_size[0]), (row, src_size[1], dst_size[1])):
+            src_start = start * block_size
+            src_end = min(src_start + block_size, src)
+            dst_start = src_start * dst // src
+            dst_end = max(-(-src_end * dst // src), dst_start + 1)
+            ranges.append(range(dst_start // block_size, (dst_end - 1) // block_size + 1))
+        parents.update((c, r) for c in ranges[0] for r in ranges[1])
+    return parents
+
+
+# Resampling methods gdal.RegenerateOverview() handles. Others, like the MRF driver's avg and nnb, go through gdaladdo.
+REGENERATE_OVERVIEW_RESAMPLINGS = [
+    "nearest",
+    "average",
+    "average_magphase",
+    "rms",
+    "bilinear",
+    "cubic",
+    "cubicspline",
+    "lanczos",
+    "gauss",
+    "mode",
+]
 
-# -------------------------------------------------------------------------------
-# Finished defining subroutines.  Begin main program.
-# -------------------------------------------------------------------------------
 
-# Define command line options and args.
-parser = OptionParser(version=versionNumber)
-parser.add_option(
-    "-c",
-    "--configuration_filename",
-    action="store",
-    type="string",
-    dest="configuration_filename",
-    default="./mrfgen_configuration_file.xml",
-    help="Full path of configuration filename.  Default:  ./mrfgen_configuration_file.xml",
-)
-parser.add_option(
-    "-d",
-    "--data_only",
-    action="store_true",
-    dest="data_only",
-    default=False,
-    help="Only output the MRF data, index, and header files",
-)
-parser.add_option(
-    "-s",
-    "--send_email",
-    action="store_true",
-    dest="send_email",
-    default=False,
-    help="Send email notification for errors and warnings.",
-)
-parser.add_option(
-    "--email_server",
-    action="store",
-    type="string",
-    dest="email_server",
-    default="",
-    help="The server where email is sent from (overrides configuration file value)",
-)
-parser.add_option(
-    "--email_recipient",
-    action="store",
-    type="string",
-    dest="email_recipient",
-    default="",
-    help="The recipient address for email notifications (overrides configuration file value)",
-)
-parser.add_option(
-    "--email_sender",
-    action="store",
-    type="string",
-    dest="email_sender",
-    default="",
-    help="The sender for email notifications (overrides configuration file value)",
-)
-parser.add_option(
-    "--email_logging_level",
-    action="store",
-    type="string",
-    dest="email_logging_level",
-    default="ERROR",
-    help="Logging level for email notifications: ERROR, WARN, or INFO.  Default: ERROR",
-)
-
-# Read command line args.
-(options, args) = parser.parse_args()
-# Configuration filename.
-configuration_filename = options.configuration_filename
-# Send email.
-send_email = options.send_email
-# Email server.
-email_server = options.email_server
-# Email recipient
-email_recipient = options.email_recipient
-# Email sender.
-email_sender = options.email_sender
-# Data only.
-data_only = options.data_only
-# Email logging level
-logging_level = options.email_logging_level.upper()
-
-# Email metadata replaces sigevent_url
-if send_email:
-    sigevent_url = (email_server, email_recipient, email_sender, logging_level)
-else:
-    sigevent_url = ""
-
-# Get current time, which is written to a file as the previous cycle time.
-# Time format is "yyyymmdd.hhmmss.f".  Do this first to avoid any gap where tiles
-# may get passed over because they were created while this script is running.
-current_cycle_time = datetime.datetime.now().strftime("%Y%m%d.%H%M%S.%f")
-
-
-# Read XML configuration file.
-try:
-    # Open file.
-    config_file = open(configuration_filename, "r")
-except IOError:
-    mssg = str().join(["Cannot read configuration file:  ", configuration_filename])
-    log_sig_exit("ERROR", mssg, sigevent_url)
-else:
-    # Get dom from XML file.
-    dom = xml.dom.minidom.parse(config_file)
-    # Parameter name.
-    parameter_name = get_dom_tag_value(dom, "parameter_name")
-    date_of_data = get_dom_tag_value(dom, "date_of_data")
-
-    # Define output basename for log, txt, vrt, .mrf, .idx and .ppg or .pjg
-    # Files get date_of_date added, links do not.
-    oe_utils.basename = basename = str().join(
-        [
-            parameter_name,
-            "_",
-            date_of_data,
-            "___",
-            "mrfgen_",
-            current_cycle_time,
-            "_",
-            str(os.getpid()),
-        ]
+def run_incremental_overviews(
+    overview_resampling, mrf_filename, overview_levels, zlevels, dirty_blocks
+):
+    """
+    Regenerates only the overview blocks derived from a set of changed base-level blocks, instead
+    of running gdaladdo over the whole MRF. Each level is built from the level below it with the
+    same GDAL resampling code gdaladdo uses. Source pixels are read with a margin around each block
+    so that resampling kernels wider than the decimation factor see the same neighbors they would
+    in a full pass. Falls back to run_gdaladdo if the MRF has no overviews yet, uses z levels, uses a
+    resampling method GDAL can't regenerate blocks with, or if regenerating a block fails.
+    Arguments:
+        overview_resampling -- The resampling method for generating overviews
+        mrf_filename -- The MRF filename
+        overview_levels -- A list of integral overview levels to build (for the gdaladdo fallback)
+        zlevels -- The number of zlevels included in the MRF
+        dirty_blocks -- Set of (col, row) base-level blocks that were written
+    """
+    if zlevels != "":
+        run_gdaladdo(overview_resampling, mrf_filename, overview_levels, zlevels)
+        return
+    if overview_resampling.lower() not in REGENERATE_OVERVIEW_RESAMPLINGS:
+        log_info_mssg(
+            "Can't regenerate overview blocks with {0} resampling, running gdaladdo".format(overview_resampling)
+        )
+        run_gdaladdo(overview_resampling, mrf_filename, overview_levels, zlevels)
+        return
+    mrf = gdal.Open(mrf_filename, gdal.GA_Update)
+    if mrf is None or mrf.GetRasterBand(1).GetOverviewCount() == 0:
+        mrf = None
+        log_info_mssg("No existing overviews in {0}, running gdaladdo".format(mrf_filename))
+        run_gdaladdo(overview_resampling, mrf_filename, overview_levels, zlevels)
+        return
+
+    start_time = time.time()
+    regenerated = regenerate_overview_blocks(mrf, overview_resampling, dirty_blocks)
+    mrf.FlushCache()
+    mrf = None
+    if not regenerated:
+        # A full pass rewrites any blocks that were already regenerated
+        log_sig_warn(
+            "Regenerating overview blocks of {0} failed: {1}, running gdaladdo".format(
+                mrf_filename, gdal.GetLastErrorMsg()
+            ),
+            sigevent_url,
+        )
+        run_gdaladdo(overview_resampling, mrf_filename, overview_levels, zlevels)
+        return
+    log_info_mssg(
+        "Incremental overviews for {0} finished in {1:.1f} seconds".format(
+            mrf_filename, time.time() - start_time
+        )
     )
 
-    # Get default email server and recipient if not override
-    if email_server == "":
-        try:
-            email_server = get_dom_tag_value(dom, "email_server")
-        except:
-            email_server = ""
-    if email_recipient == "":
-        try:
-            email_recipient = get_dom_tag_value(dom, "email_recipient")
-        except:
-            email_recipient = ""
-    if email_sender == "":
-        try:
-            email_sender = get_dom_tag_value(dom, "email_sender")
-        except:
-            email_sender = ""
-    if send_email:
-        sigevent_url = (email_server, email_recipient, email_sender, logging_level)
-        if email_recipient == "":
-            log_sig_err("No email recipient provided for notifications.", sigevent_url)
 
-    # for sub-daily imagery
-    try:
-        time_of_data = get_dom_tag_value(dom, "time_of_data")
-    except:
-        time_of_data = ""
-    # Directories.
-    try:
-        input_dir = get_dom_tag_value(dom, "input_dir")
-    except:
-        input_dir = None
-    output_dir = get_dom_tag_value(dom, "output_dir")
-    try:
-        working_dir = get_dom_tag_value(dom, "working_dir")
-        working_dir = add_trailing_slash(check_abs_path(working_dir))
-    except:  # use /tmp/ as default
-        working_dir = "/tmp/"
-    try:
-        logfile_dir = get_dom_tag_value(dom, "logfile_dir")
-    except:  # use working_dir if not specified
-        logfile_dir = working_dir
-    try:
-        mrf_name = get_dom_tag_value(dom, "mrf_name")
-    except:
-        # default to GIBS naming convention
-        mrf_name = "{$parameter_name}%Y%j_.mrf"
-    # MRF specific parameters.
-    try:
-        mrf_empty_tile_filename = check_abs_path(
-            get_dom_tag_value(dom, "mrf_empty_tile_filename")
+def regenerate_overview_blocks(mrf, overview_resampling, dirty_blocks):
+    """
+    Regenerates the overview blocks of an open MRF derived from a set of changed base-level blocks.
+    Returns False if GDAL fails to regenerate a block.
+    Arguments:
+        mrf -- The MRF dataset, opened for update
+        overview_resampling -- The resampling method for generating overviews
+        dirty_blocks -- Set of (col, row) base-level blocks that were written
+    """
+    block_size = int(mrf_blocksize)
+    margin = 4  # overview pixels read around each block for wider resampling kernels
+    mem_driver = gdal.GetDriverByName("MEM")
+    bands = [mrf.GetRasterBand(i + 1) for i in range(mrf.RasterCount)]
+    src_bands = bands
+    blocks = set(dirty_blocks)
+    for level in range(bands[0].GetOverviewCount()):
+        dst_bands = [band.GetOverview(level) for band in bands]
+        src_size = (src_bands[0].XSize, src_bands[0].YSize)
+        dst_size = (dst_bands[0].XSize, dst_bands[0].YSize)
+        blocks = get_parent_blocks(blocks, src_size, dst_size, block_size)
+        log_info_mssg(
+            "Regenerating {0} blocks of overview level {1}".format(len(blocks), level + 1)
         )
-    except:
-        try:
-            mrf_empty_tile_filename = lookupEmptyTile(
-                get_dom_tag_value(dom, "empty_tile")
-            )
-        except:
-            log_sig_warn("Empty tile was not found for " + parameter_name, sigevent_url)
-            mrf_empty_tile_filename = ""
-    try:
-        vrtnodata = get_dom_tag_value(dom, "vrtnodata")
-    except:
-        vrtnodata = ""
-    mrf_blocksize = get_dom_tag_value(dom, "mrf_blocksize")
-    mrf_compression_type = get_dom_tag_value(dom, "mrf_compression_type")
-    try:
-        outsize = get_dom_tag_value(dom, "outsize")
-        target_x, target_y = outsize.split(" ")
-    except:
-        outsize = ""
-        try:
-            target_x = get_dom_tag_value(dom, "target_x")
-        except:
-            target_x = (
-                ""  # if no target_x then use rasterXSize and rasterYSize from VRT file
-            )
-        try:
-            target_y = get_dom_tag_value(dom, "target_y")
-        except:
-            target_y = ""
-    # EPSG code projection.
-    try:
-        target_epsg = "EPSG:" + str(get_dom_tag_value(dom, "target_epsg"))
-    except:
-        target_epsg = "EPSG:4326"  # default to geographic
-    try:
-        if get_dom_tag_value(dom, "source_epsg") == "detect":
-            source_epsg = "detect"
-        else:
-            source_epsg = "EPSG:" + str(get_dom_tag_value(dom, "source_epsg"))
-    except:
-        source_epsg = "EPSG:4326"  # default to geographic
-
-    # Source extents.
-    try:
-        extents = get_dom_tag_value(dom, "extents")
-    except:
-        extents = "-180,-90,180,90"  # default to geographic
-    source_xmin, source_ymin, source_xmax, source_ymax = extents.split(",")
+        for col, row in sorted(blocks, key=lambda block: (block[1], block[0])):
+            # Window of the block in the overview, padded by the margin and clipped to the level
+            x0, y0 = col * block_size, row * block_size
+            x1, y1 = min(x0 + block_size, dst_size[0]), min(y0 + block_size, dst_size[1])
+            px0, py0 = max(x0 - margin, 0), max(y0 - margin, 0)
+            px1, py1 = min(x1 + margin, dst_size[0]), min(y1 + margin, dst_size[1])
+            # Matching window in the source level
+            sx0, sy0 = px0 * src_size[0] // dst_size[0], py0 * src_size[1] // dst_size[1]
+            sx1 = min(-(-px1 * src_size[0] // dst_size[0]), src_size[0])
+            sy1 = min(-(-py1 * src_size[1] // dst_size[1]), src_size[1])
+            for src_band, dst_band in zip(src_bands, dst_bands):
+                data = src_band.ReadAsArray(sx0, sy0, sx1 - sx0, sy1 - sy0)
+                src_mem = mem_driver.Create("", sx1 - sx0, sy1 - sy0, 1, src_band.DataType)
+                dst_mem = mem_driver.Create("", px1 - px0, py1 - py0, 1, src_band.DataType)
+                for mem in (src_mem, dst_mem):
+                    if src_band.GetNoDataValue() is not None:
+                        mem.GetRasterBand(1).SetNoDataValue(src_band.GetNoDataValue())
+                src_mem.GetRasterBand(1).WriteArray(data)
+                if gdal.RegenerateOverview(
+                    src_mem.GetRasterBand(1), dst_mem.GetRasterBand(1), overview_resampling
+                ) != 0:
+                    return False
+                dst_band.WriteArray(
+                    dst_mem.GetRasterBand(1).ReadAsArray(x0 - px0, y0 - py0, x1 - x0, y1 - y0),
+                    x0,
+                    y0,
+                )
+        src_bands = dst_bands
+    return True
 
-    # Target extents.
-    try:
-        target_extents = get_dom_tag_value(dom, "target_extents")
-    except:
-        if target_epsg == "EPSG:3857":
-            target_extents = "-20037508.34,-20037508.34,20037508.34,20037508.34"
-        elif target_epsg in ["EPSG:3413", "EPSG:3031"]:
-            target_extents = "-4194304,-4194304,4194304,4194304"
-        else:
-            target_extents = "-180,-90,180,90"
-    target_xmin, target_ymin, target_xmax, target_ymax = target_extents.split(",")
 
-    # Input files.
-    try:
-        input_files = get_input_files(dom)
-        empty_vrt = None
-        if input_files == "":
-            raise ValueError("No input files provided")
-    except:
-        if input_dir is None:
-            if mrf_empty_tile_filename != "":
-                input_files = None
-                empty_vrt = create_vrt(
-                    add_trailing_slash(check_abs_path(working_dir)) + basename,
-                    mrf_empty_tile_filename,
-                    target_epsg,
-                    target_xmin,
-                    target_ymin,
-                    target_xmax,
-                    target_ymax,
-                )
-            else:
-                log_sig_exit(
-                    "ERROR",
-                    "<input_files> or <input_dir> or <mrf_empty_tile_filename> is required",
-                    sigevent_url,
-                )
-        else:
-            input_files = None
-            empty_vrt = None
-    # overview levels
-    try:
-        overview_levels = get_dom_tag_value(dom, "overview_levels").split(" ")
-        for level in overview_levels:
-            if level.isdigit() == False:
-                log_sig_exit(
-                    "ERROR",
-                    "'" + level + "' is not a valid overview value.",
-                    sigevent_url,
-                )
-        if len(overview_levels) > 1:
-            overview = int(overview_levels[1]) / int(overview_levels[0])
-        else:
-            overview = 2
-    except:
-        overview_levels = ""
-        overview = 2
-    # resampling method
-    try:
-        overview_resampling = get_dom_tag_value(dom, "overview_resampling")
-    except:
-        overview_resampling = "nearest"
-    # gdalwarp resampling method for resizing
-    try:
-        resize_resampling = get_dom_tag_value(dom, "resize_resampling")
-        if resize_resampling == "none":
-            resize_resampling = ""
-    except:
-        resize_resampling = ""
-    if resize_resampling != "" and target_x == "":
-        log_sig_exit(
-            "ERROR", "target_x or outsize must be provided for resizing", sigevent_url
-        )
+# Stage metrics are appended as JSON lines to metrics_filename when mrf_metrics is enabled.
+# Workers forked for parallel stages append to the same file.
+metrics_filename = None
 
-    # gdalwarp resampling method for reprojection
-    try:
-        reprojection_resampling = get_dom_tag_value(dom, "reprojection_resampling")
-    except:
-        reprojection_resampling = "cubic"  # default to cubic
-    # colormap
-    try:
-        colormap = get_dom_tag_value(dom, "colormap")
-    except:
-        colormap = ""
-    # quality/precision
-    try:
-        quality_prec = get_dom_tag_value(dom, "quality_prec")
-    except:
-        if mrf_compression_type.lower() in ["lrc", "lerc"]:
-            quality_prec = (
-                "0.001"  # default to standard floating point precision if LERC
-            )
-        else:
-            quality_prec = "80"  # default to 80 quality for everything else
-    # z-levels
-    try:
-        zlevels = get_dom_tag_value(dom, "mrf_z_levels")
-    except:
-        zlevels = ""
-        # z key
-    z = None
-    zkey_type = "string"  # default to only string for now
-    try:
-        zkey = get_dom_tag_value(dom, "mrf_z_key")
-    except:
-        zkey = ""
-    # nocopy
-    try:
-        if get_dom_tag_value(dom, "mrf_nocopy") == "true":
-            nocopy = True
-        else:
-            nocopy = False
-    except:
-        nocopy = None
-    # noaddo
-    try:
-        if get_dom_tag_value(dom, "mrf_noaddo") == "true":
-            noaddo = True
-        else:
-            noaddo = False
-    except:
-        noaddo = False
 
-    # mrf_cores (max number of cpu cores to run on if mrf_parallel is set, defaults to 4
-    try:
-        mrf_cores = int(get_dom_tag_value(dom, "mrf_cores"))
-    except:
-        mrf_cores = 4  # multiprocessing.cpu_count()
+def _resource_snapshot():
+    """
+    Returns the current wall clock, CPU time and block I/O counters of this process and its
+    finished child processes (gdalwarp, mrf_insert, pool workers, etc.).
+    """
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "wall": time.time(),
+        "cpu": sum(os.times()[:4]),
+        "read_blocks": self_usage.ru_inblock + child_usage.ru_inblock,
+        "write_blocks": self_usage.ru_oublock + child_usage.ru_oublock,
+        "child_maxrss": child_usage.ru_maxrss,
+    }
+
+
+def start_stage(stage, tile=None):
+    """
+    Starts timing a stage of the run. Pass the result to end_stage when the stage is done.
+    Arguments:
+        stage -- Name of the stage
+        tile -- The tile being processed, for stages that run once per tile
+    """
+    return (stage, tile, _resource_snapshot())
 
-    # mrf_parallel (run mrf_insert in parallel), defaults to False
-    try:
-        if get_dom_tag_value(dom, "mrf_parallel") == "true":
-            mrf_parallel = True
-        else:
-            mrf_parallel = False
-    except:
-        mrf_parallel = False
 
-    # run the mrf_clean utility to reduce the size of the generated MRFs, defaults to mrf_parallel.
-    try:
-        if get_dom_tag_value(dom, "mrf_clean") == "true":
-            mrf_clean = True
-        else:
-            mrf_clean = False
-    except:
-        if mrf_parallel:
-            mrf_clean = True
-        else:
-            mrf_clean = False
+def end_stage(started, tiles=None):
+    """
+    Finishes timing a stage, logs it, and writes its metrics to metrics_filename if enabled.
+    Arguments:
+        started -- The result of start_stage
+        tiles -- The number of tiles processed by the stage
+    Returns:
+        The stage metrics
+    """
+    stage, tile, start = started
+    end = _resource_snapshot()
+    record = {
+        "basename": basename,
+        "stage": stage,
+        "start": datetime.datetime.fromtimestamp(start["wall"]).isoformat(),
+        "wall_time": round(end["wall"] - start["wall"], 3),
+        "cpu_time": round(end["cpu"] - start["cpu"], 3),
+        # ru_maxrss is the high-water mark of any child process so far, in kilobytes
+        "max_child_rss_kb": end["child_maxrss"],
+        "bytes_read": (end["read_blocks"] - start["read_blocks"]) * 512,
+        "bytes_written": (end["write_blocks"] - start["write_blocks"]) * 512,
+        "tiles": tiles if tiles is not None else (1 if tile is not None else 0),
+    }
+    if tile is not None:
+        record["tile"] = tile
+    else:
+        log_info_mssg(
+            "{0} completed in {1:.2f} seconds ({2:.2f} seconds CPU)".format(
+                stage, record["wall_time"], record["cpu_time"]
+            )
+        )
+    if metrics_filename:
+        try:
+            with open(metrics_filename, "a") as metrics_file:
+                metrics_file.write(json.dumps(record) + "\n")
+        except IOError as e:
+            log_sig_warn("Can't write metrics to {0}: {1}".format(metrics_filename, e), sigevent_url)
+    return record
 
-    # set a maximum size for the mrf before running mrf_clean. used to manage MRF sizes for mrf_parallel and mrf_noaddo
-    try:
-        mrf_maxsize = int(get_dom_tag_value(dom, "mrf_maxsize"))
-    except:
-        mrf_maxsize = None
 
-    # Use brunsli JPEG compression, defaults to False
+@contextmanager
+def timed_stage(stage, tiles=None, tile=None):
+    """
+    Context manager that times a stage with start_stage and end_stage.
+    Arguments:
+        stage -- Name of the stage
+        tiles -- The number of tiles processed by the stage
+        tile -- The tile being processed, for stages that run once per tile
+    """
+    started = start_stage(stage, tile)
     try:
-        if get_dom_tag_value(dom, "mrf_brunsli") == "false":
-            use_brunsli = False
-        else:
-            use_brunsli = True
-    except:
-        use_brunsli = False
+        yield
+    finally:
+        end_stage(started, tiles)
 
-    # merge, defaults to False
-    try:
-        if get_dom_tag_value(dom, "mrf_merge") == "false":
-            merge = False
-        else:
-            merge = True
-    except:
-        merge = False
-    # strict_palette, defaults to False
-    try:
-        if get_dom_tag_value(dom, "mrf_strict_palette") == "false":
-            strict_palette = False
-        else:
-            strict_palette = True
-    except:
-        strict_palette = False
-    # overwrite_colormap, defaults to False
-    try:
-        if get_dom_tag_value(dom, "mrf_overwrite_colormap") == "false":
-            overwrite_colormap = False
-        else:
-            overwrite_colormap = True
-    except:
-        overwrite_colormap = False
-    # mrf data
-    try:
-        mrf_data_scale = get_dom_tag_value(dom, "mrf_data_scale")
-    except:
-        mrf_data_scale = ""
-    try:
-        mrf_data_offset = get_dom_tag_value(dom, "mrf_data_offset")
-    except:
-        mrf_data_offset = ""
-    if mrf_data_scale != "" and mrf_data_offset == "":
-        log_sig_exit(
-            "ERROR",
-            "<mrf_data_offset> is required if <mrf_data_scale> is set",
-            sigevent_url,
-        )
-    if mrf_data_scale == "" and mrf_data_offset != "":
-        log_sig_exit(
-            "ERROR",
-            "<mrf_data_scale> is required if <mrf_data_offset> is set",
-            sigevent_url,
-        )
-    try:
-        mrf_data_units = get_dom_tag_value(dom, "mrf_data_units")
-    except:
-        mrf_data_units = ""
-    try:
-        source_url = get_dom_tag_value(dom, "source_url")
-    except:
-        if len(dom.getElementsByTagName("source_url")) > 0:
-            source_url = "NONE"
-        else:
-            source_url = ""
-    try:
-        background = get_dom_tag_value(dom, "background")
-    except:
-        background = ""
-    # Close file.
-    config_file.close()
-
-# Make certain each directory exists and has a trailing slash.
-if input_dir != None:
-    input_dir = add_trailing_slash(check_abs_path(input_dir))
-output_dir = add_trailing_slash(check_abs_path(output_dir))
-logfile_dir = add_trailing_slash(check_abs_path(logfile_dir))
-
-# Save script_dir
-script_dir = add_trailing_slash(os.path.dirname(os.path.abspath(__file__)))
-
-# Ensure that mrf_compression_type is uppercase.
-mrf_compression_type = mrf_compression_type.upper()
-
-# Verify logfile_dir first so that the log can be started.
-verify_directory_path_exists(logfile_dir, "logfile_dir", sigevent_url)
-# Initialize log file.
-log_filename = str().join([logfile_dir, basename, ".log"])
-logging.basicConfig(filename=log_filename, level=logging.INFO)
-
-# Verify remaining directory paths.
-if input_dir != None:
-    verify_directory_path_exists(input_dir, "input_dir", sigevent_url)
-verify_directory_path_exists(output_dir, "output_dir", sigevent_url)
-verify_directory_path_exists(working_dir, "working_dir", sigevent_url)
-
-# Make certain color map can be found
-if colormap != "" and "://" not in colormap:
-    colormap = check_abs_path(colormap)
-
-# Log all of the configuration information.
-log_info_mssg_with_timestamp(str().join(["config XML file:  ", configuration_filename]))
-
-# Copy configuration file to working_dir (if it's not already there)
-# so that the MRF can be recreated if needed.
-if os.path.dirname(configuration_filename) != os.path.dirname(working_dir):
-    config_preexisting = glob.glob(configuration_filename)
-    if len(config_preexisting) > 0:
-        at_dest_filename = str().join([working_dir, configuration_filename])
-        at_dest_preexisting = glob.glob(at_dest_filename)
-        if len(at_dest_preexisting) > 0:
-            remove_file(at_dest_filename)
-        shutil.copy(
-            configuration_filename,
-            working_dir + "/" + basename + ".configuration_file.xml",
-        )
-        log_info_mssg(str().join(["config XML file:  copied to     ", working_dir]))
-log_info_mssg(str().join(["config parameter_name:          ", parameter_name]))
-log_info_mssg(str().join(["config date_of_data:            ", date_of_data]))
-log_info_mssg(str().join(["config time_of_data:            ", time_of_data]))
-if input_files is not None:
-    log_info_mssg(str().join(["config input_files:             ", input_files]))
-if input_dir is not None:
-    log_info_mssg(str().join(["config input_dir:               ", input_dir]))
-if empty_vrt is not None:
-    log_info_mssg(str().join(["config empty_vrt:               ", empty_vrt]))
-log_info_mssg(str().join(["config output_dir:              ", output_dir]))
-log_info_mssg(str().join(["config working_dir:             ", working_dir]))
-log_info_mssg(str().join(["config logfile_dir:             ", logfile_dir]))
-log_info_mssg(str().join(["config mrf_name:                ", mrf_name]))
-log_info_mssg(str().join(["config mrf_empty_tile_filename: ", mrf_empty_tile_filename]))
-log_info_mssg(str().join(["config vrtnodata:               ", vrtnodata]))
-log_info_mssg(str().join(["config mrf_blocksize:           ", mrf_blocksize]))
-log_info_mssg(str().join(["config mrf_compression_type:    ", mrf_compression_type]))
-log_info_mssg(str().join(["config outsize:                 ", outsize]))
-log_info_mssg(str().join(["config target_x:                ", target_x]))
-log_info_mssg(str().join(["config target_y:                ", target_y]))
-log_info_mssg(str().join(["config target_epsg:             ", target_epsg]))
-log_info_mssg(str().join(["config source_epsg:             ", source_epsg]))
-log_info_mssg(str().join(["config extents:                 ", extents]))
-log_info_mssg(str().join(["config target_extents:          ", target_extents]))
-log_info_mssg(
-    str().join(["config overview levels:         ", " ".join(overview_levels)])
-)
-log_info_mssg(str().join(["config overview resampling:     ", overview_resampling]))
-log_info_mssg(str().join(["config reprojection resampling: ", reprojection_resampling]))
-log_info_mssg(str().join(["config resize resampling:       ", resize_resampling]))
-log_info_mssg(str().join(["config colormap:                ", colormap]))
-log_info_mssg(str().join(["config quality_prec:            ", quality_prec]))
-log_info_mssg(str().join(["config mrf_nocopy:              ", str(nocopy)]))
-log_info_mssg(str().join(["config mrf_noaddo:              ", str(noaddo)]))
-log_info_mssg(str().join(["config mrf_merge:               ", str(merge)]))
-log_info_mssg(str().join(["config mrf_brunsli:             ", str(use_brunsli)]))
-log_info_mssg(str().join(["config mrf_parallel:            ", str(mrf_parallel)]))
-log_info_mssg(str().join(["config mrf_cores:               ", str(mrf_cores)]))
-log_info_mssg(str().join(["config mrf_clean:               ", str(mrf_clean)]))
-log_info_mssg(str().join(["config mrf_maxsize:             ", str(mrf_maxsize)]))
-log_info_mssg(str().join(["config mrf_strict_palette:      ", str(strict_palette)]))
-log_info_mssg(str().join(["config mrf_overwrite_colormap:  ", str(overwrite_colormap)]))
-log_info_mssg(str().join(["config mrf_z_levels:            ", zlevels]))
-log_info_mssg(str().join(["config mrf_z_key:               ", zkey]))
-log_info_mssg(str().join(["config mrf_data_scale:          ", mrf_data_scale]))
-log_info_mssg(str().join(["config mrf_data_offset:         ", mrf_data_offset]))
-log_info_mssg(str().join(["config mrf_data_units:          ", mrf_data_units]))
-log_info_mssg(str().join(["config source_url:              ", source_url]))
-log_info_mssg(str().join(["mrfgen current_cycle_time:      ", current_cycle_time]))
-log_info_mssg(str().join(["mrfgen basename:                ", basename]))
-
-# Verify that date is 8 characters.
-if len(date_of_data) != 8:
-    mssg = "Format for <date_of_data> (in mrfgen XML config file) is:  yyyymmdd"
-    log_sig_exit("ERROR", mssg, sigevent_url)
-
-if time_of_data != "" and len(time_of_data) != 6:
-    mssg = "Format for <time_of_data> (in mrfgen XML config file) is:  HHMMSS"
-    log_sig_exit("ERROR", mssg, sigevent_url)
-
-# Check if empty tile filename was specified.
-if len(mrf_empty_tile_filename) == 0:
-    log_info_mssg(str("Empty tile not specified, none will be used."))
-    mrf_empty_tile_bytes = 0
-else:
-    # Verify that the empty tile can be found.
-    mrf_empty_tile_existing = glob.glob(mrf_empty_tile_filename)
-    if len(mrf_empty_tile_existing) == 0:
-        mssg = str().join(
-            ["Specified empty tile file not found:  ", mrf_empty_tile_filename]
-        )
-        log_sig_exit("ERROR", mssg, sigevent_url)
 
-    # Verify that the empty tile image format is either PNG or JPEG.
-    mrf_empty_tile_type = filetype.guess(mrf_empty_tile_filename)
-    # Use file extension as a backstop for exotic image formats (brunsli and lerc)
-    if not mrf_empty_tile_type:
-        mrf_empty_tile_what = os.path.splitext(mrf_empty_tile_filename)[1]
-        if mrf_empty_tile_what.startswith("."):
-            mrf_empty_tile_what = mrf_empty_tile_what[1:]
-        mrf_empty_tile_what = str(mrf_empty_tile_what).lower()
-    else:
-        mrf_empty_tile_what = str(mrf_empty_tile_type.extension).lower()
-    if (
-        mrf_empty_tile_what != "png"
-        and mrf_empty_tile_what != "brn"
-        and mrf_empty_tile_what != "jpeg"
-        and mrf_empty_tile_what != "jpg"
-        and mrf_empty_tile_what != "tif"
-        and mrf_empty_tile_what != "tiff"
-        and mrf_empty_tile_what != "lrc"
-        and mrf_empty_tile_what != "lerc"
-    ):
-        mssg = "Empty tile image format must be either png, jpeg, tiff, brn or lrc (lerc)."
-        log_sig_exit("ERROR", mssg, sigevent_url)
+def write_metrics_summary(summary_filename):
+    """
+    Summarizes the metrics file by stage, with the slowest tiles, and writes it as JSON.
+    Argument:
+        summary_filename -- Output summary filename
+    """
+    stages = {}
+    tile_records = []
+    with open(metrics_filename) as metrics_file:
+        for line in metrics_file:
+            record = json.loads(line)
+            if "tile" in record:
+                tile_records.append(record)
+                continue
+            totals = stages.setdefault(
+                record["stage"],
+                {"runs": 0, "wall_time": 0, "cpu_time": 0, "bytes_read": 0, "bytes_written": 0, "tiles": 0},
+            )
+            totals["runs"] += 1
+            for key in ["wall_time", "cpu_time", "bytes_read", "bytes_written", "tiles"]:
+                totals[key] += record[key]
+            totals["max_child_rss_kb"] = max(
+                totals.get("max_child_rss_kb", 0), record["max_child_rss_kb"]
+            )
+    summary = {
+        "basename": basename,
+        "stages": stages,
+        "slowest_tiles": sorted(tile_records, key=lambda record: record["wall_time"], reverse=True)[:10],
+    }
+    with open(summary_filename, "w") as summary_file:
+        json.dump(summary, summary_file, indent=2)
+    log_info_mssg("Metrics summary written to " + summary_filename)
 
-    # Verify that the empty tile matches MRF compression type.
-    if mrf_empty_tile_what == "png":
-        # Check the last 3 characters in case of PNG or PPNG or JPNG.
-        if mrf_compression_type[-3 : len(mrf_compression_type)] != "PNG":
-            mssg = "Empty tile format does not match MRF compression type."
-            log_sig_exit("ERROR", mssg, sigevent_url)
 
-    if mrf_empty_tile_what == "jpeg":
-        # Check the first 2 characters in case of JPG or JPEG.
-        if mrf_compression_type.lower() not in ["jpeg", "jpg", "zen"]:
-            mssg = "Empty tile format does not match MRF compression type."
-            log_sig_exit("ERROR", mssg, sigevent_url)
+def _run_tile_stage_task(stage_name, stage_func, tile):
+    """
+    Runs a preprocessing stage for a single tile in a worker process.
+    Errors counted by log_sig_err in the worker are returned to the parent along with the result.
+    Arguments:
+        stage_name -- Name of the stage for metrics
+        stage_func -- Stage function to run
+        tile -- Input tile
+    """
+    errors_before = errors
+    try:
+        with timed_stage(stage_name, tile=tile):
+            result = stage_func(tile)
+    except SystemExit:
+        # log_sig_exit was called in the worker; the message has already been logged
+        return (None, errors - errors_before, True)
+    return (result, errors - errors_before, False)
 
-    if mrf_empty_tile_what == "brn":
-        if not use_brunsli:
-            mssg = "Can only use a brunsli empty tile when mrf_brunsli is true"
-            log_sig_exit("ERROR", mssg, sigevent_url)
 
-    # Report empty tile size in bytes.
-    mrf_empty_tile_bytes = os.path.getsize(mrf_empty_tile_filename)
+def run_tile_stage(stage_name, stage_func, tiles, processes):
+    """
+    Runs a preprocessing stage over a list of tiles using a bounded pool of worker processes
+    and records metrics for the stage and for each tile.
+    Arguments:
+        stage_name -- Name of the stage for logging
+        stage_func -- Function that takes a single tile and returns the stage result for it
+        tiles -- List of input tiles
+        processes -- Maximum number of worker processes (mrf_cores)
+    Returns:
+        List of stage results, in the same order as tiles
+    """
+    global errors
+    started = start_stage(stage_name)
+    no_pools = min(multiprocessing.cpu_count(), len(tiles), processes)
     log_info_mssg(
-        str().join(
-            ["Empty tile size is:             ", str(mrf_empty_tile_bytes), " bytes."]
+        "Running {0} for {1} tiles with {2} processes".format(
+            stage_name, len(tiles), max(no_pools, 1)
         )
     )
 
-##IS LOCK FILE NECESSARY?
-## Lock file indicates tile generation in progress.
-# lock=glob.glob(str().join([input_dir, '*lock*']))
-# if len(lock) > 0:
-#    mssg='Lock found.'
-#    log_sig_exit('INFO', mssg, sigevent_url)
+    if no_pools <= 1:
+        results = []
+        for tile in tiles:
+            with timed_stage(stage_name, tile=tile):
+                results.append(stage_func(tile))
+    else:
+        with poolcontext(no_pools) as pool:
+            task_results = pool.map(
+                functools.partial(_run_tile_stage_task, stage_name, stage_func), tiles
+            )
+        results = []
+        exited = False
+        for result, stage_errors, stage_exited in task_results:
+            errors += stage_errors
+            exited |= stage_exited
+            results.append(result)
+        if exited:
+            sys.exit(1)
 
-# -------------------------------------------------------------------------------
-# Organize output filenames.
-# -------------------------------------------------------------------------------
+    end_stage(started, len(tiles))
+    return results
 
-# Change directory to working_dir.
-os.chdir(working_dir)
 
-# transparency flag for custom color maps; default to False
-add_transparency = False
+def validate_jpeg_tile(tile):
+    """
+    Checks that a JPEG input tile can be opened and isn't single band.
+    Argument:
+        tile -- Input tile
+    Returns:
+        The tile if it is valid, None otherwise
+    """
+    if ".mrf" in tile or ".vrt" in tile:  # ignore MRFs and VRTs
+        return tile
 
-# Declare scale, offset, and units
-scale = None
-offset = None
-units = None
+    try:
+        img = gdal.Open(tile)
 
-# Get list of all tile filenames.
-alltiles = []
-if input_files is not None:
-    input_files = input_files.strip()
-    alltiles = input_files.split(",")
+        if img is None:
+            log_sig_err("Bad JPEG tile detected: {0}".format(tile), sigevent_url)
+            return None
+    except RuntimeError as e:
+        log_sig_exit("ERROR", "Failed to execute gdal.Open", sigevent_url)
 
-if input_dir is not None:
-    if mrf_compression_type.lower() in ["jpeg", "jpg", "zen"]:
-        alltiles = alltiles + glob.glob(str().join([input_dir, "*.jpg"]))
-    if mrf_compression_type.lower() in ["png", "ppng", "zen"]:
-        alltiles = alltiles + glob.glob(str().join([input_dir, "*.png"]))
-    # check for tiffs
-    alltiles = alltiles + glob.glob(str().join([input_dir, "*.tif"]))
-    alltiles = alltiles + glob.glob(str().join([input_dir, "*.tiff"]))
-    # check for mrfs
-    alltiles = alltiles + glob.glob(str().join([input_dir, "*.mrf"]))
-
-# Sanitize input in case there were extra spaces
-striptiles = []
-for tile in alltiles:
-    striptiles.append(tile.strip())
-alltiles = striptiles
-
-# Set compression type in case of TIFF
-if mrf_compression_type.lower() in ["jpeg", "jpg", "zen"]:
-    tiff_compress = "JPEG"
-else:  # Default to png
-    tiff_compress = "PNG"
-
-# Set the blocksize for gdal_translate (-co NAME=VALUE).
-blocksize = str().join(["BLOCKSIZE=", mrf_blocksize])
-
-# Sanity check to make sure all of the input files exist
-for i, tile in enumerate(alltiles):
-
-    if tile.startswith("/vsi"):
-        try:
-            img = gdal.Open(tile)
-            img = None
-        except:
-            log_info_mssg("Missing input file: " + tile)
-            log_sig_exit("ERROR", "Invalid input files", sigevent_url)
+    if img.RasterCount == 1:
+        log_sig_err("Bad JPEG tile detected: {0}".format(tile), sigevent_url)
+        img = None
+        return None
 
-    elif not os.path.exists(tile):
-        log_info_mssg("Missing input file: " + tile)
-        log_sig_exit("ERROR", "Invalid input files", sigevent_url)
+    img = None
 
+    return tile
 
-# Filter out bad JPEGs
-goodtiles = []
-if mrf_compression_type.lower() in ["jpeg", "jpg", "zen"]:
-    for i, tile in enumerate(alltiles):
-        if ".mrf" in tile or ".vrt" in tile:  # ignore MRFs and VRTs
-            goodtiles.append(tile)
-            continue
 
-        try:
-            img = gdal.Open(tile)
+def force_tile_background(tile):
+    """
+    Forces the background color of a JPEG or TIFF input tile if specified, or
+    makes sure TIFFs being converted to JPEG only have 3 bands.
+    Argument:
+        tile -- Input tile
+    Returns:
+        The new temp tile, or the original tile if no changes were needed
+    """
+    temp_tile = None
+    tile_basename, tile_extension = os.path.splitext(os.path.basename(tile))
+    if background in ["black", "white", "transparent"]:
+        log_info_mssg("Using " + background + " background for " + tile)
+        with rasterio.open(tile) as src:
+            # Read the image data
+            img_data = src.read()
+            img_meta = src.meta
+
+            # Convert the image data to a PIL image
+            # Assuming the image has 4 bands (RGBA)
+            img = Image.fromarray(img_data.transpose(1, 2, 0), mode="RGBA")
+
+            # Create a new background image
+            if background == "white":
+                bg = Image.new("RGBA", img.size, (255, 255, 255, 255))
+            elif background == "transparent":
+                bg = Image.new("RGBA", img.size, (0, 0, 0, 0))
+            else:
+                bg = Image.new("RGBA", img.size, (0, 0, 0, 255))
 
-            if img is None:
-                log_sig_err("Bad JPEG tile detected: {0}".format(tile), sigevent_url)
-                continue
-        except RuntimeError as e:
-            log_sig_exit("ERROR", "Failed to execute gdal.Open", sigevent_url)
+            # Composite the input image onto the black background
+            composite = Image.alpha_composite(bg, img)
 
-        if img.RasterCount == 1:
-            log_sig_err("Bad JPEG tile detected: {0}".format(tile), sigevent_url)
-            img = None
-            continue
+            # Convert the composite image back to a numpy array
+            composite_data = np.array(composite).transpose(2, 0, 1)
 
-        img = None
+            # We no longer need the 4th band
+            if background != "transparent":
+                composite_data = composite_data[:3, :, :]
+                bands = 3
+            else:
+                bands = 4
+
+            # Update the metadata to reflect the changes (if necessary)
+            img_meta.update({"count": bands})
+
+            # Write the result to a new file
+            temp_tile = working_dir + tile_basename + "_bg" + tile_extension.lower()
+            log_info_mssg("Creating temp file " + temp_tile)
+            with rasterio.open(temp_tile, "w", **img_meta) as dst:
+                dst.write(composite_data)
+            log_info_mssg("just wrote the temp file")
+
+    # If we have a TIFF being converted to JPG, ensure that there are only 3 bands so that we don't end up with a CMYK JPG
+    elif tile_extension.lower() in [".tif", ".tiff"] and mrf_compression_type.lower() in ["jpg", "jpeg"]:
+        log_info_mssg("Ensuring that " + tile + " only has 3 bands")
+        with rasterio.open(tile) as src:
+            # Read the image data
+            img_data = src.read()
+            img_meta = src.meta
+            # Make sure that there are only 3 bands
+            img_data = img_data[:3, :, :]
+            bands = 3
+            # Update the metadata to reflect the changes (if necessary)
+            img_meta.update({"count": bands})
+            # Write the result to a new file
+            temp_tile = working_dir + tile_basename + "_3b" + tile_extension.lower()
+            log_info_mssg("Creating temp file " + temp_tile)
+            with rasterio.open(temp_tile, "w", **img_meta) as dst:
+                dst.write(img_data)
+
+    if temp_tile is not None:
+        return temp_tile
+    return tile
+
+
+def palettize_tile(tile):
+    """
+    Converts an RGBA PNG/TIFF input tile to an indexed paletted PNG using the colormap
+    and validates the palette of the result.
+    Argument:
+        tile -- Input tile
+    Returns:
+        Tuple of the paletted tile (or the original tile if no conversion happened) and
+        whether a transparency flag should be added for the custom color map
+    """
+    global errors
+    input_tile = tile
+    temp_tile = None
+    add_transparency = False
+    tile_path = os.path.dirname(tile)
+    tile_basename, tile_extension = os.path.splitext(os.path.basename(tile))
 
-        goodtiles.append(tile)
+    # Check input PNGs/TIFFs if RGBA, then convert
+    if not tile.lower().endswith((".png", ".tif", ".tiff")):
+        return (input_tile, add_transparency)
 
-    alltiles = goodtiles
+    tile_has_palette = has_palette(tile)
+    if not tile_has_palette:
 
-# Force background color if specified for JPEG or TIFF
-if mrf_compression_type.lower() in [
-    "jpeg",
-    "jpg",
-    "tiff",
-    "tif",
-]:
-    for i, tile in enumerate(alltiles):
-        temp_tile = None
-        tile_path = os.path.dirname(tile)
-        tile_basename, tile_extension = os.path.splitext(os.path.basename(tile))
-        if background in ["black", "white", "transparent"]:
-            log_info_mssg("Using " + background + " background for " + tile)
-            with rasterio.open(tile) as src:
-                # Read the image data
-                img_data = src.read()
-                img_meta = src.meta
-
-                # Convert the image data to a PIL image
-                # Assuming the image has 4 bands (RGBA)
-                img = Image.fromarray(img_data.transpose(1, 2, 0), mode="RGBA")
-
-                # Create a new background image
-                if background == "white":
-                    bg = Image.new("RGBA", img.size, (255, 255, 255, 255))
-                elif background == "transparent":
-                    bg = Image.new("RGBA", img.size, (0, 0, 0, 0))
-                else:
-                    bg = Image.new("RGBA", img.size, (0, 0, 0, 255))
+        # Download tile locally for RgbPngToPalPng script
+        if tile.startswith("/vsi"):
+            log_info_mssg("Downloading remote file " + tile)
 
-                # Composite the input image onto the black background
-                composite = Image.alpha_composite(bg, img)
+            # Create the gdal_translate command.
+            gdal_translate_command_list = [
+                "gdal_translate",
+                "-q",
+                "-co",
+                "WORLDFILE=YES",
+                tile,
+                working_dir + os.path.basename(tile),
+            ]
 
-                # Convert the composite image back to a numpy array
-                composite_data = np.array(composite).transpose(2, 0, 1)
+            # Log the gdal_translate command.
+            log_the_command(gdal_translate_command_list)
 
-                # We no longer need the 4th band
-                if background != "transparent":
-                    composite_data = composite_data[:3, :, :]
-                    bands = 3
-                else:
-                    bands = 4
-
-                # Update the metadata to reflect the changes (if necessary)
-                img_meta.update({"count": bands})
-
-                # Write the result to a new file
-                temp_tile = working_dir + tile_basename + "_bg" + tile_extension.lower()
-                log_info_mssg("Creating temp file " + temp_tile)
-                with rasterio.open(temp_tile, "w", **img_meta) as dst:
-                    dst.write(composite_data)
-                log_info_mssg("just wrote the temp file")
-
-        # If we have a TIFF being converted to JPG, ensure that there are only 3 bands so that we don't end up with a CMYK JPG
-        elif tile_extension.lower() in [".tif", ".tiff"] and mrf_compression_type.lower() in ["jpg", "jpeg"]:
-            log_info_mssg("Ensuring that " + tile + " only has 3 bands")
-            with rasterio.open(tile) as src:
-                # Read the image data
-                img_data = src.read()
-                img_meta = src.meta
-                # Make sure that there are only 3 bands
-                img_data = img_data[:3, :, :]
-                bands = 3
-                # Update the metadata to reflect the changes (if necessary)
-                img_meta.update({"count": bands})
-                # Write the result to a new file
-                temp_tile = working_dir + tile_basename + "_3b" + tile_extension.lower()
-                log_info_mssg("Creating temp file " + temp_tile)
-                with rasterio.open(temp_tile, "w", **img_meta) as dst:
-                    dst.write(img_data)
-
-        if temp_tile is not None:
-            alltiles[i] = temp_tile
-
-# Convert RGBA PNGs to indexed paletted PNGs if requested
-if mrf_compression_type == "PPNG" and colormap != "":
-    for i, tile in enumerate(alltiles):
-        temp_tile = None
-        tile_path = os.path.dirname(tile)
-        tile_basename, tile_extension = os.path.splitext(os.path.basename(tile))
-
-        # Check input PNGs/TIFFs if RGBA, then convert
-        if tile.lower().endswith((".png", ".tif", ".tiff")):
-
-            tile_has_palette = has_palette(tile)
-            if not tile_has_palette:
-
-                # Download tile locally for RgbPngToPalPng script
-                if tile.startswith("/vsi"):
-                    log_info_mssg("Downloading remote file " + tile)
-
-                    # Create the gdal_translate command.
-                    gdal_translate_command_list = [
-                        "gdal_translate",
-                        "-q",
-                        "-co",
-                        "WORLDFILE=YES",
-                        tile,
-                        working_dir + os.path.basename(tile),
-                    ]
-
-                    # Log the gdal_translate command.
-                    log_the_command(gdal_translate_command_list)
-
-                    # Execute gdal_translate.
-                    subprocess.call(
-                        gdal_translate_command_list,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                    )
+            # Execute gdal_translate.
+            subprocess.call(
+                gdal_translate_command_list,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
 
-                    # Replace with new tiles
-                    tile = working_dir + os.path.basename(tile)
+            # Replace with new tiles
+            tile = working_dir + os.path.basename(tile)
 
-                if ".tif" in tile.lower():
-                    # Convert TIFF files to PNG
-                    log_info_mssg(
-                        "Converting TIFF file " + tile + " to " + tiff_compress
-                    )
+        if ".tif" in tile.lower():
+            # Convert TIFF files to PNG
+            log_info_mssg("Converting TIFF file " + tile + " to " + tiff_compress)
 
-                    # Create the gdal_translate command.
-                    gdal_translate_command_list = [
-                        "gdal_translate",
-                        "-q",
-                        "-of",
-                        tiff_compress,
-                        "-co",
-                        "WORLDFILE=YES",
-                        tile,
-                        working_dir + tile_basename + "." + str(tiff_compress).lower(),
-                    ]
-                    # Log the gdal_translate command.
-                    log_the_command(gdal_translate_command_list)
-
-                    # Execute gdal_translate.
-                    subprocess.call(
-                        gdal_translate_command_list,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                    )
+            # Create the gdal_translate command.
+            gdal_translate_command_list = [
+                "gdal_translate",
+                "-q",
+                "-of",
+                tiff_compress,
+                "-co",
+                "WORLDFILE=YES",
+                tile,
+                working_dir + tile_basename + "." + str(tiff_compress).lower(),
+            ]
+            # Log the gdal_translate command.
+            log_the_command(gdal_translate_command_list)
 
-                    # Replace with new tiles
-                    tile = (
-                        working_dir + tile_basename + "." + str(tiff_compress).lower()
-                    )
-                    temp_tile = tile
+            # Execute gdal_translate.
+            subprocess.call(
+                gdal_translate_command_list,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
 
-                log_info_mssg("Converting RGBA PNG to indexed paletted PNG")
+            # Replace with new tiles
+            tile = working_dir + tile_basename + "." + str(tiff_compress).lower()
+            temp_tile = tile
 
-                output_tile = working_dir + tile_basename + "_indexed.png"
-                output_tile_path = os.path.dirname(output_tile)
-                output_tile_basename, output_tile_extension = os.path.splitext(
-                    os.path.basename(output_tile)
-                )
+        log_info_mssg("Converting RGBA PNG to indexed paletted PNG")
 
-                # Create the RgbPngToPalPng command.
-                if vrtnodata == "":
-                    fill = 0
-                else:
-                    fill = vrtnodata
-                RgbPngToPalPng_command_list = [
-                    "python3 "
-                    + script_dir
-                    + "RgbPngToPalPng.py -v -c "
-                    + colormap
-                    + " -f "
-                    + str(fill)
-                    + " -o "
-                    + output_tile
-                    + " -i "
-                    + tile
-                ]
-
-                # Log the RgbPngToPalPng command.
-                log_the_command(RgbPngToPalPng_command_list)
-
-                # Execute RgbPngToPalPng.
-                try:
-                    RgbPngToPalPng = subprocess.Popen(
-                        RgbPngToPalPng_command_list,
-                        shell=True,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                    )
-                except OSError:
-                    log_sig_exit(
-                        "ERROR", "RgbPngToPalPng tool cannot be found.", sigevent_url
-                    )
+        output_tile = working_dir + tile_basename + "_indexed.png"
+        output_tile_path = os.path.dirname(output_tile)
+        output_tile_basename, output_tile_extension = os.path.splitext(
+            os.path.basename(output_tile)
+        )
 
-                RgbPngToPalPng.wait()
-                if RgbPngToPalPng.returncode != None:
-                    if 0 < RgbPngToPalPng.returncode < 255:
-                        mssg = (
-                            "RgbPngToPalPng: "
-                            + str(RgbPngToPalPng.returncode)
-                            + " colors in image not found in color table"
-                        )
-                        if strict_palette:
-                            log_sig_err(mssg, sigevent_url, count_err=False)
-                            errors += RgbPngToPalPng.returncode
-                        else:
-                            log_sig_warn(mssg, sigevent_url)
-                    elif RgbPngToPalPng.returncode == 255:
-                        mssg = str(RgbPngToPalPng.stderr.readlines()[-1])
-                        log_sig_err(
-                            "RgbPngToPalPng: " + mssg, sigevent_url, count_err=False
-                        )
-                        errors += RgbPngToPalPng.returncode
+        # Create the RgbPngToPalPng command.
+        if vrtnodata == "":
+            fill = 0
+        else:
+            fill = vrtnodata
+        RgbPngToPalPng_command_list = [
+            "python3 "
+            + script_dir
+            + "RgbPngToPalPng.py -v -c "
+            + colormap
+            + " -f "
+            + str(fill)
+            + " -o "
+            + output_tile
+            + " -i "
+            + tile
+        ]
 
-                if os.path.isfile(output_tile):
-                    mssg = output_tile + " created"
-                    try:
-                        log_info_mssg(mssg)
-                        # sigevent('INFO', mssg, sigevent_url)
-                    except urllib.error.URLError:
-                        print("sigevent service is unavailable")
-                    # Replace with new tiles
-                    alltiles[i] = output_tile
-                else:
-                    log_sig_err(
-                        "RgbPngToPalPng failed to create {0}".format(output_tile),
-                        sigevent_url,
-                    )
+        # Log the RgbPngToPalPng command.
+        log_the_command(RgbPngToPalPng_command_list)
 
-                # Make a copy of world file
-                try:
-                    if os.path.isfile(tile_path + "/" + tile_basename + ".pgw"):
-                        shutil.copy(
-                            tile_path + "/" + tile_basename + ".pgw",
-                            output_tile_path + "/" + output_tile_basename + ".pgw",
-                        )
-                    elif os.path.isfile(working_dir + "/" + tile_basename + ".wld"):
-                        shutil.copy(
-                            working_dir + "/" + tile_basename + ".wld",
-                            output_tile_path + "/" + output_tile_basename + ".pgw",
-                        )
-                    else:
-                        log_info_mssg(
-                            "World file does not exist for tile: {0}".format(tile)
-                        )
-                except:
-                    log_sig_err("ERROR: " + mssg, sigevent_url)
-
-                # Save projection information for EPSG detection
-                try:
-                    if os.path.isfile(
-                        working_dir + "/" + tile_basename + ".png.aux.xml"
-                    ):
-                        shutil.copy(
-                            working_dir + "/" + tile_basename + ".png.aux.xml",
-                            output_tile_path
-                            + "/"
-                            + output_tile_basename
-                            + ".png.aux.xml",
-                        )
-                    else:
-                        log_info_mssg(
-                            "Geolocation file does not exist for tile: " + tile
-                        )
-                except:
-                    log_sig_err("ERROR: " + mssg, sigevent_url)
+        # Execute RgbPngToPalPng.
+        try:
+            RgbPngToPalPng = subprocess.Popen(
+                RgbPngToPalPng_command_list,
+                shell=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+        except OSError:
+            log_sig_exit("ERROR", "RgbPngToPalPng tool cannot be found.", sigevent_url)
+
+        RgbPngToPalPng.wait()
+        if RgbPngToPalPng.returncode != None:
+            if 0 < RgbPngToPalPng.returncode < 255:
+                mssg = (
+                    "RgbPngToPalPng: "
+                    + str(RgbPngToPalPng.returncode)
+                    + " colors in image not found in color table"
+                )
+                if strict_palette:
+                    log_sig_err(mssg, sigevent_url, count_err=False)
+                    errors += RgbPngToPalPng.returncode
+                else:
+                    log_sig_warn(mssg, sigevent_url)
+            elif RgbPngToPalPng.returncode == 255:
+                mssg = str(RgbPngToPalPng.stderr.readlines()[-1])
+                log_sig_err("RgbPngToPalPng: " + mssg, sigevent_url, count_err=False)
+                errors += RgbPngToPalPng.returncode
+
+        if os.path.isfile(output_tile):
+            mssg = output_tile + " created"
+            try:
+                log_info_mssg(mssg)
+                # sigevent('INFO', mssg, sigevent_url)
+            except urllib.error.URLError:
+                print("sigevent service is unavailable")
+            # Replace with new tiles
+            input_tile = output_tile
+        else:
+            log_sig_err(
+                "RgbPngToPalPng failed to create {0}".format(output_tile),
+                sigevent_url,
+            )
 
-                # add transparency flag for custom color map
-                add_transparency = True
+        # Make a copy of world file
+        try:
+            if os.path.isfile(tile_path + "/" + tile_basename + ".pgw"):
+                shutil.copy(
+                    tile_path + "/" + tile_basename + ".pgw",
+                    output_tile_path + "/" + output_tile_basename + ".pgw",
+                )
+            elif os.path.isfile(working_dir + "/" + tile_basename + ".wld"):
+                shutil.copy(
+                    working_dir + "/" + tile_basename + ".wld",
+                    output_tile_path + "/" + output_tile_basename + ".pgw",
+                )
             else:
-                log_info_mssg(
-                    "Paletted image found for PPNG output, no palettization required"
+                log_info_mssg("World file does not exist for tile: {0}".format(tile))
+        except:
+            log_sig_err("ERROR: " + mssg, sigevent_url)
+
+        # Save projection information for EPSG detection
+        try:
+            if os.path.isfile(working_dir + "/" + tile_basename + ".png.aux.xml"):
+                shutil.copy(
+                    working_dir + "/" + tile_basename + ".png.aux.xml",
+                    output_tile_path + "/" + output_tile_basename + ".png.aux.xml",
                 )
+            else:
+                log_info_mssg("Geolocation file does not exist for tile: " + tile)
+        except:
+            log_sig_err("ERROR: " + mssg, sigevent_url)
 
-            # ONEARTH-348 - Validate the palette
-            oe_validate_palette_command_list = [
-                script_dir + "oe_validate_palette.py",
-                "-v",
-                "-c",
-                colormap,
-                "-i",
-                alltiles[i],
-            ]
+        # add transparency flag for custom color map
+        add_transparency = True
+    else:
+        log_info_mssg("Paletted image found for PPNG output, no palettization required")
 
-            # Log the oe_validate_palette.py command.
-            log_the_command(oe_validate_palette_command_list)
+    # ONEARTH-348 - Validate the palette
+    oe_validate_palette_command_list = [
+        script_dir + "oe_validate_palette.py",
+        "-v",
+        "-c",
+        colormap,
+        "-i",
+        input_tile,
+    ]
 
-            # Execute oe_validate_palette.py
-            try:
-                oeValidatePalette = subprocess.Popen(
-                    oe_validate_palette_command_list,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                )
-                oeValidatePalette.wait()
-
-                val_pal_out, val_pal_err = oeValidatePalette.communicate()
-                if oeValidatePalette.returncode != None:
-                    if oeValidatePalette.returncode != 0:
-                        mssg = "oe_validate_palette.py:\nstdout: {0}\n{1}Mismatching palette entries between the image and colormap; Resulting image may be invalid".format(
-                            val_pal_out.decode("utf-8"),
-                            (
-                                "stderr: " + val_pal_err.decode("utf-8") + "\n"
-                                if val_pal_err.decode("utf-8") != ""
-                                else ""
-                            ),
-                        )
-                        if strict_palette:
-                            log_sig_err(mssg, sigevent_url, count_err=tile_has_palette)
-                        else:
-                            log_sig_warn(mssg, sigevent_url)
+    # Log the oe_validate_palette.py command.
+    log_the_command(oe_validate_palette_command_list)
 
-            except OSError:
+    # Execute oe_validate_palette.py
+    try:
+        oeValidatePalette = subprocess.Popen(
+            oe_validate_palette_command_list,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        oeValidatePalette.wait()
+
+        val_pal_out, val_pal_err = oeValidatePalette.communicate()
+        if oeValidatePalette.returncode != None:
+            if oeValidatePalette.returncode != 0:
+                mssg = "oe_validate_palette.py:\nstdout: {0}\n{1}Mismatching palette entries between the image and colormap; Resulting image may be invalid".format(
+                    val_pal_out.decode("utf-8"),
+                    (
+                        "stderr: " + val_pal_err.decode("utf-8") + "\n"
+                        if val_pal_err.decode("utf-8") != ""
+                        else ""
+                    ),
+                )
                 if strict_palette:
-                    log_sig_err("Error executing oe_validate_palette.py", sigevent_url)
+                    log_sig_err(mssg, sigevent_url, count_err=tile_has_palette)
                 else:
-                    log_sig_warn("Error executing oe_validate_palette.py", sigevent_url)
+                    log_sig_warn(mssg, sigevent_url)
 
-        # remove tif temp tiles
-        if temp_tile != None:
-            remove_file(temp_tile)
-            remove_file(temp_tile + ".aux.xml")
-            remove_file(temp_tile.split(".")[0] + ".wld")
+    except OSError:
+        if strict_palette:
+            log_sig_err("Error executing oe_validate_palette.py", sigevent_url)
+        else:
+            log_sig_warn("Error executing oe_validate_palette.py", sigevent_url)
 
-# Create VRTs with the target EPSG for input images if the source EPSG is different or is to be detected:
-if source_epsg == "detect" or source_epsg != target_epsg:
-    log_info_mssg(
-        "source EPSG != target EPSG or source EPSG is to be detected; Creating VRTs for each input tile in target EPSG"
-    )
+    # remove tif temp tiles
+    if temp_tile != None:
+        remove_file(temp_tile)
+        remove_file(temp_tile + ".aux.xml")
+        remove_file(temp_tile.split(".")[0] + ".wld")
 
-    for i, tile in enumerate(alltiles):
-        temp_tile = None
-        tile_path = os.path.dirname(tile)
-        tile_basename, tile_extension = os.path.splitext(os.path.basename(tile))
-        tile_vrt = os.path.join(working_dir, tile_basename + "_reproject.vrt")
+    return (input_tile, add_transparency)
 
-        if source_epsg == "detect":
-            s_epsg = get_image_epsg(tile)
-        else:
-            s_epsg = source_epsg
 
-        if not s_epsg:
-            # if EPSG can't be determined, remove the tile
-            log_sig_warn(tile + " has undetectable EPSG", sigevent_url)
-            del alltiles[i]
-        elif s_epsg != target_epsg:
-            log_info_mssg("Creating VRT for input tile: " + tile)
+def reproject_tile(tile):
+    """
+    Creates a VRT with the target EPSG for an input tile if its source EPSG is different.
+    Argument:
+        tile -- Input tile
+    Returns:
+        The reprojected VRT, the original tile if no reprojection is needed, or None
+        if the tile should be removed from the inputs
+    """
+    tile_basename, tile_extension = os.path.splitext(os.path.basename(tile))
+    tile_vrt = os.path.join(working_dir, tile_basename + "_reproject.vrt")
 
-            # if the source and target EPSGs are not the same, create a VRT
+    if source_epsg == "detect":
+        s_epsg = get_image_epsg(tile)
+    else:
+        s_epsg = source_epsg
 
-            gdalwarp_command_list = [
-                "gdalwarp",
-                "-q",
-                "-overwrite",
-                "-of",
-                "vrt",
-                "-s_srs",
-                s_epsg,
-                "-t_srs",
-                target_epsg,
-                tile,
-                tile_vrt,
-            ]
+    if not s_epsg:
+        # if EPSG can't be determined, remove the tile
+        log_sig_warn(tile + " has undetectable EPSG", sigevent_url)
+        return None
+    if s_epsg == target_epsg:
+        return tile
 
-            # Log the gdalbuildvrt command.
-            log_the_command(gdalwarp_command_list)
+    key = intermediate_key([tile], ["reproject", s_epsg, target_epsg, tile_vrt])
+    if restore_intermediates(key, [tile_vrt]):
+        return tile_vrt
 
-            # Capture stderr to record skipped .png files that are not valid PNG+World.
-            gdalwarp_stderr_filename = str().join(
-                [working_dir, basename, "_gdalwarp_stderr.txt"]
-            )
-            # Open stderr file for write.
-            gdalwarp_stderr_file = open(gdalwarp_stderr_filename, "w+")
-
-            # ---------------------------------------------------------------------------
-            # Execute gdalwarp.
-            subprocess.call(gdalwarp_command_list, stderr=gdalwarp_stderr_file)
-            # ---------------------------------------------------------------------------
-
-            gdalwarp_stderr_file.seek(0)
-            gdalwarp_stderr = gdalwarp_stderr_file.read()
-            if "Error" in gdalwarp_stderr:
-                log_info_mssg(gdalwarp_stderr)
-                log_sig_err("ERROR", "Error creating VRT for input image", sigevent_url)
-                gdalwarp_stderr_file.close()
-                del alltiles[i]
-                continue
+    log_info_mssg("Creating VRT for input tile: " + tile)
 
-            # If we made it this far, the VRT was created successfully, so replace it in the input list
-            alltiles[i] = tile_vrt
+    # if the source and target EPSGs are not the same, create a VRT
 
-# Create an encoded PNG from GeoTIFF
-if mrf_compression_type == "EPNG":
-    scale = 0
-    offset = 0
-    units = mrf_data_units
-    for i, tile in enumerate(alltiles):
-        tile_path = os.path.dirname(tile)
-        tile_basename, tile_extension = os.path.splitext(os.path.basename(tile))
-        output_tile = working_dir + tile_basename + ".png"
-        # Check if input is TIFF
-        if tile.lower().endswith((".tif", ".tiff")):
-            # NOTE: Did not convert to JSON parsing because of a lack of test data
-            # Get Scale and Offset from gdalinfo
-            gdalinfo_out = oe_utils.run_gdalinfo(tile, sigevent_url, json_fmt=False)
-            if "Color Table" in "".join(gdalinfo_out):
-                log_sig_warn("{0} contains a palette".format(tile), sigevent_url)
-                mrf_compression_type = "PPNG"
-            if "Offset:" in "".join(gdalinfo_out) and "Scale:" in "".join(gdalinfo_out):
-                log_info_mssg("{0} is already an encoded TIFF".format(tile))
-            else:  # Encode the TIFF file
-                encoded_tile = working_dir + tile_basename + "_encoded.tif"
-                log_info_mssg("{0} will be encoded as {1}".format(tile, encoded_tile))
-                if mrf_data_scale != "" and mrf_data_offset != "":
-                    scale_offset = [float(mrf_data_scale), float(mrf_data_offset)]
-                else:
-                    scale_offset = None
-                pack(tile, encoded_tile, False, True, None, None, scale_offset, False)
-                tile = encoded_tile
-                # Re-run gdalinfo to get new metadata after encoding the tile
-                gdalinfo_out = oe_utils.run_gdalinfo(tile, sigevent_url, json_fmt=False)
-            log_info_mssg("Reading scale and offset from bands")
-            for line in gdalinfo_out:
-                if "Offset:" in str(line) and "Scale:" in str(line):
-                    offset, scale = (
-                        str(line)
-                        .strip()
-                        .replace("Offset: ", "")
-                        .replace("Scale:", "")
-                        .split(",")
-                    )
-                    log_info_mssg("Offset: " + offset + ", Scale: " + scale)
-                    scale = int(scale)
-                    offset = int(offset)
+    gdalwarp_command_list = [
+        "gdalwarp",
+        "-q",
+        "-overwrite",
+        "-of",
+        "vrt",
+        "-s_srs",
+        s_epsg,
+        "-t_srs",
+        target_epsg,
+        tile,
+        tile_vrt,
+    ]
 
-            # Convert the tile to PNG
-            gdal_translate_command_list = [
-                "gdal_translate",
-                "-of",
-                "PNG",
-                tile,
-                output_tile,
-            ]
-            log_the_command(gdal_translate_command_list)
-            gdal_translate = subprocess.Popen(
-                gdal_translate_command_list,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
+    # Log the gdalbuildvrt command.
+    log_the_command(gdalwarp_command_list)
+
+    # Capture stderr to record skipped .png files that are not valid PNG+World.
+    # Tiles may be reprojected in parallel, so each tile gets its own stderr file.
+    gdalwarp_stderr_filename = str().join(
+        [working_dir, basename, "_", tile_basename, "_gdalwarp_stderr.txt"]
+    )
+    # Open stderr file for write.
+    with open(gdalwarp_stderr_filename, "w+") as gdalwarp_stderr_file:
+
+        # ---------------------------------------------------------------------------
+        # Execute gdalwarp.
+        subprocess.call(gdalwarp_command_list, stderr=gdalwarp_stderr_file)
+        # ---------------------------------------------------------------------------
+
+        gdalwarp_stderr_file.seek(0)
+        gdalwarp_stderr = gdalwarp_stderr_file.read()
+    if "Error" in gdalwarp_stderr:
+        log_info_mssg(gdalwarp_stderr)
+        log_sig_err("Error creating VRT for input image", sigevent_url)
+        return None
+
+    # If we made it this far, the VRT was created successfully, so replace it in the input list
+    store_intermediates(key, [tile_vrt])
+    return tile_vrt
+
+
+def encode_png_tile(tile):
+    """
+    Encodes a GeoTIFF input tile as a PNG for EPNG output.
+    Argument:
+        tile -- Input tile
+    Returns:
+        Tuple of the output tile, the offset and scale read from the tile bands (None if
+        not found), and whether the tile contains a palette
+    """
+    tile_basename, tile_extension = os.path.splitext(os.path.basename(tile))
+    output_tile = working_dir + tile_basename + ".png"
+    offset = scale = None
+    tile_has_palette = False
+    # Check if input is TIFF
+    if not tile.lower().endswith((".tif", ".tiff")):
+        return (tile, offset, scale, tile_has_palette)
+
+    # NOTE: Did not convert to JSON parsing because of a lack of test data
+    # Get Scale and Offset from gdalinfo
+    gdalinfo_out = oe_utils.run_gdalinfo(tile, sigevent_url, json_fmt=False)
+    if "Color Table" in "".join(gdalinfo_out):
+        log_sig_warn("{0} contains a palette".format(tile), sigevent_url)
+        tile_has_palette = True
+    if "Offset:" in "".join(gdalinfo_out) and "Scale:" in "".join(gdalinfo_out):
+        log_info_mssg("{0} is already an encoded TIFF".format(tile))
+    else:  # Encode the TIFF file
+        encoded_tile = working_dir + tile_basename + "_encoded.tif"
+        log_info_mssg("{0} will be encoded as {1}".format(tile, encoded_tile))
+        if mrf_data_scale != "" and mrf_data_offset != "":
+            scale_offset = [float(mrf_data_scale), float(mrf_data_offset)]
+        else:
+            scale_offset = None
+        pack(tile, encoded_tile, False, True, None, None, scale_offset, False)
+        tile = encoded_tile
+        # Re-run gdalinfo to get new metadata after encoding the tile
+        gdalinfo_out = oe_utils.run_gdalinfo(tile, sigevent_url, json_fmt=False)
+    log_info_mssg("Reading scale and offset from bands")
+    for line in gdalinfo_out:
+        if "Offset:" in str(line) and "Scale:" in str(line):
+            offset, scale = (
+                str(line)
+                .strip()
+                .replace("Offset: ", "")
+                .replace("Scale:", "")
+                .split(",")
             )
-            returncode = gdal_translate.wait()
-            gdal_translate_stderr = gdal_translate.stderr.read()
-            if len(gdal_translate_stderr) > 0:
-                log_sig_err(gdal_translate_stderr, sigevent_url)
-            if returncode != 0:
-                log_sig_err(
-                    "gdal_translate return code {0}".format(returncode), sigevent_url
-                )
-            alltiles[i] = output_tile
+            log_info_mssg("Offset: " + offset + ", Scale: " + scale)
+            scale = int(scale)
+            offset = int(offset)
 
-# Look for ZenJPEG Output
-if mrf_compression_type.lower() == "zen":
-    # mrf_insert doesn't convert tiles automatically to ZenJPEG
-    # so we first convert each input tile individually into smaller "input" MRFs
-    # and then insert and transform them later just like normal tiles
-    for i, tile in enumerate(alltiles):
-        tile_path = os.path.dirname(tile)
-        tile_basename, tile_extension = os.path.splitext(os.path.basename(tile))
-        tile_mrf = os.path.join(working_dir, tile_basename + "_zen.mrf")
+    # Convert the tile to PNG
+    gdal_translate_command_list = [
+        "gdal_translate",
+        "-of",
+        "PNG",
+        tile,
+        output_tile,
+    ]
+    log_the_command(gdal_translate_command_list)
+    gdal_translate = subprocess.Popen(
+        gdal_translate_command_list,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    returncode = gdal_translate.wait()
+    gdal_translate_stderr = gdal_translate.stderr.read()
+    if len(gdal_translate_stderr) > 0:
+        log_sig_err(gdal_translate_stderr, sigevent_url)
+    if returncode != 0:
+        log_sig_err("gdal_translate return code {0}".format(returncode), sigevent_url)
+    return (output_tile, offset, scale, tile_has_palette)
 
-        # Do the MRF creation from the input tile
-        gdal_translate_command_list = [
-            "gdal_translate",
-            "-q",
-            "-b",
-            "1",
-            "-b",
-            "2",
-            "-b",
-            "3",
-            "-of",
-            "MRF",
-            "-co",
-            "compress=JPEG",
-            "-co",
-            blocksize,
-            "-co",
-            "PHOTOMETRIC=DEFAULT",
-        ]
-        gdal_translate_command_list.append("-co")
-        gdal_translate_command_list.append("QUALITY=" + quality_prec)
-        gdal_translate_command_list.append(tile)
-        gdal_translate_command_list.append(tile_mrf)
 
-        # Log and execute gdal_translate to generate "input" ZenJPEG MRFs
-        log_the_command(gdal_translate_command_list)
-        gdal_translate_stderr_filename = str().join(
-            [working_dir, basename, "_gdal_translate_zen_stderr.txt"]
-        )
-        gdal_translate_stderr_file = open(gdal_translate_stderr_filename, "w")
-        subprocess.call(gdal_translate_command_list, stderr=gdal_translate_stderr_file)
-        gdal_translate_stderr_file.close()
-        if os.path.getsize(gdal_translate_stderr_filename) == 0:
-            remove_file(gdal_translate_stderr_filename)
+def convert_zen_tile(tile):
+    """
+    Converts an input tile into a small "input" JPEG MRF, since mrf_insert doesn't
+    convert tiles to ZenJPEG automatically.
+    Argument:
+        tile -- Input tile
+    Returns:
+        The input MRF
+    """
+    tile_basename, tile_extension = os.path.splitext(os.path.basename(tile))
+    tile_mrf = os.path.join(working_dir, tile_basename + "_zen.mrf")
+
+    # Do the MRF creation from the input tile
+    gdal_translate_command_list = [
+        "gdal_translate",
+        "-q",
+        "-b",
+        "1",
+        "-b",
+        "2",
+        "-b",
+        "3",
+        "-of",
+        "MRF",
+        "-co",
+        "compress=JPEG",
+        "-co",
+        blocksize,
+        "-co",
+        "PHOTOMETRIC=DEFAULT",
+    ]
+    gdal_translate_command_list.append("-co")
+    gdal_translate_command_list.append("QUALITY=" + quality_prec)
+    gdal_translate_command_list.append(tile)
+    gdal_translate_command_list.append(tile_mrf)
 
-        alltiles[i] = tile_mrf
+    # Log and execute gdal_translate to generate "input" ZenJPEG MRFs
+    log_the_command(gdal_translate_command_list)
+    gdal_translate_stderr_filename = str().join(
+        [working_dir, basename, "_", tile_basename, "_gdal_translate_zen_stderr.txt"]
+    )
+    gdal_translate_stderr_file = open(gdal_translate_stderr_filename, "w")
+    subprocess.call(gdal_translate_command_list, stderr=gdal_translate_stderr_file)
+    gdal_translate_stderr_file.close()
+    if os.path.getsize(gdal_translate_stderr_filename) == 0:
+        remove_file(gdal_translate_stderr_filename)
 
-# sort
-alltiles.sort()
+    return tile_mrf
 
-# check for different resolutions
-diff_res, res = diff_resolution(alltiles)
 
-# determine if nocopy should be used if not set
-if nocopy is None:
-    if len(alltiles) == 1 and alltiles[0].endswith(".vrt") == False:
-        if (
-            is_global_image(
-                alltiles[0], source_xmin, source_ymin, source_xmax, source_ymax
-            )
-            == True
-        ):
-            # Don't do inserts if we have a single global image
-            nocopy = False
-        else:
-            nocopy = True
-    elif (
-        len(alltiles) == 1 and alltiles[0].endswith("empty.vrt") == True
-    ):  # empty VRT, use nocopy
-        nocopy = True
-    else:
-        if source_epsg != target_epsg:
-            # Avoid inserts if reprojecting
-            nocopy = False
-        else:
-            nocopy = True
-    log_info_mssg("Setting MRF nocopy to " + str(nocopy))
-
-# Write all tiles list to a file on disk.
-all_tiles_filename = str().join([working_dir, basename, "_all_tiles.txt"])
-try:
-    # Open file.
-    alltilesfile = open(all_tiles_filename, "w")
-except IOError:
-    mssg = str().join(["Cannot open for write:  ", all_tiles_filename])
-    log_sig_exit("ERROR", mssg, sigevent_url)
-else:
-    # Write to file with line termination.
-    if len(alltiles) > 0:
-        for ndx in range(len(alltiles)):
-            alltilesfile.write(str().join([alltiles[ndx], "\n"]))
-    elif empty_vrt is not None:
-        # Create a VRT for an empty input
-        alltilesfile.write("{0}\n".format(empty_vrt))
-    else:
-        mssg = "No input tiles or empty VRT to process"
-        log_sig_exit("ERROR", mssg, sigevent_url)
+# call oe_utils' log_sig_err and keep track of errors if count_err is True
+def log_sig_err(mssg, sigevent_url, count_err=True):
+    global errors
+    oe_utils.log_sig_err(mssg, sigevent_url)
+    if count_err:
+        errors += 1
 
-    # Close file.
-    alltilesfile.close()
-# Send to log.
-log_info_mssg(str().join(["all tiles:  ", str(len(alltiles))]))
-log_info_mssg(all_tiles_filename)
 
 # -------------------------------------------------------------------------------
-# Begin GDAL processing.
+# Finished defining subroutines.  Begin main program.
 # -------------------------------------------------------------------------------
 
-# Convert date of the data into day of the year.  Requred for TWMS server.
-doy = get_doy_string(date_of_data)
-# Combine year and doy to conform to TWMS convention (yyyydoy).
-doy = str().join([date_of_data[0:4], str(doy)])
-# Send to log.
-log_info_mssg(str().join(["doy:  ", doy]))
-
-# The .mrf file is the XML component of the MRF format.
-mrf_filename = str().join([output_dir, basename, ".mrf"])
-# The .idx file is the index compnent of the MRF format.
-idx_filename = str().join([output_dir, basename, ".idx"])
-
 
 def get_extension(compression_type):
     if compression_type in ["PNG", "PPNG", "EPNG", "JPNG"]:
@@ -3074,636 +3027,1737 @@ def data_name(mrf_name):
     return bname + os.extsep + get_extension(mrf_compression_type)
 
 
-if mrf_compression_type in ["PNG", "PPNG", "EPNG"]:
-    # Output filename.
-    out_filename = str().join([output_dir, basename, ".ppg"])
-elif mrf_compression_type == "JPNG":
-    # Output filename.
-    out_filename = str().join([output_dir, basename, ".pjp"])
-elif mrf_compression_type in ["JPG", "JPEG", "ZEN"]:
-    # Output filename.
-    out_filename = str().join([output_dir, basename, ".pjg"])
-elif mrf_compression_type in ["TIF", "TIFF"]:
-    # Output filename.
-    out_filename = str().join([output_dir, basename, ".ptf"])
-elif mrf_compression_type in ["LRC", "LERC"]:
-    # Output filename.
-    out_filename = str().join([output_dir, basename, ".lrc"])
-else:
-    mssg = "Unrecognized compression type for MRF: " + mrf_compression_type
-    log_sig_exit("ERROR", mssg, sigevent_url)
-
-# The .vrt file is the XML describing the virtual image mosaic layout.
-vrt_filename = str().join([working_dir, basename, ".vrt"])
-
-# Make certain output files do not preexist.  GDAL has issues with that.
-remove_file(mrf_filename)
-remove_file(idx_filename)
-remove_file(out_filename)
-remove_file(vrt_filename)
-
-# Check if this is an MRF insert update, if not then regenerate a new MRF
-mrf_list = []
-if overview_resampling.lower() == "none" or overview_resampling == "":
-    # set to blank or none if we don't want to build overviews
-    overview_resampling = ""
-    insert_method = ""
-elif overview_resampling[:4].lower() == "near" or overview_resampling.lower() == "nnb":
-    insert_method = "NNb"
-else:
-    insert_method = "Avg"
-
-for tile in list(alltiles):
-    if ".mrf" in tile.lower() and "_zen." not in tile:
-        mrf_list.append(tile)
-        alltiles.remove(tile)
-
-# If more than one MRF, expected behavior is unknown... so exit
-if len(mrf_list) > 1:
-    log_sig_exit(
-        "ERROR",
-        "Multiple MRFs found in input list, expected behavior unknown",
-        sigevent_url,
-    )
-# Only be one MRF, so use that one
-elif len(mrf_list) == 1:
-    mrf = mrf_list[0]
-    timeout = time.time() + 30  # 30 second timeout if MRF is still being generated
-
-    # Bail if a remote MRF is included in the input list.  Just can't handle this yet.
-    if mrf.startswith("/vsi"):
-        mssg = "Cannot support a remote (i.e. /vsi...) MRF input"
-        log_sig_exit("ERROR", mssg, sigevent_url)
-
-    while not os.path.isfile(mrf):
-        mssg = str().join([mrf, " does not exist"])
-        if time.time() > timeout:
-            log_sig_exit("ERROR", mssg, sigevent_url)
-            break
-        log_sig_warn(mssg + ", waiting 5 seconds...", sigevent_url)
-        time.sleep(5)
-
-    # Check if zdb is used
-    if zlevels != "":
-        mrf, z, zdb_out, con = insert_zdb(
-            mrf, zlevels, zkey, source_url, scale, offset, units
-        )
-        if con:
-            con.commit()
-            con.close()
-            log_info_mssg("Successfully committed record to " + zdb_out)
-        else:
-            log_info_mssg("No ZDB record created")
-    else:
-        con = None
-
-    if mrf_parallel:
-        parallel_mrf_insert(
-            alltiles,
-            mrf,
-            insert_method,
-            resize_resampling,
-            target_x,
-            target_y,
-            mrf_blocksize,
-            [target_xmin, target_ymin, target_xmax, target_ymax],
-            target_epsg,
-            vrtnodata,
-            merge,
-            working_dir,
-            mrf_cores,
-        )
-    else:
-        run_mrf_insert(
-            alltiles,
-            mrf,
-            insert_method,
-            resize_resampling,
-            target_x,
-            target_y,
-            mrf_blocksize,
-            [target_xmin, target_ymin, target_xmax, target_ymax],
-            target_epsg,
-            vrtnodata,
-            merge,
-            working_dir,
-            max_size=mrf_maxsize,
+def run_mrfgen(
+    configuration_filename,
+    data_only=False,
+    send_email=False,
+    email_server="",
+    email_recipient="",
+    email_sender="",
+    email_logging_level="ERROR",
+):
+    """
+    Generates or updates an MRF from an mrfgen configuration file. This is what the mrfgen.py
+    command runs, and can be called repeatedly from the same process (see run_mrfgen_batch).
+    Arguments:
+        configuration_filename -- Full path of the configuration file
+        data_only -- Only output the MRF data, index, and header files
+        send_email -- Send email notification for errors and warnings
+        email_server -- The server where email is sent from (overrides configuration file value)
+        email_recipient -- The recipient address for email notifications (overrides configuration file value)
+        email_sender -- The sender for email notifications (overrides configuration file value)
+        email_logging_level -- Logging level for email notifications: ERROR, WARN, or INFO
+    Returns:
+        0 if the MRF was created without errors, otherwise 1. Fatal errors raise SystemExit.
+    """
+    root_logger = logging.getLogger()
+    handlers = list(root_logger.handlers)
+    with _image_info_lock:
+        _image_info_cache.clear()
+    try:
+        return _run_mrfgen(
+            configuration_filename,
+            data_only,
+            send_email,
+            email_server,
+            email_recipient,
+            email_sender,
+            email_logging_level.upper(),
         )
+    finally:
+        # Detach this run's log file so the next run in the process gets its own
+        for handler in list(root_logger.handlers):
+            if handler not in handlers:
+                root_logger.removeHandler(handler)
+                handler.close()
 
-    # Clean up
-    remove_file(all_tiles_filename)
-
-    if not noaddo and overview_resampling != "":
-        run_gdaladdo(overview_resampling, mrf, overview_levels, zlevels)
 
-    if mrf_clean:
-        mrf_data_name = data_name(mrf)
-        log_info_mssg("running mrf_clean on data file {}".format(mrf_data_name))
-        clean_mrf(mrf_data_name)
+def _run_batch_job(configuration_filename, run_options):
+    """
+    Runs one configuration in a batch worker process and returns its exit code.
+    Fatal errors (SystemExit) and exceptions end the job but not the worker.
+    """
+    try:
+        return run_mrfgen(configuration_filename, **run_options)
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else 1
+    except Exception as e:
+        print("mrfgen failed for {0}: {1}".format(configuration_filename, e), file=sys.stderr)
+        return 1
 
-    # Exit here since we don't need to build an MRF from scratch
-    mssg = str().join(["MRF updated:  ", mrf])
-    log_info_mssg(mssg)
 
-    # Exit mrfgen because we are done
-    if errors > 0:
-        print("{0} errors encountered".format(errors))
-        sys.exit(1)
-    else:
-        sys.exit(0)
+def find_batch_configs(paths):
+    """
+    Returns the configuration files in a list of files and directories (*.xml).
+    """
+    configs = []
+    for path in paths:
+        if os.path.isdir(path):
+            configs.extend(sorted(glob.glob(os.path.join(path, "*.xml"))))
+        else:
+            configs.append(path)
+    return configs
 
-# Else, no MRF so continue on with the rest of the processing...
 
+def run_mrfgen_batch(
+    paths, workers=4, watch_interval=None, archive_dir=None, **run_options
+):
+    """
+    Runs many mrfgen configurations in a pool of long-lived worker processes. Workers are forked
+    from this process after GDAL is loaded and are reused between jobs, so per-process state such as
+    the GDAL drivers, the empty tile config and cached image metadata stays warm.
+    Arguments:
+        paths -- Configuration files and/or directories containing *.xml configuration files
+        workers -- Number of configurations to run concurrently
+        watch_interval -- If set, keep polling the directories for new configurations every
+            watch_interval seconds instead of exiting once all jobs are done
+        archive_dir -- If set, configurations are moved here once their job is done
+        run_options -- Keyword arguments passed to run_mrfgen for every job
+    Returns:
+        The number of jobs that failed
+    """
+    failed = 0
+    started = set()
+    pending = {}
+    context = multiprocessing.get_context("fork")
+    with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context) as executor:
+        scan = True
+        while True:
+            if scan:
+                for config in find_batch_configs(paths):
+                    if config not in started:
+                        started.add(config)
+                        pending[executor.submit(_run_batch_job, config, run_options)] = config
+                scan = watch_interval is not None
+            if not pending:
+                if watch_interval is None:
+                    break
+                # wait() returns at once with nothing to wait on
+                time.sleep(watch_interval)
+                continue
+            done, _ = concurrent.futures.wait(
+                pending, timeout=watch_interval, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                config = pending.pop(future)
+                returncode = future.result()
+                if returncode != 0:
+                    failed += 1
+                print("mrfgen {0} finished with exit code {1}".format(config, returncode))
+                if archive_dir is not None and os.path.isfile(config):
+                    shutil.move(config, os.path.join(archive_dir, os.path.basename(config)))
+                    started.discard(config)
+    return failed
+
+
+def _run_mrfgen(
+    configuration_filename,
+    data_only,
+    send_email,
+    email_server,
+    email_recipient,
+    email_sender,
+    logging_level,
+):
+    # Settings read by the subroutines above
+    global background, basename, blocksize, colormap, errors, extents
+    global intermediate_cache_dir, intermediate_cache_maxsize, mrf_blocksize
+    global mrf_compression_type, mrf_data_offset, mrf_data_scale, mrf_maxsize
+    global quality_prec, script_dir, sigevent_url, source_epsg, strict_palette
+    global target_epsg, target_x, target_y, tiff_compress, vrtnodata, working_dir
+    global metrics_filename
+    errors = 0
 
-# Use zdb index if z-levels are defined
-if zlevels != "":
-    mrf_filename, idx_filename, out_filename, output_aux, output_vrt = get_mrf_names(
-        out_filename, mrf_name, parameter_name, date_of_data, time_of_data
-    )
-    mrf_filename = output_dir + mrf_filename
-    idx_filename = output_dir + idx_filename
-    out_filename = output_dir + out_filename
-    gdal_mrf_filename, z, zdb_out, con = insert_zdb(
-        mrf_filename, zlevels, zkey, source_url, scale, offset, units
-    )
-    # Commit database if successful
-    if con:
-        con.commit()
-        con.close()
-        log_info_mssg("Successfully committed record to " + zdb_out)
+    # Email metadata replaces sigevent_url
+    if send_email:
+        sigevent_url = (email_server, email_recipient, email_sender, logging_level)
     else:
-        log_info_mssg("No ZDB record created")
-else:
-    con = None
-    gdal_mrf_filename = mrf_filename
+        sigevent_url = ""
 
+    # Get current time, which is written to a file as the previous cycle time.
+    # Time format is "yyyymmdd.hhmmss.f".  Do this first to avoid any gap where tiles
+    # may get passed over because they were created while this script is running.
+    current_cycle_time = datetime.datetime.now().strftime("%Y%m%d.%H%M%S.%f")
 
-gdalbuildvrt_command_list = [
-    "gdalbuildvrt",
-    "-q",
-    "-input_file_list",
-    all_tiles_filename,
-]
+    # Read XML configuration file.
+    try:
+        # Open file.
+        config_file = open(configuration_filename, "r")
+    except IOError:
+        mssg = str().join(["Cannot read configuration file:  ", configuration_filename])
+        log_sig_exit("ERROR", mssg, sigevent_url)
+    else:
+        # Get dom from XML file.
+        dom = xml.dom.minidom.parse(config_file)
+        # Parameter name.
+        parameter_name = get_dom_tag_value(dom, "parameter_name")
+        date_of_data = get_dom_tag_value(dom, "date_of_data")
+
+        # Define output basename for log, txt, vrt, .mrf, .idx and .ppg or .pjg
+        # Files get date_of_date added, links do not.
+        oe_utils.basename = basename = str().join(
+            [
+                parameter_name,
+                "_",
+                date_of_data,
+                "___",
+                "mrfgen_",
+                current_cycle_time,
+                "_",
+                str(os.getpid()),
+            ]
+        )
 
-# all tiles are now in the target_epsg because:
-#   a) source_epsg == target_epsg
-#       OR
-#   b) source_epsg != target_epsg and we've fixed that by replacing the tile with a VRT
+        # Get default email server and recipient if not override
+        if email_server == "":
+            try:
+                email_server = get_dom_tag_value(dom, "email_server")
+            except:
+                email_server = ""
+        if email_recipient == "":
+            try:
+                email_recipient = get_dom_tag_value(dom, "email_recipient")
+            except:
+                email_recipient = ""
+        if email_sender == "":
+            try:
+                email_sender = get_dom_tag_value(dom, "email_sender")
+            except:
+                email_sender = ""
+        if send_email:
+            sigevent_url = (email_server, email_recipient, email_sender, logging_level)
+            if email_recipient == "":
+                log_sig_err("No email recipient provided for notifications.", sigevent_url)
+
+        # for sub-daily imagery
+        try:
+            time_of_data = get_dom_tag_value(dom, "time_of_data")
+        except:
+            time_of_data = ""
+        # Directories.
+        try:
+            input_dir = get_dom_tag_value(dom, "input_dir")
+        except:
+            input_dir = None
+        output_dir = get_dom_tag_value(dom, "output_dir")
+        try:
+            working_dir = get_dom_tag_value(dom, "working_dir")
+            working_dir = add_trailing_slash(check_abs_path(working_dir))
+        except:  # use /tmp/ as default
+            working_dir = "/tmp/"
+        try:
+            logfile_dir = get_dom_tag_value(dom, "logfile_dir")
+        except:  # use working_dir if not specified
+            logfile_dir = working_dir
+        try:
+            mrf_name = get_dom_tag_value(dom, "mrf_name")
+        except:
+            # default to GIBS naming convention
+            mrf_name = "{$parameter_name}%Y%j_.mrf"
+        # MRF specific parameters.
+        try:
+            mrf_empty_tile_filename = check_abs_path(
+                get_dom_tag_value(dom, "mrf_empty_tile_filename")
+            )
+        except:
+            try:
+                mrf_empty_tile_filename = lookupEmptyTile(
+                    get_dom_tag_value(dom, "empty_tile")
+                )
+            except:
+                log_sig_warn("Empty tile was not found for " + parameter_name, sigevent_url)
+                mrf_empty_tile_filename = ""
+        try:
+            vrtnodata = get_dom_tag_value(dom, "vrtnodata")
+        except:
+            vrtnodata = ""
+        mrf_blocksize = get_dom_tag_value(dom, "mrf_blocksize")
+        mrf_compression_type = get_dom_tag_value(dom, "mrf_compression_type")
+        try:
+            outsize = get_dom_tag_value(dom, "outsize")
+            target_x, target_y = outsize.split(" ")
+        except:
+            outsize = ""
+            try:
+                target_x = get_dom_tag_value(dom, "target_x")
+            except:
+                target_x = (
+                    ""  # if no target_x then use rasterXSize and rasterYSize from VRT file
+                )
+            try:
+                target_y = get_dom_tag_value(dom, "target_y")
+            except:
+                target_y = ""
+        # EPSG code projection.
+        try:
+            target_epsg = "EPSG:" + str(get_dom_tag_value(dom, "target_epsg"))
+        except:
+            target_epsg = "EPSG:4326"  # default to geographic
+        try:
+            if get_dom_tag_value(dom, "source_epsg") == "detect":
+                source_epsg = "detect"
+            else:
+                source_epsg = "EPSG:" + str(get_dom_tag_value(dom, "source_epsg"))
+        except:
+            source_epsg = "EPSG:4326"  # default to geographic
 
-# Set the extents and EPSG based on the target since we know that that the EPSG of all tiles is the target EPSG
-gdalbuildvrt_command_list.extend(
-    ["-te", target_xmin, target_ymin, target_xmax, target_ymax]
-)
-gdalbuildvrt_command_list.append("-a_srs")
-gdalbuildvrt_command_list.append(target_epsg)
-
-if target_x != "":
-    # set the output resolution if a target size has been provided
-    xres = repr(abs((float(target_xmax) - float(target_xmin)) / float(target_x)))
-    if target_y != "":
-        yres = repr(abs((float(target_ymin) - float(target_ymax)) / float(target_y)))
-    else:
-        yres = xres
-    log_info_mssg("x resolution: " + xres + ", y resolution: " + yres)
-    gdalbuildvrt_command_list.append("-resolution")
-    gdalbuildvrt_command_list.append("user")
-    gdalbuildvrt_command_list.append("-tr")
-    gdalbuildvrt_command_list.append(xres)
-    gdalbuildvrt_command_list.append(yres)
-
-if vrtnodata != "":
-    # set the nodata values if provided
-    gdalbuildvrt_command_list.append("-vrtnodata")
-    gdalbuildvrt_command_list.append(vrtnodata)
-    gdalbuildvrt_command_list.append("-srcnodata")
-    gdalbuildvrt_command_list.append(vrtnodata)
-
-
-# add VRT filename at the end
-gdalbuildvrt_command_list.append(vrt_filename)
-# Log the gdalbuildvrt command.
-log_the_command(gdalbuildvrt_command_list)
-# Capture stderr to record skipped .png files that are not valid PNG+World.
-gdalbuildvrt_stderr_filename = str().join(
-    [working_dir, basename, "_gdalbuildvrt_stderr.txt"]
-)
-# Open stderr file for write.
-gdalbuildvrt_stderr_file = open(gdalbuildvrt_stderr_filename, "w")
+        # Source extents.
+        try:
+            extents = get_dom_tag_value(dom, "extents")
+        except:
+            extents = "-180,-90,180,90"  # default to geographic
+        source_xmin, source_ymin, source_xmax, source_ymax = extents.split(",")
 
-# ---------------------------------------------------------------------------
-# Execute gdalbuildvrt.
-subprocess.call(gdalbuildvrt_command_list, stderr=gdalbuildvrt_stderr_file)
-# ---------------------------------------------------------------------------
+        # Target extents.
+        try:
+            target_extents = get_dom_tag_value(dom, "target_extents")
+        except:
+            if target_epsg == "EPSG:3857":
+                target_extents = "-20037508.34,-20037508.34,20037508.34,20037508.34"
+            elif target_epsg in ["EPSG:3413", "EPSG:3031"]:
+                target_extents = "-4194304,-4194304,4194304,4194304"
+            else:
+                target_extents = "-180,-90,180,90"
+        target_xmin, target_ymin, target_xmax, target_ymax = target_extents.split(",")
 
-# use gdalwarp if resize with resampling method is declared
-if resize_resampling != "":
-    if target_y == "":
-        target_y = str(int(target_x) / 2)
-    gdal_warp_command_list = [
-        "gdalwarp",
-        "-of",
-        "VRT",
-        "-r",
-        resize_resampling,
-        "-ts",
-        str(target_x),
-        str(target_y),
-        "-te",
-        target_xmin,
-        target_ymin,
-        target_xmax,
-        target_ymax,
-        "-overwrite",
-        vrt_filename,
-        vrt_filename.replace(".vrt", "_resample.vrt"),
-    ]
-    log_the_command(gdal_warp_command_list)
-    subprocess.call(gdal_warp_command_list, stderr=gdalbuildvrt_stderr_file)
-    vrt_filename = vrt_filename.replace(".vrt", "_resample.vrt")
-
-# Close stderr file.
-gdalbuildvrt_stderr_file.close()
-
-# Open stderr file for read.
-try:
-    gdalbuildvrt_stderr_file = open(gdalbuildvrt_stderr_filename, "r")
-    # Report skipped .png files that are not valid PNG+World.
-    gdalbuildvrt_stderr = gdalbuildvrt_stderr_file.readlines()
-    # Loop over all lines in file.
-    for ndx in range(len(gdalbuildvrt_stderr)):
-        # Get line number(s) where skipped files appear in the stderr file.
-        skipped = str(gdalbuildvrt_stderr[ndx]).find("Warning")
-        # If a line (including line 0) was found.
-        if skipped >= 0:
-            mssg = str().join(["gdalbuildvrt ", str(gdalbuildvrt_stderr[ndx])])
-            log_sig_warn(mssg, sigevent_url)
-    # Close file.
-    gdalbuildvrt_stderr_file.close()
-except IOError:
-    mssg = str().join(["Cannot read:  ", gdalbuildvrt_stderr_filename])
-    log_sig_exit("ERROR", mssg, sigevent_url)
-
-# Clean up.
-remove_file(all_tiles_filename)
-# Check if vrt was created.
-vrt_output = glob.glob(vrt_filename)
-if len(vrt_output) == 0:
-    mssg = str().join(
-        [
-            "Fail:  gdalbuildvrt",
-            "  May indicate no georeferenced tiles found.",
-            #'  May indicate unappropriate target_x.',
-            "  Look at stderr file:  ",
-            gdalbuildvrt_stderr_filename,
-        ]
-    )
-    log_sig_exit("ERROR", mssg, sigevent_url)
-
-# Create mrf only if vrt was successful.
-vrtf = get_modification_time(vrt_filename)
-remove_file(gdalbuildvrt_stderr_filename)
-
-# Set the compression type for gdal_translate (-co NAME=VALUE).
-if mrf_compression_type == "PNG" or mrf_compression_type == "EPNG":
-    # Unpaletted PNG.
-    compress = str("COMPRESS=PNG")
-elif mrf_compression_type == "PPNG":
-    # Paletted PNG.
-    compress = str("COMPRESS=PPNG")
-elif mrf_compression_type == "JPNG":
-    # JPNG Blended Format
-    compress = str("COMPRESS=JPNG")
-elif mrf_compression_type == "JPG":
-    compress = str("COMPRESS=JPEG")
-elif mrf_compression_type == "JPEG":
-    compress = str("COMPRESS=JPEG")
-elif mrf_compression_type == "ZEN":
-    compress = str("COMPRESS=JPEG")
-elif mrf_compression_type == "TIFF" or mrf_compression_type == "TIF":
-    compress = str("COMPRESS=TIF")
-elif mrf_compression_type == "LERC" or mrf_compression_type == "LRC":
-    compress = str("COMPRESS=LERC")
-else:
-    mssg = "Unrecognized compression type for MRF."
-    log_sig_exit("ERROR", mssg, sigevent_url)
-
-# Insert colormap into VRT if a colormap is provided and colormap overwriting is enabled.
-# This could be problematic if we're overwriting with a different palette than what is in the imagery.
-if overwrite_colormap and colormap != "":
-    new_vrt_filename = vrt_filename.replace(".vrt", "_newcolormap.vrt")
-    colormap2vrt_command_list = [
-        script_dir + "colormap2vrt.py",
-        "--colormap",
-        colormap,
-        "--output",
-        new_vrt_filename,
-        "--merge",
-        vrt_filename,
-    ]
-    if add_transparency == True:
-        colormap2vrt_command_list.append("--transparent")
-    if send_email == True:
-        colormap2vrt_command_list.append("--send_email")
-    if email_server != "":
-        colormap2vrt_command_list.append("--email_server")
-        colormap2vrt_command_list.append(email_server)
-    if email_recipient != "":
-        colormap2vrt_command_list.append("--email_recipient")
-        colormap2vrt_command_list.append(email_recipient)
-    if email_sender != "":
-        colormap2vrt_command_list.append("--email_sender")
-        colormap2vrt_command_list.append(email_sender)
-    log_the_command(colormap2vrt_command_list)
-    colormap2vrt_stderr_filename = str().join(
-        [working_dir, basename, "_colormap2vrt_stderr.txt"]
-    )
-    colormap2vrt_stderr_file = open(colormap2vrt_stderr_filename, "w+")
-    subprocess.call(colormap2vrt_command_list, stderr=colormap2vrt_stderr_file)
-    colormap2vrt_stderr_file.seek(0)
-    colormap2vrt_stderr = colormap2vrt_stderr_file.read()
-    log_info_mssg(colormap2vrt_stderr)
-    if "Error" in colormap2vrt_stderr:
-        log_sig_exit(
-            "ERROR",
-            "Error executing colormap2vrt.py with colormap:" + colormap,
-            sigevent_url,
+        # Input files.
+        try:
+            input_files = get_input_files(dom)
+            empty_vrt = None
+            if input_files == "":
+                raise ValueError("No input files provided")
+        except:
+            if input_dir is None:
+                if mrf_empty_tile_filename != "":
+                    input_files = None
+                    empty_vrt = create_vrt(
+                        add_trailing_slash(check_abs_path(working_dir)) + basename,
+                        mrf_empty_tile_filename,
+                        target_epsg,
+                        target_xmin,
+                        target_ymin,
+                        target_xmax,
+                        target_ymax,
+                    )
+                else:
+                    log_sig_exit(
+                        "ERROR",
+                        "<input_files> or <input_dir> or <mrf_empty_tile_filename> is required",
+                        sigevent_url,
+                    )
+            else:
+                input_files = None
+                empty_vrt = None
+        # overview levels
+        try:
+            overview_levels = get_dom_tag_value(dom, "overview_levels").split(" ")
+            for level in overview_levels:
+                if level.isdigit() == False:
+                    log_sig_exit(
+                        "ERROR",
+                        "'" + level + "' is not a valid overview value.",
+                        sigevent_url,
+                    )
+            if len(overview_levels) > 1:
+                overview = int(overview_levels[1]) / int(overview_levels[0])
+            else:
+                overview = 2
+        except:
+            overview_levels = ""
+            overview = 2
+        # resampling method
+        try:
+            overview_resampling = get_dom_tag_value(dom, "overview_resampling")
+        except:
+            overview_resampling = "nearest"
+        # gdalwarp resampling method for resizing
+        try:
+            resize_resampling = get_dom_tag_value(dom, "resize_resampling")
+            if resize_resampling == "none":
+                resize_resampling = ""
+        except:
+            resize_resampling = ""
+        if resize_resampling != "" and target_x == "":
+            log_sig_exit(
+                "ERROR", "target_x or outsize must be provided for resizing", sigevent_url
+            )
+
+        # gdalwarp resampling method for reprojection
+        try:
+            reprojection_resampling = get_dom_tag_value(dom, "reprojection_resampling")
+        except:
+            reprojection_resampling = "cubic"  # default to cubic
+        # colormap
+        try:
+            colormap = get_dom_tag_value(dom, "colormap")
+        except:
+            colormap = ""
+        # quality/precision
+        try:
+            quality_prec = get_dom_tag_value(dom, "quality_prec")
+        except:
+            if mrf_compression_type.lower() in ["lrc", "lerc"]:
+                quality_prec = (
+                    "0.001"  # default to standard floating point precision if LERC
+                )
+            else:
+                quality_prec = "80"  # default to 80 quality for everything else
+        # z-levels
+        try:
+            zlevels = get_dom_tag_value(dom, "mrf_z_levels")
+        except:
+            zlevels = ""
+            # z key
+        z = None
+        zkey_type = "string"  # default to only string for now
+        try:
+            zkey = get_dom_tag_value(dom, "mrf_z_key")
+        except:
+            zkey = ""
+        # nocopy
+        try:
+            if get_dom_tag_value(dom, "mrf_nocopy") == "true":
+                nocopy = True
+            else:
+                nocopy = False
+        except:
+            nocopy = None
+        # noaddo
+        try:
+            if get_dom_tag_value(dom, "mrf_noaddo") == "true":
+                noaddo = True
+            else:
+                noaddo = False
+        except:
+            noaddo = False
+
+        # mrf_cores (max number of cpu cores to run on if mrf_parallel is set, defaults to 4
+        try:
+            mrf_cores = int(get_dom_tag_value(dom, "mrf_cores"))
+        except:
+            mrf_cores = 4  # multiprocessing.cpu_count()
+
+        # mrf_parallel (run mrf_insert in parallel), defaults to False
+        try:
+            if get_dom_tag_value(dom, "mrf_parallel") == "true":
+                mrf_parallel = True
+            else:
+                mrf_parallel = False
+        except:
+            mrf_parallel = False
+
+        # run the mrf_clean utility to reduce the size of the generated MRFs, defaults to mrf_parallel.
+        try:
+            if get_dom_tag_value(dom, "mrf_clean") == "true":
+                mrf_clean = True
+            else:
+                mrf_clean = False
+        except:
+            if mrf_parallel:
+                mrf_clean = True
+            else:
+                mrf_clean = False
+
+        # set a maximum size for the mrf before running mrf_clean. used to manage MRF sizes for mrf_parallel and mrf_noaddo
+        try:
+            mrf_maxsize = int(get_dom_tag_value(dom, "mrf_maxsize"))
+        except:
+            mrf_maxsize = None
+
+        # Directory for caching intermediate VRTs across runs, and its maximum size in bytes
+        try:
+            intermediate_cache_dir = add_trailing_slash(
+                check_abs_path(get_dom_tag_value(dom, "intermediate_cache_dir"))
+            )
+        except:
+            intermediate_cache_dir = None
+        try:
+            intermediate_cache_maxsize = int(
+                get_dom_tag_value(dom, "intermediate_cache_maxsize")
+            )
+        except:
+            intermediate_cache_maxsize = 10 * 1024 ** 3
+
+        # Write per-stage timing and resource metrics next to the MRF, defaults to False
+        try:
+            if get_dom_tag_value(dom, "mrf_metrics") == "true":
+                mrf_metrics = True
+            else:
+                mrf_metrics = False
+        except:
+            mrf_metrics = False
+
+        # Only regenerate overview blocks affected by inserts into an existing MRF, defaults to False
+        try:
+            if get_dom_tag_value(dom, "mrf_incremental_overviews") == "true":
+                incremental_overviews = True
+            else:
+                incremental_overviews = False
+        except:
+            incremental_overviews = False
+
+        # Use brunsli JPEG compression, defaults to False
+        try:
+            if get_dom_tag_value(dom, "mrf_brunsli") == "false":
+                use_brunsli = False
+            else:
+                use_brunsli = True
+        except:
+            use_brunsli = False
+
+        # merge, defaults to False
+        try:
+            if get_dom_tag_value(dom, "mrf_merge") == "false":
+                merge = False
+            else:
+                merge = True
+        except:
+            merge = False
+        # strict_palette, defaults to False
+        try:
+            if get_dom_tag_value(dom, "mrf_strict_palette") == "false":
+                strict_palette = False
+            else:
+                strict_palette = True
+        except:
+            strict_palette = False
+        # overwrite_colormap, defaults to False
+        try:
+            if get_dom_tag_value(dom, "mrf_overwrite_colormap") == "false":
+                overwrite_colormap = False
+            else:
+                overwrite_colormap = True
+        except:
+            overwrite_colormap = False
+        # mrf data
+        try:
+            mrf_data_scale = get_dom_tag_value(dom, "mrf_data_scale")
+        except:
+            mrf_data_scale = ""
+        try:
+            mrf_data_offset = get_dom_tag_value(dom, "mrf_data_offset")
+        except:
+            mrf_data_offset = ""
+        if mrf_data_scale != "" and mrf_data_offset == "":
+            log_sig_exit(
+                "ERROR",
+                "<mrf_data_offset> is required if <mrf_data_scale> is set",
+                sigevent_url,
+            )
+        if mrf_data_scale == "" and mrf_data_offset != "":
+            log_sig_exit(
+                "ERROR",
+                "<mrf_data_scale> is required if <mrf_data_offset> is set",
+                sigevent_url,
+            )
+        try:
+            mrf_data_units = get_dom_tag_value(dom, "mrf_data_units")
+        except:
+            mrf_data_units = ""
+        try:
+            source_url = get_dom_tag_value(dom, "source_url")
+        except:
+            if len(dom.getElementsByTagName("source_url")) > 0:
+                source_url = "NONE"
+            else:
+                source_url = ""
+        try:
+            background = get_dom_tag_value(dom, "background")
+        except:
+            background = ""
+        # Close file.
+        config_file.close()
+
+    # Make certain each directory exists and has a trailing slash.
+    if input_dir != None:
+        input_dir = add_trailing_slash(check_abs_path(input_dir))
+    output_dir = add_trailing_slash(check_abs_path(output_dir))
+    logfile_dir = add_trailing_slash(check_abs_path(logfile_dir))
+
+    # Save script_dir
+    script_dir = add_trailing_slash(os.path.dirname(os.path.abspath(__file__)))
+
+    # Ensure that mrf_compression_type is uppercase.
+    mrf_compression_type = mrf_compression_type.upper()
+
+    # Verify logfile_dir first so that the log can be started.
+    verify_directory_path_exists(logfile_dir, "logfile_dir", sigevent_url)
+    # Initialize log file.
+    log_filename = str().join([logfile_dir, basename, ".log"])
+    log_handler = logging.FileHandler(log_filename)
+    log_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    logging.getLogger().addHandler(log_handler)
+    logging.getLogger().setLevel(logging.INFO)
+
+    # Verify remaining directory paths.
+    if input_dir != None:
+        verify_directory_path_exists(input_dir, "input_dir", sigevent_url)
+    verify_directory_path_exists(output_dir, "output_dir", sigevent_url)
+    verify_directory_path_exists(working_dir, "working_dir", sigevent_url)
+    if intermediate_cache_dir:
+        os.makedirs(intermediate_cache_dir, exist_ok=True)
+    if mrf_metrics:
+        metrics_filename = str().join([output_dir, basename, "_metrics.jsonl"])
+        log_info_mssg("Writing stage metrics to " + metrics_filename)
+        # Start fresh so the summary only covers this run
+        open(metrics_filename, "w").close()
+    else:
+        metrics_filename = None
+
+    # Make certain color map can be found
+    if colormap != "" and "://" not in colormap:
+        colormap = check_abs_path(colormap)
+
+    # Log all of the configuration information.
+    log_info_mssg_with_timestamp(str().join(["config XML file:  ", configuration_filename]))
+
+    # Copy configuration file to working_dir (if it's not already there)
+    # so that the MRF can be recreated if needed.
+    if os.path.dirname(configuration_filename) != os.path.dirname(working_dir):
+        config_preexisting = glob.glob(configuration_filename)
+        if len(config_preexisting) > 0:
+            at_dest_filename = str().join([working_dir, configuration_filename])
+            at_dest_preexisting = glob.glob(at_dest_filename)
+            if len(at_dest_preexisting) > 0:
+                remove_file(at_dest_filename)
+            shutil.copy(
+                configuration_filename,
+                working_dir + "/" + basename + ".configuration_file.xml",
+            )
+            log_info_mssg(str().join(["config XML file:  copied to     ", working_dir]))
+    log_info_mssg(str().join(["config parameter_name:          ", parameter_name]))
+    log_info_mssg(str().join(["config date_of_data:            ", date_of_data]))
+    log_info_mssg(str().join(["config time_of_data:            ", time_of_data]))
+    if input_files is not None:
+        log_info_mssg(str().join(["config input_files:             ", input_files]))
+    if input_dir is not None:
+        log_info_mssg(str().join(["config input_dir:               ", input_dir]))
+    if empty_vrt is not None:
+        log_info_mssg(str().join(["config empty_vrt:               ", empty_vrt]))
+    log_info_mssg(str().join(["config output_dir:              ", output_dir]))
+    log_info_mssg(str().join(["config working_dir:             ", working_dir]))
+    log_info_mssg(str().join(["config logfile_dir:             ", logfile_dir]))
+    log_info_mssg(str().join(["config mrf_name:                ", mrf_name]))
+    log_info_mssg(str().join(["config mrf_empty_tile_filename: ", mrf_empty_tile_filename]))
+    log_info_mssg(str().join(["config vrtnodata:               ", vrtnodata]))
+    log_info_mssg(str().join(["config mrf_blocksize:           ", mrf_blocksize]))
+    log_info_mssg(str().join(["config mrf_compression_type:    ", mrf_compression_type]))
+    log_info_mssg(str().join(["config outsize:                 ", outsize]))
+    log_info_mssg(str().join(["config target_x:                ", target_x]))
+    log_info_mssg(str().join(["config target_y:                ", target_y]))
+    log_info_mssg(str().join(["config target_epsg:             ", target_epsg]))
+    log_info_mssg(str().join(["config source_epsg:             ", source_epsg]))
+    log_info_mssg(str().join(["config extents:                 ", extents]))
+    log_info_mssg(str().join(["config target_extents:          ", target_extents]))
+    log_info_mssg(
+        str().join(["config overview levels:         ", " ".join(overview_levels)])
+    )
+    log_info_mssg(str().join(["config overview resampling:     ", overview_resampling]))
+    log_info_mssg(str().join(["config reprojection resampling: ", reprojection_resampling]))
+    log_info_mssg(str().join(["config resize resampling:       ", resize_resampling]))
+    log_info_mssg(str().join(["config colormap:                ", colormap]))
+    log_info_mssg(str().join(["config quality_prec:            ", quality_prec]))
+    log_info_mssg(str().join(["config mrf_nocopy:              ", str(nocopy)]))
+    log_info_mssg(str().join(["config mrf_noaddo:              ", str(noaddo)]))
+    log_info_mssg(str().join(["config mrf_incremental_overviews: ", str(incremental_overviews)]))
+    log_info_mssg(str().join(["config mrf_merge:               ", str(merge)]))
+    log_info_mssg(str().join(["config mrf_brunsli:             ", str(use_brunsli)]))
+    log_info_mssg(str().join(["config mrf_parallel:            ", str(mrf_parallel)]))
+    log_info_mssg(str().join(["config mrf_cores:               ", str(mrf_cores)]))
+    log_info_mssg(str().join(["config mrf_clean:               ", str(mrf_clean)]))
+    log_info_mssg(str().join(["config mrf_metrics:             ", str(mrf_metrics)]))
+    log_info_mssg(str().join(["config mrf_maxsize:             ", str(mrf_maxsize)]))
+    log_info_mssg(str().join(["config intermediate_cache_dir:  ", str(intermediate_cache_dir)]))
+    log_info_mssg(str().join(["config intermediate_cache_maxsize: ", str(intermediate_cache_maxsize)]))
+    log_info_mssg(str().join(["config mrf_strict_palette:      ", str(strict_palette)]))
+    log_info_mssg(str().join(["config mrf_overwrite_colormap:  ", str(overwrite_colormap)]))
+    log_info_mssg(str().join(["config mrf_z_levels:            ", zlevels]))
+    log_info_mssg(str().join(["config mrf_z_key:               ", zkey]))
+    log_info_mssg(str().join(["config mrf_data_scale:          ", mrf_data_scale]))
+    log_info_mssg(str().join(["config mrf_data_offset:         ", mrf_data_offset]))
+    log_info_mssg(str().join(["config mrf_data_units:          ", mrf_data_units]))
+    log_info_mssg(str().join(["config source_url:              ", source_url]))
+    log_info_mssg(str().join(["mrfgen current_cycle_time:      ", current_cycle_time]))
+    log_info_mssg(str().join(["mrfgen basename:                ", basename]))
+
+    # Verify that date is 8 characters.
+    if len(date_of_data) != 8:
+        mssg = "Format for <date_of_data> (in mrfgen XML config file) is:  yyyymmdd"
+        log_sig_exit("ERROR", mssg, sigevent_url)
+
+    if time_of_data != "" and len(time_of_data) != 6:
+        mssg = "Format for <time_of_data> (in mrfgen XML config file) is:  HHMMSS"
+        log_sig_exit("ERROR", mssg, sigevent_url)
+
+    # Check if empty tile filename was specified.
+    if len(mrf_empty_tile_filename) == 0:
+        log_info_mssg(str("Empty tile not specified, none will be used."))
+        mrf_empty_tile_bytes = 0
+    else:
+        # Verify that the empty tile can be found.
+        mrf_empty_tile_existing = glob.glob(mrf_empty_tile_filename)
+        if len(mrf_empty_tile_existing) == 0:
+            mssg = str().join(
+                ["Specified empty tile file not found:  ", mrf_empty_tile_filename]
+            )
+            log_sig_exit("ERROR", mssg, sigevent_url)
+
+        # Verify that the empty tile image format is either PNG or JPEG.
+        mrf_empty_tile_type = filetype.guess(mrf_empty_tile_filename)
+        # Use file extension as a backstop for exotic image formats (brunsli and lerc)
+        if not mrf_empty_tile_type:
+            mrf_empty_tile_what = os.path.splitext(mrf_empty_tile_filename)[1]
+            if mrf_empty_tile_what.startswith("."):
+                mrf_empty_tile_what = mrf_empty_tile_what[1:]
+            mrf_empty_tile_what = str(mrf_empty_tile_what).lower()
+        else:
+            mrf_empty_tile_what = str(mrf_empty_tile_type.extension).lower()
+        if (
+            mrf_empty_tile_what != "png"
+            and mrf_empty_tile_what != "brn"
+            and mrf_empty_tile_what != "jpeg"
+            and mrf_empty_tile_what != "jpg"
+            and mrf_empty_tile_what != "tif"
+            and mrf_empty_tile_what != "tiff"
+            and mrf_empty_tile_what != "lrc"
+            and mrf_empty_tile_what != "lerc"
+        ):
+            mssg = "Empty tile image format must be either png, jpeg, tiff, brn or lrc (lerc)."
+            log_sig_exit("ERROR", mssg, sigevent_url)
+
+        # Verify that the empty tile matches MRF compression type.
+        if mrf_empty_tile_what == "png":
+            # Check the last 3 characters in case of PNG or PPNG or JPNG.
+            if mrf_compression_type[-3 : len(mrf_compression_type)] != "PNG":
+                mssg = "Empty tile format does not match MRF compression type."
+                log_sig_exit("ERROR", mssg, sigevent_url)
+
+        if mrf_empty_tile_what == "jpeg":
+            # Check the first 2 characters in case of JPG or JPEG.
+            if mrf_compression_type.lower() not in ["jpeg", "jpg", "zen"]:
+                mssg = "Empty tile format does not match MRF compression type."
+                log_sig_exit("ERROR", mssg, sigevent_url)
+
+        if mrf_empty_tile_what == "brn":
+            if not use_brunsli:
+                mssg = "Can only use a brunsli empty tile when mrf_brunsli is true"
+                log_sig_exit("ERROR", mssg, sigevent_url)
+
+        # Report empty tile size in bytes.
+        mrf_empty_tile_bytes = os.path.getsize(mrf_empty_tile_filename)
+        log_info_mssg(
+            str().join(
+                ["Empty tile size is:             ", str(mrf_empty_tile_bytes), " bytes."]
+            )
         )
-    colormap2vrt_stderr_file.close()
-    if os.path.isfile(new_vrt_filename):
-        remove_file(colormap2vrt_stderr_filename)
-        vrt_filename = new_vrt_filename
-
-# Get input size.
-dom = xml.dom.minidom.parse(vrt_filename)
-rastersize_elements = dom.getElementsByTagName("VRTDataset")
-x_size = rastersize_elements[0].getAttribute("rasterXSize")  # width
-y_size = rastersize_elements[0].getAttribute("rasterYSize")  # height
-
-if target_x == "":
-    log_info_mssg("x size and y size from VRT " + x_size + "," + y_size)
-    exp = 11  # minimum outsize 20480 for EPSG4326_2km
-    while int(10 * (2**exp)) < int(x_size):
-        exp += 1
-    target_x = str(10 * (2**exp))
-    log_info_mssg("Calculating target_x from VRT to " + target_x)
-
-# Only use new target size if different.
-if target_x != x_size:
-    # Calculate output size of Y dimension and maintain aspect ratio.
-    if target_y == "":
-        target_y = str(int(float(target_x) * (float(y_size) / float(x_size))))
-        log_info_mssg("Calculating target_y " + target_y)
-    if resize_resampling == "":
-        log_sig_warn(
-            "Target size ({0}x{1}) differs from input size ({2}x{3}), but <resize_resampling> flag has not been set.".format(
-                target_x, target_y, x_size, y_size
-            ),
-            sigevent_url,
+
+    ##IS LOCK FILE NECESSARY?
+    ## Lock file indicates tile generation in progress.
+    # lock=glob.glob(str().join([input_dir, '*lock*']))
+    # if len(lock) > 0:
+    #    mssg='Lock found.'
+    #    log_sig_exit('INFO', mssg, sigevent_url)
+
+    # -------------------------------------------------------------------------------
+    # Organize output filenames.
+    # -------------------------------------------------------------------------------
+
+    # Change directory to working_dir.
+    os.chdir(working_dir)
+
+    # transparency flag for custom color maps; default to False
+    add_transparency = False
+
+    # Declare scale, offset, and units
+    scale = None
+    offset = None
+    units = None
+
+    # Get list of all tile filenames.
+    stage = start_stage("input discovery")
+    alltiles = []
+    if input_files is not None:
+        input_files = input_files.strip()
+        alltiles = input_files.split(",")
+
+    if input_dir is not None:
+        if mrf_compression_type.lower() in ["jpeg", "jpg", "zen"]:
+            alltiles = alltiles + glob.glob(str().join([input_dir, "*.jpg"]))
+        if mrf_compression_type.lower() in ["png", "ppng", "zen"]:
+            alltiles = alltiles + glob.glob(str().join([input_dir, "*.png"]))
+        # check for tiffs
+        alltiles = alltiles + glob.glob(str().join([input_dir, "*.tif"]))
+        alltiles = alltiles + glob.glob(str().join([input_dir, "*.tiff"]))
+        # check for mrfs
+        alltiles = alltiles + glob.glob(str().join([input_dir, "*.mrf"]))
+
+    # Sanitize input in case there were extra spaces
+    striptiles = []
+    for tile in alltiles:
+        striptiles.append(tile.strip())
+    alltiles = striptiles
+    end_stage(stage, len(alltiles))
+
+    # Set compression type in case of TIFF
+    if mrf_compression_type.lower() in ["jpeg", "jpg", "zen"]:
+        tiff_compress = "JPEG"
+    else:  # Default to png
+        tiff_compress = "PNG"
+
+    # Set the blocksize for gdal_translate (-co NAME=VALUE).
+    blocksize = str().join(["BLOCKSIZE=", mrf_blocksize])
+
+    # Sanity check to make sure all of the input files exist
+    stage = start_stage("input validation")
+    for i, tile in enumerate(alltiles):
+
+        if tile.startswith("/vsi"):
+            try:
+                img = gdal.Open(tile)
+                img = None
+            except:
+                log_info_mssg("Missing input file: " + tile)
+                log_sig_exit("ERROR", "Invalid input files", sigevent_url)
+
+        elif not os.path.exists(tile):
+            log_info_mssg("Missing input file: " + tile)
+            log_sig_exit("ERROR", "Invalid input files", sigevent_url)
+
+    # Load metadata for all input files up front; the helpers below probe each tile several times
+    prefetch_image_info(alltiles, mrf_cores)
+    end_stage(stage, len(alltiles))
+
+
+    # Each preprocessing stage below runs over all tiles using a pool of up to mrf_cores processes
+
+    # Filter out bad JPEGs
+    if mrf_compression_type.lower() in ["jpeg", "jpg", "zen"]:
+        results = run_tile_stage(
+            "JPEG validation", validate_jpeg_tile, alltiles, mrf_cores
         )
-else:  # don't bother calculating y
-    if target_y == "":
-        target_y = y_size
-        log_info_mssg("Setting target_y from VRT to {0}".format(target_y))
-    elif float(target_y) != float(y_size):
-        log_sig_warn(
-            "Target y size ({0}) differs from raster y size ({1})".format(
-                target_y, y_size
-            ),
+        alltiles = [tile for tile in results if tile is not None]
+
+    # Force background color if specified for JPEG or TIFF
+    if mrf_compression_type.lower() in [
+        "jpeg",
+        "jpg",
+        "tiff",
+        "tif",
+    ]:
+        alltiles = run_tile_stage(
+            "background forcing", force_tile_background, alltiles, mrf_cores
+        )
+
+    # Convert RGBA PNGs to indexed paletted PNGs if requested
+    if mrf_compression_type == "PPNG" and colormap != "":
+        results = run_tile_stage(
+            "RGBA to paletted PNG conversion", palettize_tile, alltiles, mrf_cores
+        )
+        alltiles = [tile for tile, _ in results]
+        add_transparency = any(tile_add_transparency for _, tile_add_transparency in results)
+
+    # Create VRTs with the target EPSG for input images if the source EPSG is different or is to be detected:
+    if source_epsg == "detect" or source_epsg != target_epsg:
+        log_info_mssg(
+            "source EPSG != target EPSG or source EPSG is to be detected; Creating VRTs for each input tile in target EPSG"
+        )
+        results = run_tile_stage("reprojection", reproject_tile, alltiles, mrf_cores)
+        alltiles = [tile for tile in results if tile is not None]
+
+    # Create an encoded PNG from GeoTIFF
+    if mrf_compression_type == "EPNG":
+        scale = 0
+        offset = 0
+        units = mrf_data_units
+        results = run_tile_stage("EPNG encoding", encode_png_tile, alltiles, mrf_cores)
+        alltiles = []
+        for tile, tile_offset, tile_scale, tile_has_palette in results:
+            alltiles.append(tile)
+            if tile_offset is not None:
+                offset, scale = tile_offset, tile_scale
+            if tile_has_palette:
+                mrf_compression_type = "PPNG"
+
+    # Look for ZenJPEG Output
+    if mrf_compression_type.lower() == "zen":
+        # mrf_insert doesn't convert tiles automatically to ZenJPEG
+        # so we first convert each input tile individually into smaller "input" MRFs
+        # and then insert and transform them later just like normal tiles
+        alltiles = run_tile_stage(
+            "ZenJPEG conversion", convert_zen_tile, alltiles, mrf_cores
+        )
+
+    # sort
+    alltiles.sort()
+
+    # check for different resolutions
+    prefetch_image_info(alltiles, mrf_cores)
+    diff_res, res = diff_resolution(alltiles)
+
+    # determine if nocopy should be used if not set
+    if nocopy is None:
+        if len(alltiles) == 1 and alltiles[0].endswith(".vrt") == False:
+            if (
+                is_global_image(
+                    alltiles[0], source_xmin, source_ymin, source_xmax, source_ymax
+                )
+                == True
+            ):
+                # Don't do inserts if we have a single global image
+                nocopy = False
+            else:
+                nocopy = True
+        elif (
+            len(alltiles) == 1 and alltiles[0].endswith("empty.vrt") == True
+        ):  # empty VRT, use nocopy
+            nocopy = True
+        else:
+            if source_epsg != target_epsg:
+                # Avoid inserts if reprojecting
+                nocopy = False
+            else:
+                nocopy = True
+        log_info_mssg("Setting MRF nocopy to " + str(nocopy))
+
+    # Write all tiles list to a file on disk.
+    all_tiles_filename = str().join([working_dir, basename, "_all_tiles.txt"])
+    try:
+        # Open file.
+        alltilesfile = open(all_tiles_filename, "w")
+    except IOError:
+        mssg = str().join(["Cannot open for write:  ", all_tiles_filename])
+        log_sig_exit("ERROR", mssg, sigevent_url)
+    else:
+        # Write to file with line termination.
+        if len(alltiles) > 0:
+            for ndx in range(len(alltiles)):
+                alltilesfile.write(str().join([alltiles[ndx], "\n"]))
+        elif empty_vrt is not None:
+            # Create a VRT for an empty input
+            alltilesfile.write("{0}\n".format(empty_vrt))
+        else:
+            mssg = "No input tiles or empty VRT to process"
+            log_sig_exit("ERROR", mssg, sigevent_url)
+
+        # Close file.
+        alltilesfile.close()
+    # Send to log.
+    log_info_mssg(str().join(["all tiles:  ", str(len(alltiles))]))
+    log_info_mssg(all_tiles_filename)
+
+    # -------------------------------------------------------------------------------
+    # Begin GDAL processing.
+    # -------------------------------------------------------------------------------
+
+    # Convert date of the data into day of the year.  Requred for TWMS server.
+    doy = get_doy_string(date_of_data)
+    # Combine year and doy to conform to TWMS convention (yyyydoy).
+    doy = str().join([date_of_data[0:4], str(doy)])
+    # Send to log.
+    log_info_mssg(str().join(["doy:  ", doy]))
+
+    # The .mrf file is the XML component of the MRF format.
+    mrf_filename = str().join([output_dir, basename, ".mrf"])
+    # The .idx file is the index compnent of the MRF format.
+    idx_filename = str().join([output_dir, basename, ".idx"])
+
+
+    if mrf_compression_type in ["PNG", "PPNG", "EPNG"]:
+        # Output filename.
+        out_filename = str().join([output_dir, basename, ".ppg"])
+    elif mrf_compression_type == "JPNG":
+        # Output filename.
+        out_filename = str().join([output_dir, basename, ".pjp"])
+    elif mrf_compression_type in ["JPG", "JPEG", "ZEN"]:
+        # Output filename.
+        out_filename = str().join([output_dir, basename, ".pjg"])
+    elif mrf_compression_type in ["TIF", "TIFF"]:
+        # Output filename.
+        out_filename = str().join([output_dir, basename, ".ptf"])
+    elif mrf_compression_type in ["LRC", "LERC"]:
+        # Output filename.
+        out_filename = str().join([output_dir, basename, ".lrc"])
+    else:
+        mssg = "Unrecognized compression type for MRF: " + mrf_compression_type
+        log_sig_exit("ERROR", mssg, sigevent_url)
+
+    # The .vrt file is the XML describing the virtual image mosaic layout.
+    vrt_filename = str().join([working_dir, basename, ".vrt"])
+
+    # Make certain output files do not preexist.  GDAL has issues with that.
+    remove_file(mrf_filename)
+    remove_file(idx_filename)
+    remove_file(out_filename)
+    remove_file(vrt_filename)
+
+    # Check if this is an MRF insert update, if not then regenerate a new MRF
+    mrf_list = []
+    if overview_resampling.lower() == "none" or overview_resampling == "":
+        # set to blank or none if we don't want to build overviews
+        overview_resampling = ""
+        insert_method = ""
+    elif overview_resampling[:4].lower() == "near" or overview_resampling.lower() == "nnb":
+        insert_method = "NNb"
+    else:
+        insert_method = "Avg"
+
+    for tile in list(alltiles):
+        if ".mrf" in tile.lower() and "_zen." not in tile:
+            mrf_list.append(tile)
+            alltiles.remove(tile)
+
+    # If more than one MRF, expected behavior is unknown... so exit
+    if len(mrf_list) > 1:
+        log_sig_exit(
+            "ERROR",
+            "Multiple MRFs found in input list, expected behavior unknown",
             sigevent_url,
         )
+    # Only be one MRF, so use that one
+    elif len(mrf_list) == 1:
+        mrf = mrf_list[0]
+        timeout = time.time() + 30  # 30 second timeout if MRF is still being generated
+
+        # Bail if a remote MRF is included in the input list.  Just can't handle this yet.
+        if mrf.startswith("/vsi"):
+            mssg = "Cannot support a remote (i.e. /vsi...) MRF input"
+            log_sig_exit("ERROR", mssg, sigevent_url)
 
+        while not os.path.isfile(mrf):
+            mssg = str().join([mrf, " does not exist"])
+            if time.time() > timeout:
+                log_sig_exit("ERROR", mssg, sigevent_url)
+                break
+            log_sig_warn(mssg + ", waiting 5 seconds...", sigevent_url)
+            time.sleep(5)
 
-# -----------------------------------------------------------------------
-# Seed the MRF data file (.ppg or .pjg) with a copy of the empty tile.
-if mrf_empty_tile_filename != "" and (z is None or z == 0):
-    log_info_mssg("Seed the MRF data file with a copy of the empty tile.")
-    log_info_mssg(str().join(["Copy ", mrf_empty_tile_filename, " to ", out_filename]))
-    shutil.copy(mrf_empty_tile_filename, out_filename)
-# -----------------------------------------------------------------------
-
-# Create the gdal_translate command.
-gdal_translate_command_list = [
-    "gdal_translate",
-    "-q",
-    "-of",
-    "MRF",
-    "-co",
-    compress,
-    "-co",
-    blocksize,
-    "-outsize",
-    target_x,
-    target_y,
-]
-if compress in ["COMPRESS=JPEG", "COMPRESS=PNG", "COMPRESS=JPNG"]:
-    gdal_translate_command_list.append("-co")
-    gdal_translate_command_list.append("QUALITY=" + quality_prec)
-if compress == "COMPRESS=LERC":
-    # Default to V1 for Javascript decoding
-    gdal_translate_command_list.append("-co")
-    gdal_translate_command_list.append(
-        'OPTIONS="LERC_PREC=' + quality_prec + ' V1=ON DEFLATE=ON"'
-    )
-if zlevels != "":
-    gdal_translate_command_list.append("-co")
-    gdal_translate_command_list.append("ZSIZE=" + str(zlevels))
-if use_brunsli == False and compress == "COMPRESS=JPEG":
-    gdal_translate_command_list.append("-co")
-    gdal_translate_command_list.append("OPTIONS=JFIF:on")
+        # Check if zdb is used
+        if zlevels != "":
+            stage = start_stage("zdb insert")
+            mrf, z, zdb_out, con = insert_zdb(
+                mrf, zlevels, zkey, source_url, scale, offset, units
+            )
+            end_stage(stage)
+            if con:
+                con.commit()
+                con.close()
+                log_info_mssg("Successfully committed record to " + zdb_out)
+            else:
+                log_info_mssg("No ZDB record created")
+        else:
+            con = None
 
-if nocopy == True:
-    gdal_translate_command_list.append("-co")
-    gdal_translate_command_list.append("NOCOPY=true")
-    if (
-        noaddo or len(alltiles) <= 1
-    ) and overview_resampling != "":  # use UNIFORM_SCALE if empty MRF, single input, or noaddo and overview resampling specified
-        gdal_translate_command_list.append("-co")
-        gdal_translate_command_list.append("UNIFORM_SCALE=" + str(int(overview)))
+        # Track the base-level blocks written by the inserts for incremental overviews
+        if incremental_overviews:
+            dirty_blocks = set()
+            for col_start, col_end, row_start, row_end in get_tile_block_ranges(
+                alltiles,
+                target_x,
+                target_y,
+                mrf_blocksize,
+                [target_xmin, target_ymin, target_xmax, target_ymax],
+            ):
+                dirty_blocks.update(
+                    (col, row)
+                    for col in range(col_start, col_end)
+                    for row in range(row_start, row_end)
+                )
 
-# add ending parameters
-gdal_translate_command_list.append(vrt_filename)
-gdal_translate_command_list.append(gdal_mrf_filename)
+        stage = start_stage("mrf_insert")
+        if mrf_parallel:
+            parallel_mrf_insert(
+                alltiles,
+                mrf,
+                insert_method,
+                resize_resampling,
+                target_x,
+                target_y,
+                mrf_blocksize,
+                [target_xmin, target_ymin, target_xmax, target_ymax],
+                target_epsg,
+                vrtnodata,
+                merge,
+                working_dir,
+                mrf_cores,
+                regenerate_overviews=noaddo,
+            )
+        else:
+            run_mrf_insert(
+                alltiles,
+                mrf,
+                insert_method,
+                resize_resampling,
+                target_x,
+                target_y,
+                mrf_blocksize,
+                [target_xmin, target_ymin, target_xmax, target_ymax],
+                target_epsg,
+                vrtnodata,
+                merge,
+                working_dir,
+                max_size=mrf_maxsize,
+            )
+        end_stage(stage, len(alltiles))
 
-# Log the gdal_translate command.
-log_the_command(gdal_translate_command_list)
-# Capture stderr.
-gdal_translate_stderr_filename = str().join(
-    [working_dir, basename, "_gdal_translate_stderr.txt"]
-)
-# Open stderr file for write.
-gdal_translate_stderr_file = open(gdal_translate_stderr_filename, "w")
-
-# -----------------------------------------------------------------------
-# Execute gdal_translate.
-subprocess.call(gdal_translate_command_list, stderr=gdal_translate_stderr_file)
-# -----------------------------------------------------------------------
-
-# Close stderr file.
-gdal_translate_stderr_file.close()
-
-# Copy vrt to output
-if not data_only:
-    shutil.copy(vrt_filename, str().join([output_dir, basename, ".vrt"]))
-
-# Clean up temporary VRT files
-for vrt in [
-    v
-    for v in glob.glob(str().join([working_dir, basename, "*.vrt"]))
-    if (v not in alltiles)
-]:
-    remove_file(vrt)
-
-# Check if MRF was created.
-mrf_output = glob.glob(mrf_filename)
-if len(mrf_output) == 0:
-    mssg = str().join(
-        [
-            "Fail:  gdal_translate",
-            " Check gdal mrf driver plugin.",
-            " Check stderr file:  ",
-            gdal_translate_stderr_filename,
-        ]
+        # Clean up
+        remove_file(all_tiles_filename)
+
+        if not noaddo and overview_resampling != "":
+            stage = start_stage("gdaladdo")
+            if incremental_overviews:
+                run_incremental_overviews(
+                    overview_resampling, mrf, overview_levels, zlevels, dirty_blocks
+                )
+            else:
+                run_gdaladdo(overview_resampling, mrf, overview_levels, zlevels)
+            end_stage(stage)
+
+        if mrf_clean:
+            mrf_data_name = data_name(mrf)
+            log_info_mssg("running mrf_clean on data file {}".format(mrf_data_name))
+            clean_mrf(mrf_data_name)
+
+        # Exit here since we don't need to build an MRF from scratch
+        mssg = str().join(["MRF updated:  ", mrf])
+        log_info_mssg(mssg)
+        if metrics_filename:
+            write_metrics_summary(str().join([output_dir, basename, "_metrics_summary.json"]))
+
+        # Exit mrfgen because we are done
+        if errors > 0:
+            print("{0} errors encountered".format(errors))
+            return 1
+        else:
+            return 0
+
+    # Else, no MRF so continue on with the rest of the processing...
+
+
+    # Use zdb index if z-levels are defined
+    if zlevels != "":
+        mrf_filename, idx_filename, out_filename, output_aux, output_vrt = get_mrf_names(
+            out_filename, mrf_name, parameter_name, date_of_data, time_of_data
+        )
+        mrf_filename = output_dir + mrf_filename
+        idx_filename = output_dir + idx_filename
+        out_filename = output_dir + out_filename
+        stage = start_stage("zdb insert")
+        gdal_mrf_filename, z, zdb_out, con = insert_zdb(
+            mrf_filename, zlevels, zkey, source_url, scale, offset, units
+        )
+        end_stage(stage)
+        # Commit database if successful
+        if con:
+            con.commit()
+            con.close()
+            log_info_mssg("Successfully committed record to " + zdb_out)
+        else:
+            log_info_mssg("No ZDB record created")
+    else:
+        con = None
+        gdal_mrf_filename = mrf_filename
+
+
+    gdalbuildvrt_command_list = [
+        "gdalbuildvrt",
+        "-q",
+        "-input_file_list",
+        all_tiles_filename,
+    ]
+
+    # all tiles are now in the target_epsg because:
+    #   a) source_epsg == target_epsg
+    #       OR
+    #   b) source_epsg != target_epsg and we've fixed that by replacing the tile with a VRT
+
+    # Set the extents and EPSG based on the target since we know that that the EPSG of all tiles is the target EPSG
+    gdalbuildvrt_command_list.extend(
+        ["-te", target_xmin, target_ymin, target_xmax, target_ymax]
     )
-    log_sig_exit("ERROR", mssg, sigevent_url)
-
-# Insert if there are input tiles to process
-if len(alltiles) > 0 and nocopy == True:
-    if mrf_parallel:
-        parallel_mrf_insert(
-            alltiles,
-            gdal_mrf_filename,
-            insert_method,
+    gdalbuildvrt_command_list.append("-a_srs")
+    gdalbuildvrt_command_list.append(target_epsg)
+
+    if target_x != "":
+        # set the output resolution if a target size has been provided
+        xres = repr(abs((float(target_xmax) - float(target_xmin)) / float(target_x)))
+        if target_y != "":
+            yres = repr(abs((float(target_ymin) - float(target_ymax)) / float(target_y)))
+        else:
+            yres = xres
+        log_info_mssg("x resolution: " + xres + ", y resolution: " + yres)
+        gdalbuildvrt_command_list.append("-resolution")
+        gdalbuildvrt_command_list.append("user")
+        gdalbuildvrt_command_list.append("-tr")
+        gdalbuildvrt_command_list.append(xres)
+        gdalbuildvrt_command_list.append(yres)
+
+    if vrtnodata != "":
+        # set the nodata values if provided
+        gdalbuildvrt_command_list.append("-vrtnodata")
+        gdalbuildvrt_command_list.append(vrtnodata)
+        gdalbuildvrt_command_list.append("-srcnodata")
+        gdalbuildvrt_command_list.append(vrtnodata)
+
+
+    # add VRT filename at the end
+    gdalbuildvrt_command_list.append(vrt_filename)
+    # Log the gdalbuildvrt command.
+    log_the_command(gdalbuildvrt_command_list)
+    # Capture stderr to record skipped .png files that are not valid PNG+World.
+    gdalbuildvrt_stderr_filename = str().join(
+        [working_dir, basename, "_gdalbuildvrt_stderr.txt"]
+    )
+    # Open stderr file for write.
+    gdalbuildvrt_stderr_file = open(gdalbuildvrt_stderr_filename, "w")
+
+    # ---------------------------------------------------------------------------
+    # Execute gdalbuildvrt.
+    stage = start_stage("gdalbuildvrt")
+    subprocess.call(gdalbuildvrt_command_list, stderr=gdalbuildvrt_stderr_file)
+    end_stage(stage, len(alltiles))
+    # ---------------------------------------------------------------------------
+
+    # use gdalwarp if resize with resampling method is declared
+    if resize_resampling != "":
+        if target_y == "":
+            target_y = str(int(target_x) / 2)
+        gdal_warp_command_list = [
+            "gdalwarp",
+            "-of",
+            "VRT",
+            "-r",
             resize_resampling,
-            target_x,
-            target_y,
-            mrf_blocksize,
-            [target_xmin, target_ymin, target_xmax, target_ymax],
-            target_epsg,
-            vrtnodata,
-            merge,
-            working_dir,
-            mrf_cores,
+            "-ts",
+            str(target_x),
+            str(target_y),
+            "-te",
+            target_xmin,
+            target_ymin,
+            target_xmax,
+            target_ymax,
+            "-overwrite",
+            vrt_filename,
+            vrt_filename.replace(".vrt", "_resample.vrt"),
+        ]
+        log_the_command(gdal_warp_command_list)
+        stage = start_stage("gdalwarp")
+        subprocess.call(gdal_warp_command_list, stderr=gdalbuildvrt_stderr_file)
+        end_stage(stage)
+        vrt_filename = vrt_filename.replace(".vrt", "_resample.vrt")
+
+    # Close stderr file.
+    gdalbuildvrt_stderr_file.close()
+
+    # Open stderr file for read.
+    try:
+        gdalbuildvrt_stderr_file = open(gdalbuildvrt_stderr_filename, "r")
+        # Report skipped .png files that are not valid PNG+World.
+        gdalbuildvrt_stderr = gdalbuildvrt_stderr_file.readlines()
+        # Loop over all lines in file.
+        for ndx in range(len(gdalbuildvrt_stderr)):
+            # Get line number(s) where skipped files appear in the stderr file.
+            skipped = str(gdalbuildvrt_stderr[ndx]).find("Warning")
+            # If a line (including line 0) was found.
+            if skipped >= 0:
+                mssg = str().join(["gdalbuildvrt ", str(gdalbuildvrt_stderr[ndx])])
+                log_sig_warn(mssg, sigevent_url)
+        # Close file.
+        gdalbuildvrt_stderr_file.close()
+    except IOError:
+        mssg = str().join(["Cannot read:  ", gdalbuildvrt_stderr_filename])
+        log_sig_exit("ERROR", mssg, sigevent_url)
+
+    # Clean up.
+    remove_file(all_tiles_filename)
+    # Check if vrt was created.
+    vrt_output = glob.glob(vrt_filename)
+    if len(vrt_output) == 0:
+        mssg = str().join(
+            [
+                "Fail:  gdalbuildvrt",
+                "  May indicate no georeferenced tiles found.",
+                #'  May indicate unappropriate target_x.',
+                "  Look at stderr file:  ",
+                gdalbuildvrt_stderr_filename,
+            ]
         )
+        log_sig_exit("ERROR", mssg, sigevent_url)
+
+    # Create mrf only if vrt was successful.
+    vrtf = get_modification_time(vrt_filename)
+    remove_file(gdalbuildvrt_stderr_filename)
+
+    # Set the compression type for gdal_translate (-co NAME=VALUE).
+    if mrf_compression_type == "PNG" or mrf_compression_type == "EPNG":
+        # Unpaletted PNG.
+        compress = str("COMPRESS=PNG")
+    elif mrf_compression_type == "PPNG":
+        # Paletted PNG.
+        compress = str("COMPRESS=PPNG")
+    elif mrf_compression_type == "JPNG":
+        # JPNG Blended Format
+        compress = str("COMPRESS=JPNG")
+    elif mrf_compression_type == "JPG":
+        compress = str("COMPRESS=JPEG")
+    elif mrf_compression_type == "JPEG":
+        compress = str("COMPRESS=JPEG")
+    elif mrf_compression_type == "ZEN":
+        compress = str("COMPRESS=JPEG")
+    elif mrf_compression_type == "TIFF" or mrf_compression_type == "TIF":
+        compress = str("COMPRESS=TIF")
+    elif mrf_compression_type == "LERC" or mrf_compression_type == "LRC":
+        compress = str("COMPRESS=LERC")
     else:
-        run_mrf_insert(
-            alltiles,
-            gdal_mrf_filename,
-            insert_method,
-            resize_resampling,
-            target_x,
-            target_y,
-            mrf_blocksize,
-            [target_xmin, target_ymin, target_xmax, target_ymax],
-            target_epsg,
-            vrtnodata,
-            merge,
-            working_dir,
-            max_size=mrf_maxsize,
+        mssg = "Unrecognized compression type for MRF."
+        log_sig_exit("ERROR", mssg, sigevent_url)
+
+    # Insert colormap into VRT if a colormap is provided and colormap overwriting is enabled.
+    # This could be problematic if we're overwriting with a different palette than what is in the imagery.
+    if overwrite_colormap and colormap != "":
+        new_vrt_filename = vrt_filename.replace(".vrt", "_newcolormap.vrt")
+        colormap2vrt_command_list = [
+            script_dir + "colormap2vrt.py",
+            "--colormap",
+            colormap,
+            "--output",
+            new_vrt_filename,
+            "--merge",
+            vrt_filename,
+        ]
+        if add_transparency == True:
+            colormap2vrt_command_list.append("--transparent")
+        if send_email == True:
+            colormap2vrt_command_list.append("--send_email")
+        if email_server != "":
+            colormap2vrt_command_list.append("--email_server")
+            colormap2vrt_command_list.append(email_server)
+        if email_recipient != "":
+            colormap2vrt_command_list.append("--email_recipient")
+            colormap2vrt_command_list.append(email_recipient)
+        if email_sender != "":
+            colormap2vrt_command_list.append("--email_sender")
+            colormap2vrt_command_list.append(email_sender)
+        log_the_command(colormap2vrt_command_list)
+        colormap2vrt_stderr_filename = str().join(
+            [working_dir, basename, "_colormap2vrt_stderr.txt"]
         )
+        colormap2vrt_stderr_file = open(colormap2vrt_stderr_filename, "w+")
+        subprocess.call(colormap2vrt_command_list, stderr=colormap2vrt_stderr_file)
+        colormap2vrt_stderr_file.seek(0)
+        colormap2vrt_stderr = colormap2vrt_stderr_file.read()
+        log_info_mssg(colormap2vrt_stderr)
+        if "Error" in colormap2vrt_stderr:
+            log_sig_exit(
+                "ERROR",
+                "Error executing colormap2vrt.py with colormap:" + colormap,
+                sigevent_url,
+            )
+        colormap2vrt_stderr_file.close()
+        if os.path.isfile(new_vrt_filename):
+            remove_file(colormap2vrt_stderr_filename)
+            vrt_filename = new_vrt_filename
+
+    # Get input size.
+    dom = xml.dom.minidom.parse(vrt_filename)
+    rastersize_elements = dom.getElementsByTagName("VRTDataset")
+    x_size = rastersize_elements[0].getAttribute("rasterXSize")  # width
+    y_size = rastersize_elements[0].getAttribute("rasterYSize")  # height
+
+    if target_x == "":
+        log_info_mssg("x size and y size from VRT " + x_size + "," + y_size)
+        exp = 11  # minimum outsize 20480 for EPSG4326_2km
+        while int(10 * (2**exp)) < int(x_size):
+            exp += 1
+        target_x = str(10 * (2**exp))
+        log_info_mssg("Calculating target_x from VRT to " + target_x)
+
+    # Only use new target size if different.
+    if target_x != x_size:
+        # Calculate output size of Y dimension and maintain aspect ratio.
+        if target_y == "":
+            target_y = str(int(float(target_x) * (float(y_size) / float(x_size))))
+            log_info_mssg("Calculating target_y " + target_y)
+        if resize_resampling == "":
+            log_sig_warn(
+                "Target size ({0}x{1}) differs from input size ({2}x{3}), but <resize_resampling> flag has not been set.".format(
+                    target_x, target_y, x_size, y_size
+                ),
+                sigevent_url,
+            )
+    else:  # don't bother calculating y
+        if target_y == "":
+            target_y = y_size
+            log_info_mssg("Setting target_y from VRT to {0}".format(target_y))
+        elif float(target_y) != float(y_size):
+            log_sig_warn(
+                "Target y size ({0}) differs from raster y size ({1})".format(
+                    target_y, y_size
+                ),
+                sigevent_url,
+            )
 
 
-# Create pyramid only if idx (MRF index file) was successfully created.
-idxf = get_modification_time(idx_filename)
-if idxf >= vrtf:
-    remove_file(gdal_translate_stderr_filename)
+    # -----------------------------------------------------------------------
+    # Seed the MRF data file (.ppg or .pjg) with a copy of the empty tile.
+    if mrf_empty_tile_filename != "" and (z is None or z == 0):
+        log_info_mssg("Seed the MRF data file with a copy of the empty tile.")
+        log_info_mssg(str().join(["Copy ", mrf_empty_tile_filename, " to ", out_filename]))
+        shutil.copy(mrf_empty_tile_filename, out_filename)
+    # -----------------------------------------------------------------------
 
-    # Run gdaladdo if overview_resampling is set
-    if not noaddo and overview_resampling != "":
-        run_gdaladdo(overview_resampling, mrf_filename, overview_levels, zlevels)
-else:
-    log_info_mssg(str().join(["idxf = ", str(idxf)]))
-    log_info_mssg(str().join(["vrtf = ", str(vrtf)]))
-    log_info_mssg("idxf should be >= vrtf")
-    mssg = mrf_filename + " already exists"
-    log_sig_exit("ERROR", mssg, sigevent_url)
-
-if mrf_clean:
-    log_info_mssg("running mrf_clean on data file {}".format(out_filename))
-    clean_mrf(out_filename)
-
-# Rename MRFs
-if mrf_name != "":
-    output_mrf, output_idx, output_data, output_aux, output_vrt = get_mrf_names(
-        out_filename, mrf_name, parameter_name, date_of_data, time_of_data
-    )
-    if (output_dir + output_mrf) != mrf_filename:
-        log_info_mssg(
-            str().join(["Moving ", mrf_filename, " to ", output_dir + output_mrf])
+    # Create the gdal_translate command.
+    gdal_translate_command_list = [
+        "gdal_translate",
+        "-q",
+        "-of",
+        "MRF",
+        "-co",
+        compress,
+        "-co",
+        blocksize,
+        "-outsize",
+        target_x,
+        target_y,
+    ]
+    if compress in ["COMPRESS=JPEG", "COMPRESS=PNG", "COMPRESS=JPNG"]:
+        gdal_translate_command_list.append("-co")
+        gdal_translate_command_list.append("QUALITY=" + quality_prec)
+    if compress == "COMPRESS=LERC":
+        # Default to V1 for Javascript decoding
+        gdal_translate_command_list.append("-co")
+        gdal_translate_command_list.append(
+            'OPTIONS="LERC_PREC=' + quality_prec + ' V1=ON DEFLATE=ON"'
         )
-        shutil.move(mrf_filename, output_dir + output_mrf)
-    if (output_dir + output_data) != out_filename:
-        log_info_mssg(
-            str().join(["Moving ", out_filename, " to ", output_dir + output_data])
+    if zlevels != "":
+        gdal_translate_command_list.append("-co")
+        gdal_translate_command_list.append("ZSIZE=" + str(zlevels))
+    if use_brunsli == False and compress == "COMPRESS=JPEG":
+        gdal_translate_command_list.append("-co")
+        gdal_translate_command_list.append("OPTIONS=JFIF:on")
+
+    if nocopy == True:
+        gdal_translate_command_list.append("-co")
+        gdal_translate_command_list.append("NOCOPY=true")
+        if (
+            noaddo or len(alltiles) <= 1
+        ) and overview_resampling != "":  # use UNIFORM_SCALE if empty MRF, single input, or noaddo and overview resampling specified
+            gdal_translate_command_list.append("-co")
+            gdal_translate_command_list.append("UNIFORM_SCALE=" + str(int(overview)))
+
+    # add ending parameters
+    gdal_translate_command_list.append(vrt_filename)
+    gdal_translate_command_list.append(gdal_mrf_filename)
+
+    # Log the gdal_translate command.
+    log_the_command(gdal_translate_command_list)
+    # Capture stderr.
+    gdal_translate_stderr_filename = str().join(
+        [working_dir, basename, "_gdal_translate_stderr.txt"]
+    )
+    # Open stderr file for write.
+    gdal_translate_stderr_file = open(gdal_translate_stderr_filename, "w")
+
+    # -----------------------------------------------------------------------
+    # Execute gdal_translate.
+    stage = start_stage("gdal_translate")
+    subprocess.call(gdal_translate_command_list, stderr=gdal_translate_stderr_file)
+    end_stage(stage)
+    # -----------------------------------------------------------------------
+
+    # Close stderr file.
+    gdal_translate_stderr_file.close()
+
+    # Copy vrt to output
+    if not data_only:
+        shutil.copy(vrt_filename, str().join([output_dir, basename, ".vrt"]))
+
+    # Clean up temporary VRT files
+    for vrt in [
+        v
+        for v in glob.glob(str().join([working_dir, basename, "*.vrt"]))
+        if (v not in alltiles)
+    ]:
+        remove_file(vrt)
+
+    # Check if MRF was created.
+    mrf_output = glob.glob(mrf_filename)
+    if len(mrf_output) == 0:
+        mssg = str().join(
+            [
+                "Fail:  gdal_translate",
+                " Check gdal mrf driver plugin.",
+                " Check stderr file:  ",
+                gdal_translate_stderr_filename,
+            ]
         )
-        shutil.move(out_filename, output_dir + output_data)
-    if (output_dir + output_idx) != idx_filename:
-        log_info_mssg(
-            str().join(["Moving ", idx_filename, " to ", output_dir + output_idx])
+        log_sig_exit("ERROR", mssg, sigevent_url)
+
+    # Insert if there are input tiles to process
+    if len(alltiles) > 0 and nocopy == True:
+        stage = start_stage("mrf_insert")
+        if mrf_parallel:
+            parallel_mrf_insert(
+                alltiles,
+                gdal_mrf_filename,
+                insert_method,
+                resize_resampling,
+                target_x,
+                target_y,
+                mrf_blocksize,
+                [target_xmin, target_ymin, target_xmax, target_ymax],
+                target_epsg,
+                vrtnodata,
+                merge,
+                working_dir,
+                mrf_cores,
+                regenerate_overviews=noaddo,
+            )
+        else:
+            run_mrf_insert(
+                alltiles,
+                gdal_mrf_filename,
+                insert_method,
+                resize_resampling,
+                target_x,
+                target_y,
+                mrf_blocksize,
+                [target_xmin, target_ymin, target_xmax, target_ymax],
+                target_epsg,
+                vrtnodata,
+                merge,
+                working_dir,
+                max_size=mrf_maxsize,
+            )
+        end_stage(stage, len(alltiles))
+
+    # Create pyramid only if idx (MRF index file) was successfully created.
+    idxf = get_modification_time(idx_filename)
+    if idxf >= vrtf:
+        remove_file(gdal_translate_stderr_filename)
+
+        # Run gdaladdo if overview_resampling is set
+        if not noaddo and overview_resampling != "":
+            stage = start_stage("gdaladdo")
+            run_gdaladdo(overview_resampling, mrf_filename, overview_levels, zlevels)
+            end_stage(stage)
+    else:
+        log_info_mssg(str().join(["idxf = ", str(idxf)]))
+        log_info_mssg(str().join(["vrtf = ", str(vrtf)]))
+        log_info_mssg("idxf should be >= vrtf")
+        mssg = mrf_filename + " already exists"
+        log_sig_exit("ERROR", mssg, sigevent_url)
+
+    if mrf_clean:
+        log_info_mssg("running mrf_clean on data file {}".format(out_filename))
+        clean_mrf(out_filename)
+
+    # Rename MRFs
+    if mrf_name != "":
+        output_mrf, output_idx, output_data, output_aux, output_vrt = get_mrf_names(
+            out_filename, mrf_name, parameter_name, date_of_data, time_of_data
         )
-        shutil.move(idx_filename, output_dir + output_idx)
-    if data_only == False:
-        if os.path.isfile(mrf_filename + ".aux.xml"):
+        if (output_dir + output_mrf) != mrf_filename:
             log_info_mssg(
-                str().join(
-                    [
-                        "Moving ",
-                        mrf_filename + ".aux.xml",
-                        " to ",
-                        working_dir + output_aux,
-                    ]
-                )
+                str().join(["Moving ", mrf_filename, " to ", output_dir + output_mrf])
             )
-            shutil.move(mrf_filename + ".aux.xml", working_dir + output_aux)
-        if os.path.isfile(str().join([output_dir, basename, ".vrt"])):
+            shutil.move(mrf_filename, output_dir + output_mrf)
+        if (output_dir + output_data) != out_filename:
             log_info_mssg(
-                str().join(
-                    [
-                        "Moving ",
-                        str().join([output_dir, basename, ".vrt"]),
-                        " to ",
-                        working_dir + output_vrt,
-                    ]
-                )
+                str().join(["Moving ", out_filename, " to ", output_dir + output_data])
             )
-            shutil.move(
-                str().join([output_dir, basename, ".vrt"]), working_dir + output_vrt
+            shutil.move(out_filename, output_dir + output_data)
+        if (output_dir + output_idx) != idx_filename:
+            log_info_mssg(
+                str().join(["Moving ", idx_filename, " to ", output_dir + output_idx])
             )
-    mrf_filename = output_dir + output_mrf
-    out_filename = output_dir + output_data
-
-# Leave only MRF data, index, and header files
-if data_only:
-    remove_file(log_filename)
-    remove_file(output_dir + "/" + basename + ".mrf.aux.xml")
-    remove_file(working_dir + "/" + basename + ".configuration_file.xml")
-
-# Remove temp tiles
-working_dir_files = glob.glob(working_dir + "/*")
-for tilename in alltiles:
-    if os.path.normpath(tilename) in working_dir_files:
-        if tiff_compress != None:
-            remove_file(tilename + ".aux.xml")
-        if "_indexed." in tilename:
-            remove_file(tilename.rsplit(".", 1)[0] + ".pgw")
-        # Remove intermediary zen MRF files
-        if mrf_compression_type.lower() == "zen":
-            if "_zen." in tilename:
-                for zen_file in glob.iglob(os.path.splitext(tilename)[0] + "*"):
-                    remove_file(zen_file)
-        # remove background tiles
-        if background != "":
-            if "_bg." in tilename:
-                remove_file(tilename)
-
-# Send to log.
-mssg = str().join(["MRF created:  ", out_filename])
-try:
-    log_info_mssg(mssg)
-    # sigevent('INFO', mssg, sigevent_url)
-except urllib.error.URLError:
-    None
-if errors > 0:
-    print("{0} errors encountered".format(errors))
-    sys.exit(1)
-else:
-    sys.exit(0)
+            shutil.move(idx_filename, output_dir + output_idx)
+        if data_only == False:
+            if os.path.isfile(mrf_filename + ".aux.xml"):
+                log_info_mssg(
+                    str().join(
+                        [
+                            "Moving ",
+                            mrf_filename + ".aux.xml",
+                            " to ",
+                            working_dir + output_aux,
+                        ]
+                    )
+                )
+                shutil.move(mrf_filename + ".aux.xml", working_dir + output_aux)
+            if os.path.isfile(str().join([output_dir, basename, ".vrt"])):
+                log_info_mssg(
+                    str().join(
+                        [
+                            "Moving ",
+                            str().join([output_dir, basename, ".vrt"]),
+                            " to ",
+                            working_dir + output_vrt,
+                        ]
+                    )
+                )
+                shutil.move(
+                    str().join([output_dir, basename, ".vrt"]), working_dir + output_vrt
+                )
+        mrf_filename = output_dir + output_mrf
+        out_filename = output_dir + output_data
+
+    # Leave only MRF data, index, and header files
+    if data_only:
+        remove_file(log_filename)
+        remove_file(output_dir + "/" + basename + ".mrf.aux.xml")
+        remove_file(working_dir + "/" + basename + ".configuration_file.xml")
+
+    # Remove temp tiles
+    working_dir_files = glob.glob(working_dir + "/*")
+    for tilename in alltiles:
+        if os.path.normpath(tilename) in working_dir_files:
+            if tiff_compress != None:
+                remove_file(tilename + ".aux.xml")
+            if "_indexed." in tilename:
+                remove_file(tilename.rsplit(".", 1)[0] + ".pgw")
+            # Remove intermediary zen MRF files
+            if mrf_compression_type.lower() == "zen":
+                if "_zen." in tilename:
+                    for zen_file in glob.iglob(os.path.splitext(tilename)[0] + "*"):
+                        remove_file(zen_file)
+            # remove background tiles
+            if background != "":
+                if "_bg." in tilename:
+                    remove_file(tilename)
+
+    # Keep the intermediate cache within its size limit
+    evict_intermediate_cache()
+
+    if metrics_filename:
+        write_metrics_summary(str().join([output_dir, basename, "_metrics_summary.json"]))
+
+    # Send to log.
+    mssg = str().join(["MRF created:  ", out_filename])
+    try:
+        log_info_mssg(mssg)
+        # sigevent('INFO', mssg, sigevent_url)
+    except urllib.error.URLError:
+        None
+    if errors > 0:
+        print("{0} errors encountered".format(errors))
+        return 1
+    else:
+        return 0
+
+
+if __name__ == "__main__":
+    # Define command line options and args.
+    parser = OptionParser(version=versionNumber)
+    parser.add_option(
+        "-c",
+        "--configuration_filename",
+        action="store",
+        type="string",
+        dest="configuration_filename",
+        default="./mrfgen_configuration_file.xml",
+        help="Full path of configuration filename.  Default:  ./mrfgen_configuration_file.xml",
+    )
+    parser.add_option(
+        "-d",
+        "--data_only",
+        action="store_true",
+        dest="data_only",
+        default=False,
+        help="Only output the MRF data, index, and header files",
+    )
+    parser.add_option(
+        "-s",
+        "--send_email",
+        action="store_true",
+        dest="send_email",
+        default=False,
+        help="Send email notification for errors and warnings.",
+    )
+    parser.add_option(
+        "--email_server",
+        action="store",
+        type="string",
+        dest="email_server",
+        default="",
+        help="The server where email is sent from (overrides configuration file value)",
+    )
+    parser.add_option(
+        "--email_recipient",
+        action="store",
+        type="string",
+        dest="email_recipient",
+        default="",
+        help="The recipient address for email notifications (overrides configuration file value)",
+    )
+    parser.add_option(
+        "--email_sender",
+        action="store",
+        type="string",
+        dest="email_sender",
+        default="",
+        help="The sender for email notifications (overrides configuration file value)",
+    )
+    parser.add_option(
+        "--email_logging_level",
+        action="store",
+        type="string",
+        dest="email_logging_level",
+        default="ERROR",
+        help="Logging level for email notifications: ERROR, WARN, or INFO.  Default: ERROR",
+    )
+    parser.add_option(
+        "-b",
+        "--batch",
+        action="store_true",
+        dest="batch",
+        default=False,
+        help="Run every configuration file or directory of configuration files (*.xml) given as arguments in one process",
+    )
+    parser.add_option(
+        "-w",
+        "--workers",
+        action="store",
+        type="int",
+        dest="workers",
+        default=4,
+        help="Number of configurations to run concurrently in batch mode.  Default: 4",
+    )
+    parser.add_option(
+        "--watch",
+        action="store",
+        type="float",
+        dest="watch",
+        default=None,
+        help="Keep running in batch mode, checking the directories for new configurations every WATCH seconds",
+    )
+    parser.add_option(
+        "--archive_dir",
+        action="store",
+        type="string",
+        dest="archive_dir",
+        default=None,
+        help="Directory to move configurations to when they are done in batch mode",
+    )
+
+    # Read command line args.
+    (options, args) = parser.parse_args()
+    run_options = {
+        "data_only": options.data_only,
+        "send_email": options.send_email,
+        "email_server": options.email_server,
+        "email_recipient": options.email_recipient,
+        "email_sender": options.email_sender,
+        "email_logging_level": options.email_logging_level,
+    }
+
+    if options.batch:
+        failed = run_mrfgen_batch(
+            args,
+            workers=options.workers,
+            watch_interval=options.watch,
+            archive_dir=options.archive_dir,
+            **run_options
+        )
+        sys.exit(1 if failed > 0 else 0)
+
+    sys.exit(run_mrfgen(options.configuration_filename, **run_options))
@@ -32,29 +32,98 @@
 # limitations under the License.
 
 import argparse
+import collections
+from multiprocessing.pool import ThreadPool
 from osgeo import gdal, gdalconst
 from osgeo.gdalconst import *
 import numpy as np
-import numpy.ma as ma
 import math
 
-
-def pack(infile, outfile, calcscaleoffset=False, forgibs=False, minmax=None, rawnodata = None, scaleoffset=None, noverifydata=False):
+# Approximate number of pixels read per window; windows are whole rows of native blocks
+WINDOW_PIXELS = 16 * 1024 * 1024
+
+
+def get_windows(band):
+    """
+    Splits a band into full-width row windows aligned to its native block height.
+    Returns a list of (yoff, ysize) tuples.
+    """
+    block_y = max(band.GetBlockSize()[1], 1)
+    rows = max(block_y, (WINDOW_PIXELS // max(band.XSize, 1)) // block_y * block_y)
+    return [(j, min(rows, band.YSize - j)) for j in range(0, band.YSize, rows)]
+
+
+def read_windows(band, windows):
+    """
+    Reads each window of a band as float32.
+    """
+    for yoff, ysize in windows:
+        yield yoff, band.ReadAsArray(xoff=0, yoff=yoff, win_xsize=band.XSize, win_ysize=ysize).astype(np.float32, copy=False)
+
+
+def get_nodata_mask(data, nodata):
+    """
+    Returns a boolean mask of the pixels that match any of the nodata values.
+    """
+    if len(nodata) == 0:
+        return np.zeros(data.shape, dtype=bool)
+    return np.isin(data, np.array(nodata, dtype=data.dtype))
+
+
+def pack_window(data, nodata, scale, offset, pscale, poffset, numbands, verifydata=True):
+    """
+    Packs a window of source data into 3 bytes per pixel, plus an alpha band if there are nodata values.
+    Arguments:
+        data -- float32 source data, modified in place
+        nodata -- list of nodata values, compared after the source scale and offset are applied
+        scale, offset -- source band scale and offset, or None
+        pscale, poffset -- packing scale and offset
+        numbands -- 3, or 4 to include the alpha band
+        verifydata -- check that the packed values fit in 24 bits
+    Returns:
+        uint8 array of shape (numbands, rows, cols)
+    """
+    if scale is not None:
+        np.multiply(data, scale, data)
+    if offset is not None:
+        np.add(data, offset, data)
+
+    mask = get_nodata_mask(data, nodata)
+    data[mask] = poffset
+    np.subtract(data, poffset, data)
+    if verifydata:
+        assert not (data < 0).any(), "The offset must be less than the minimum value in the data."
+    np.multiply(data, pscale, data)
+    if verifydata:
+        assert not (data >= 2 ** 24).any(), "The scale must make the values fall between 0 and 2^24"
+    packed = data.astype(np.int32)
+
+    out = np.empty((numbands,) + data.shape, dtype=np.uint8)
+    for i in range(3):
+        np.bitwise_and(np.right_shift(packed, i * 8), 0x000000ff, out=out[i], casting="unsafe")
+    if numbands == 4:
+        out[3] = 0x000000ff
+        out[3][mask] = 0
+    return out
+
+
+def pack(infile, outfile, calcscaleoffset=False, forgibs=False, minmax=None, rawnodata = None, scaleoffset=None, noverifydata=False, threads=1):
     # Get metadata information
     tiffds = gdal.Open(infile, GA_ReadOnly)
     projection = tiffds.GetProjection()
     geotransform = tiffds.GetGeoTransform()
     metadata = tiffds.GetMetadata()
+    band = tiffds.GetRasterBand(1)
 
     nodata = []
-    if tiffds.GetRasterBand(1).GetNoDataValue() is not None:
-        nodata.append(tiffds.GetRasterBand(1).GetNoDataValue())
+    if band.GetNoDataValue() is not None:
+        nodata.append(band.GetNoDataValue())
     if rawnodata is not None:
         del nodata[:]
         for k in range(len(rawnodata)):
             nodata.append(float(rawnodata[k]))
-    scale = tiffds.GetRasterBand(1).GetScale()
-    offset = tiffds.GetRasterBand(1).GetOffset()
+    scale = band.GetScale()
+    offset = band.GetOffset()
     numbands = 3
     if len(nodata) != 0:
         numbands = 4
@@ -67,34 +136,23 @@ def pack(infile, outfile, calcscaleoffset=False, forgibs=False, minmax=None, raw
     ptiffraster.SetMetadata(metadata)
 
     overviewlist = []
-    for i in range(tiffds.GetRasterBand(1).GetOverviewCount()):
-        overviewlist.append(tiffds.GetRasterBand(1).XSize / tiffds.GetRasterBand(1).GetOverview(i).XSize + 1)
+    for i in range(band.GetOverviewCount()):
+        overviewlist.append(band.XSize / band.GetOverview(i).XSize + 1)
 
     ptiffraster.BuildOverviews(overviewlist=overviewlist)
 
     print("Getting statistics in source data...")
     if minmax is None:
         if rawnodata is not None:
+            # Single streaming pass over the raw values, ignoring nodata
             minmax = [float("inf"), float("-inf")]
-            stride = 5
-
-            for j in range(0, tiffds.GetRasterBand(1).YSize, stride):
-                if (tiffds.GetRasterBand(1).YSize - j) < stride:
-                    stride = tiffds.GetRasterBand(1).YSize % stride
-                mask = np.zeros((stride, tiffds.GetRasterBand(1).XSize))
-                tiffdsa = tiffds.GetRasterBand(1).ReadAsArray(xoff=0, yoff=j, win_xsize=tiffds.GetRasterBand(1).XSize,
-                                                              win_ysize=stride).astype(np.float32)
-                for k in range(len(rawnodata)):
-                    mask[tiffdsa == nodata[k]] = 1
-                masktiffdsa = ma.MaskedArray(tiffdsa, mask)
-                thismin = np.amin(masktiffdsa)
-                thismax = np.amax(masktiffdsa)
-                if thismin < minmax[0]:
-                    minmax[0] = thismin
-                if thismax > minmax[1]:
-                    minmax[1] = thismax
+            for yoff, data in read_windows(band, get_windows(band)):
+                valid = data[~get_nodata_mask(data, nodata)]
+                if valid.size:
+                    minmax[0] = min(minmax[0], float(valid.min()))
+                    minmax[1] = max(minmax[1], float(valid.max()))
         else:
-            tiffstats = tiffds.GetRasterBand(1).GetStatistics(0, 1)
+            tiffstats = band.GetStatistics(0, 1)
             minmax = (tiffstats[0], tiffstats[1])
 
     poffset = math.floor(minmax[0])
@@ -108,79 +166,59 @@ def pack(infile, outfile, calcscaleoffset=False, forgibs=False, minmax=None, raw
     if calcscaleoffset:
         return
 
-    print("Reading in source data...")
+    def write_level(source_band, get_target_band, verifydata):
+        # The source is read once per window, all output bands are packed from the same buffer,
+        # and results are written in order. At most threads * 2 windows are held in memory at once.
+        windows = read_windows(source_band, get_windows(source_band))
+
+        def pack_source_window(yoff, data):
+            return yoff, pack_window(data, nodata, scale, offset, pscale, poffset, numbands, verifydata)
+
+        def write_window(yoff, out):
+            for i in range(1, numbands + 1):
+                get_target_band(i).WriteArray(out[i - 1], xoff=0, yoff=yoff)
+
+        if threads <= 1:
+            for yoff, data in windows:
+                write_window(*pack_source_window(yoff, data))
+            return
+
+        pool = ThreadPool(threads)
+        in_flight = collections.deque()
+        try:
+            for yoff, data in windows:
+                in_flight.append(pool.apply_async(pack_source_window, (yoff, data)))
+                if len(in_flight) >= threads * 2:
+                    write_window(*in_flight.popleft().get())
+            while in_flight:
+                write_window(*in_flight.popleft().get())
+        finally:
+            pool.close()
+            pool.join()
 
+    print("Reading in source data...")
+    print("Writing band data...")
+    write_level(band, ptiffraster.GetRasterBand, not noverifydata)
     for i in range(1, numbands + 1):
-        print("Writing band %d data..." % i)
-        stride = 5
-        for j in range(0, tiffds.GetRasterBand(1).YSize, stride):
-            if (tiffds.GetRasterBand(1).YSize - j) < stride:
-                stride = tiffds.GetRasterBand(1).YSize % stride
-            tiffdsa = tiffds.GetRasterBand(1).ReadAsArray(xoff=0, yoff=j, win_xsize=tiffds.GetRasterBand(1).XSize,
-                                                          win_ysize=stride).astype(np.float32)
-
-            if scale is not None:
-                np.multiply(tiffdsa, scale, tiffdsa)
-            if offset is not None:
-                np.add(tiffdsa, offset, tiffdsa)
-
-            if i <= 3:
-                for k in range(len(nodata)):
-                    tiffdsa[tiffdsa == nodata[k]] = poffset
-                np.subtract(tiffdsa, poffset, tiffdsa)
-                if not noverifydata:
-                    assert (tiffdsa < 0).sum() == 0, "The offset must be less than the minimum value in the data."
-                np.multiply(tiffdsa, pscale, tiffdsa)
-                if not noverifydata:
-                    assert (tiffdsa >= 2 ** 24).sum() == 0, "The scale must make the values fall between 0 and 2^24"
-                tiffdsa = tiffdsa.astype(np.int32)
-                np.right_shift(tiffdsa, (i - 1) * 8, tiffdsa)
-                np.bitwise_and(tiffdsa, 0x000000ff, tiffdsa)
-            if i == 4:
-                nodatadsa = np.empty(tiffdsa.shape)
-                np.ndarray.fill(nodatadsa, 0x000000ff)
-                for k in range(len(nodata)):
-                    nodatadsa[tiffdsa == nodata[k]] = 0
-                tiffdsa = nodatadsa
-            ptiffraster.GetRasterBand(i).WriteArray(tiffdsa, xoff=0, yoff=j)
         ptiffraster.GetRasterBand(i).SetScale(pscale)
         ptiffraster.GetRasterBand(i).SetOffset(poffset)
         if len(nodata) != 0:  # Write nodata for every band if there is nodata information
             ptiffraster.GetRasterBand(i).SetNoDataValue(nodata[0])
             if forgibs:
                 ptiffraster.GetRasterBand(i).SetNoDataValue(0)
-        ptiffraster.FlushCache()
+    ptiffraster.FlushCache()
 
     for j in range(len(overviewlist)):
-        tiffdsa = tiffds.GetRasterBand(1).GetOverview(j).ReadAsArray().astype(np.float32)
-
-        if scale is not None:
-            np.multiply(tiffdsa, scale, tiffdsa)
-        if offset is not None:
-            np.add(tiffdsa, offset, tiffdsa)
-
+        print("Writing overview %d data..." % j)
+        write_level(band.GetOverview(j), lambda i: ptiffraster.GetRasterBand(i).GetOverview(j), False)
         for i in range(1, numbands + 1):
-            if i <= 3:
-                np.subtract(tiffdsa, poffset, tiffdsa)
-                np.multiply(tiffdsa, pscale, tiffdsa)
-                tiffdsa = tiffdsa.astype(np.int32)
-                np.right_shift(tiffdsa, (i - 1) * 8, tiffdsa)
-                np.bitwise_and(tiffdsa, 0x000000ff, tiffdsa)
-            if i == 4:
-                nodatadsa = np.empty(tiffdsa.shape)
-                np.ndarray.fill(nodatadsa, 0x000000ff)
-                for k in range(len(nodata)):
-                    nodatadsa[tiffdsa == nodata[k]] = 0
-                tiffdsa = nodatadsa
-            print("Writing band %d, overview %d data..." % (i, j))
-            ptiffraster.GetRasterBand(i).GetOverview(j).WriteArray(tiffdsa)
             ptiffraster.GetRasterBand(i).GetOverview(j).SetScale(pscale)
             ptiffraster.GetRasterBand(i).GetOverview(j).SetOffset(poffset)
             if len(nodata) != 0:
                 ptiffraster.GetRasterBand(i).GetOverview(j).SetNoDataValue(nodata[0])
                 if forgibs:
                     ptiffraster.GetRasterBand(i).SetNoDataValue(0)
-            ptiffraster.FlushCache()
+        ptiffraster.FlushCache()
 
 
 def main():
@@ -195,6 +233,8 @@ def main():
                         help='Only use specified nodata values and not the source nodata values. Only for use with poorly generated GeoTIFFs, will slow processing.')
     parser.add_argument('-n', '--no-verify-data', dest='noverifydata', action='store_true',
                         help='Does not verify data (that offset >= min data value and scaled values < 2^24)')
+    parser.add_argument('-t', '--threads', dest='threads', type=int, default=1,
+                        help='Number of threads to use for packing data (default: 1)')
     group = parser.add_mutually_exclusive_group()
     group.add_argument('-m', '--minmax', dest='minmax', type=float, nargs=2,
                        help='The minimum and maximum values for scale and offset)')
@@ -202,7 +242,7 @@ def main():
                        help='The scale and offset values, computed automatically if not specified. Note: offset is also scaled.')
     args = parser.parse_args()
 
-    pack(args.tiff, args.ptiff, args.calcscaleoffset, args.forgibs, args.minmax, args.nodata, args.scaleoffset, args.noverifydata)
+    pack(args.tiff, args.ptiff, args.calcscaleoffset, args.forgibs, args.minmax, args.nodata, args.scaleoffset, args.noverifydata, args.threads)
 
 
 if __name__ == "__main__":
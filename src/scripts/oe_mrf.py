@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Utilities for reading and writing MRF index (.idx) files.
+
+An MRF index is a flat array of big-endian 64-bit (offset, size) pairs, one per tile,
+starting with the full resolution level followed by each overview level. Tiles within
+a level are ordered by z-level, then row, then column. Indexes are memory-mapped as
+NumPy structured arrays so they can be read and modified without copying.
+"""
+
+import logging
+import math
+import os
+import shutil
+import xml.dom.minidom
+import numpy as np
+
+IDX_DTYPE = np.dtype([("offset", ">i8"), ("size", ">i8")])
+
+# Largest single copy when compacting data files
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+DATA_EXTENSIONS = {
+    "JPEG": ".pjg",
+    "JPG": ".pjg",
+    "PNG": ".ppg",
+    "PPNG": ".ppg",
+    "TIF": ".ptf",
+    "TIFF": ".ptf",
+    "LERC": ".lrc",
+    "MVT": ".pvt",
+    "PBF": ".pvt",
+}
+
+
+def read_mrf_header(mrf_path):
+    """
+    Reads the raster size, page size, compression and file names from an MRF header.
+    Arguments:
+        mrf_path -- Path of the .mrf file
+    Returns:
+        dict with size_x, size_y, size_z, page_x, page_y, compression, index_file and data_file
+    """
+    dom = xml.dom.minidom.parse(mrf_path)
+    raster = dom.getElementsByTagName("Raster")[0]
+    size = raster.getElementsByTagName("Size")[0]
+    header = {
+        "size_x": int(size.getAttribute("x")),
+        "size_y": int(size.getAttribute("y")),
+        "size_z": int(size.getAttribute("z") or 1),
+        "page_x": 512,
+        "page_y": 512,
+        "compression": "PNG",
+    }
+    page_size = raster.getElementsByTagName("PageSize")
+    if page_size:
+        header["page_x"] = int(page_size[0].getAttribute("x") or 512)
+        header["page_y"] = int(page_size[0].getAttribute("y") or 512)
+    compression = raster.getElementsByTagName("Compression")
+    if compression and compression[0].firstChild is not None:
+        header["compression"] = compression[0].firstChild.nodeValue.strip().upper()
+
+    base, _ = os.path.splitext(mrf_path)
+    data_file = raster.getElementsByTagName("DataFile")
+    if data_file and data_file[0].firstChild is not None:
+        header["data_file"] = data_file[0].firstChild.nodeValue.strip()
+    else:
+        header["data_file"] = base + DATA_EXTENSIONS.get(header["compression"], ".ppg")
+    index_file = raster.getElementsByTagName("IndexFile")
+    if index_file and index_file[0].firstChild is not None:
+        header["index_file"] = index_file[0].firstChild.nodeValue.strip()
+    else:
+        header["index_file"] = base + ".idx"
+    return header
+
+
+def level_layout(size_x, size_y, page_x=512, page_y=512, size_z=1):
+    """
+    Calculates where each level starts in an index with power of 2 overviews.
+    Arguments:
+        size_x, size_y -- Size of the full resolution level in pixels
+        page_x, page_y -- Tile size in pixels
+        size_z -- Number of z-levels
+    Returns:
+        List of (first tile number, columns, rows), starting with the full resolution level
+    """
+    cols = int(math.ceil(float(size_x) / page_x))
+    rows = int(math.ceil(float(size_y) / page_y))
+    layout = [(0, cols, rows)]
+    start = 0
+    while cols * rows > 1:
+        start += cols * rows * size_z
+        cols = int(math.ceil(cols / 2.0))
+        rows = int(math.ceil(rows / 2.0))
+        layout.append((start, cols, rows))
+    return layout
+
+
+def read_index(index_path, writable=False):
+    """
+    Memory-maps an MRF index file.
+    Arguments:
+        index_path -- Path of the .idx file
+        writable -- Map the file for writing; changes are written through to the file
+    Returns:
+        Structured array of (offset, size) entries
+    """
+    if os.path.getsize(index_path) < IDX_DTYPE.itemsize:
+        return np.zeros(0, dtype=IDX_DTYPE)
+    return np.memmap(index_path, dtype=IDX_DTYPE, mode="r+" if writable else "r")
+
+
+def make_index(offsets, sizes):
+    """
+    Builds index entries from offset and size arrays.
+    Arguments:
+        offsets -- Data file offsets of the tiles
+        sizes -- Sizes of the tiles in bytes, 0 for empty tiles
+    Returns:
+        Structured array of (offset, size) entries
+    """
+    entries = np.zeros(len(sizes), dtype=IDX_DTYPE)
+    entries["offset"] = offsets
+    entries["size"] = sizes
+    return entries
+
+
+def append_index(index_file, offsets, sizes):
+    """
+    Appends a block of entries to an open index file with a single write.
+    Arguments:
+        index_file -- Index file object opened for binary writing
+        offsets -- Data file offsets of the tiles
+        sizes -- Sizes of the tiles in bytes, 0 for empty tiles
+    Returns:
+        Number of entries written
+    """
+    entries = make_index(offsets, sizes)
+    index_file.write(entries.tobytes())
+    return len(entries)
+
+
+def write_index(index_path, entries):
+    """
+    Writes index entries to a new index file.
+    Arguments:
+        index_path -- Path of the .idx file
+        entries -- Structured array of (offset, size) entries
+    """
+    with open(index_path, "wb") as index_file:
+        index_file.write(np.asarray(entries, dtype=IDX_DTYPE).tobytes())
+
+
+def compact_index(entries, start_offset=0):
+    """
+    Plans the compaction of an MRF data file. The live byte ranges referenced by the index
+    are merged into spans (tiles that share or overlap data stay shared), and the spans are
+    packed one after another in data file order.
+    Arguments:
+        entries -- Structured array of (offset, size) entries
+        start_offset -- Offset in the new data file where the first span is written
+    Returns:
+        Tuple of the new index entries and an (N, 2) array of (source offset, size) spans to copy,
+        in order, to the new data file
+    """
+    offsets = entries["offset"].astype(np.int64)
+    sizes = entries["size"].astype(np.int64)
+    new_entries = np.array(entries, dtype=IDX_DTYPE)
+
+    live = np.flatnonzero(sizes > 0)
+    if len(live) == 0:
+        return new_entries, np.zeros((0, 2), dtype=np.int64)
+
+    order = live[np.argsort(offsets[live], kind="stable")]
+    starts = offsets[order]
+    ends = starts + sizes[order]
+
+    # A tile starts a new span if it begins after the end of everything before it
+    running_end = np.maximum.accumulate(ends)
+    span_breaks = np.ones(len(order), dtype=bool)
+    span_breaks[1:] = starts[1:] > running_end[:-1]
+    span_ids = np.cumsum(span_breaks) - 1
+    span_first = np.flatnonzero(span_breaks)
+    span_starts = starts[span_first]
+    span_sizes = np.maximum.reduceat(ends, span_first) - span_starts
+    new_span_starts = start_offset + np.concatenate(([0], np.cumsum(span_sizes)[:-1]))
+
+    new_entries["offset"][order] = new_span_starts[span_ids] + (starts - span_starts[span_ids])
+    return new_entries, np.column_stack((span_starts, span_sizes))
+
+
+def _copy_range(src_fd, dst_fd, src_offset, dst_offset, size, use_copy_file_range=True):
+    """
+    Copies a byte range between file descriptors, using copy_file_range where available
+    so the data doesn't pass through user space. Falls back to pread/pwrite, which is also
+    used when moving data down within the same file.
+    """
+    while size > 0:
+        count = min(size, COPY_CHUNK_SIZE)
+        copied = 0
+        if use_copy_file_range:
+            try:
+                copied = os.copy_file_range(src_fd, dst_fd, count, src_offset, dst_offset)
+            except (AttributeError, OSError):
+                use_copy_file_range = False
+        if not copied:
+            data = os.pread(src_fd, count, src_offset)
+            if not data:
+                raise IOError("Data file ends before offset {0}".format(src_offset))
+            copied = os.pwrite(dst_fd, data, dst_offset)
+        src_offset += copied
+        dst_offset += copied
+        size -= copied
+
+
+def _compaction_paths(data_path):
+    """
+    Returns the temporary data and index paths used while compacting a data file.
+    """
+    base, ext = os.path.splitext(data_path)
+    return base + os.extsep + "tmp" + ext, base + os.extsep + "tmp" + os.extsep + "idx"
+
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def finish_compaction(data_path):
+    """
+    Completes or rolls back a compaction of an MRF data file that was interrupted.
+    The compacted index replaces the original first, so a leftover temporary data file
+    without a temporary index means the index already refers to it.
+    Arguments:
+        data_path -- Path of the MRF data file
+    Returns:
+        True if an interrupted compaction was found
+    """
+    tmp_data_path, tmp_index_path = _compaction_paths(data_path)
+    if os.path.exists(tmp_index_path):
+        # Interrupted before the index was replaced, the original files are intact
+        os.remove(tmp_index_path)
+        if os.path.exists(tmp_data_path):
+            os.remove(tmp_data_path)
+        return True
+    if os.path.exists(tmp_data_path):
+        os.replace(tmp_data_path, data_path)
+        return True
+    return False
+
+
+def compact_mrf(data_path, index_path, in_place=False):
+    """
+    Compacts an MRF data file by copying only the tile data referenced by the index, in large
+    sequential ranges, and rewriting the index offsets.
+
+    By default the compacted index and data are written to temporary files next to the originals.
+    The index is replaced first and the data file second. If the process is interrupted,
+    finish_compaction (which runs first thing) either discards the temporary files or completes the
+    data file replacement, so the index never refers to the wrong data file. This needs enough free
+    space for the compacted copy.
+
+    With in_place, the live data is moved down within the existing data file, the index is rewritten
+    and the data file is truncated. This needs no extra space, but an interruption while data is being
+    moved leaves the MRF corrupt, so it is only done when asked for.
+    Arguments:
+        data_path -- Path of the MRF data file
+        index_path -- Path of the .idx file
+        in_place -- Compact within the existing data file
+    Returns:
+        Tuple of the data file size before and after compaction
+    """
+    finish_compaction(data_path)
+    entries = np.array(read_index(index_path))
+    new_entries, spans = compact_index(entries)
+    old_size = os.path.getsize(data_path)
+    new_size = int(spans[:, 1].sum())
+    if new_size == old_size and np.array_equal(new_entries, entries):
+        return old_size, new_size
+
+    tmp_data_path, tmp_index_path = _compaction_paths(data_path)
+    if in_place:
+        logging.warning(
+            "Compacting %s in place, the MRF will be corrupt if this is interrupted", data_path
+        )
+        write_index(tmp_index_path, new_entries)
+        # Spans are in data file order and only ever move to lower offsets, so copying them
+        # front to back never overwrites data that hasn't been copied yet
+        data_fd = os.open(data_path, os.O_RDWR)
+        try:
+            dst_offset = 0
+            for src_offset, size in spans.tolist():
+                if src_offset != dst_offset:
+                    _copy_range(data_fd, data_fd, src_offset, dst_offset, size, use_copy_file_range=False)
+                dst_offset += size
+            os.fsync(data_fd)
+            _fsync_path(tmp_index_path)
+            os.replace(tmp_index_path, index_path)
+            os.ftruncate(data_fd, new_size)
+        finally:
+            os.close(data_fd)
+        return old_size, new_size
+
+    free_space = shutil.disk_usage(os.path.dirname(os.path.abspath(data_path))).free
+    if free_space < new_size + new_entries.nbytes:
+        raise IOError(
+            "Not enough free space to compact {0}: {1} bytes needed, {2} available".format(
+                data_path, new_size + new_entries.nbytes, free_space
+            )
+        )
+    # The temporary index marks the compaction as incomplete until it replaces the original
+    write_index(tmp_index_path, new_entries)
+    src_fd = os.open(data_path, os.O_RDONLY)
+    dst_fd = os.open(tmp_data_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        dst_offset = 0
+        for src_offset, size in spans.tolist():
+            _copy_range(src_fd, dst_fd, src_offset, dst_offset, size)
+            dst_offset += size
+        os.fsync(dst_fd)
+    except BaseException:
+        os.remove(tmp_data_path)
+        os.remove(tmp_index_path)
+        raise
+    finally:
+        os.close(src_fd)
+        os.close(dst_fd)
+    _fsync_path(tmp_index_path)
+    os.replace(tmp_index_path, index_path)
+    os.replace(tmp_data_path, data_path)
+
+    return old_size, new_size
+
+
+class MRFIndex:
+    """
+    Random access to the tiles of a memory-mapped MRF index by level, row and column.
+    Level 0 is the full resolution level.
+    """
+
+    def __init__(self, index_path, size_x, size_y, page_x=512, page_y=512, size_z=1, writable=False):
+        self.index_path = index_path
+        self.size_z = size_z
+        self.layout = level_layout(size_x, size_y, page_x, page_y, size_z)
+        self.entries = read_index(index_path, writable)
+
+    @classmethod
+    def from_mrf(cls, mrf_path, writable=False):
+        """
+        Opens the index of an MRF using the sizes from its header.
+        Arguments:
+            mrf_path -- Path of the .mrf file
+            writable -- Map the index for writing
+        """
+        header = read_mrf_header(mrf_path)
+        return cls(header["index_file"], header["size_x"], header["size_y"],
+                   header["page_x"], header["page_y"], header["size_z"], writable)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def tile_number(self, level, row, col, z=0):
+        """
+        Returns the position of a tile in the index.
+        """
+        start, cols, rows = self.layout[level]
+        if not (0 <= row < rows and 0 <= col < cols and 0 <= z < self.size_z):
+            raise IndexError("Tile {0}/{1}/{2} (z={3}) is outside of the level".format(level, row, col, z))
+        return start + (z * rows + row) * cols + col
+
+    def get_tile(self, level, row, col, z=0):
+        """
+        Returns the (offset, size) of a tile. The size is 0 for empty tiles.
+        """
+        entry = self.entries[self.tile_number(level, row, col, z)]
+        return int(entry["offset"]), int(entry["size"])
+
+    def level_entries(self, level, z=0):
+        """
+        Returns a (rows, cols) view of the entries of a level, without copying.
+        """
+        start, cols, rows = self.layout[level]
+        start += z * rows * cols
+        return self.entries[start:start + rows * cols].reshape(rows, cols)
+
+    def flush(self):
+        if isinstance(self.entries, np.memmap):
+            self.entries.flush()
+
+    def close(self):
+        self.flush()
+        self.entries = None
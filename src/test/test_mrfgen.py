@@ -22,9 +22,12 @@ import sys
 import unittest
 import xmlrunner
 import filecmp
+import glob
+import json
 import shutil
 import datetime
 import sqlite3
+import numpy as np
 from osgeo import gdal
 from optparse import OptionParser
 from io import StringIO
@@ -37,6 +40,16 @@ year = datetime.datetime.now().strftime('%Y')
 doy = int(datetime.datetime.now().strftime('%j'))-1
 
 
+def import_mrfgen():
+    # Copy required files to test directory
+    shutil.copyfile("/home/oe2/onearth/src/mrfgen/mrfgen.py", os.path.join(os.getcwd(), 'mrfgen.py'))
+    shutil.copyfile("/home/oe2/onearth/src/mrfgen/overtiffpacker.py", os.path.join(os.getcwd(), 'overtiffpacker.py'))
+    shutil.copyfile("/home/oe2/onearth/src/scripts/oe_utils.py", os.path.join(os.getcwd(), 'oe_utils.py'))
+    shutil.copyfile("/home/oe2/onearth/src/scripts/oe_mrf.py", os.path.join(os.getcwd(), 'oe_mrf.py'))
+    import mrfgen
+    return mrfgen
+
+
 class TestMRFGeneration_paletted(unittest.TestCase):
     
     def setUp(self):
@@ -1512,6 +1525,179 @@ class TestMRFGeneration_mixed_projections(unittest.TestCase):
         else:
             print("Leaving test results in : " + self.staging_area)
 
+class TestMRFGeneration_parallel_insert(unittest.TestCase):
+    
+    def setUp(self):
+        testdata_path = os.path.join(os.getcwd(), 'mrfgen_files')
+        self.staging_area = os.path.join(os.getcwd(), 'mrfgen_test_data')
+        test_config = os.path.join(testdata_path, "mrfgen_test_config20.xml")
+
+        # Make source image dir
+        input_dir = os.path.join(testdata_path, 'mixed_projections')
+        make_dir_tree(os.path.join(input_dir), ignore_existing=True)
+        
+        # Make empty dirs for mrfgen output
+        mrfgen_dirs = ('output_dir', 'working_dir', 'logfile_dir')
+        [make_dir_tree(os.path.join(self.staging_area, path)) for path in mrfgen_dirs]
+
+        # Copy empty output tile
+        shutil.copytree(os.path.join(testdata_path, 'empty_tiles'), os.path.join(self.staging_area, 'empty_tiles'))
+
+        self.output_mrf = os.path.join(self.staging_area, "output_dir/sst2019231_.mrf")
+        self.output_ppg = os.path.join(self.staging_area, "output_dir/sst2019231_.ppg")
+        self.output_idx = os.path.join(self.staging_area, "output_dir/sst2019231_.idx")
+        self.output_img = os.path.join(self.staging_area, "output_dir/sst2019231_.png")
+        # Inserting the granules in parallel gives the same image as inserting them one at a time
+        self.compare_img = os.path.join(testdata_path, "test_comp8.png")
+            
+        # generate MRF, with the data file cleaned after the parallel insert since it's larger than mrf_maxsize
+        run_command("mrfgen -c " + test_config, show_output=DEBUG)
+           
+    def test_generate_parallel_insert(self):
+        # Check MRF generation succeeded
+        self.assertTrue(os.path.isfile(self.output_mrf), "MRF generation failed")
+        self.assertTrue(os.path.isfile(self.output_ppg), "MRF PPG generation failed")
+        self.assertTrue(os.path.isfile(self.output_idx), "MRF IDX generation failed")
+        
+        # Convert and compare MRF
+        mrf = gdal.Open(self.output_mrf)
+        driver = gdal.GetDriverByName("PNG")       
+        img = driver.CreateCopy(self.output_img, mrf, 0 )
+        self.assertEqual(img.RasterXSize, 2048, "Size does not match")
+        self.assertEqual(img.RasterYSize, 1024, "Size does not match")
+        
+        if DEBUG:
+            print("Comparing: " + self.output_img + " to " + self.compare_img)
+        self.assertTrue(filecmp.cmp(self.output_img, self.compare_img), "Output image does not match")
+        
+        img = None
+        mrf = None
+
+    def test_metrics_summary(self):
+        summaries = glob.glob(os.path.join(self.staging_area, "output_dir/*_metrics_summary.json"))
+        self.assertEqual(len(summaries), 1, "Metrics summary not found")
+        with open(summaries[0]) as f:
+            summary = json.load(f)
+        self.assertEqual(summary["stages"]["mrf_insert"]["runs"], 1, "Metrics summary includes other runs")
+        self.assertGreater(summary["stages"]["mrf_insert"]["tiles"], 1, "No tiles recorded for mrf_insert")
+        
+    def tearDown(self):
+        if not SAVE_RESULTS:
+            shutil.rmtree(self.staging_area)
+        else:
+            print("Leaving test results in : " + self.staging_area)
+
+class TestMRFGeneration_incremental_overviews(unittest.TestCase):
+
+    def setUp(self):
+        mrfgen = import_mrfgen()
+        self.mrfgen = mrfgen
+
+        self.staging_area = os.path.join(os.getcwd(), 'mrfgen_test_data')
+        make_dir_tree(self.staging_area)
+        mrfgen.mrf_blocksize = '512'
+        mrfgen.working_dir = self.staging_area + '/'
+        mrfgen.basename = 'incremental'
+        mrfgen.sigevent_url = ''
+
+        # Base level with overviews built by gdaladdo
+        self.full_mrf = os.path.join(self.staging_area, 'full.mrf')
+        self.incremental_mrf = os.path.join(self.staging_area, 'incremental.mrf')
+        rng = np.random.default_rng(0)
+        source = gdal.GetDriverByName('MEM').Create('', 2048, 2048, 1, gdal.GDT_Byte)
+        source.GetRasterBand(1).WriteArray(rng.integers(0, 255, (2048, 2048), dtype=np.uint8))
+        gdal.Translate(self.full_mrf, source, format='MRF', creationOptions=['BLOCKSIZE=512', 'COMPRESS=PNG'])
+        source = None
+        mrfgen.run_gdaladdo('average', self.full_mrf, [2, 4], '')
+        for ext in ('.mrf', '.idx', '.ppg'):
+            shutil.copyfile(self.full_mrf.replace('.mrf', ext), self.incremental_mrf.replace('.mrf', ext))
+
+        # Change one base-level block in both copies
+        for mrf_filename in (self.full_mrf, self.incremental_mrf):
+            mrf = gdal.Open(mrf_filename, gdal.GA_Update)
+            mrf.GetRasterBand(1).WriteArray(rng.integers(0, 255, (512, 512), dtype=np.uint8), 512, 512)
+            mrf = None
+
+    def assert_overviews_equal(self):
+        full = gdal.Open(self.full_mrf)
+        incremental = gdal.Open(self.incremental_mrf)
+        full_band = full.GetRasterBand(1)
+        incremental_band = incremental.GetRasterBand(1)
+        self.assertEqual(incremental_band.GetOverviewCount(), full_band.GetOverviewCount(), "Overview count does not match")
+        for level in range(full_band.GetOverviewCount()):
+            self.assertTrue(np.array_equal(incremental_band.GetOverview(level).ReadAsArray(),
+                                           full_band.GetOverview(level).ReadAsArray()),
+                            "Overview level {0} does not match gdaladdo".format(level + 1))
+        full = None
+        incremental = None
+
+    def test_incremental_overviews(self):
+        self.mrfgen.run_gdaladdo('average', self.full_mrf, [2, 4], '')
+        self.mrfgen.run_incremental_overviews('average', self.incremental_mrf, [2, 4], '', {(1, 1)})
+        self.assert_overviews_equal()
+
+    def test_incremental_overviews_fallback(self):
+        # avg is handled by the MRF driver rather than gdal.RegenerateOverview
+        self.mrfgen.run_gdaladdo('avg', self.full_mrf, [2, 4], '')
+        self.mrfgen.run_incremental_overviews('avg', self.incremental_mrf, [2, 4], '', {(1, 1)})
+        self.assert_overviews_equal()
+
+    def tearDown(self):
+        if not SAVE_RESULTS:
+            shutil.rmtree(self.staging_area)
+        else:
+            print("Leaving test results in : " + self.staging_area)
+
+class TestMRFGeneration_repeated_runs(unittest.TestCase):
+
+    def setUp(self):
+        self.mrfgen = import_mrfgen()
+        testdata_path = os.path.join(os.getcwd(), 'mrfgen_files')
+        self.staging_area = os.path.join(os.getcwd(), 'mrfgen_test_data')
+
+        # Make source image dir
+        make_dir_tree(os.path.join(testdata_path, 'mixed_projections'), ignore_existing=True)
+
+        # Make empty dirs for mrfgen output
+        mrfgen_dirs = ('input_dir', 'output_dir', 'working_dir', 'logfile_dir')
+        [make_dir_tree(os.path.join(self.staging_area, path)) for path in mrfgen_dirs]
+
+        # Copy empty output tile
+        shutil.copytree(os.path.join(testdata_path, 'empty_tiles'), os.path.join(self.staging_area, 'empty_tiles'))
+
+        # A paletted global MRF, then a reprojected non-paletted one from the same process
+        self.runs = [
+            (os.path.join(testdata_path, "mrfgen_test_config1a.xml"),
+             os.path.join(self.staging_area, "output_dir/MYR4ODLOLLDY2014277_.mrf"),
+             os.path.join(testdata_path, "test_comp1.png")),
+            (os.path.join(testdata_path, "mrfgen_test_config8.xml"),
+             os.path.join(self.staging_area, "output_dir/sst2019231_.mrf"),
+             os.path.join(testdata_path, "test_comp8.png")),
+        ]
+
+    def test_repeated_runs(self):
+        for test_config, output_mrf, compare_img in self.runs:
+            self.assertEqual(self.mrfgen.run_mrfgen(test_config), 0, "mrfgen failed for " + test_config)
+            self.assertTrue(os.path.isfile(output_mrf), "MRF generation failed")
+
+            # Convert and compare MRF
+            output_img = output_mrf.replace('.mrf', '.png')
+            mrf = gdal.Open(output_mrf)
+            driver = gdal.GetDriverByName("PNG")
+            img = driver.CreateCopy(output_img, mrf, 0)
+            img = None
+            mrf = None
+
+            if DEBUG:
+                print("Comparing: " + output_img + " to " + compare_img)
+            self.assertTrue(filecmp.cmp(output_img, compare_img), "Output image does not match for " + test_config)
+
+    def tearDown(self):
+        if not SAVE_RESULTS:
+            shutil.rmtree(self.staging_area)
+        else:
+            print("Leaving test results in : " + self.staging_area)
+
 class TestMRFGeneration_antimeridian_crossing(unittest.TestCase):
     
     def setUp(self):
@@ -2400,6 +2586,9 @@ if __name__ == '__main__':
         'mrf_generation_nonpaletted_colormap': TestMRFGeneration_nonpaletted_colormap,
         'email_notification': TestMRFGeneration_email_notification,
         'mixed_projections': TestMRFGeneration_mixed_projections,
+        'parallel_insert': TestMRFGeneration_parallel_insert,
+        'incremental_overviews': TestMRFGeneration_incremental_overviews,
+        'repeated_runs': TestMRFGeneration_repeated_runs,
         'antimeridian_crossing': TestMRFGeneration_antimeridian_crossing,
         'rgba2pal': TestRGBA2Pal,
         'jpng': TestMRFGeneration_jpng,
@@ -30,7 +30,7 @@ import redis
 shutil.copyfile("/home/oe2/onearth/src/modules/time_service/utils/oe_redis_utl.py", os.getcwd() + '/oe_redis_utl.py')
 shutil.copyfile("/home/oe2/onearth/src/modules/time_service/utils/oe_best_redis.py", os.getcwd() + '/oe_best_redis.py')
 
-from oe_best_redis import calculate_layer_best, recalculate_best
+from oe_best_redis import calculate_layer_best, calculate_layers_best, recalculate_best
 from oe_redis_utl import create_redis_client
 
 def redis_running():
@@ -195,6 +195,44 @@ class TestOEBestRedis(unittest.TestCase):
         self.assertTrue(self.redis_client.zscore(f"test:{best_layer}:dates", date1) == 0)
         self.assertTrue(self.redis_client.zscore(f"test:{best_layer}:dates", date2) == 0)
 
+    def test_calculate_layers_best(self):
+        """
+        Test calculate_layers_best with multiple source layers and dates
+        """
+        layer_key1 = "test:source_layer1"
+        layer_key2 = "test:source_layer2"
+        layer_key3 = "test:source_layer3"
+        best_layer = "best_layer"
+
+        # source_layer3 points to the best layer, but isn't part of its best_config
+        for layer_key in (layer_key1, layer_key2, layer_key3):
+            self.redis_client.set(f"{layer_key}:best_layer", best_layer)
+        self.redis_client.zadd(f"test:{best_layer}:best_config", {
+            "source_layer1": 1,  # Higher priority
+            "source_layer2": 0   # Lower priority
+        })
+
+        date1 = "2024-01-01T00:00:00"
+        date2 = "2024-01-02T00:00:00"
+        date3 = "2024-01-03T00:00:00"
+        layer_dates = {layer_key1: [date1], layer_key2: [date1, date2], layer_key3: [date3]}
+        for layer_key, dates in layer_dates.items():
+            self.redis_client.zadd(f"{layer_key}:dates", {date: 0 for date in dates})
+        self.redis_client.hset(f"test:{best_layer}:best", date3 + 'Z', 'source_layer2')
+
+        # Run the function
+        best_keys = calculate_layers_best(self.redis_client, layer_dates)
+        self.assertEqual(best_keys, [f"test:{best_layer}"])
+
+        # Verify results - should match calculating the best layer one date at a time
+        best_value = self.redis_client.hget(f"test:{best_layer}:best", date1 + 'Z')
+        self.assertEqual(best_value.decode('utf-8'), "source_layer1")
+        best_value = self.redis_client.hget(f"test:{best_layer}:best", date2 + 'Z')
+        self.assertEqual(best_value.decode('utf-8'), "source_layer2")
+        self.assertFalse(self.redis_client.hexists(f"test:{best_layer}:best", date3 + 'Z'))
+        self.assertEqual(self.redis_client.zrange(f"test:{best_layer}:dates", 0, -1),
+                         [date1.encode('utf-8'), date2.encode('utf-8')])
+
 
 if __name__ == '__main__':
     # Parse options before running tests
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# Tests for oe_mrf.py
+#
+
+import os
+import sys
+import unittest
+import xmlrunner
+from optparse import OptionParser
+import shutil
+import struct
+import tempfile
+import numpy as np
+
+# Copy required files to test directory
+shutil.copyfile("/home/oe2/onearth/src/scripts/oe_mrf.py", os.getcwd() + '/oe_mrf.py')
+
+from oe_mrf import MRFIndex, append_index, compact_index, compact_mrf, finish_compaction, level_layout, read_index, write_index
+
+MRF_HEADER = """<MRF_META>
+  <Raster>
+    <Size x="2048" y="1024" c="1" />
+    <PageSize x="512" y="512" c="1" />
+    <Compression>PNG</Compression>
+  </Raster>
+  <Rsets model="uniform" scale="2" />
+</MRF_META>
+"""
+
+
+class TestOEMrf(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.mrf_path = os.path.join(self.test_dir, 'test.mrf')
+        self.idx_path = os.path.join(self.test_dir, 'test.idx')
+        with open(self.mrf_path, 'w') as f:
+            f.write(MRF_HEADER)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_level_layout(self):
+        self.assertEqual(level_layout(2048, 1024), [(0, 4, 2), (8, 2, 1), (10, 1, 1)])
+        self.assertEqual(level_layout(2048, 1024, size_z=2), [(0, 4, 2), (16, 2, 1), (20, 1, 1)])
+        self.assertEqual(level_layout(1000, 500, 256, 256), [(0, 4, 2), (8, 2, 1), (10, 1, 1)])
+
+    def test_read_tiles(self):
+        # Write the index the same way as the existing tools, one struct at a time
+        with open(self.idx_path, 'wb') as f:
+            for tile in range(11):
+                f.write(struct.pack('!QQ', tile * 100, tile % 3))
+
+        with MRFIndex.from_mrf(self.mrf_path) as index:
+            self.assertEqual(len(index), 11)
+            self.assertEqual(index.get_tile(0, 0, 0), (0, 0))
+            self.assertEqual(index.get_tile(0, 1, 2), (600, 0))
+            self.assertEqual(index.get_tile(1, 0, 1), (900, 0))
+            self.assertEqual(index.get_tile(2, 0, 0), (1000, 1))
+            self.assertEqual(index.level_entries(0).shape, (2, 4))
+            self.assertEqual(list(index.level_entries(1)['size'][0]), [2, 0])
+            with self.assertRaises(IndexError):
+                index.get_tile(1, 1, 0)
+
+    def test_append_index(self):
+        with open(self.idx_path, 'wb') as f:
+            self.assertEqual(append_index(f, [0, 10, 0], [10, 5, 0]), 3)
+            self.assertEqual(append_index(f, np.array([15]), np.array([7])), 1)
+        with open(self.idx_path, 'rb') as f:
+            self.assertEqual(f.read(), b''.join(struct.pack('!QQ', offset, size) for offset, size in
+                                                [(0, 10), (10, 5), (0, 0), (15, 7)]))
+
+        # Writes through a writable map go to the file
+        entries = read_index(self.idx_path, writable=True)
+        entries[2] = (22, 3)
+        entries.flush()
+        del entries
+        self.assertEqual(read_index(self.idx_path)[2].tolist(), (22, 3))
+
+    def test_compact_index(self):
+        # Tiles 1 and 4 share data, tile 3 overlaps the end of tile 2, and there are gaps of dead data
+        entries = np.zeros(6, dtype=[('offset', '>i8'), ('size', '>i8')])
+        entries[0] = (500, 0)
+        entries[1] = (100, 50)
+        entries[2] = (300, 40)
+        entries[3] = (320, 40)
+        entries[4] = (100, 50)
+        entries[5] = (200, 10)
+        new_entries, spans = compact_index(entries, start_offset=8)
+
+        self.assertEqual(spans.tolist(), [[100, 50], [200, 10], [300, 60]])
+        self.assertEqual(new_entries.tolist(), [(500, 0), (8, 50), (68, 40), (88, 40), (8, 50), (58, 10)])
+
+        write_index(self.idx_path, new_entries)
+        self.assertEqual(read_index(self.idx_path).tolist(), new_entries.tolist())
+
+    def make_fragmented_mrf(self):
+        # Tile data interleaved with dead data that is no longer referenced by the index
+        tiles = [b'tile0' * 3, b'tile1', b'', b'tile3' * 5]
+        data_path = os.path.join(self.test_dir, 'test.ppg')
+        offsets = []
+        with open(data_path, 'wb') as f:
+            for tile in tiles:
+                f.write(b'x' * 7)
+                offsets.append(f.tell() if tile else 0)
+                f.write(tile)
+        with open(self.idx_path, 'wb') as f:
+            append_index(f, offsets, [len(tile) for tile in tiles])
+        return data_path, tiles
+
+    def check_compacted_mrf(self, data_path, tiles, sizes):
+        self.assertEqual(sizes, (7 * 4 + 45, 45))
+        self.assertEqual(os.path.getsize(data_path), 45)
+        with open(data_path, 'rb') as f:
+            data = f.read()
+        for (offset, size), tile in zip(read_index(self.idx_path).tolist(), tiles):
+            self.assertEqual(data[offset:offset + size], tile)
+
+    def test_compact_mrf(self):
+        data_path, tiles = self.make_fragmented_mrf()
+        self.check_compacted_mrf(data_path, tiles, compact_mrf(data_path, self.idx_path))
+        self.assertFalse(os.path.exists(os.path.join(self.test_dir, 'test.tmp.ppg')))
+        # Compacting again does nothing
+        self.assertEqual(compact_mrf(data_path, self.idx_path), (45, 45))
+
+    def test_compact_mrf_in_place(self):
+        data_path, tiles = self.make_fragmented_mrf()
+        self.check_compacted_mrf(data_path, tiles, compact_mrf(data_path, self.idx_path, in_place=True))
+        self.assertFalse(os.path.exists(os.path.join(self.test_dir, 'test.tmp.idx')))
+
+    def test_finish_compaction(self):
+        data_path, tiles = self.make_fragmented_mrf()
+        with open(data_path, 'rb') as f:
+            data = f.read()
+        new_entries, spans = compact_index(np.array(read_index(self.idx_path)))
+        tmp_data_path = os.path.join(self.test_dir, 'test.tmp.ppg')
+        with open(tmp_data_path, 'wb') as f:
+            for offset, size in spans.tolist():
+                f.write(data[offset:offset + size])
+
+        # Interrupted before the index was replaced
+        write_index(os.path.join(self.test_dir, 'test.tmp.idx'), new_entries)
+        self.assertTrue(finish_compaction(data_path))
+        self.assertFalse(os.path.exists(tmp_data_path))
+        self.assertEqual(os.path.getsize(data_path), len(data))
+
+        # Interrupted after the index was replaced
+        with open(tmp_data_path, 'wb') as f:
+            for offset, size in spans.tolist():
+                f.write(data[offset:offset + size])
+        write_index(self.idx_path, new_entries)
+        self.assertTrue(finish_compaction(data_path))
+        self.assertFalse(os.path.exists(tmp_data_path))
+        self.check_compacted_mrf(data_path, tiles, (len(data), 45))
+        self.assertFalse(finish_compaction(data_path))
+
+
+if __name__ == '__main__':
+    # Parse options before running tests
+    parser = OptionParser()
+    parser.add_option('-o', '--output', action='store', type='string', dest='outfile',
+                      default='test_results.xml',
+                      help='Specify XML output file (default: test_results.xml)')
+    parser.add_option(
+        '-d',
+        '--debug',
+        action='store_true',
+        dest='debug',
+        help='Output verbose debugging messages')
+    (options, args) = parser.parse_args()
+
+    DEBUG = options.debug
+
+    # Have to delete the arguments as they confuse unittest
+    del sys.argv[1:]
+
+    with open(options.outfile, 'wb') as f:
+        print('\nStoring test results in "{0}"'.format(options.outfile))
+        unittest.main(testRunner=xmlrunner.XMLTestRunner(output=f))
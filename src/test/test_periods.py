@@ -94,6 +94,25 @@ class TestPeriods(unittest.TestCase):
         ]
         self.assertEqual(find_periods_and_breaks(dates, interval), expected)
 
+    # Test find_periods_and_breaks with month intervals that are clipped to the end of the month
+    def test_find_periods_and_breaks_month_end(self):
+        dates = ["2023-12-31T00:00:00", "2024-01-31T00:00:00", "2024-02-29T00:00:00", "2024-03-29T00:00:00",
+                 "2024-05-29T00:00:00", "2025-05-29T00:00:00"]
+        expected = [
+            {'start': '2023-12-31T00:00:00', 'end': '2024-03-29T00:00:00', 'duration': 'P1M'},
+            {'start': '2024-05-29T00:00:00', 'end': '2024-05-29T00:00:00', 'duration': 'P1M'},
+            {'start': '2025-05-29T00:00:00', 'end': '2025-05-29T00:00:00', 'duration': 'P1M'}
+        ]
+        self.assertEqual(find_periods_and_breaks(dates, rd.relativedelta(months=1)), expected)
+        expected = [
+            {'start': '2023-12-31T00:00:00', 'end': '2023-12-31T00:00:00', 'duration': 'P1Y'},
+            {'start': '2024-01-31T00:00:00', 'end': '2024-01-31T00:00:00', 'duration': 'P1Y'},
+            {'start': '2024-02-29T00:00:00', 'end': '2024-02-29T00:00:00', 'duration': 'P1Y'},
+            {'start': '2024-03-29T00:00:00', 'end': '2024-03-29T00:00:00', 'duration': 'P1Y'},
+            {'start': '2024-05-29T00:00:00', 'end': '2025-05-29T00:00:00', 'duration': 'P1Y'}
+        ]
+        self.assertEqual(find_periods_and_breaks(dates, rd.relativedelta(years=1)), expected)
+
     # --- Tests of calculate_periods_from_config ---
 
     def test_detect_period_from_dates(self):
@@ -346,6 +365,35 @@ class TestPeriods(unittest.TestCase):
         new_period = list(members)[0].decode('utf-8')
         self.assertTrue(new_period.endswith('/PT12H'))
 
+    def test_calculate_layer_periods_incremental(self):
+        # Test that adding dates one at a time incrementally gives the same periods as a full recalculation
+        dates = {"2024-01-01": 0,
+                 "2024-01-02": 0,
+                 "2024-01-03": 0,
+                 "2024-01-05": 0,
+                 "2024-01-06": 0,
+                 "2024-01-10": 0}
+        new_dates = ["2024-01-07", "2024-01-04", "2024-01-12", "2024-01-11", "2024-01-08", "2024-01-20"]
+        expected_periods = [[b'2024-01-01/2024-01-03/P1D', b'2024-01-05/2024-01-07/P1D', b'2024-01-10/2024-01-10/P1D'],
+                            [b'2024-01-01/2024-01-07/P1D', b'2024-01-10/2024-01-10/P1D'],
+                            [b'2024-01-01/2024-01-07/P1D', b'2024-01-10/2024-01-10/P1D', b'2024-01-12/2024-01-12/P1D'],
+                            [b'2024-01-01/2024-01-07/P1D', b'2024-01-10/2024-01-12/P1D'],
+                            [b'2024-01-01/2024-01-08/P1D', b'2024-01-10/2024-01-12/P1D'],
+                            [b'2024-01-01/2024-01-08/P1D', b'2024-01-10/2024-01-12/P1D', b'2024-01-20/2024-01-20/P1D']]
+
+        for layer_key in ("test_layer_incremental", "test_layer_full"):
+            self.redis_client.zadd(layer_key + ":dates", dates)
+            calculate_layer_periods(self.redis_client, layer_key)
+
+        for new_date, expected in zip(new_dates, expected_periods):
+            calculate_layer_periods(self.redis_client, "test_layer_incremental", new_date)
+            calculate_layer_periods(self.redis_client, "test_layer_full", new_date, incremental=False)
+            for layer_key in ("test_layer_incremental", "test_layer_full"):
+                periods = self.redis_client.zrange(layer_key + ":periods", 0, -1)
+                default = self.redis_client.get(layer_key + ":default").decode('utf-8')
+                self.assertEqual(periods, expected, "Returned periods {0} for {1} does not match expected periods {2}".format(periods, layer_key, expected))
+                self.assertEqual(default, expected[-1].decode('utf-8').split('/')[1])
+
     @classmethod
     def tearDownClass(self):
         if not DEBUG:
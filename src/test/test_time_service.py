@@ -26,9 +26,11 @@ import time
 import redis
 import json
 import requests
+import asyncio
+from datetime import datetime
 from oe_test_utils import seed_redis_data, seed_redis_best_data
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'modules', 'time_service'))
-from time_service import OnearthTimeService
+from time_service import OnearthTimeService, CachedPeriods
 
 DEBUG = False
 
@@ -204,6 +206,81 @@ class TestDateService(unittest.TestCase):
                 .format(test_layer[2], test_layer[3], returned_date,
                         test_layer[4]))
 
+    def test_month_snap_long_period(self):
+        test_layers = [
+            # Snap to interval decades after the period start
+            ('test1_month_snap_long_period', '1980-01-15', '1980-01-15/2030-01-15/P1M',
+             '2024-03-20', '2024-03-15T00:00:00Z'),
+            # Requested date is earlier in the month than the interval date
+            ('test2_month_snap_long_period', '1980-01-15', '1980-01-15/2030-01-15/P3M',
+             '2024-04-10', '2024-01-15T00:00:00Z'),
+            # Snap to interval of a multi-year period
+            ('test3_month_snap_long_period', '1900-07-01', '1900-07-01/2100-07-01/P2Y',
+             '2025-06-30', '2024-07-01T00:00:00Z'),
+            # Snap to the last interval of the period
+            ('test4_month_snap_long_period', '1980-01-01', '1980-01-01/2000-01-01/P1Y',
+             '2000-06-01', '2000-01-01T00:00:00Z'),
+            # Period ends before the interval containing the requested date
+            ('test5_month_snap_long_period', '1980-01-01', '1980-01-01/1999-06-01/P1Y',
+             '2000-06-01', 'Date out of range'),
+        ]
+
+        seed_redis_data(test_layers)
+
+        # Test data
+        for test_layer in test_layers:
+            query_string = 'layer={0}&datetime={1}'.format(test_layer[0], test_layer[3])
+            response_body, headers, status_code = self.handler(query_string, {}, {})
+            res = json.loads(response_body)
+            returned_date = res.get('date', res.get('err_msg'))
+            if not DEBUG:
+                remove_redis_layer(test_layer)
+            self.assertEqual(
+                returned_date, test_layer[4],
+                'Error with date snapping: for period {0}, date {1} was requested and date {2} was returned. Should be {3}'
+                .format(test_layer[2], test_layer[3], returned_date,
+                        test_layer[4]))
+
+    def test_month_end_snap(self):
+        test_layers = [
+            # Requested month doesn't have the start day, long after the end of the period
+            ('test1_month_end_snap', '1997-04-29', '1997-04-29/1997-06-29/P1M',
+             '2022-02-05', 'Date out of range'),
+            # Requested date is after the end of the period, but before the next interval
+            ('test2_month_end_snap', '1997-04-29', '1997-04-29/1997-06-29/P1M',
+             '1997-07-05', '1997-06-29T00:00:00Z'),
+            # Intervals in shorter months fall on the last day of the month
+            ('test3_month_end_snap', '2000-01-31', '2000-01-31/2000-12-31/P2M',
+             '2000-10-15', '2000-09-30T00:00:00Z'),
+            # The day of the month is kept after a shorter month
+            ('test4_month_end_snap', '2000-01-31', '2000-01-31/2000-12-31/P2M',
+             '2000-12-01', '2000-11-30T00:00:00Z'),
+            # Next interval (2001-01-31) is after the end of the period
+            ('test5_month_end_snap', '2000-01-31', '2000-01-31/2000-12-31/P2M',
+             '2001-02-05', 'Date out of range'),
+            # Durations with a zero time part
+            ('test6_month_end_snap', '2000-01-31', '2000-01-31/2000-12-31/P1MT0S',
+             '2000-03-10', '2000-02-29T00:00:00Z'),
+            ('test7_month_end_snap', '2000-01-31', '2000-01-31/2000-12-31/P1MT0S',
+             '2000-03-31', '2000-03-31T00:00:00Z'),
+        ]
+
+        seed_redis_data(test_layers)
+
+        # Test data
+        for test_layer in test_layers:
+            query_string = 'layer={0}&datetime={1}'.format(test_layer[0], test_layer[3])
+            response_body, headers, status_code = self.handler(query_string, {}, {})
+            res = json.loads(response_body)
+            returned_date = res.get('date', res.get('err_msg'))
+            if not DEBUG:
+                remove_redis_layer(test_layer)
+            self.assertEqual(
+                returned_date, test_layer[4],
+                'Error with date snapping: for period {0}, date {1} was requested and date {2} was returned. Should be {3}'
+                .format(test_layer[2], test_layer[3], returned_date,
+                        test_layer[4]))
+
     def test_hour_snap(self):
         test_layers = [
             # Snap to beginning
@@ -1189,6 +1266,56 @@ class TestDateService(unittest.TestCase):
                 'Error: the returned value for \'default\' for layer {0} was {1} when it should have been {2}.'.format(test_layer[0], res[test_layer[0]]['default'], test_layer[3])
             )
 
+    def test_all_layers_aggregate(self):
+        # Tests that the full listing is served from the precomputed layers:all key when all_layers_ttl is set
+        test_layers = [('test1_all_layers_aggregate', '2012-01-01',
+                        '2012-01-01/2016-01-01/P1Y'),
+                       ('test2_all_layers_aggregate', '2015-02-01',
+                        ['2012-01-01/2013-01-01/P1M', '2015-01-01/2015-02-01/P1D'])]
+        seed_redis_data(test_layers, db_keys=['aggregate_test'])
+        r = redis.StrictRedis(host='localhost', port=6379, db=0)
+        r.delete('aggregate_test:layers:all')
+
+        handler = OnearthTimeService().time_service(
+            {"handler_type": "redis", "host": "127.0.0.1", "all_layers_ttl": 60},
+            {"filename_format": "basic"}
+        )
+        res = json.loads(handler('key0=aggregate_test', {}, {})[0])
+        self.assertTrue(r.exists('aggregate_test:layers:all'), 'layers:all key was not created')
+
+        # Layers added after the aggregate is built aren't listed until the generation counter changes
+        seed_redis_data([('test3_all_layers_aggregate', '2012-01-01', '2012-01-01/2016-01-01/P1Y')],
+                        db_keys=['aggregate_test'])
+        cached_res = json.loads(handler('key0=aggregate_test', {}, {})[0])
+        range_res = json.loads(handler('key0=aggregate_test&periods_start=2015-01-15', {}, {})[0])
+
+        # While another request holds the lock, the current aggregate is still served
+        r.incr('aggregate_test:layers:all:generation')
+        lock = r.lock('aggregate_test:layers:all:lock', timeout=60)
+        lock.acquire()
+        locked_res = json.loads(handler('key0=aggregate_test', {}, {})[0])
+        lock.release()
+        updated_res = json.loads(handler('key0=aggregate_test', {}, {})[0])
+        async_handler = OnearthTimeService().async_time_service(
+            {"handler_type": "redis", "host": "127.0.0.1", "all_layers_ttl": 60},
+            {"filename_format": "basic"}
+        )
+        r.incr('aggregate_test:layers:all:generation')
+        async_res = json.loads(asyncio.run(async_handler('key0=aggregate_test', {}, {}))[0])
+        r.delete('aggregate_test:layers:all', 'aggregate_test:layers:all:generation')
+        if not DEBUG:
+            for layer in test_layers + [('test3_all_layers_aggregate',)]:
+                remove_redis_layer(layer, db_keys=['aggregate_test'])
+
+        self.assertEqual(res, cached_res)
+        self.assertEqual(res, locked_res)
+        self.assertEqual(sorted(updated_res.keys()), [layer[0] for layer in test_layers] + ['test3_all_layers_aggregate'])
+        self.assertEqual(async_res, updated_res)
+        self.assertEqual(sorted(res.keys()), [layer[0] for layer in test_layers])
+        self.assertEqual(res['test2_all_layers_aggregate']['periods'], test_layers[1][2])
+        self.assertEqual(res['test2_all_layers_aggregate']['default'], '2015-02-01')
+        self.assertEqual(range_res['test2_all_layers_aggregate']['periods'], ['2015-01-15/2015-02-01/P1D'])
+
     def test_periods_begin_limit_all_layers(self):
         # Test data
         layer_1_periods = ['2023-02-05/2023-02-09/P2D',
@@ -1536,6 +1663,255 @@ class TestDateService(unittest.TestCase):
                 .format(test_layer[0], test_layer[2], test_layer[3], result,
                         test_layer[4]))
 
+    def test_layer_period_cache(self):
+        # Tests that cached layers are served until their :generation counter changes
+        test_layer = ('test_layer_period_cache', '2012-01-01',
+                      '2012-01-01/2016-01-01/P1Y', '2017-06-06')
+        seed_redis_data([test_layer])
+        r = redis.StrictRedis(host='localhost', port=6379, db=0)
+        r.set('layer:{0}:generation'.format(test_layer[0]), 1)
+
+        handler = OnearthTimeService().time_service(
+            {"handler_type": "redis", "host": "127.0.0.1", "cache_ttl": 0.5},
+            {"filename_format": "basic"}
+        )
+        query_string = 'layer={0}&datetime={1}'.format(test_layer[0], test_layer[3])
+        res = json.loads(handler(query_string, {}, {})[0])
+        self.assertEqual(res.get('err_msg'), 'Date out of range')
+
+        # Changes made without bumping the generation aren't seen, even after the TTL expires
+        r.zadd('layer:{0}:periods'.format(test_layer[0]), {'2012-01-01/2018-01-01/P1Y': 0})
+        time.sleep(0.6)
+        res = json.loads(handler(query_string, {}, {})[0])
+        self.assertEqual(res.get('err_msg'), 'Date out of range')
+
+        # Bumping the generation reloads the layer once the TTL expires
+        r.incr('layer:{0}:generation'.format(test_layer[0]))
+        res = json.loads(handler(query_string, {}, {})[0])
+        self.assertEqual(res.get('err_msg'), 'Date out of range')
+        time.sleep(0.6)
+        res = json.loads(handler(query_string, {}, {})[0])
+        r.delete('layer:{0}:generation'.format(test_layer[0]))
+        if not DEBUG:
+            remove_redis_layer(test_layer)
+        self.assertEqual(res.get('date'), '2017-01-01T00:00:00Z')
+
+    def test_best_layer_cache(self):
+        # Tests that cached best layers are bounded by cache_max_best_dates, least recently used first out
+        test_layer = ('test_best_layer_cache', '2012-01-01',
+                      '2012-01-01/2016-01-01/P1Y', '2013-06-06')
+        seed_redis_data([test_layer])
+        r = redis.StrictRedis(host='localhost', port=6379, db=0)
+        best_key = 'layer:{0}:best'.format(test_layer[0])
+        r.hset(best_key, '2013-01-01T00:00:00Z', 'best_v1')
+        r.hset(best_key, '2014-01-01T00:00:00Z', 'best_2014')
+
+        handler = OnearthTimeService().time_service(
+            {"handler_type": "redis", "host": "127.0.0.1", "cache_ttl": 60, "cache_max_best_dates": 1},
+            {"filename_format": "basic"}
+        )
+        prefixes = []
+        for request_date, best_layer_name in [('2013-06-06', None), ('2013-06-06', 'best_v2'),
+                                              ('2014-06-06', None), ('2013-06-06', None)]:
+            if best_layer_name:
+                r.hset(best_key, '2013-01-01T00:00:00Z', best_layer_name)
+            query_string = 'layer={0}&datetime={1}'.format(test_layer[0], request_date)
+            prefixes.append(json.loads(handler(query_string, {}, {})[0]).get('prefix'))
+        r.delete(best_key)
+        if not DEBUG:
+            remove_redis_layer(test_layer)
+        # The second request is served from the cache, and the last one is read again after being evicted
+        self.assertEqual(prefixes, ['best_v1', 'best_v1', 'best_2014', 'best_v2'])
+
+    def test_snap_script(self):
+        # Tests that snapping with the server-side snap script matches snapping in Python
+        test_layers = [('test1_snap_script', '2012-01-01', '2012-01-01/2016-01-01/P1Y', '2013-06-06'),
+                       ('test2_snap_script', '2012-01-01', '2012-01-01/2016-01-01/P7D', '2012-02-02'),
+                       ('test3_snap_script', '2012-01-01', '2012-01-15/2016-01-15/P2M', '2014-01-10'),
+                       ('test4_snap_script', '2012-01-01T00:00:00',
+                        '2012-01-01T00:00:00Z/2012-01-02T00:00:00Z/PT10M', '2012-01-01T13:37:01Z'),
+                       ('test5_snap_script', '2012-01-01', '2012-01-01/2016-01-01/P1Y', '2017-06-06'),
+                       ('test6_snap_script', '2012-01-01', '2012-01-01/2016-01-01/P1Y', '2011-06-06'),
+                       ('test7_snap_script', '2012-01-01', '2012-01-01/2016-01-01/P1DT2S', '2012-01-05'),
+                       ('test8_snap_script', '2012-01-01', '2012-01-01/2016-01-01/P1Y', '2013-01-01'),
+                       ('test9_snap_script', '1997-04-29', '1997-04-29/1997-06-29/P1M', '2022-02-05'),
+                       ('test10_snap_script', '2000-01-31', '2000-01-31/2000-12-31/P2M', '2000-10-15')]
+        seed_redis_data(test_layers)
+        seed_redis_best_data([test_layers[7] + ('2013-01-01T00:00:00Z',)], 'test8_snap_script_best')
+
+        snap_script_handler = OnearthTimeService().time_service(
+            {"handler_type": "redis", "host": "127.0.0.1", "snap_script": True},
+            {"filename_format": "basic"}
+        )
+        for test_layer in test_layers + [('test_snap_script_missing_layer', None, None, '2012-01-01')]:
+            query_string = 'layer={0}&datetime={1}'.format(test_layer[0], test_layer[3])
+            expected = json.loads(self.handler(query_string, {}, {})[0])
+            res = json.loads(snap_script_handler(query_string, {}, {})[0])
+            self.assertEqual(
+                res, expected,
+                'Snap script returned {0} for {1}, expected {2}'.format(res, query_string, expected))
+        r = redis.StrictRedis(host='localhost', port=6379, db=0)
+        r.delete('layer:test8_snap_script:best')
+        if not DEBUG:
+            for test_layer in test_layers:
+                remove_redis_layer(test_layer)
+
+    def test_async_time_service(self):
+        # Tests that the asyncio handler and ASGI application return the same responses as the synchronous handler
+        test_layers = [('test1_async', '2012-01-01', '2012-01-01/2016-01-01/P1Y', '2013-06-06'),
+                       ('test2_async', '2012-01-01', '2012-01-01/2016-01-01/P7D', '2012-02-02'),
+                       ('test3_async', '2012-01-01', '2012-01-01/2016-01-01/P1Y', '2017-06-06')]
+        seed_redis_data(test_layers)
+        seed_redis_data(test_layers, db_keys=['epsg4326', 'best'])
+
+        query_strings = ['layer=test1_async&datetime=2013-06-06',
+                         'layer=test2_async&datetime=2012-02-02',
+                         'layer=test3_async&datetime=2017-06-06',
+                         'layer=test1_async&datetime=default',
+                         'layer=test2_async&periods_start=2012-02-01&periods_end=2012-03-01&limit=2&skip=1',
+                         'layer=test2_async&key1=epsg4326&key2=best&datetime=2012-02-02',
+                         'layer=test1_async&datetime=2013-13-06',
+                         'layer=test_async_missing_layer&datetime=2012-01-01',
+                         'layer=test1_async&limit=one',
+                         'key1=epsg4326&key2=best']
+
+        async def run_requests(layer_handler_options):
+            async_handler = OnearthTimeService().async_time_service(layer_handler_options, {"filename_format": "basic"})
+            return await asyncio.gather(*[async_handler(query_string, {}, {}) for query_string in query_strings])
+
+        # With and without the layer period cache
+        for layer_handler_options in [{"handler_type": "redis", "host": "127.0.0.1"},
+                                      {"handler_type": "redis", "host": "127.0.0.1", "cache_ttl": 60}]:
+            for query_string, res in zip(query_strings, asyncio.run(run_requests(layer_handler_options))):
+                expected = self.handler(query_string, {}, {})
+                self.assertEqual(
+                    json.loads(res[0]), json.loads(expected[0]),
+                    'Async handler returned {0} for {1}, expected {2}'.format(res[0], query_string, expected[0]))
+
+        async def run_asgi_request(query_string):
+            application = OnearthTimeService().asgi_app({"handler_type": "redis", "host": "127.0.0.1"})
+            messages = []
+
+            async def send(message):
+                messages.append(message)
+
+            await application({"type": "http", "query_string": query_string.encode(), "headers": []}, None, send)
+            return messages
+
+        messages = asyncio.run(run_asgi_request(query_strings[0]))
+        self.assertEqual(messages[0]["status"], 200)
+        self.assertIn((b"content-type", b"application/json"), messages[0]["headers"])
+        self.assertEqual(json.loads(messages[1]["body"]), json.loads(self.handler(query_strings[0], {}, {})[0]))
+
+        # Errors are returned without their details, which can include Redis connection information
+        async def failing_handler(query_string, headers, notes):
+            raise redis.exceptions.ConnectionError('Error connecting to redis-internal:6379')
+
+        async def run_failing_asgi_request():
+            time_service = OnearthTimeService()
+            time_service.async_time_service = lambda layer_handler_options, filename_options: failing_handler
+            application = time_service.asgi_app({"handler_type": "redis", "host": "127.0.0.1"})
+            messages = []
+
+            async def send(message):
+                messages.append(message)
+
+            await application({"type": "http", "query_string": query_strings[0].encode(), "headers": []}, None, send)
+            return messages
+
+        messages = asyncio.run(run_failing_asgi_request())
+        self.assertEqual(messages[0]["status"], 500)
+        self.assertEqual(json.loads(messages[1]["body"]), {"err_msg": "Server error"})
+        if not DEBUG:
+            for test_layer in test_layers:
+                remove_redis_layer(test_layer)
+                remove_redis_layer(test_layer, db_keys=['epsg4326', 'best'])
+
+    def test_batch_snap(self):
+        # Tests that a batch request returns the same snap results as individual requests
+        test_layers = [('test1_batch', '2012-01-01', '2012-01-01/2016-01-01/P1Y', '2013-06-06'),
+                       ('test2_batch', '2012-01-01', '2012-01-01/2016-01-01/P7D', '2012-02-02'),
+                       ('test3_batch', '2012-01-01T00:00:00Z',
+                        '2012-01-01T00:00:00Z/2012-01-02T00:00:00Z/PT10M', '2012-01-01T13:37:01Z')]
+        seed_redis_data(test_layers)
+        seed_redis_best_data([test_layers[0] + ('2013-01-01T00:00:00Z',)], 'test1_batch_best')
+
+        batch_requests = [('test1_batch', '2013-06-06'), ('test2_batch', '2012-02-02'),
+                          ('test3_batch', '2012-01-01T13:37:01Z'), ('test1_batch', '2017-06-06'),
+                          ('test1_batch', 'default'), ('test2_batch', '2012-13-01'),
+                          ('test_batch_missing_layer', '2012-01-01')]
+        query_string = 'layers=' + ','.join('{0}:{1}'.format(*batch_request) for batch_request in batch_requests)
+        query_string += ',test2_batch'
+        res = json.loads(self.handler(query_string, {}, {})[0])
+        self.assertEqual(len(res), len(batch_requests) + 1, 'Batch request returned {0} results'.format(len(res)))
+
+        for (layer_name, request_date), result in zip(batch_requests + [('test2_batch', 'default')], res):
+            expected = json.loads(self.handler('layer={0}&datetime={1}'.format(layer_name, request_date), {}, {})[0])
+            expected['layer'] = layer_name
+            self.assertEqual(
+                result, expected,
+                'Batch request returned {0} for {1}:{2}, expected {3}'.format(result, layer_name, request_date, expected))
+
+        async def run_async_batch():
+            async_handler = OnearthTimeService().async_time_service({"handler_type": "redis", "host": "127.0.0.1"},
+                                                                    {"filename_format": "basic"})
+            return await async_handler(query_string, {}, {})
+        self.assertEqual(json.loads(asyncio.run(run_async_batch())[0]), res)
+
+        r = redis.StrictRedis(host='localhost', port=6379, db=0)
+        r.delete('layer:test1_batch:best')
+        if not DEBUG:
+            for test_layer in test_layers:
+                remove_redis_layer(test_layer)
+
+    def test_period_index_snap(self):
+        # Tests snapping against period strings and indexed (cached) periods, including requests before the first
+        # period, after the end of a period, on interval boundaries, and in periods starting at the end of a month
+        time_service = OnearthTimeService()
+        periods = ['2012-01-01/2012-12-31/P1D',
+                   '2013-02-01T00:00:00Z/2013-02-01T12:00:00Z/PT6H',
+                   '2014-01-01/2016-01-01/P2M',
+                   '2018-01-01/2018-01-01/P1D',
+                   '2019-01-31/2019-12-31/P1M']
+        # Requested date, then the expected snap date and period index when snapping to the previous and next intervals
+        test_snaps = [
+            # Before the first period
+            ('2011-06-01', (None, 1), (None, 1)),
+            # Start of a period
+            ('2012-01-01', ('2012-01-01', 0), ('2012-01-01', 0)),
+            ('2012-07-04T12:00:00', ('2012-07-04', 0), ('2012-07-05', 0)),
+            # Between periods
+            ('2013-01-15', (None, 0), (None, 0)),
+            ('2013-02-01T07:00:00', ('2013-02-01T06:00:00', 1), ('2013-02-01T12:00:00', 1)),
+            # Interval at the end of a period
+            ('2013-02-01T12:00:00', ('2013-02-01T12:00:00', 1), ('2013-02-01T12:00:00', 1)),
+            ('2014-06-15', ('2014-05-01', 2), ('2014-07-01', 2)),
+            # Interval boundary, where the next interval is the end of the period
+            ('2015-11-01', ('2015-11-01', 2), ('2016-01-01', 2)),
+            ('2016-01-01', ('2016-01-01', 2), (None, 2)),
+            # After the end of a period, but before its next interval
+            ('2016-01-20', ('2016-01-01', 2), (None, 2)),
+            # After the next interval
+            ('2016-03-01', (None, 2), (None, 2)),
+            ('2018-01-01', ('2018-01-01', 3), ('2018-01-01', 3)),
+            ('2019-01-15', (None, 3), (None, 3)),
+            # Intervals of a period starting at the end of the month fall on the last day of shorter months
+            ('2019-02-15', ('2019-01-31', 4), ('2019-02-28', 4)),
+            ('2019-03-15', ('2019-02-28', 4), ('2019-03-31', 4)),
+            ('2019-12-31', ('2019-12-31', 4), (None, 4)),
+            ('2020-02-05', (None, 4), (None, 4)),
+        ]
+        for request_date, previous_snap, next_snap in test_snaps:
+            req_date = datetime.fromisoformat(request_date)
+            for snap_to_previous, (snap_date, snap_period_idx) in ((True, previous_snap), (False, next_snap)):
+                expected = (datetime.fromisoformat(snap_date) if snap_date else None, snap_period_idx)
+                for snap_periods in (periods, CachedPeriods(periods)):
+                    res = time_service.time_snap(req_date, snap_periods, snap_to_previous)
+                    self.assertEqual(
+                        res, expected,
+                        'Snap for {0} (snap_to_previous={1}, {2}) returned {3}, expected {4}'
+                        .format(request_date, snap_to_previous, type(snap_periods).__name__, res, expected))
+
 if __name__ == '__main__':
     # Parse options before running tests
     parser = OptionParser()
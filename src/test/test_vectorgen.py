@@ -48,6 +48,7 @@ import fiona.crs
 import xmlrunner
 import xml.dom.minidom
 import shutil
+import random
 from optparse import OptionParser
 import mapbox_vector_tile
 # from osgeo import osr
@@ -83,6 +84,7 @@ class TestVectorgen(unittest.TestCase):
         self.mrf_clust_reduce_rate_test_config = os.path.join(self.test_data_path, 'vectorgen_test_create_mvt_mrf_clust_reduce_rate.xml')
         self.mrf_feature_filters_test_config = os.path.join(self.test_data_path, 'vectorgen_test_create_mvt_mrf_feature_filters.xml')
         self.mrf_overview_filters_test_config = os.path.join(self.test_data_path, 'vectorgen_test_create_mvt_mrf_overview_filters.xml')
+        self.mrf_dedupe_tiles_test_config = os.path.join(self.test_data_path, 'vectorgen_test_create_mvt_mrf_dedupe_tiles.xml')
         self.shapefile_test_config = os.path.join(self.test_data_path, 'vectorgen_test_create_shapefile.xml')
         self.shapefile_polygons_test_config = os.path.join(self.test_data_path, 'vectorgen_test_create_shapefile_polygons.xml')
         self.shapefile_diff_proj_test_config = os.path.join(self.test_data_path, 'vectorgen_test_create_shapefile_diff_proj.xml')
@@ -676,6 +678,59 @@ class TestVectorgen(unittest.TestCase):
                     else:
                         self.assertTrue(feature['properties']['type'] == "MGRS", "Overview filter failed to filter features. Zoom {0} contains a feature of type {1}, which isn't 'MGRS'.".format(zoom_level, feature['type']))
             
+    # Tests that tiles with identical content are stored once when dedupe_tiles is set, and that tiles without
+    # features are left empty in the index. The input polygon covers the western hemisphere, so the base level
+    # tiles inside it are all the same, and the tiles of the eastern hemisphere are empty.
+    def test_MVT_MRF_generation_dedupe_tiles(self):
+        # Process config file
+        test_artifact_path = os.path.join(self.main_artifact_path, 'mvt_mrf_dedupe_tiles')
+        config = self.parse_vector_config(self.mrf_dedupe_tiles_test_config, test_artifact_path)
+
+        # Run vectorgen
+        prevdir = os.getcwd()
+        os.chdir(test_artifact_path)
+        cmd = 'oe_vectorgen -c ' + self.mrf_dedupe_tiles_test_config
+        run_command(cmd, ignore_warnings=True)
+        os.chdir(prevdir)
+
+        # Read the index entries of the 10x5 base level, which comes first in the index
+        with open(os.path.join(config['output_dir'], config['prefix'] + '.idx'), 'rb') as idx:
+            entries = [struct.unpack('>qq', idx.read(16)) for _ in range(10 * 5)]
+        pvt_size = os.path.getsize(os.path.join(config['output_dir'], config['prefix'] + '.pvt'))
+
+        # Tiles that don't touch the edges of the polygon or the tile matrix have the same content
+        interior_entries = set(entries[y * 10 + x] for x in range(1, 4) for y in range(1, 4))
+        self.assertEqual(len(interior_entries), 1, "Identical tiles don't share the same data: {0}".format(interior_entries))
+        offset, size = interior_entries.pop()
+        self.assertTrue(size > 0, "Tiles inside the polygon are empty")
+        self.assertTrue(offset + size <= pvt_size, "Index entry points past the end of the data file")
+
+        # Tiles in the eastern hemisphere (past the buffer of the polygon edge) have no features
+        for y in range(5):
+            for x in range(6, 10):
+                self.assertEqual(entries[y * 10 + x], (0, 0), "Tile {0},{1} without features isn't empty".format(x, y))
+
+    # Tests that cluster reduction thins out points within a pixel of each other, keeps isolated points, and picks
+    # the same points to drop when given the same seed.
+    def test_cluster_reduce(self):
+        # Copy required files to test directory
+        shutil.copyfile("/home/oe2/onearth/src/vectorgen/oe_create_mvt_mrf.py", os.path.join(os.getcwd(), 'oe_create_mvt_mrf.py'))
+        shutil.copyfile("/home/oe2/onearth/src/scripts/oe_utils.py", os.path.join(os.getcwd(), 'oe_utils.py'))
+        shutil.copyfile("/home/oe2/onearth/src/scripts/oe_mrf.py", os.path.join(os.getcwd(), 'oe_mrf.py'))
+        from oe_create_mvt_mrf import cluster_reduce
+
+        # 20 points within a pixel of each other, and two points far away from everything
+        clustered = [(point_id, (0.01 * point_id, 0.0, 0.01 * point_id, 0.0)) for point_id in range(20)]
+        isolated = [(100, (100.0, 100.0, 100.0, 100.0)), (101, (-100.0, 50.0, -100.0, 50.0))]
+        points = clustered + isolated
+
+        deleted = cluster_reduce(points, 1.0, 2, random.Random(1))
+        # The first point visited has the other 19 nearby, which are reduced to floor(sqrt(19)) = 4
+        self.assertEqual(len(deleted), 15, "Expected 15 of the 20 clustered points to be dropped, got {0}".format(len(deleted)))
+        self.assertTrue(set(deleted) <= set(point_id for point_id, _ in clustered), "Isolated points were dropped: {0}".format(deleted))
+
+        self.assertEqual(deleted, cluster_reduce(points, 1.0, 2, random.Random(1)), "Cluster reduction isn't reproducible with the same seed")
+
     # Tests the creation of a shapefile from a single input GeoJSON.
     # Alerts if shapefile has different number of features from the GeoJSON.
     def test_shapefile_generation(self):
@@ -37,20 +37,24 @@ or by using the create_vector_mrf() function in another script.
 
 import os
 import sys
-import struct
 import io
 import gzip
+import hashlib
 import xml.dom.minidom
 import math
 import random
 import fiona
+import numpy as np
+import shapely
 import shapely.geometry
-import rtree
 import mapbox_vector_tile
 from osgeo import osr
 import decimal
 import re
+import multiprocessing
+from contextlib import contextmanager
 from oe_utils import *
+from oe_mrf import append_index
 
 
 # Main tile-creation function.
@@ -72,6 +76,9 @@ def create_vector_mrf(input_file_path,
                       cluster_reduce_rate=2,
                       buffer_size=5,
                       buffer_edges=False,
+                      processes=1,
+                      reduce_seed=None,
+                      dedupe_tiles=False,
                       debug=False):
     """
     Creates a MVT MRF stack using the specified TileMatrixSet.
@@ -102,6 +109,12 @@ def create_vector_mrf(input_file_path,
             Default is 5 (pixel size in map units at each zoom level) which allows enough room for most styling.
         buffer_edges (boolean) -- Flag indicating whether buffering should be performed on the edges of the tile matrix.
             Default is False
+        processes (int) -- Number of worker processes used to encode the rows of tiles in each zoom level.
+            Default is 1 (encode in this process)
+        reduce_seed (int) -- Seed for the random selection of features dropped by feature and cluster reduction, so that runs
+            can be reproduced. Default is None (seeded from the system)
+        dedupe_tiles (boolean) -- Flag indicating whether tiles with identical content should be stored once in the MRF data file,
+            with all of their index entries pointing at it. Default is False
         debug (bool) -- Toggle verbose output messages and MVT file artifacts (MVT tile files will be created in addition to MRF)
     """
     # Get projection and calculate overview levels if necessary
@@ -119,11 +132,15 @@ def create_vector_mrf(input_file_path,
     tile_matrices = get_tms(target_x, target_y, target_extents, tile_size,
                             overview_levels, proj)
 
+    # Features are dropped at random by the point reductions
+    rng = random.Random(reduce_seed)
+
     # Open MRF data and index files and generate the MRF XML
     fidx = open(os.path.join(output_path, mrf_prefix + '.idx'), 'wb+')
     fout = open(os.path.join(output_path, mrf_prefix + '.pvt'), 'wb+')
-    notile = struct.pack('!QQ', 0, 0)
     pvt_offset = 0
+    # Data offsets of the tiles written so far, by digest, when deduping tiles
+    tile_digests = {}
 
     mrf_dom = build_mrf_dom(tile_matrices, target_extents, tile_size, proj)
     with open(os.path.join(output_path, mrf_prefix) + '.mrf', 'w+') as f:
@@ -132,183 +149,91 @@ def create_vector_mrf(input_file_path,
     spatial_dbs = []
     source_schemas = []
 
-    # Dump contents of shapefile into a mutable rtree spatial database for faster searching.
+    # Stream the contents of each shapefile into a feature store with a spatial index for faster searching.
     for input_file in input_file_path:
         log_info_mssg('Processing ' + input_file)
         with fiona.open(input_file) as f:
             try:
-                spatial_db = rtree.index.Index(rtree_index_generator(list(f), feature_filters,
-                                                                     feature_id, create_feature_id))
-            except rtree.core.RTreeError as e:
-                log_info_mssg('ERROR -- problem importing feature data. If you have filters configured, ' \
-                              'the source dataset may have no features that pass. Err: {0}'.format(e))
-                return False
+                spatial_db = FeatureStore(f, feature_filters, feature_id, create_feature_id)
             except ValueError as e:
                 log_info_mssg('ERROR -- problem processing feature data. Err: {0}'.format(e))
                 return False
+            if not spatial_db.count():
+                log_info_mssg('ERROR -- problem importing feature data. If you have filters configured, ' \
+                              'the source dataset may have no features that pass.')
+                return False
 
             spatial_dbs.append(spatial_db)
             source_schema = f.schema['geometry']
             source_schemas.append(source_schema)
             if debug:
-                log_info_mssg('Points to process: ' + str(spatial_db.count(spatial_db.bounds)))
+                log_info_mssg('Points to process: ' + str(spatial_db.count()))
 
 
     # Build tilematrix pyramid from the bottom (highest zoom) up. We generate tiles left-right,
     # top-bottom and write them successively to the MRF.
     for i, tile_matrix in enumerate(reversed(tile_matrices)):
         z = len(tile_matrices) - i - 1
-        z_orig_features = sum([spatial_dbs[idx].count(spatial_dbs[idx].bounds) for idx, spatial_db in enumerate(spatial_dbs)])
+        z_orig_features = sum([spatial_db.count() for spatial_db in spatial_dbs])
 
         for idx, spatial_db in enumerate(spatial_dbs):
             # We do general point rate reduction randomly, deleting those items from the
-            # spatial index. The highest zoom level is never reduced.
+            # feature store. The highest zoom level is never reduced.
             if source_schemas[idx] == 'Point' and feature_reduce_rate and z != len(tile_matrices) - 1:
-                feature_count = spatial_dbs[idx].count(spatial_dbs[idx].bounds)
+                feature_count = spatial_db.count()
                 num_points_to_delete = int(feature_count - math.floor(feature_count / feature_reduce_rate))
                 if debug:
                     print(("Rate reduced " + str(num_points_to_delete) + " features from zoom level"))
-                for feature in random.sample([feature for feature in spatial_dbs[idx].intersection(
-                      spatial_dbs[idx].bounds, objects=True)], num_points_to_delete):
-                    spatial_dbs[idx].delete(feature.id, feature.bbox)
+                spatial_db.delete(rng.sample(spatial_db.ids().tolist(), num_points_to_delete))
 
-            # Here we're culling points that are less than a pixel away from each other. We use a queue to keep track
-            # of them and avoid looking at points twice.
+            # Here we're culling points that are less than a pixel away from each other.
             if source_schemas[idx] == 'Point' and cluster_reduce_rate and z != len(tile_matrices) - 1:
-                feature_queue = [
-                    item for item in spatial_dbs[idx].intersection(
-                        spatial_dbs[idx].bounds, objects=True)
-                ]
-                while feature_queue:
-                    feature = feature_queue.pop()
-                    sub_pixel_bbox = (
-                        feature.bbox[0] - tile_matrix['resolution'],
-                        feature.bbox[1] - tile_matrix['resolution'],
-                        feature.bbox[2] + tile_matrix['resolution'],
-                        feature.bbox[3] + tile_matrix['resolution'])
-                    nearby_points = [
-                        item for item in spatial_dbs[idx].intersection(
-                            sub_pixel_bbox, objects=True)
-                        if item.id != feature.id
-                    ]
-                    if nearby_points:
-                        # We reduce the number of clustered points to 1/nth of their previous number. (user-selectable)
-                        # All the nearby points are then dropped from the queue.
-                        for point in random.sample(
-                                nearby_points,
-                                len(nearby_points) - int(
-                                    math.floor(
-                                        len(nearby_points)**
-                                        (1 / float(cluster_reduce_rate))))):
-                            spatial_dbs[idx].delete(point.id, point.bbox)
-                        for point in nearby_points:
-                            [
-                                feature_queue.remove(item)
-                                for item in feature_queue
-                                if item.id == point.id
-                            ]
+                ids = spatial_db.ids()
+                spatial_db.delete(cluster_reduce(zip(ids.tolist(), spatial_db.bounds[ids].tolist()),
+                                                 tile_matrix['resolution'], cluster_reduce_rate, rng))
 
         # Capture how many features are left after feature and cluster reduction
-        z_rdct_features = sum([spatial_dbs[idx].count(spatial_dbs[idx].bounds) for idx, spatial_db in enumerate(spatial_dbs)])
+        z_rdct_features = sum([spatial_db.count() for spatial_db in spatial_dbs])
 
         # Start making tiles. We figure out the tile's bbox, then search for all the features that intersect with that bbox,
         # then turn the resulting list into an MVT tile and write the tile.
         z_fltr_features = 0
 
-        for y in range(tile_matrix['matrix_height']):
-            for x in range(tile_matrix['matrix_width']):
-                # Get tile bounds
-                tile_size = tile_matrix['tile_size_in_map_units']
-
-                min_x = tile_matrix['matrix_extents'][0] + (x * tile_size)
-                max_y = tile_matrix['matrix_extents'][3] - (y * tile_size)
-                max_x = min_x + tile_size
-                min_y = max_y - tile_size
-                tile_bbox = shapely.geometry.box(min_x, min_y, max_x, max_y)
-
-                # If we're buffering around the edges, then use the same min/max buffer for all dimensions and tiles
-                if buffer_edges:
-                    tile_min_x_buffer = tile_max_x_buffer = tile_min_y_buffer = tile_max_y_buffer = (buffer_size * (tile_size / 256))
-
-                # Else, set the min/max buffer to 0 if we're on an edge
-                else:
-                    tile_min_x_buffer = buffer_size * (tile_size / 256) if x != 0 else 0
-                    tile_max_x_buffer = buffer_size * (tile_size / 256) if x != (tile_matrix['matrix_width'] - 1) else 0
-                    tile_min_y_buffer = buffer_size * (tile_size / 256) if y != 0 else 0
-                    tile_max_y_buffer = buffer_size * (tile_size / 256) if y != (tile_matrix['matrix_height'] - 1) else 0
-
-                tile_buffer_bbox = shapely.geometry.box(
-                    min_x - tile_min_x_buffer, min_y - tile_min_y_buffer,
-                    max_x + tile_max_x_buffer, max_y + tile_max_y_buffer)
-
-                if debug:
-                    print(("Processing tile: {0}/{1}/{2}\r".format(z, x, y)))
-                    print(("Tile Bounds: " + str(tile_bbox.bounds)))
-
-                # Iterate through the feature geometry and grab anything in this tile's bounds
-                tile_features = []
-                for spatial_db in spatial_dbs:
-                    for feature in [item.object for item in spatial_db.intersection(
-                          tile_buffer_bbox.bounds, objects=True)]:
-
-                        geometry = shapely.geometry.shape(feature['geometry'])
-                        # If the feature isn't fully contained in the tile bounds, we need to clip it.
-                        if not shapely.geometry.shape(feature['geometry']).within(tile_buffer_bbox):
-                            geometry = tile_buffer_bbox.intersection(geometry)
-
-                        new_feature = {
-                            'geometry': geometry,
-                            'properties': feature['properties']
-                        }
-                        tile_features.append(new_feature)
-
-                # Filter features based on overview feature filters
-                if str(z) in overview_filters:
-                    before_count = len(tile_features)
-                    filtered_features = [f for f in tile_features if passes_filters(f, overview_filters[str(z)], debug)]
-                    tile_features = filtered_features
-                    after_count = len(tile_features)
-
-                    if debug:
-                        print(("Filtered features in tile from " + str(before_count) + " to " + str(after_count)))
-
-                # Keep a running count of how many features end up in the tiles in this zoom level after overview filtering
-                z_fltr_features += len(tile_features)
-
-                # Create MVT tile from the features in this tile (Only doing single layers for now)
-                new_layer = {'name': layer_name, 'features': tile_features}
-
-                # Encode the MVT
-                mvt_tile = mapbox_vector_tile.encode(
-                    [new_layer],
-                    quantize_bounds=tile_bbox.bounds,
-                    y_coord_down=False)
-
-                # Write out artifact mvt files for debug mode.
-                if debug and mvt_tile:
-                    tiles_dir = os.path.join(os.getcwd(), 'tiles')
-                    if not os.path.exists(tiles_dir):
-                        os.mkdir(tiles_dir)
-
-                    mvt_filename = os.path.join(tiles_dir, 'test_{0}_{1}_{2}.mvt'.format(z, x, y))
-                    with open(mvt_filename, 'wb+') as f:
-                        f.write(mvt_tile)
-
-                # Write out MVT tile data to MRF. Note that we have to gzip the tile first.
-                if mvt_tile:
-                    out = io.BytesIO()
-                    gzip_obj = gzip.GzipFile(fileobj=out, mode='wb')
-                    gzip_obj.write(mvt_tile)
-                    gzip_obj.close()
-                    zipped_tile_data = out.getvalue()
-                    tile_index = struct.pack('!QQ', pvt_offset,
-                                             len(zipped_tile_data))
+        # Index entries for this level, written in one block once the level is done
+        level_offsets = [0] * (tile_matrix['matrix_width'] * tile_matrix['matrix_height'])
+        level_sizes = [0] * len(level_offsets)
+
+        # The spatial indexes are only read from here on, so the row workers forked below inherit this level's
+        # state instead of having it pickled to them.
+        _tile_state.update({'spatial_dbs': spatial_dbs, 'tile_matrix': tile_matrix, 'z': z, 'layer_name': layer_name,
+                            'overview_filters': overview_filters, 'buffer_size': buffer_size,
+                            'buffer_edges': buffer_edges, 'debug': debug})
+        rows = range(tile_matrix['matrix_height'])
+        with tile_row_results(rows, processes) as row_results:
+            # Rows come back in order, so tiles are written to the MRF left-right, top-bottom
+            for y, row in zip(rows, row_results):
+                for x, zipped_tile_data, feature_count in row:
+                    # Keep a running count of how many features end up in the tiles in this zoom level after overview filtering
+                    z_fltr_features += feature_count
+                    if not zipped_tile_data:
+                        continue
+                    tile_number = y * tile_matrix['matrix_width'] + x
+                    level_sizes[tile_number] = len(zipped_tile_data)
+
+                    # Point the index entry at a copy of the same tile that's already been written
+                    if dedupe_tiles:
+                        tile_digest = hashlib.sha256(zipped_tile_data).digest()
+                        if tile_digest in tile_digests:
+                            level_offsets[tile_number] = tile_digests[tile_digest]
+                            continue
+                        tile_digests[tile_digest] = pvt_offset
+
+                    level_offsets[tile_number] = pvt_offset
                     pvt_offset += len(zipped_tile_data)
                     fout.write(zipped_tile_data)
+        _tile_state.clear()
 
-                else:
-                    tile_index = notile
-                fidx.write(tile_index)
+        append_index(fidx, level_offsets, level_sizes)
 
         if debug:
             print(("Z-Level (" + str(z) + ") Tile Filtering - Orig: {0} / Reduced: {1} / Filtered: {2}".
@@ -319,6 +244,189 @@ def create_vector_mrf(input_file_path,
     return True
 
 
+# Read-only state for encoding the tiles of the zoom level currently being built. It's set by create_vector_mrf()
+# before any worker processes are forked.
+_tile_state = {}
+
+
+@contextmanager
+def tile_row_results(rows, processes):
+    """
+    Yields an iterator of encode_tile_row() results for the given rows, in row order.
+
+    Args:
+        rows (range) -- Tile rows to encode.
+        processes (int) -- Number of worker processes. Rows are encoded in this process if it's 1 or there's only one row.
+    """
+    if processes <= 1 or len(rows) <= 1:
+        yield map(encode_tile_row, rows)
+        return
+    pool = multiprocessing.get_context('fork').Pool(min(processes, len(rows)))
+    try:
+        yield pool.imap(encode_tile_row, rows)
+    finally:
+        pool.terminate()
+
+
+def encode_tile_row(y):
+    """
+    Encodes one row of tiles for the zoom level set in _tile_state.
+
+    Args:
+        y (int) -- Row of the tile matrix.
+    Returns:
+        List of (x, gzipped MVT tile data or None, number of features in the tile) tuples.
+    """
+    return [encode_tile(x, y) for x in range(_tile_state['tile_matrix']['matrix_width'])]
+
+
+def encode_tile(x, y):
+    """
+    Clips, filters and encodes the features of one tile. Returns the same tuple as encode_tile_row().
+    """
+    tile_matrix = _tile_state['tile_matrix']
+    spatial_dbs = _tile_state['spatial_dbs']
+    z = _tile_state['z']
+    layer_name = _tile_state['layer_name']
+    overview_filters = _tile_state['overview_filters']
+    buffer_size = _tile_state['buffer_size']
+    buffer_edges = _tile_state['buffer_edges']
+    debug = _tile_state['debug']
+
+    # Get tile bounds
+    tile_size = tile_matrix['tile_size_in_map_units']
+
+    min_x = tile_matrix['matrix_extents'][0] + (x * tile_size)
+    max_y = tile_matrix['matrix_extents'][3] - (y * tile_size)
+    max_x = min_x + tile_size
+    min_y = max_y - tile_size
+    tile_bbox = shapely.geometry.box(min_x, min_y, max_x, max_y)
+
+    # If we're buffering around the edges, then use the same min/max buffer for all dimensions and tiles
+    if buffer_edges:
+        tile_min_x_buffer = tile_max_x_buffer = tile_min_y_buffer = tile_max_y_buffer = (buffer_size * (tile_size / 256))
+
+    # Else, set the min/max buffer to 0 if we're on an edge
+    else:
+        tile_min_x_buffer = buffer_size * (tile_size / 256) if x != 0 else 0
+        tile_max_x_buffer = buffer_size * (tile_size / 256) if x != (tile_matrix['matrix_width'] - 1) else 0
+        tile_min_y_buffer = buffer_size * (tile_size / 256) if y != 0 else 0
+        tile_max_y_buffer = buffer_size * (tile_size / 256) if y != (tile_matrix['matrix_height'] - 1) else 0
+
+    tile_buffer_bbox = shapely.geometry.box(
+        min_x - tile_min_x_buffer, min_y - tile_min_y_buffer,
+        max_x + tile_max_x_buffer, max_y + tile_max_y_buffer)
+
+    if debug:
+        print(("Processing tile: {0}/{1}/{2}\r".format(z, x, y)))
+        print(("Tile Bounds: " + str(tile_bbox.bounds)))
+
+    # Grab the geometry of anything in this tile's bounds
+    tile_features = []
+    for spatial_db in spatial_dbs:
+        ids = spatial_db.query(tile_buffer_bbox.bounds)
+        geometries = spatial_db.geometries[ids]
+
+        # If a feature isn't fully contained in the tile bounds, we need to clip it.
+        clipped = ~shapely.within(geometries, tile_buffer_bbox)
+        geometries[clipped] = shapely.intersection(geometries[clipped], tile_buffer_bbox)
+
+        for feature_idx, geometry in zip(ids.tolist(), geometries):
+            new_feature = {
+                'geometry': geometry,
+                'properties': spatial_db.properties[feature_idx]
+            }
+            tile_features.append(new_feature)
+
+    # Filter features based on overview feature filters
+    if str(z) in overview_filters:
+        before_count = len(tile_features)
+        filtered_features = [f for f in tile_features if passes_filters(f, overview_filters[str(z)], debug)]
+        tile_features = filtered_features
+        after_count = len(tile_features)
+
+        if debug:
+            print(("Filtered features in tile from " + str(before_count) + " to " + str(after_count)))
+
+    # Tiles without any features are left empty in the MRF
+    if not tile_features:
+        return x, None, 0
+
+    # Create MVT tile from the features in this tile (Only doing single layers for now)
+    new_layer = {'name': layer_name, 'features': tile_features}
+
+    # Encode the MVT
+    mvt_tile = mapbox_vector_tile.encode(
+        [new_layer],
+        quantize_bounds=tile_bbox.bounds,
+        y_coord_down=False)
+
+    # Write out artifact mvt files for debug mode.
+    if debug and mvt_tile:
+        tiles_dir = os.path.join(os.getcwd(), 'tiles')
+        os.makedirs(tiles_dir, exist_ok=True)
+
+        mvt_filename = os.path.join(tiles_dir, 'test_{0}_{1}_{2}.mvt'.format(z, x, y))
+        with open(mvt_filename, 'wb+') as f:
+            f.write(mvt_tile)
+
+    # Note that we have to gzip the tile before it goes in the MRF. The timestamp is left out of the gzip header so
+    # tiles with the same content are identical.
+    if not mvt_tile:
+        return x, None, len(tile_features)
+    out = io.BytesIO()
+    gzip_obj = gzip.GzipFile(fileobj=out, mode='wb', mtime=0)
+    gzip_obj.write(mvt_tile)
+    gzip_obj.close()
+    return x, out.getvalue(), len(tile_features)
+
+
+def cluster_reduce(points, resolution, cluster_reduce_rate, rng=random):
+    """
+    Culls points that are within one pixel of each other. Each point is visited in turn, and the points still left
+    within one pixel of it are reduced (by random selection) to the cluster_reduce_rate root of their number. Those
+    nearby points aren't visited themselves.
+
+    Points are bucketed into a grid of pixel-sized cells, so only the neighboring cells need to be searched for
+    each point.
+
+    Args:
+        points (iterable) -- (id, bbox) tuples for the points, where bbox is (min_x, min_y, max_x, max_y)
+        resolution (float) -- Pixel size in map units.
+        cluster_reduce_rate (float) -- Clusters of n points are reduced to n ** (1 / cluster_reduce_rate) points.
+        rng (random.Random) -- Source of the random selection.
+    Returns:
+        List of the ids of the points to delete.
+    """
+    points = list(points)
+    grid = {}
+    for point_id, bbox in points:
+        grid.setdefault((math.floor(bbox[0] / resolution), math.floor(bbox[1] / resolution)), []).append((point_id, bbox))
+
+    deleted = set()
+    visited = set()
+    # Visited from the end, as the original queue-based implementation did
+    for point_id, bbox in reversed(points):
+        if point_id in visited or point_id in deleted:
+            continue
+        visited.add(point_id)
+        cell_x = math.floor(bbox[0] / resolution)
+        cell_y = math.floor(bbox[1] / resolution)
+        nearby_points = [
+            other_id for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+            for other_id, other_bbox in grid.get((cell_x + dx, cell_y + dy), ())
+            if other_id != point_id and other_id not in deleted and
+            other_bbox[0] <= bbox[2] + resolution and other_bbox[2] >= bbox[0] - resolution and
+            other_bbox[1] <= bbox[3] + resolution and other_bbox[3] >= bbox[1] - resolution
+        ]
+        if nearby_points:
+            keep = int(math.floor(len(nearby_points) ** (1 / float(cluster_reduce_rate))))
+            deleted.update(rng.sample(nearby_points, len(nearby_points) - keep))
+            visited.update(nearby_points)
+
+    return [point_id for point_id, _ in points if point_id in deleted]
+
+
 def get_tms(target_x, target_y, extents, tile_size, o_levels, proj):
     tile_matrices = []
     if proj.IsGeographic():
@@ -433,27 +541,64 @@ def build_mrf_dom(tile_matrices, extents, tile_size, proj):
 
 # UTILITY STUFF
 
-# This is the recommended way of building an rtree index.
-def rtree_index_generator(features, filter_list, feature_id, create_feature_id):
-
-    for idx, feature in enumerate(features):
-        try:
-            if len(filter_list) == 0 or passes_filters(feature, filter_list):
-                if create_feature_id:
-                    feature['properties'] = dict(feature['properties'])
-                    if feature_id in feature['properties']:
-                        raise ValueError("Unique ID Property (" + feature_id + " already exists; Cannot create")
-
-                    # Update (or initialize) the static feature id counter if we are assigning feature IDs
-                    try:
-                        rtree_index_generator.feature_id_value += 1
-                    except AttributeError:
-                        rtree_index_generator.feature_id_value = 1
-                    feature['properties'][feature_id] = rtree_index_generator.feature_id_value
-
-                yield (idx, shapely.geometry.shape(feature['geometry']).bounds, feature)
-        except ValueError as e:
-            print("WARN - " + str(e))
+class FeatureStore:
+    """
+    The features of one input dataset, indexed by integer id. The features are streamed in once: their shapely
+    geometries, bounds and properties are kept in arrays indexed by id, and an STRtree is bulk-loaded from the
+    bounds. Features dropped by the point reductions are masked out rather than removed from the tree.
+
+    Args:
+        features (iterable) -- Features (e.g., an open fiona collection) with 'geometry' and 'properties'.
+        filter_list (list object) -- Feature filters; features that don't pass are skipped.
+        feature_id (str) -- Identifier name of the unique feature property.
+        create_feature_id (boolean) -- Flag indicating whether the unique feature id should be created.
+    """
+
+    def __init__(self, features, filter_list, feature_id, create_feature_id):
+        geometries = []
+        self.properties = []
+        for feature in features:
+            try:
+                if len(filter_list) == 0 or passes_filters(feature, filter_list):
+                    properties = dict(feature['properties'])
+                    if create_feature_id:
+                        if feature_id in properties:
+                            raise ValueError("Unique ID Property (" + feature_id + " already exists; Cannot create")
+
+                        # Update (or initialize) the static feature id counter if we are assigning feature IDs
+                        try:
+                            FeatureStore.feature_id_value += 1
+                        except AttributeError:
+                            FeatureStore.feature_id_value = 1
+                        properties[feature_id] = FeatureStore.feature_id_value
+
+                    geometries.append(shapely.geometry.shape(feature['geometry']))
+                    self.properties.append(properties)
+            except ValueError as e:
+                print("WARN - " + str(e))
+
+        self.geometries = np.empty(len(geometries), dtype=object)
+        self.geometries[:] = geometries
+        self.bounds = shapely.bounds(self.geometries).reshape(-1, 4)
+        self.tree = shapely.STRtree(shapely.box(*self.bounds.T))
+        self.alive = np.ones(len(geometries), dtype=bool)
+
+    def count(self):
+        """Returns the number of features that haven't been deleted."""
+        return int(np.count_nonzero(self.alive))
+
+    def ids(self):
+        """Returns the ids of the features that haven't been deleted, in input order."""
+        return np.flatnonzero(self.alive)
+
+    def delete(self, ids):
+        """Drops the features with the given ids."""
+        self.alive[np.asarray(ids, dtype=np.intp)] = False
+
+    def query(self, bounds):
+        """Returns the ids of the features whose bounds intersect (min_x, min_y, max_x, max_y), in input order."""
+        ids = self.tree.query(shapely.box(*bounds))
+        return np.sort(ids[self.alive[ids]])
 
 
 def passes_filters(feature, filter_list, debug=False):
@@ -34,6 +34,7 @@ limitations under the License.
 
 
 import argparse
+import itertools
 import json
 import logging
 import numpy as np
@@ -43,7 +44,7 @@ from pathlib import Path
 from PIL import Image
 from scipy.interpolate import griddata
 from scipy.spatial import cKDTree
-from typing import Tuple, List, Dict, Union, Optional
+from typing import Tuple, Dict, Union, Optional
 
 logger = logging.getLogger(__name__)
 
@@ -81,44 +82,48 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
-def load_geojson(file_path: Path) -> List[Tuple[float, float, float, float]]:
+def load_geojson(file_path: Path) -> npt.NDArray[np.float64]:
     """
-    Load and parse GeoJSON file into a list of (lon, lat, u, v) tuples.
+    Load and parse GeoJSON file into an array of (lon, lat, u, v) rows.
 
     Arguments:
         file_path (Path) -- Path to the GeoJSON file
 
     Returns:
-        list[tuple[float...]] -- List of tuples containing (longitude, latitude, u_value, v_value)
+        npt.NDArray[np.float64] -- (N, 4) array with columns (longitude, latitude, u_value, v_value)
     """
     with open(file_path, "r") as f:
-        data = json.load(f)
+        features = json.load(f)["features"]
 
-    points = []
-    for feature in data["features"]:
-        lon, lat = feature["geometry"]["coordinates"]
-        u_val = feature["properties"]["u"]
-        v_val = feature["properties"]["v"]
-        points.append((lon, lat, u_val, v_val))
+    count = len(features)
+    coordinates = np.fromiter(
+        itertools.chain.from_iterable(feature["geometry"]["coordinates"] for feature in features),
+        dtype=np.float64,
+        count=2 * count,
+    ).reshape(count, 2)
+    u_vals = np.fromiter((feature["properties"]["u"] for feature in features), dtype=np.float64, count=count)
+    v_vals = np.fromiter((feature["properties"]["v"] for feature in features), dtype=np.float64, count=count)
 
-    return points
+    return np.column_stack((coordinates, u_vals, v_vals))
 
 
 def detect_resolution(
-    points: List[Tuple[float, float, float, float]]
+    points: npt.ArrayLike
 ) -> Tuple[float, float]:
     """
     Detect the grid resolution from the input points.
 
     Arguments:
-        points (list[tuple[float..]]) -- List of (lon, lat, u, v) tuples
+        points (npt.ArrayLike) -- (N, 4) array or list of (lon, lat, u, v) tuples
 
     Returns:
         tuple[float, float] -- (longitude_resolution, latitude_resolution)
     """
-    # Extract all unique longitudes and latitudes
-    lons = sorted(set(p[0] for p in points))
-    lats = sorted(set(p[1] for p in points))
+    points = np.asarray(points, dtype=np.float64)
+
+    # Extract all unique longitudes and latitudes (sorted)
+    lons = np.unique(points[:, 0])
+    lats = np.unique(points[:, 1])
 
     # Calculate differences between consecutive values
     lon_diffs = np.diff(lons)
@@ -139,7 +144,7 @@ def detect_resolution(
 
 
 def create_grid(
-    points: List[Tuple[float, float, float, float]], resolution: Optional[float] = None
+    points: npt.ArrayLike, resolution: Optional[float] = None
 ) -> Tuple[
     npt.NDArray[np.float32],
     npt.NDArray[np.float32],
@@ -150,7 +155,7 @@ def create_grid(
     Create a regular grid from input points with interpolation for custom resolutions.
 
     Arguments:
-        points (list[tuple[float...]]) -- List of (lon, lat, u, v) tuples
+        points (npt.ArrayLike) -- (N, 4) array or list of (lon, lat, u, v) tuples
         resolution (float | None) -- Optional override for grid resolution in degrees
 
     Returns:
@@ -161,10 +166,11 @@ def create_grid(
         - grid_info (Dict) -- Dictionary with grid dimensions and resolution
     """
     # Get input data values
-    input_lons = np.array([p[0] for p in points])
-    input_lats = np.array([p[1] for p in points])
-    input_u = np.array([p[2] for p in points], dtype=np.float32)
-    input_v = np.array([p[3] for p in points], dtype=np.float32)
+    points = np.asarray(points, dtype=np.float64)
+    input_lons = points[:, 0]
+    input_lats = points[:, 1]
+    input_u = points[:, 2].astype(np.float32)
+    input_v = points[:, 3].astype(np.float32)
     u_min: np.float32 = input_u.min()
     u_max: np.float32 = input_u.max()
     v_min: np.float32 = input_v.min()
@@ -200,21 +206,20 @@ def create_grid(
     if use_exact_match:
         # If resolutions match, use direct mapping which is faster for simple cases
         # logger.info("Using exact matching for grid points (resolutions match)")
-        # Create lookup dictionaries for grid indices
-        lon_index = {round(lon, 6): i for i, lon in enumerate(grid_lons)}
-        lat_index = {round(lat, 6): i for i, lat in enumerate(grid_lats)}
-        
+        # Compute the nearest grid indices, and keep the points that land exactly (to 6 decimals) on a grid point
+        x = np.rint((input_lons - grid_lons[0]) / lon_res).astype(np.intp)
+        y = np.rint((grid_lats[0] - input_lats) / lat_res).astype(np.intp)
+        mapped = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        x, y = x[mapped], y[mapped]
+        on_grid = (np.round(grid_lons[x], 6) == np.round(input_lons[mapped], 6)) & \
+                  (np.round(grid_lats[y], 6) == np.round(input_lats[mapped], 6))
+        mapped[mapped] = on_grid
+        x, y = x[on_grid], y[on_grid]
+
         # Fill grid points
-        points_mapped = 0
-        for lon, lat, u_val, v_val in points:
-            lon_key = round(lon, 6)
-            lat_key = round(lat, 6)
-            if lon_key in lon_index and lat_key in lat_index:
-                x = lon_index[lon_key]
-                y = lat_index[lat_key]
-                grid_u[y, x] = u_val
-                grid_v[y, x] = v_val
-                points_mapped += 1
+        grid_u[y, x] = input_u[mapped]
+        grid_v[y, x] = input_v[mapped]
+        points_mapped = int(np.count_nonzero(mapped))
         
         logger.info(f"Mapped {points_mapped} out of {len(points)} points to grid")
     else:
@@ -349,8 +354,6 @@ def save_png(
         grid_info  (Dict[str, Union[float, int]]) -- Dictionary with grid dimensions
     """
     width, height = grid_info["width"], grid_info["height"]
-    img = Image.new("RGBA", (width, height))
-    img_data = img.load()
 
     u_range = value_ranges["u_max"] - value_ranges["u_min"]
     v_range = value_ranges["v_max"] - value_ranges["v_min"]
@@ -359,18 +362,12 @@ def save_png(
     grid_u = np.nan_to_num(grid_u, nan=value_ranges["u_min"])
     grid_v = np.nan_to_num(grid_v, nan=value_ranges["v_min"])
 
-    for y in range(height):
-        for x in range(width):
-            u_val = grid_u[y, x]
-            v_val = grid_v[y, x]
-
-            # Scale to 0-255
-            r = int(255 * (u_val - value_ranges["u_min"]) / u_range)
-            g = int(255 * (v_val - value_ranges["v_min"]) / v_range)
-            b = 0
-            a = 255
-
-            img_data[x, y] = (r, g, b, a)
+    # Scale to 0-255, with blue 0 and alpha 255
+    rgba = np.zeros((height, width, 4), dtype=np.uint8)
+    rgba[..., 0] = 255 * (grid_u - value_ranges["u_min"]) / u_range
+    rgba[..., 1] = 255 * (grid_v - value_ranges["v_min"]) / v_range
+    rgba[..., 3] = 255
+    img = Image.fromarray(rgba)
 
     img.save(output_path, optimize=True, compress_level=9)
 
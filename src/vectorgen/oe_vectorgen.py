@@ -276,6 +276,24 @@ if __name__ == '__main__':
             cluster_reduce_rate = float(get_dom_tag_value(dom, 'cluster_reduce_rate'))
         except:
             cluster_reduce_rate = 0
+        # Seed for the random selection of reduced features
+        try:
+            reduce_seed = int(get_dom_tag_value(dom, 'reduce_seed'))
+        except:
+            reduce_seed = None
+        # Store identical MVT tiles once
+        try:
+            if get_dom_tag_value(dom, 'dedupe_tiles') == "true":
+                dedupe_tiles = True
+            else:
+                dedupe_tiles = False
+        except:
+            dedupe_tiles = False
+        # Number of processes used to encode MVT tiles
+        try:
+            processes = int(get_dom_tag_value(dom, 'processes'))
+        except:
+            processes = 1
         # Input files.
         try:
             input_files = get_input_files(dom)
@@ -468,6 +486,9 @@ if __name__ == '__main__':
     log_info_mssg(str().join(['config create_feature_id:       ', str(create_feature_id)]))
     log_info_mssg(str().join(['config feature_reduce_rate:     ', str(feature_reduce_rate)]))
     log_info_mssg(str().join(['config cluster_reduce_rate:     ', str(cluster_reduce_rate)]))
+    log_info_mssg(str().join(['config reduce_seed:             ', str(reduce_seed)]))
+    log_info_mssg(str().join(['config processes:               ', str(processes)]))
+    log_info_mssg(str().join(['config dedupe_tiles:            ', str(dedupe_tiles)]))
     log_info_mssg(str().join(['config buffer_size:             ', str(buffer_size)]))
     log_info_mssg(str().join(['config buffer_edges:            ', str(buffer_edges)]))
     log_info_mssg(str().join(['config target_epsg:             ', target_epsg]))
@@ -563,7 +584,9 @@ if __name__ == '__main__':
                                         target_extents, tile_size, overview_levels, target_epsg, feature_filters, overview_filters,
                                         feature_id, create_feature_id, feature_reduce_rate=feature_reduce_rate,
                                         cluster_reduce_rate=cluster_reduce_rate,
-                                        buffer_size=buffer_size, buffer_edges=buffer_edges, debug=False)
+                                        buffer_size=buffer_size, buffer_edges=buffer_edges,
+                                        processes=processes, reduce_seed=reduce_seed,
+                                        dedupe_tiles=dedupe_tiles, debug=False)
             if not success: errors += 1
 
             files = [os.path.join(working_dir, basename + ".mrf"),